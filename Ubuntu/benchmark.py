@@ -0,0 +1,227 @@
+"""Load-test benchmark: starts a local server and drives simulated players against it.
+
+Reports throughput, p50/p99/p999 command latency and server CPU/RSS for each engine,
+and can save the results to compare later changes against a baseline.
+
+Usage: python benchmark.py [--engine threaded asyncio tick] [--players 50] [--rate 1000]
+                           [--duration 10] [--strategy random|seek] [--processes 1] [--codec json|binary] [--udp]
+                           [--seed N] [--record FILE] [--save FILE] [--baseline FILE]
+"""
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from bot import STRATEGIES, BotClient
+from codec import CODECS, JSON
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+
+class ServerProcess:
+    """A game server running in a child process, sampled through /proc for CPU and memory.
+
+    With --processes the server forks workers, so the samples cover its whole process tree.
+    """
+
+    def __init__(self, engine, port, players, map_size, treasures, processes=1, udp=False, seed=None, record=None):
+        self.port = port
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.join(HERE, 'jogo.py'), '--port', str(port), '--engine', engine,
+             '--backlog', str(max(players, 5)), '--map-size', str(map_size), '--treasures', str(treasures),
+             '--processes', str(processes)] + (['--udp-port', '0'] if udp else []) +
+            (['--seed', str(seed)] if seed is not None else []) + (['--record', record] if record else []),
+            stdout=subprocess.DEVNULL
+        )
+
+    def wait_ready(self, timeout=10):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f'server exited with code {self.process.returncode}')
+            # The probe joins as a player and leaves right away, like any other disconnect
+            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as probe:
+                if probe.connect_ex(('localhost', self.port)) == 0:
+                    return
+            time.sleep(0.05)
+        raise RuntimeError('server did not start in time')
+
+    def pids(self):
+        pids, pending = [], [self.process.pid]
+        while pending:
+            pid = pending.pop()
+            pids.append(pid)
+            try:
+                with open(f'/proc/{pid}/task/{pid}/children') as children:
+                    pending.extend(int(child) for child in children.read().split())
+            except OSError:
+                pass
+        return pids
+
+    def cpu_seconds(self):
+        try:
+            total = 0
+            for pid in self.pids():
+                with open(f'/proc/{pid}/stat') as stat:
+                    # Fields after the command name; utime and stime are the 12th and 13th
+                    fields = stat.read().rsplit(')', 1)[1].split()
+                total += int(fields[11]) + int(fields[12])
+            return total / CLOCK_TICKS
+        except OSError:
+            return None
+
+    def peak_rss(self):
+        # Pages shared between the processes are counted once per process
+        total = 0
+        try:
+            for pid in self.pids():
+                with open(f'/proc/{pid}/status') as status:
+                    for line in status:
+                        if line.startswith('VmHWM:'):
+                            total += int(line.split()[1]) * 1024
+        except OSError:
+            return None
+        return total or None
+
+    def stop(self):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as probe:
+        probe.bind(('localhost', 0))
+        return probe.getsockname()[1]
+
+
+def run_bots(port, count, strategy, duration, rate, codec=JSON, udp=False):
+    """Runs `count` bots on threads in this process; returns latencies, commands, errors and connected bots."""
+    bots = [BotClient(port=port, strategy=strategy, codec=codec, udp=udp) for _ in range(count)]
+    bots = [bot for bot in bots if bot.connect()]
+    threads = [threading.Thread(target=bot.play, args=(duration, rate)) for bot in bots]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    latencies = [latency for bot in bots for latency in bot.latencies]
+    return latencies, len(latencies), sum(bot.errors for bot in bots), len(bots)
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))]
+
+
+def benchmark(engine, args):
+    port = free_port()
+    server = ServerProcess(engine, port, args.players, args.map_size, args.treasures, args.processes, args.udp,
+                           args.seed, args.record)
+    try:
+        server.wait_ready()
+        # Bots are spread over worker processes so the load generator does not share one GIL
+        workers = max(1, min(args.workers, args.players))
+        shares = [args.players // workers + (i < args.players % workers) for i in range(workers)]
+        per_bot_rate = args.rate / args.players
+
+        cpu_start = server.cpu_seconds()
+        started = time.perf_counter()
+        with multiprocessing.Pool(workers) as pool:
+            results = pool.starmap(run_bots, [
+                (port, share, args.strategy, args.duration, per_bot_rate, args.codec, args.udp) for share in shares
+            ])
+        elapsed = time.perf_counter() - started
+        cpu_end = server.cpu_seconds()
+        rss = server.peak_rss()
+    finally:
+        server.stop()
+
+    latencies = sorted(latency for result in results for latency in result[0])
+    commands = sum(result[1] for result in results)
+    cpu = None if cpu_start is None or cpu_end is None else cpu_end - cpu_start
+    label = engine if args.processes == 1 else f'{engine}x{args.processes}'
+    if args.codec != JSON:
+        label += f'/{args.codec}'
+    return {
+        'engine': label + '+udp' if args.udp else label,
+        'players': sum(result[3] for result in results),
+        'commands': commands,
+        'errors': sum(result[2] for result in results),
+        'throughput': commands / elapsed,
+        'p50_ms': (percentile(latencies, 0.5) or 0) * 1000,
+        'p99_ms': (percentile(latencies, 0.99) or 0) * 1000,
+        'p999_ms': (percentile(latencies, 0.999) or 0) * 1000,
+        'cpu_percent': None if cpu is None else cpu / elapsed * 100,
+        'rss_mb': None if rss is None else rss / (1024 * 1024)
+    }
+
+
+def format_result(result, baseline=None):
+    def value(key, unit, fmt='.1f'):
+        if result[key] is None:
+            return f"{key}=n/a"
+        text = f"{key}={result[key]:{fmt}}{unit}"
+        if baseline and baseline.get(key):
+            text += f" ({(result[key] / baseline[key] - 1) * 100:+.0f}%)"
+        return text
+
+    return ' '.join([
+        f"{result['engine']:>8}: {result['players']} players, {result['commands']} commands, {result['errors']} errors,",
+        value('throughput', '/s'), value('p50_ms', 'ms', '.2f'), value('p99_ms', 'ms', '.2f'),
+        value('p999_ms', 'ms', '.2f'), value('cpu_percent', '%'), value('rss_mb', 'MB')
+    ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Treasure hunt load-test benchmark')
+    parser.add_argument('--engine', nargs='+', choices=['threaded', 'asyncio', 'tick'], default=['threaded'])
+    parser.add_argument('--players', type=int, default=50)
+    parser.add_argument('--rate', type=float, default=1000, help='target commands per second across all players')
+    parser.add_argument('--duration', type=float, default=10, help='seconds of load per engine')
+    parser.add_argument('--strategy', choices=sorted(STRATEGIES), default='random')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='processes running the bots')
+    parser.add_argument('--map-size', type=int, default=64)
+    parser.add_argument('--treasures', type=int, default=1000)
+    parser.add_argument('--processes', type=int, default=1, help='server processes sharing the match (threaded only)')
+    parser.add_argument('--codec', choices=CODECS, default=JSON, help='wire encoding the bots ask the server for')
+    parser.add_argument('--udp', action='store_true', help='bots send their moves over UDP (lost moves count as errors)')
+    parser.add_argument('--seed', type=int, help='seed the server with, so every run plays on the same map')
+    parser.add_argument('--record', help='have the server record the commands to this file, for replay.py')
+    parser.add_argument('--save', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='compare against results saved earlier with --save')
+    args = parser.parse_args()
+    if args.udp and args.processes > 1:
+        parser.error('--udp cannot be combined with --processes')
+    if args.record and (len(args.engine) > 1 or args.processes > 1):
+        parser.error('--record needs a single engine and cannot be combined with --processes')
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = {result['engine']: result for result in json.load(file)}
+
+    results = []
+    for engine in args.engine:
+        result = benchmark(engine, args)
+        results.append(result)
+        print(format_result(result, baseline.get(result['engine'])))
+
+    if args.save:
+        with open(args.save, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+"""Headless bot client for load tests: plays without a terminal and times every command.
+
+    bot = BotClient(port=5000, strategy='seek')
+    if bot.connect():
+        bot.play(duration=10, rate=20)
+    print(bot.latencies)
+"""
+import random
+import socket
+import time
+
+from codec import JSON
+from grade import EMPTY, TREASURE_ROOM, Grid
+from protocolo import MessageReader, send_message
+from udp import UdpMoves
+
+DIRECTIONS = {'up': (-1, 0), 'down': (1, 0), 'left': (0, -1), 'right': (0, 1)}
+UDP_ACK_TIMEOUT = 1  # seconds to wait for the ack of a move sent by UDP before counting it lost
+
+
+def random_walk(bot):
+    return {'type': 'move', 'direction': random.choice(list(DIRECTIONS))}
+
+
+def seek_treasure(bot):
+    """Walks to the nearest treasure, and loots the treasure room when standing on it."""
+    state = bot.game_state
+    if state is None:
+        return {'type': 'get_state'}
+
+    grid = Grid.decode(state['map_size'], state['map'])
+    x, y = state['players'][str(bot.player_id)]['position']
+    if (x, y) == bot.room and state['room_treasures'] > 0:
+        return {'type': 'enter_room'}
+
+    if bot.target is None or not grid.is_treasure(*bot.target):
+        bot.target = bot.nearest_treasure(grid, x, y)
+    if bot.target is None or bot.blocked:
+        bot.blocked = False
+        return random_walk(bot)
+
+    target_x, target_y = bot.target
+    if target_x != x:
+        direction = 'down' if target_x > x else 'up'
+    else:
+        direction = 'right' if target_y > y else 'left'
+    return {'type': 'move', 'direction': direction}
+
+
+STRATEGIES = {'random': random_walk, 'seek': seek_treasure}
+
+
+class BotClient:
+    def __init__(self, host='localhost', port=5000, strategy='random', timeout=10, codec=JSON, udp=False):
+        self.host = host
+        self.port = port
+        self.strategy = STRATEGIES[strategy]
+        self.codec = codec
+        self.use_udp = udp
+        self.udp = None
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # A bot gives up after this long without a reply instead of hanging the whole run
+        self.socket.settimeout(timeout)
+        self.reader = MessageReader(self.socket)
+        self.player_id = None
+        self.game_state = None
+        self.room = None
+        self.target = None
+        self.blocked = False
+        self.latencies = []  # seconds per command
+        self.errors = 0
+
+    def connect(self):
+        try:
+            self.socket.connect((self.host, self.port))
+            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            handshake = self.reader.receive()
+            if isinstance(handshake, dict) or handshake is None:
+                return False
+            self.player_id = int(handshake)
+            if self.codec != JSON:
+                send_message(self.socket, {'type': 'codec', 'codec': self.codec})
+                reply = self.reader.receive()
+                if not reply or reply.get('status') != 'success':
+                    return False
+            if self.use_udp:
+                send_message(self.socket, {'type': 'udp'}, self.codec)
+                reply = self.reader.receive()
+                if not reply or reply.get('status') != 'success':
+                    return False
+                self.udp = UdpMoves(self.host, reply['port'], self.player_id, reply['token'], UDP_ACK_TIMEOUT)
+        except (socket.error, TypeError, ValueError):
+            return False
+
+        self.request({'type': 'get_state'})
+        return self.game_state is not None
+
+    def request(self, command, sent_at=None):
+        """Sends a command and waits for its reply; the latency counts from `sent_at` when given."""
+        if sent_at is None:
+            sent_at = time.perf_counter()
+        if self.udp and command['type'] == 'move':
+            return self.move_by_udp(command['direction'], sent_at)
+        send_message(self.socket, command, self.codec)
+        reply = self.reader.receive()
+        if reply is None:
+            raise ConnectionError('server closed the connection')
+        self.latencies.append(time.perf_counter() - sent_at)
+
+        if reply.get('status') == 'error':
+            self.errors += 1
+            self.blocked = True
+        state = reply.get('state', reply)
+        if 'map' in state:
+            self.game_state = state
+            if self.room is None:
+                self.find_room(state)
+        return reply
+
+    def move_by_udp(self, direction, sent_at):
+        """Sends a move as a datagram and waits for its ack; a move lost either way counts as an error."""
+        sequence = self.udp.move(direction)
+        while True:
+            ack = self.udp.receive()
+            if ack is None:
+                self.errors += 1
+                return None
+            if ack[0] == sequence:
+                break  # anything older is the late ack of a move already counted as lost
+        self.latencies.append(time.perf_counter() - sent_at)
+
+        position = list(ack[2])
+        self.game_state['players'][str(self.player_id)]['position'] = position
+        if tuple(position) == self.target:
+            # The treasure there is gone now, but only TCP brings the new map
+            self.game_state = None
+        return ack
+
+    def find_room(self, state):
+        grid = Grid.decode(state['map_size'], state['map'])
+        index = grid.cells.find(TREASURE_ROOM)
+        if index >= 0:
+            self.room = grid.position(index)
+
+    def nearest_treasure(self, grid, x, y):
+        best, best_distance = None, None
+        for index, value in enumerate(grid.cells):
+            if EMPTY < value < TREASURE_ROOM:
+                cell_x, cell_y = grid.position(index)
+                distance = abs(cell_x - x) + abs(cell_y - y)
+                if best is None or distance < best_distance:
+                    best, best_distance = (cell_x, cell_y), distance
+        return best
+
+    def play(self, duration, rate, stop=None):
+        """Sends about `rate` commands per second for `duration` seconds, or until `stop` is set.
+
+        Latency is measured from the scheduled send time, so a stalled server shows up
+        in the tail instead of silently lowering the command rate.
+        """
+        interval = 1 / rate
+        next_send = time.perf_counter()
+        deadline = next_send + duration
+        try:
+            while next_send < deadline and not (stop and stop.is_set()):
+                delay = next_send - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                self.request(self.strategy(self), sent_at=next_send)
+                next_send += interval
+        except (ConnectionError, socket.error):
+            pass
+        finally:
+            self.close()
+
+    def close(self):
+        try:
+            self.socket.close()
+        except socket.error:
+            pass
+        if self.udp:
+            self.udp.close()
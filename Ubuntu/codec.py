@@ -0,0 +1,252 @@
+"""Compact binary form of the frequent messages, negotiated per connection.
+
+JSON stays the default, and every message without a binary form below is still sent as JSON,
+so a capture stays readable unless a client asks otherwise with
+
+    {'type': 'codec', 'codec': 'binary'}
+
+The server then sends move acks, states and deltas in binary. Commands may be sent either way
+at any time: a binary payload starts with an opcode byte below 0x20, which JSON text never
+starts with, so every frame says how it is encoded. Numbers are big-endian; a request id of 0
+means the message carries no 'id'.
+
+    move        B op, B direction, I request id
+    enter_room  B op, I request id
+    get_state   B op, I request id, q since (NO_SINCE when absent)
+    ack         B op, I request id, q version
+    state       B op, I request id, q version (-1 for a plain state reply), I map size,
+                I treasures left, I room treasures, I players, B has view,
+                [I x, I y, I rows, I cols,] the cells as raw bytes, then one record per player
+    delta       B op, I request id, q from, q version, I changes, then one record per change
+"""
+import base64
+import struct
+
+JSON = 'json'
+BINARY = 'binary'
+CODECS = (JSON, BINARY)
+
+OP_MOVE, OP_ENTER_ROOM, OP_GET_STATE, OP_ACK, OP_STATE, OP_DELTA = range(1, 7)
+CHANGE_CELL, CHANGE_PLAYER, CHANGE_REMOVE, CHANGE_COUNTERS, CHANGE_AREA = range(1, 6)
+
+DIRECTIONS = ('up', 'down', 'left', 'right')
+DIRECTION_CODES = {direction: code for code, direction in enumerate(DIRECTIONS)}
+NO_SINCE = -2 ** 63
+PLAIN_STATE = -1
+
+MOVE = struct.Struct('!BBI')
+ENTER_ROOM = struct.Struct('!BI')
+GET_STATE = struct.Struct('!BIq')
+ACK = struct.Struct('!BIq')
+STATE = struct.Struct('!BIqIIIIB')
+VIEW = struct.Struct('!IIII')
+PLAYER = struct.Struct('!IIII')  # id, x, y, score
+DELTA = struct.Struct('!BIqqI')
+CELL_CHANGE = struct.Struct('!BIIIB')  # op, v, x, y, value
+PLAYER_CHANGE = struct.Struct('!BIIIII')  # op, v, id, x, y, score
+REMOVE_CHANGE = struct.Struct('!BII')  # op, v, id
+COUNTERS_CHANGE = struct.Struct('!BIII')  # op, v, treasures left, room treasures
+AREA_CHANGE = struct.Struct('!BIIIII')  # op, v, x, y, rows, cols, then the cells
+
+STATE_KEYS = {'map', 'map_size', 'players', 'treasures_left', 'room_treasures'}
+VIEW_STATE_KEYS = {'view', 'map_size', 'players', 'treasures_left', 'room_treasures'}
+
+
+def is_binary(payload):
+    return len(payload) > 0 and payload[0] in DECODERS
+
+
+def _cells(data):
+    # Servers keep the cells base64-encoded for JSON replies; the binary form carries the bytes
+    return base64.b64decode(data) if isinstance(data, str) else bytes(data)
+
+
+def _request_id(message, keys):
+    """The message's request id (0 if untagged), checking it has no keys beyond `keys`."""
+    if not message.keys() - {'id'} <= keys:
+        raise KeyError('no binary form')
+    request_id = message.get('id', 0)
+    if 'id' in message and (type(request_id) is not int or request_id < 1):
+        raise TypeError('request ids in binary are positive integers')
+    return request_id
+
+
+def encode_binary(message):
+    """The binary payload of `message`, or None when it has no binary form and goes as JSON."""
+    if not isinstance(message, dict):
+        return None
+    try:
+        kind = message.get('type')
+        if kind == 'move':
+            return MOVE.pack(OP_MOVE, DIRECTION_CODES[message['direction']],
+                             _request_id(message, {'type', 'direction'}))
+        if kind == 'enter_room':
+            return ENTER_ROOM.pack(OP_ENTER_ROOM, _request_id(message, {'type'}))
+        if kind == 'get_state':
+            return GET_STATE.pack(OP_GET_STATE, _request_id(message, {'type', 'since'}), message.get('since', NO_SINCE))
+        if kind == 'state':
+            return _encode_state(_request_id(message, {'type', 'version', 'state'}), message['version'], message['state'])
+        if kind == 'delta':
+            return _encode_delta(message)
+        if kind is None and message.get('status') == 'success' and 'version' in message and 'id' in message:
+            return ACK.pack(OP_ACK, _request_id(message, {'status', 'version'}), message['version'])
+        if kind is None and 'map' in message:
+            return _encode_state(_request_id(message, STATE_KEYS), PLAIN_STATE, message)
+    except (KeyError, TypeError, ValueError, struct.error):
+        pass
+    return None
+
+
+def _encode_state(request_id, version, state):
+    keys = state.keys() - {'id'}
+    if keys != STATE_KEYS and keys != VIEW_STATE_KEYS:
+        raise KeyError('no binary form')
+    view = state.get('view')
+    players = state['players']
+    parts = [STATE.pack(OP_STATE, request_id, version, state['map_size'], state['treasures_left'],
+                        state['room_treasures'], len(players), view is not None)]
+    if view is None:
+        cells = _cells(state['map'])
+        if len(cells) != state['map_size'] ** 2:
+            raise ValueError('map does not match its size')
+    else:
+        cells = _cells(view['cells'])
+        if len(cells) != view['rows'] * view['cols']:
+            raise ValueError('view does not match its size')
+        parts.append(VIEW.pack(view['x'], view['y'], view['rows'], view['cols']))
+    parts.append(cells)
+    for player_id, player in players.items():
+        x, y = player['position']
+        parts.append(PLAYER.pack(int(player_id), x, y, player['score']))
+    return b''.join(parts)
+
+
+def _encode_delta(message):
+    changes = message['changes']
+    parts = [DELTA.pack(OP_DELTA, _request_id(message, {'type', 'from', 'version', 'changes'}),
+                        message['from'], message['version'], len(changes))]
+    for change in changes:
+        op = change['op']
+        if op == 'cell':
+            parts.append(CELL_CHANGE.pack(CHANGE_CELL, change['v'], change['x'], change['y'], change['value']))
+        elif op == 'player':
+            x, y = change['position']
+            parts.append(PLAYER_CHANGE.pack(CHANGE_PLAYER, change['v'], int(change['id']), x, y, change['score']))
+        elif op == 'remove':
+            parts.append(REMOVE_CHANGE.pack(CHANGE_REMOVE, change['v'], int(change['id'])))
+        elif op == 'counters':
+            parts.append(COUNTERS_CHANGE.pack(CHANGE_COUNTERS, change['v'], change['treasures_left'],
+                                              change['room_treasures']))
+        elif op == 'area':
+            cells = _cells(change['cells'])
+            if len(cells) != change['rows'] * change['cols']:
+                raise ValueError('area does not match its size')
+            parts.append(AREA_CHANGE.pack(CHANGE_AREA, change['v'], change['x'], change['y'],
+                                          change['rows'], change['cols']))
+            parts.append(cells)
+        else:
+            raise KeyError(op)
+    return b''.join(parts)
+
+
+def _tag(message, request_id):
+    if request_id:
+        message['id'] = request_id
+    return message
+
+
+def _decode_move(payload):
+    _, direction, request_id = MOVE.unpack_from(payload)
+    return _tag({'type': 'move', 'direction': DIRECTIONS[direction]}, request_id)
+
+
+def _decode_enter_room(payload):
+    _, request_id = ENTER_ROOM.unpack_from(payload)
+    return _tag({'type': 'enter_room'}, request_id)
+
+
+def _decode_get_state(payload):
+    _, request_id, since = GET_STATE.unpack_from(payload)
+    message = {'type': 'get_state'}
+    if since != NO_SINCE:
+        message['since'] = since
+    return _tag(message, request_id)
+
+
+def _decode_ack(payload):
+    _, request_id, version = ACK.unpack_from(payload)
+    return _tag({'status': 'success', 'version': version}, request_id)
+
+
+def _decode_state(payload):
+    _, request_id, version, map_size, treasures_left, room_treasures, count, has_view = STATE.unpack_from(payload)
+    offset = STATE.size
+    state = {'map_size': map_size}
+    if has_view:
+        x, y, rows, cols = VIEW.unpack_from(payload, offset)
+        offset += VIEW.size
+        state['view'] = {'x': x, 'y': y, 'rows': rows, 'cols': cols, 'cells': bytes(payload[offset:offset + rows * cols])}
+        offset += rows * cols
+    else:
+        state['map'] = bytes(payload[offset:offset + map_size * map_size])
+        offset += map_size * map_size
+
+    players = {}
+    for player_id, x, y, score in PLAYER.iter_unpack(payload[offset:offset + count * PLAYER.size]):
+        players[str(player_id)] = {'position': [x, y], 'score': score}
+    state.update(players=players, treasures_left=treasures_left, room_treasures=room_treasures)
+
+    if version == PLAIN_STATE:
+        return _tag(state, request_id)
+    return _tag({'type': 'state', 'version': version, 'state': state}, request_id)
+
+
+def _decode_delta(payload):
+    _, request_id, since, version, count = DELTA.unpack_from(payload)
+    offset = DELTA.size
+    changes = []
+    for _ in range(count):
+        op = payload[offset]
+        if op == CHANGE_CELL:
+            _, v, x, y, value = CELL_CHANGE.unpack_from(payload, offset)
+            offset += CELL_CHANGE.size
+            changes.append({'op': 'cell', 'x': x, 'y': y, 'value': value, 'v': v})
+        elif op == CHANGE_PLAYER:
+            _, v, player_id, x, y, score = PLAYER_CHANGE.unpack_from(payload, offset)
+            offset += PLAYER_CHANGE.size
+            changes.append({'op': 'player', 'id': str(player_id), 'position': [x, y], 'score': score, 'v': v})
+        elif op == CHANGE_REMOVE:
+            _, v, player_id = REMOVE_CHANGE.unpack_from(payload, offset)
+            offset += REMOVE_CHANGE.size
+            changes.append({'op': 'remove', 'id': str(player_id), 'v': v})
+        elif op == CHANGE_COUNTERS:
+            _, v, treasures_left, room_treasures = COUNTERS_CHANGE.unpack_from(payload, offset)
+            offset += COUNTERS_CHANGE.size
+            changes.append({'op': 'counters', 'treasures_left': treasures_left,
+                            'room_treasures': room_treasures, 'v': v})
+        elif op == CHANGE_AREA:
+            _, v, x, y, rows, cols = AREA_CHANGE.unpack_from(payload, offset)
+            offset += AREA_CHANGE.size
+            changes.append({'op': 'area', 'x': x, 'y': y, 'rows': rows, 'cols': cols,
+                            'cells': bytes(payload[offset:offset + rows * cols]), 'v': v})
+            offset += rows * cols
+        else:
+            raise ValueError(f'Unknown change op {op}')
+    return _tag({'type': 'delta', 'from': since, 'version': version, 'changes': changes}, request_id)
+
+
+DECODERS = {
+    OP_MOVE: _decode_move,
+    OP_ENTER_ROOM: _decode_enter_room,
+    OP_GET_STATE: _decode_get_state,
+    OP_ACK: _decode_ack,
+    OP_STATE: _decode_state,
+    OP_DELTA: _decode_delta
+}
+
+
+def decode_binary(payload):
+    try:
+        return DECODERS[payload[0]](payload)
+    except (IndexError, struct.error) as e:
+        raise ValueError(f'Malformed binary message: {e}') from e
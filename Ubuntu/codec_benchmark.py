@@ -0,0 +1,60 @@
+"""Compares the binary codec with JSON: bytes on the wire and encode/decode time per message.
+
+The messages come from a real game, so their shapes and sizes are the ones the server sends.
+
+Usage: python codec_benchmark.py [--map-size 64] [--players 50] [--repeat 2000]
+"""
+import argparse
+import random
+import timeit
+
+from codec import BINARY, JSON
+from jogo import GameServer
+from protocolo import HEADER, decode_payload, encode_message
+
+
+def sample_messages(args):
+    server = GameServer(map_size=args.map_size, num_treasures=args.map_size * args.map_size // 4, listen=False)
+    for player_id in range(1, 1 + args.players):
+        server.add_player(player_id)
+    start = server.version
+    for player_id in random.sample(sorted(server.players), min(8, args.players)):
+        server.move_player(player_id, random.choice(['up', 'down', 'left', 'right']))
+
+    viewer = server.interest.add(1, None, 8)
+    return {
+        'move': {'type': 'move', 'direction': 'up', 'id': 41},
+        'get_state': {'type': 'get_state', 'since': start, 'id': 42},
+        'ack': {'status': 'success', 'version': server.version, 'id': 41},
+        'delta': server.get_state_since(start),
+        'state': server.get_game_state(),
+        'snapshot': server.get_snapshot(),
+        'view': server.interest.snapshot(viewer)
+    }
+
+
+def measure(message, codec, repeat):
+    frame = encode_message(message, codec)
+    payload = frame[HEADER.size:]
+    encode = min(timeit.repeat(lambda: encode_message(message, codec), number=repeat, repeat=3)) / repeat
+    decode = min(timeit.repeat(lambda: decode_payload(payload), number=repeat, repeat=3)) / repeat
+    return len(frame), encode, decode
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Binary codec versus JSON')
+    parser.add_argument('--map-size', type=int, default=64)
+    parser.add_argument('--players', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=2000, help='runs per measurement')
+    args = parser.parse_args()
+
+    print(f"{'message':>10} {'json B':>8} {'binary B':>8} {'json enc':>10} {'bin enc':>10} {'json dec':>10} {'bin dec':>10}")
+    for name, message in sample_messages(args).items():
+        json_size, json_encode, json_decode = measure(message, JSON, args.repeat)
+        binary_size, binary_encode, binary_decode = measure(message, BINARY, args.repeat)
+        print(f"{name:>10} {json_size:>8} {binary_size:>8} {json_encode * 1e6:>8.2f}us {binary_encode * 1e6:>8.2f}us "
+              f"{json_decode * 1e6:>8.2f}us {binary_decode * 1e6:>8.2f}us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+import base64
+import random
+from array import array
+
+# Cell codes: 0 is an empty cell, 1-253 is a treasure worth that many points
+EMPTY = 0
+TREASURE_ROOM = 254
+CLOSED = 255
+
+SYMBOLS = {EMPTY: ".", TREASURE_ROOM: "X", CLOSED: "#"}
+
+
+def symbol(value):
+    return SYMBOLS.get(value) or str(value)
+
+
+class Grid:
+    """Square map stored as one contiguous bytearray, one byte per cell (row-major)."""
+
+    __slots__ = ('size', 'cells')
+
+    def __init__(self, size, cells=None):
+        self.size = size
+        self.cells = cells if cells is not None else bytearray(size * size)
+
+    def __getitem__(self, position):
+        x, y = position
+        return self.cells[x * self.size + y]
+
+    def __setitem__(self, position, value):
+        x, y = position
+        self.cells[x * self.size + y] = value
+
+    def index(self, x, y):
+        return x * self.size + y
+
+    def position(self, index):
+        return divmod(index, self.size)
+
+    def is_treasure(self, x, y):
+        return EMPTY < self.cells[x * self.size + y] < TREASURE_ROOM
+
+    def row(self, x):
+        return self.cells[x * self.size:(x + 1) * self.size]
+
+    def encode(self):
+        return base64.b64encode(self.cells).decode('ascii')
+
+    @classmethod
+    def decode(cls, size, data):
+        # JSON carries the cells as base64 text, the binary codec as the raw bytes
+        return cls(size, bytearray(base64.b64decode(data) if isinstance(data, str) else data))
+
+    def encode_area(self, x, y, rows, cols):
+        """Encodes the rows x cols block whose top-left cell is (x, y)."""
+        start = x * self.size + y
+        return base64.b64encode(b''.join(
+            self.cells[start + row * self.size:start + row * self.size + cols] for row in range(rows)
+        )).decode('ascii')
+
+    def load_area(self, x, y, rows, cols, data):
+        """Writes a block made by encode_area (or its raw bytes) back at (x, y)."""
+        cells = base64.b64decode(data) if isinstance(data, str) else data
+        start = x * self.size + y
+        for row in range(rows):
+            self.cells[start + row * self.size:start + row * self.size + cols] = cells[row * cols:(row + 1) * cols]
+
+
+class CellPool:
+    """Set of flat cell indexes with O(1) add, discard and random choice.
+
+    Backed by two int arrays, so it stays compact even on very large maps.
+    """
+
+    __slots__ = ('cells', 'slots')
+
+    def __init__(self, capacity, cells=()):
+        self.cells = array('l', cells)
+        self.slots = array('l', [-1]) * capacity
+        for slot, cell in enumerate(self.cells):
+            self.slots[cell] = slot
+
+    def __len__(self):
+        return len(self.cells)
+
+    def __contains__(self, cell):
+        return self.slots[cell] >= 0
+
+    def add(self, cell):
+        if self.slots[cell] < 0:
+            self.slots[cell] = len(self.cells)
+            self.cells.append(cell)
+
+    def discard(self, cell):
+        slot = self.slots[cell]
+        if slot < 0:
+            return
+        self.slots[cell] = -1
+        last = self.cells.pop()
+        if slot < len(self.cells):
+            self.cells[slot] = last
+            self.slots[last] = slot
+
+    def choice(self, rng=random):
+        return self.cells[rng.randrange(len(self.cells))]
@@ -0,0 +1,253 @@
+"""Area-of-interest filtering, so a client only gets the part of the game around its player.
+
+A client opts in by subscribing with a view radius:
+
+    {'type': 'subscribe', 'view': 8}
+
+It then gets a snapshot of the square of side 2 * view + 1 around its player (clipped to the
+map), and deltas holding only what happens inside that square:
+
+    {'op': 'area', 'x', 'y', 'rows', 'cols', 'cells'}   cells uncovered as the square moves
+    {'op': 'player', ...}                              a player moving inside, or walking in
+    {'op': 'remove', 'id'}                             a player leaving the square, or the game
+
+Viewers are indexed by the map regions their square overlaps, so a change only costs the
+viewers that can see it, however many players the match has.
+"""
+import socket
+import threading
+
+
+def uncovered(new, old):
+    """Splits the part of rectangle `new` outside rectangle `old` into up to four rectangles."""
+    new_top, new_left, new_bottom, new_right = new
+    old_top, old_left, old_bottom, old_right = old
+    if old_top > new_bottom or old_bottom < new_top or old_left > new_right or old_right < new_left:
+        return [new]
+
+    parts = []
+    if new_top < old_top:
+        parts.append((new_top, new_left, old_top - 1, new_right))
+    if new_bottom > old_bottom:
+        parts.append((old_bottom + 1, new_left, new_bottom, new_right))
+    top, bottom = max(new_top, old_top), min(new_bottom, old_bottom)
+    if new_left < old_left:
+        parts.append((top, new_left, bottom, old_left - 1))
+    if new_right > old_right:
+        parts.append((top, old_right + 1, bottom, new_right))
+    return parts
+
+
+class Viewer:
+    """A subscriber that only sees the square of cells around its own player."""
+
+    __slots__ = ('player_id', 'connection', 'radius', 'window', 'regions', 'visible', 'pending', 'version', 'lock')
+
+    def __init__(self, player_id, connection, radius):
+        self.player_id = player_id
+        self.connection = connection
+        self.radius = radius
+        self.window = None  # (top, left, bottom, right), inclusive
+        self.regions = ()
+        self.visible = set()  # ids of the players this viewer was told about
+        self.pending = []  # changes not sent yet
+        self.version = 0  # version of the last delta or snapshot sent
+        self.lock = threading.Lock()  # keeps this viewer's messages in order
+
+    def sees(self, position):
+        x, y = position
+        top, left, bottom, right = self.window
+        return top <= x <= bottom and left <= y <= right
+
+
+class Interest:
+    """The viewers of one game, and the routing of its changes to them.
+
+    Everything but `flush` runs with the game's log lock held, so viewers see the changes in
+    version order.
+    """
+
+    def __init__(self, server):
+        self.server = server
+        self.viewers = {}  # player id -> viewer
+        self.regions = {}  # region index -> viewers whose square overlaps it
+        self.watchers = {}  # player id (str) -> viewers told about that player
+        self.dirty = set()  # viewers with pending changes
+
+    def _window(self, position, radius):
+        x, y = position
+        last = self.server.map_size - 1
+        return (max(0, x - radius), max(0, y - radius), min(last, x + radius), min(last, y + radius))
+
+    def _move_window(self, viewer, window):
+        size = self.server.region_size
+        per_row = self.server.regions_per_row
+        top, left, bottom, right = window
+        regions = [row * per_row + column
+                   for row in range(top // size, bottom // size + 1)
+                   for column in range(left // size, right // size + 1)]
+        if regions != viewer.regions:
+            for region in viewer.regions:
+                self.regions[region].discard(viewer)
+            for region in regions:
+                self.regions.setdefault(region, set()).add(viewer)
+            viewer.regions = regions
+        viewer.window = window
+
+    def _candidates(self, position):
+        x, y = position
+        size = self.server.region_size
+        return self.regions.get((x // size) * self.server.regions_per_row + y // size, ())
+
+    def _queue(self, viewer, change):
+        viewer.pending.append(change)
+        self.dirty.add(viewer)
+
+    def _show(self, viewer, player_id, change):
+        self._queue(viewer, change)
+        if player_id not in viewer.visible:
+            viewer.visible.add(player_id)
+            self.watchers.setdefault(player_id, set()).add(viewer)
+
+    def _forget(self, viewer, player_id):
+        viewer.visible.discard(player_id)
+        watchers = self.watchers.get(player_id)
+        if watchers:
+            watchers.discard(viewer)
+            if not watchers:
+                del self.watchers[player_id]
+
+    def _players_in(self, window):
+        """Yields (id, player) for everybody standing inside `window`."""
+        server = self.server
+        top, left, bottom, right = window
+        for x in range(top, bottom + 1):
+            for y in range(left, right + 1):
+                for player_id in tuple(server.players_at(x, y)):
+                    player = server.players.get(player_id)
+                    if player:
+                        yield str(player_id), player
+
+    def add(self, player_id, connection, radius):
+        viewer = Viewer(player_id, connection, radius)
+        self.viewers[player_id] = viewer
+        return viewer
+
+    def remove(self, player_id):
+        viewer = self.viewers.pop(player_id, None)
+        if viewer is None:
+            return
+        for region in viewer.regions:
+            self.regions[region].discard(viewer)
+        for visible_id in list(viewer.visible):
+            self._forget(viewer, visible_id)
+        self.dirty.discard(viewer)
+
+    def snapshot(self, viewer):
+        """Starts the viewer over from the square around its player and returns the state message."""
+        server = self.server
+        player = server.players.get(viewer.player_id)
+        self._move_window(viewer, self._window(player['position'] if player else (0, 0), viewer.radius))
+        for visible_id in list(viewer.visible):
+            self._forget(viewer, visible_id)
+        viewer.pending = []
+        viewer.version = server.version
+
+        players = {}
+        for player_id, player in self._players_in(viewer.window):
+            players[player_id] = {'position': player['position'], 'score': player['score']}
+            viewer.visible.add(player_id)
+            self.watchers.setdefault(player_id, set()).add(viewer)
+
+        top, left, bottom, right = viewer.window
+        rows, cols = bottom - top + 1, right - left + 1
+        return {'type': 'state', 'version': server.version, 'state': {
+            'map_size': server.map_size,
+            'view': {'x': top, 'y': left, 'rows': rows, 'cols': cols,
+                     'cells': server.main_map.encode_area(top, left, rows, cols)},
+            'players': players,
+            'treasures_left': server.total_treasures - server.collected_treasures,
+            'room_treasures': server.treasures_in_room
+        }}
+
+    def ack_version(self, viewer):
+        """The version a move acknowledged now is shown at, in the versions this viewer gets."""
+        # Anything still pending goes out with the current version; otherwise the viewer is up to date
+        return self.server.version if viewer.pending else viewer.version
+
+    def route(self, changes):
+        """Queues each recorded change for the viewers that can see it."""
+        for change in changes:
+            op = change['op']
+            if op == 'cell':
+                position = (change['x'], change['y'])
+                for viewer in self._candidates(position):
+                    if viewer.sees(position):
+                        self._queue(viewer, change)
+            elif op == 'player':
+                self._route_player(change)
+            elif op == 'remove':
+                for viewer in list(self.watchers.get(change['id'], ())):
+                    self._queue(viewer, change)
+                    self._forget(viewer, change['id'])
+            else:
+                # Counters are the same for the whole map
+                for viewer in self.viewers.values():
+                    self._queue(viewer, change)
+
+    def _route_player(self, change):
+        player_id, position = change['id'], tuple(change['position'])
+        own = self.viewers.get(int(player_id))
+        if own is not None:
+            self._recenter(own, position, change['v'])
+
+        for viewer in set(self._candidates(position)) | self.watchers.get(player_id, set()):
+            if viewer.sees(position):
+                self._show(viewer, player_id, change)
+            elif player_id in viewer.visible:
+                self._queue(viewer, {'op': 'remove', 'id': player_id, 'v': change['v']})
+                self._forget(viewer, player_id)
+
+    def _recenter(self, viewer, position, version):
+        """Moves the viewer's square: sends the cells and players it uncovers, drops the players it leaves."""
+        old = viewer.window
+        self._move_window(viewer, self._window(position, viewer.radius))
+        if viewer.window == old:
+            return
+
+        server = self.server
+        for visible_id in list(viewer.visible):
+            player = server.players.get(int(visible_id))
+            if player is None or not viewer.sees(player['position']):
+                self._queue(viewer, {'op': 'remove', 'id': visible_id, 'v': version})
+                self._forget(viewer, visible_id)
+
+        for area in uncovered(viewer.window, old):
+            top, left, bottom, right = area
+            rows, cols = bottom - top + 1, right - left + 1
+            self._queue(viewer, {'op': 'area', 'x': top, 'y': left, 'rows': rows, 'cols': cols,
+                                 'cells': server.main_map.encode_area(top, left, rows, cols), 'v': version})
+            for player_id, player in self._players_in(area):
+                self._show(viewer, player_id, {'op': 'player', 'id': player_id, 'position': player['position'],
+                                               'score': player['score'], 'v': version})
+
+    def flush(self):
+        """Sends every viewer with pending changes one delta holding them. Called without the log lock."""
+        if not self.dirty:
+            return
+        server = self.server
+        with server.log_lock:
+            dirty, self.dirty = self.dirty, set()
+
+        for viewer in dirty:
+            with viewer.lock:
+                with server.log_lock:
+                    changes, viewer.pending = viewer.pending, []
+                    since, viewer.version = viewer.version, server.version
+                if not changes:
+                    continue
+                delta = {'type': 'delta', 'from': since, 'version': viewer.version, 'changes': changes}
+                try:
+                    server.send_to(viewer.player_id, viewer.connection, server.encode_for(viewer.player_id, delta))
+                except (socket.error, KeyError):
+                    server.unsubscribe(viewer.player_id)
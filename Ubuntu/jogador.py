@@ -1,80 +1,318 @@
+import argparse
 import socket
-import json
 import curses
 import sys
 import threading
 import time
+from collections import deque
+from codec import CODECS, JSON
+from grade import TREASURE_ROOM, Grid, symbol
+from protocolo import Connection, MessageReader, send_message
+from udp import UdpMoves
+
+MOVES = {'up': (-1, 0), 'down': (1, 0), 'left': (0, -1), 'right': (0, 1)}
+UDP_ACK_TIMEOUT = 0.5  # a move sent by UDP and not acked by then is taken as lost
 
 class GameClient:
-    def __init__(self, host='localhost', port=5000):
+    def __init__(self, host='localhost', port=5000, match=None, view=None, codec=JSON, use_udp=False):
         self.host = host
         self.port = port
+        self.match = match  # match id, or 'new', when connecting through a lobby
+        self.view = view  # only follow the cells this close to the player, for very large maps
+        self.codec = codec  # how the server should encode what it sends; JSON is easier to debug
+        self.use_udp = use_udp  # send moves as datagrams, so a lost packet does not hold up the next ones
+        self.udp = None
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.reader = MessageReader(self.socket)
+        self.connection = None
         self.player_id = None
         self.game_state = None
+        self.version = -1
+        self.resync_pending = False
+        self.status_message = ''
+        self.state_changed = threading.Event()
         self.running = True
+        
+        # Local frame model: what is on screen and what changed since, so a frame only redraws changes
+        self.state_lock = threading.Lock()
+        self.occupants = {}  # (x, y) -> ids of the players standing there
+        self.dirty_cells = set()
+        self.full_redraw = True
+        self.drawn_status = [None] * 3
+        self.drawn_me = None
+        self.drawn_viewport = None
+        
+        # Moves sent but not yet shown by the server: [request id, direction, version that shows it];
+        # moves sent by UDP have (sequence, time sent) instead of a request id
+        self.pending_moves = deque()
     
     def connect(self):
         try:
             self.socket.connect((self.host, self.port))
-            self.player_id = int(self.socket.recv(1024).decode())
+            if self.match is not None and not self.join_match():
+                return False
+            handshake = self.reader.receive()
+            if isinstance(handshake, dict):
+                print(f"Connection refused: {handshake.get('message')}")
+                return False
+            self.player_id = int(handshake)
+            self.connection = Connection(self.socket, self.reader)
             return True
-        except socket.error as e:
+        except (socket.error, TypeError, ValueError) as e:
             print(f"Connection failed: {e}")
             return False
     
+    def join_match(self):
+        match = self.match
+        if match == 'new':
+            send_message(self.socket, {'type': 'create_match'})
+            reply = self.reader.receive()
+            if not reply or reply.get('status') != 'success':
+                print(f"Could not create a match: {reply and reply.get('message')}")
+                return False
+            match = reply['match']
+        send_message(self.socket, {'type': 'join_match', 'match': int(match)})
+        return True
+    
     def send_command(self, command):
-        try:
-            self.socket.send(json.dumps(command).encode())
-            response = self.socket.recv(1024).decode()
-            return json.loads(response)
-        except (socket.error, json.JSONDecodeError) as e:
-            print(f"Error communicating with server: {e}")
-            self.running = False
-            return None
+        # Never waits for the reply, which comes back to handle_reply through the reader thread
+        return self.connection.request(command, self.handle_reply)
     
-    def update_game_state(self):
-        response = self.send_command({'type': 'get_state'})
-        if response:
-            self.game_state = response
+    def move(self, direction):
+        # Shown right away; the server's state catches up one round trip later
+        with self.state_lock:
+            if self.udp:
+                request_id = (self.udp.move(direction), time.monotonic())
+            else:
+                request_id = self.send_command({'type': 'move', 'direction': direction})
+            self.pending_moves.append([request_id, direction, None])
+        self.state_changed.set()
     
-    def draw_screen(self, stdscr):
-        if not self.game_state:
+    def open_udp(self, reply):
+        if reply.get('status') != 'success':
+            with self.state_lock:
+                self.status_message = f"Moves stay on TCP: {reply.get('message')}"
+            self.state_changed.set()
             return
+        self.udp = UdpMoves(self.host, reply['port'], self.player_id, reply['token'], timeout=UDP_ACK_TIMEOUT)
+        threading.Thread(target=self.read_acks, daemon=True).start()
+    
+    def read_acks(self):
+        while self.running:
+            ack = self.udp.receive()
+            with self.state_lock:
+                now = time.monotonic()
+                for pending in self.pending_moves:
+                    if not isinstance(pending[0], tuple) or pending[2] is not None:
+                        continue
+                    sequence, sent_at = pending[0]
+                    if ack is not None and sequence <= ack[0]:
+                        # Earlier moves without an ack were either applied before this one or dropped
+                        # as stale; either way the server state at the acked version settles them
+                        pending[2] = ack[1]
+                    elif now - sent_at > UDP_ACK_TIMEOUT:
+                        pending[2] = self.version
+                self.settle_moves()
+            self.state_changed.set()
+    
+    def handle_message(self, message):
+        # State is pushed by the server whenever it changes, so there is no polling loop
+        with self.state_lock:
+            self.apply_message(message)
+        self.state_changed.set()
+    
+    def handle_reply(self, message):
+        with self.state_lock:
+            for pending in self.pending_moves:
+                if pending[0] == message['id']:
+                    pending[2] = message.get('version', -1)
+                    if message.get('status') == 'error':
+                        # The moves after a refused one were predicted from the wrong place
+                        self.pending_moves.clear()
+                    break
+            self.apply_message(message)
+        self.state_changed.set()
+    
+    def apply_message(self, message):
+        if message.get('type') == 'state':
+            self.load_snapshot(message)
+        elif message.get('type') == 'delta':
+            self.apply_delta(message)
+        elif 'leaderboard' in message:
+            self.status_message = self.leaderboard_line(message)
+        elif 'message' in message:
+            self.status_message = message['message']
+        self.settle_moves()
+    
+    def settle_moves(self):
+        # Moves the server state already shows are no longer predicted
+        while self.pending_moves and self.pending_moves[0][2] is not None and self.pending_moves[0][2] <= self.version:
+            self.pending_moves.popleft()
+    
+    @staticmethod
+    def leaderboard_line(message):
+        top = '  '.join(f"{entry['rank']}. {entry['id']} ({entry['score']})" for entry in message['leaderboard'])
+        return f"Rank {message['rank']} of {message['players']} | {top}"
+    
+    def connection_closed(self, error):
+        if error:
+            print(f"Error communicating with server: {error}")
+        self.running = False
+        self.state_changed.set()
+    
+    def load_snapshot(self, message):
+        state = message['state']
+        if 'view' in state:
+            # Only the square around us was sent; the rest of the map stays unknown until we get near
+            view = state.pop('view')
+            state['map'] = Grid(state['map_size'])
+            state['map'].load_area(view['x'], view['y'], view['rows'], view['cols'], view['cells'])
+        else:
+            state['map'] = Grid.decode(state['map_size'], state['map'])
+        self.game_state = state
+        self.version = message['version']
+        self.resync_pending = False
         
-        stdscr.clear()
+        self.occupants = {}
+        for player_id, player in state['players'].items():
+            self.occupants.setdefault(tuple(player['position']), set()).add(player_id)
+        self.full_redraw = True
+    
+    def _place_player(self, player_id, position):
+        """Moves a player's marker to `position` (None removes it) and marks both cells for redrawing."""
+        old = self.game_state['players'].get(player_id)
+        if old is not None:
+            old_position = tuple(old['position'])
+            occupants = self.occupants.get(old_position)
+            if occupants:
+                occupants.discard(player_id)
+                if not occupants:
+                    del self.occupants[old_position]
+            self.dirty_cells.add(old_position)
+        if position is not None:
+            self.occupants.setdefault(tuple(position), set()).add(player_id)
+            self.dirty_cells.add(tuple(position))
+    
+    def apply_delta(self, delta):
+        if self.game_state is None or delta['from'] > self.version:
+            # Missed an update, ask for everything after the last version we have
+            if not self.resync_pending:
+                self.resync_pending = True
+                self.send_command({'type': 'get_state', 'since': self.version})
+            return
         
-        # Draw map
-        for i, row in enumerate(self.game_state['map']):
-            for j, cell in enumerate(row):
-                # Draw players
-                is_player = False
-                for pid, pdata in self.game_state['players'].items():
-                    if pdata['position'] == (i, j):
-                        if int(pid) == self.player_id:
-                            stdscr.addstr(i, j, "P", curses.A_BOLD)
-                        else:
-                            stdscr.addstr(i, j, "O")
-                        is_player = True
-                        break
-                
-                if not is_player:
-                    stdscr.addstr(i, j, cell)
+        self.resync_pending = False
+        # Changes made up for a view (cells or players coming into sight) share the version that caused them
+        known = self.version
+        for change in delta['changes']:
+            if change['v'] <= known:
+                continue
+            
+            op = change['op']
+            if op == 'cell':
+                self.game_state['map'][change['x'], change['y']] = change['value']
+                self.dirty_cells.add((change['x'], change['y']))
+            elif op == 'area':
+                x, y, rows, cols = change['x'], change['y'], change['rows'], change['cols']
+                self.game_state['map'].load_area(x, y, rows, cols, change['cells'])
+                self.dirty_cells.update((i, j) for i in range(x, x + rows) for j in range(y, y + cols))
+            elif op == 'player':
+                self._place_player(change['id'], change['position'])
+                self.game_state['players'][change['id']] = {
+                    'position': change['position'],
+                    'score': change['score']
+                }
+            elif op == 'remove':
+                self._place_player(change['id'], None)
+                self.game_state['players'].pop(change['id'], None)
+            elif op == 'counters':
+                self.game_state['treasures_left'] = change['treasures_left']
+                self.game_state['room_treasures'] = change['room_treasures']
+        self.version = max(known, delta['version'])
+    
+    def draw_screen(self, stdscr):
+        """Draws only the cells and status lines that changed since the last frame."""
+        with self.state_lock:
+            if not self.game_state:
+                return
+            
+            grid = self.game_state['map']
+            me = self.shown_position()
+            if me != self.drawn_me:
+                self.dirty_cells.update(position for position in (self.drawn_me, me) if position)
+                self.drawn_me = me
+            
+            # With a view the screen scrolls along with the player
+            viewport = self.viewport()
+            if viewport != self.drawn_viewport:
+                self.drawn_viewport = viewport
+                self.full_redraw = True
+            top, left, rows, cols = viewport
+            
+            if self.full_redraw:
+                self.full_redraw = False
+                self.dirty_cells.clear()
+                self.drawn_status = [None] * len(self.drawn_status)
+                stdscr.erase()
+                cells = ((i, j) for i in range(top, top + rows) for j in range(left, left + cols))
+            else:
+                cells, self.dirty_cells = self.dirty_cells, set()
+            
+            for position in cells:
+                x, y = position
+                if top <= x < top + rows and left <= y < left + cols:
+                    self.draw_cell(stdscr, grid, position, x - top, y - left)
+            
+            status_y = rows + 2
+            for offset, line in enumerate(self.status_lines(grid)):
+                if line != self.drawn_status[offset]:
+                    stdscr.addstr(status_y + offset, 0, line)
+                    stdscr.clrtoeol()
+                    self.drawn_status[offset] = line
         
-        # Draw status
-        status_y = len(self.game_state['map']) + 2
+        stdscr.refresh()
+    
+    def shown_position(self):
+        """Where this player is drawn: its position on the server plus the moves still on the way."""
+        player = self.game_state['players'].get(str(self.player_id))
+        if player is None:
+            return None
+        x, y = player['position']
+        last = self.game_state['map_size'] - 1
+        for _, direction, _ in self.pending_moves:
+            dx, dy = MOVES[direction]
+            x, y = min(max(x + dx, 0), last), min(max(y + dy, 0), last)
+        return (x, y)
+    
+    def viewport(self):
+        """The (top, left, rows, cols) part of the map on screen: all of it, or the view around the player."""
+        size = self.game_state['map_size']
+        player = self.game_state['players'].get(str(self.player_id))
+        if not self.view or player is None:
+            return (0, 0, size, size)
+        x, y = player['position']
+        top, left = max(0, x - self.view), max(0, y - self.view)
+        return (top, left, min(size, x + self.view + 1) - top, min(size, y + self.view + 1) - left)
+    
+    def draw_cell(self, stdscr, grid, position, x, y):
+        occupants = self.occupants.get(position, ())
+        if position == self.drawn_me:
+            stdscr.addstr(x, y, "P", curses.A_BOLD)
+        elif any(player_id != str(self.player_id) for player_id in occupants):
+            stdscr.addstr(x, y, "O")
+        else:
+            stdscr.addstr(x, y, symbol(grid[position]))
+    
+    def status_lines(self, grid):
+        lines = ['', '', self.status_message]
         player = self.game_state['players'].get(str(self.player_id))
         if player:
-            stdscr.addstr(status_y, 0, f"Score: {player['score']} | ")
-            stdscr.addstr(f"Treasures left: {self.game_state['treasures_left']}")
+            lines[0] = f"Score: {player['score']} | Treasures left: {self.game_state['treasures_left']}"
             
             # Show treasure room info if on X
-            if player['position'] == (self.game_state['map'].index('X' in row) 
-                                    for row in self.game_state['map']):
-                stdscr.addstr(status_y + 1, 0, 
-                            f"Press 'k' to collect treasure ({self.game_state['room_treasures']} left)")
-        
-        stdscr.refresh()
+            if grid[player['position']] == TREASURE_ROOM:
+                lines[1] = f"Press 'k' to collect treasure ({self.game_state['room_treasures']} left)"
+        return lines
     
     def handle_input(self, stdscr):
         key_mapping = {
@@ -93,22 +331,17 @@ class GameClient:
                 key = stdscr.getkey()
                 
                 if key in key_mapping:
-                    response = self.send_command({
-                        'type': 'move',
-                        'direction': key_mapping[key]
-                    })
-                    if response:
-                        self.game_state = response
+                    self.move(key_mapping[key])
                 
                 elif key == 'k':
-                    response = self.send_command({'type': 'enter_room'})
-                    if response and response.get('status') == 'success':
-                        self.game_state = response['state']
-                        stdscr.addstr(len(self.game_state['map']) + 3, 0, 
-                                    response['message'])
+                    self.send_command({'type': 'enter_room'})
+                
+                elif key == 'l':
+                    self.send_command({'type': 'leaderboard', 'k': 3})
                 
                 elif key == 'q':
                     self.running = False
+                    self.state_changed.set()
                     break
                 
             except curses.error:
@@ -124,20 +357,37 @@ class GameClient:
             input_thread = threading.Thread(target=self.handle_input, args=(stdscr,))
             input_thread.start()
             
-            # Main game loop
+            # Main game loop: redraw only when the server pushed something new
             while self.running:
-                self.update_game_state()
-                self.draw_screen(stdscr)
-                time.sleep(0.1)
+                if self.state_changed.wait(0.1):
+                    self.state_changed.clear()
+                    self.draw_screen(stdscr)
             
             input_thread.join()
         
         if self.connect():
+            self.connection.start(self.handle_message, self.connection_closed)
+            if self.codec != JSON:
+                self.connection.use_codec(self.codec)
+            self.connection.send({'type': 'subscribe', 'view': self.view} if self.view else {'type': 'subscribe'})
+            if self.use_udp:
+                self.connection.request({'type': 'udp'}, self.open_udp)
             try:
                 curses.wrapper(curses_main)
             finally:
-                self.socket.close()
+                self.connection.close()
+                if self.udp:
+                    self.udp.close()
 
 if __name__ == "__main__":
-    client = GameClient()
+    parser = argparse.ArgumentParser(description='Treasure hunt client')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--match', help="match to join through a lobby, or 'new' to create one")
+    parser.add_argument('--view', type=int, help='only follow the cells this many steps around you (large maps)')
+    parser.add_argument('--codec', choices=CODECS, default=JSON, help='wire encoding of the server messages')
+    parser.add_argument('--udp', action='store_true', help='send moves over UDP, if the server takes them')
+    args = parser.parse_args()
+    
+    client = GameClient(args.host, args.port, args.match, args.view, args.codec, args.udp)
     client.run()
\ No newline at end of file
@@ -3,112 +3,709 @@ import threading
 import json
 import time
 import random
+import argparse
+import asyncio
+import os
+import queue
+import multiprocessing
+import signal
+from collections import deque
+from contextlib import ExitStack, nullcontext
+from functools import partial
+from itertools import islice
 from threading import Lock
+from grade import EMPTY, TREASURE_ROOM, CellPool, Grid
+from codec import CODECS, JSON
+from interest import Interest
+from leaderboard import Leaderboard
+from metrics import Metrics, serve_metrics
+from persistence import Journal, load_state
+from outbox import AsyncOutbox, Outbox
+from players import IdAllocator, PlayerTable
+from shared import ACTIVE, COLLECTED, ROOM_TREASURES, VERSION, SharedCounter, SharedGame, SharedIds, SharedPlayers
+from recording import JOIN, LEAVE, Recorder
+from protocolo import AsyncMessageReader, MessageReader, ProtocolError, encode_message, send_message
+from udp import UdpChannel, UdpDatagrams
+
+MAP_FULL = {'status': 'error', 'message': 'Map is full'}
+MOVED = {}  # a move that went through; its reply is built from the state after the moves sent with it
+LEADERBOARD_MAX = 100  # most players a leaderboard reply lists
+MOVE_BATCH = 64  # most moves already read from one connection that are answered together
+INBOX_LIMIT = 64  # most commands of one connection the tick engine holds before it stops reading them
 
 class GameServer:
-    def __init__(self, host='localhost', port=5000):
+    def __init__(self, host='localhost', port=5000, backlog=5, map_size=10, num_treasures=20, region_size=4,
+                 state_path=None, snapshot_interval=30, listen=True, udp_port=None, seed=None, record_path=None):
         self.host = host
         self.port = port
-        self.map_size = 10
-        self.num_treasures = 20
-        self.main_map = [["." for _ in range(self.map_size)] for _ in range(self.map_size)]
-        self.map_lock = Lock()
-        self.player_lock = Lock()
+        self.backlog = backlog
+        
+        # A saved game, if there is one, decides the map size and treasure count
+        self.journal = None
+        journal_path = state_path and os.path.splitext(state_path)[0] + '.journal'
+        saved, saved_changes = load_state(state_path, journal_path) if state_path else (None, [])
+        if saved:
+            map_size, num_treasures = saved['map_size'], saved['num_treasures']
+        
+        self.map_size = map_size
+        self.num_treasures = num_treasures
+        self.main_map = Grid(self.map_size)
+        
+        # Everything random in a match comes from the seed, so a seed and the commands a match
+        # applied are enough to play it again
+        self.seed = seed if seed is not None else random.randrange(2 ** 32)
+        self.random = random.Random(self.seed)
+        self._initialize_locks(region_size)
         self.game_active = True
         
         # Game state
-        self.players = {}
+        self.players = PlayerTable()
+        # Cell index -> id of the player standing there, or a set of ids while several share it;
+        # most cells hold one player, and a bare id costs far less than a set per player
+        self.occupancy = {}
         self.collected_treasures = 0
         self.total_treasures = self.num_treasures + 5  # Regular + room treasures
+        self.leaderboard = Leaderboard()  # follows the recorded player changes
         
         # Treasure room
-        self.treasure_room_x = random.randint(0, self.map_size - 1)
-        self.treasure_room_y = random.randint(0, self.map_size - 1)
+        self.treasure_room_x = self.random.randint(0, self.map_size - 1)
+        self.treasure_room_y = self.random.randint(0, self.map_size - 1)
         self.treasures_in_room = 5
-        self.room_lock = Lock()
+        
+        # Versioned change log used to send deltas instead of full snapshots
+        self.version = 0
+        self.broadcast_version = 0
+        self.change_log = deque(maxlen=1024)
+        
+        self._initialize_connections()
         
         # Initialize game
         self._initialize_map()
-        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.server_socket.bind((self.host, self.port))
-        self.server_socket.listen(5)
+        if saved:
+            self._restore(saved, saved_changes)
+        self.player_ids = IdAllocator(self.players)  # skips the ids of players restored from a save
+        if state_path:
+            self.journal = Journal(state_path, journal_path, fresh=not saved)
+            self.snapshot_interval = snapshot_interval
+            self.next_snapshot = time.monotonic() + snapshot_interval
+            self.save_snapshot()  # the journal is replayed on top of a snapshot, so start with one
+        
+        # Optional log of every command applied, for replay.py
+        self.recorder = None
+        if record_path:
+            self.recorder = Recorder(record_path, {'seed': self.seed, 'map_size': self.map_size,
+                                                   'num_treasures': self.num_treasures, 'region_size': region_size})
+        
+        # Matches hosted by a lobby get their connections handed over instead of listening
+        self.server_socket = None
+        self.udp = None
+        if listen:
+            self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.server_socket.bind((self.host, self.port))
+            self.server_socket.listen(self.backlog)
+            # Optional datagram channel for moves (see udp.py); port 0 lets the system pick one
+            if udp_port is not None:
+                self.udp = UdpChannel(self.host, udp_port)
+    
+    def _initialize_locks(self, region_size, locks=None, stripes=None):
+        """Creates the metrics and the game's locks, all timed by them.
+
+        A match served by several processes passes the locks they share (see shared.py), by
+        name and one per stripe of regions, to be timed instead of new ones.
+        """
+        self.metrics = Metrics()
+        locks = locks or {}
+        self.player_lock = self.metrics.timed_lock('player', locks.get('player'))
+        self.room_lock = self.metrics.timed_lock('room', locks.get('room'))
+        self.counter_lock = self.metrics.timed_lock('counter', locks.get('counter'))
+        self.spawn_lock = self.metrics.timed_lock('spawn')
+        self.log_lock = self.metrics.timed_lock('log', locks.get('log'))
+        
+        # The map is split into region_size x region_size regions with one lock each,
+        # so moves in different regions run in parallel
+        self.region_size = region_size
+        self.regions_per_row = -(-self.map_size // region_size)
+        if stripes is None:
+            stripes = [None] * (self.regions_per_row * self.regions_per_row)
+        self.region_locks = [self.metrics.timed_lock('region', lock) for lock in stripes]
+    
+    def _initialize_connections(self):
+        # Connections that receive pushed state updates: player id -> last version pushed to it
+        self.subscribers = {}
+        self.outboxes = {}  # player id -> Outbox every frame to its connection goes through
+        self.subscriber_lock = Lock()
+        self.codecs = {}  # player id -> codec its connection switched to, when not JSON
+        
+        # Serialized views of the current version, shared by every client that asks for them
+        self.encoded_cache = {}
+        
+        # Subscribers that only follow the area around their player
+        self.interest = Interest(self)
     
     def _initialize_map(self):
-        with self.map_lock:
-            # Place regular treasures
-            for _ in range(self.num_treasures):
-                while True:
-                    x, y = random.randint(0, self.map_size - 1), random.randint(0, self.map_size - 1)
-                    if self.main_map[x][y] == "." and (x, y) != (self.treasure_room_x, self.treasure_room_y):
-                        self.main_map[x][y] = str(random.randint(1, 9))
-                        break
+        with self._lock_all_regions():
+            room_index = self.main_map.index(self.treasure_room_x, self.treasure_room_y)
+            total_cells = self.map_size * self.map_size
+            if self.num_treasures > total_cells - 1:
+                raise ValueError(f'{self.num_treasures} treasures do not fit on a {self.map_size}x{self.map_size} map')
+            
+            # Place regular treasures on distinct cells, skipping the treasure room
+            for index in self.random.sample(range(total_cells - 1), self.num_treasures):
+                if index >= room_index:
+                    index += 1
+                self.main_map.cells[index] = self.random.randint(1, 9)
             
             # Mark treasure room
-            self.main_map[self.treasure_room_x][self.treasure_room_y] = "X"
+            self.main_map.cells[room_index] = TREASURE_ROOM
+            
+            # Empty cells nobody stands on, used to place new players
+            self.spawn_cells = CellPool(
+                total_cells, (index for index, value in enumerate(self.main_map.cells) if value == EMPTY)
+            )
+    
+    def _restore(self, snapshot, changes):
+        """Rebuilds the game from a snapshot plus the journaled changes made after it."""
+        self.main_map = Grid.decode(self.map_size, snapshot['map'])
+        self.treasure_room_x, self.treasure_room_y = snapshot['room']
+        self.treasures_in_room = snapshot['treasures_in_room']
+        self.collected_treasures = snapshot['collected_treasures']
+        self.players = PlayerTable({
+            int(player_id): {'position': tuple(player['position']), 'score': player['score']}
+            for player_id, player in snapshot['players'].items()
+        })
+        self.version = snapshot['version']
+        for change in changes:
+            self._apply_change(change)
+            self.version = change['v']
+        self.broadcast_version = self.version
+        
+        # Players from before the restart have no connection; they keep their cell and score
+        self.occupancy = {}
+        for player_id, player in self.players.items():
+            self._add_occupant(self.main_map.index(*player['position']), player_id)
+            self.leaderboard.update(player_id, player['score'])
+        self.spawn_cells = CellPool(self.map_size * self.map_size, (
+            index for index, value in enumerate(self.main_map.cells)
+            if value == EMPTY and index not in self.occupancy
+        ))
+    
+    def _apply_change(self, change):
+        op = change['op']
+        if op == 'cell':
+            self.main_map[change['x'], change['y']] = change['value']
+        elif op == 'player':
+            self.players[int(change['id'])] = {'position': tuple(change['position']), 'score': change['score']}
+        elif op == 'remove':
+            self.players.pop(int(change['id']), None)
+        elif op == 'counters':
+            self.collected_treasures = self.total_treasures - change['treasures_left']
+            self.treasures_in_room = change['room_treasures']
+    
+    def save_snapshot(self):
+        """Hands a consistent copy of the game to the journal writer, which saves it off the hot path."""
+        with self.room_lock, self._lock_all_regions(), self.log_lock:
+            version = self.version
+            cells = bytes(self.main_map.cells)
+            players = {str(player_id): player for player_id, player in self.players.snapshot().items()}
+            counters = (self.treasures_in_room, self.collected_treasures)
+        
+        self.journal.save_snapshot({
+            'version': version,
+            'map_size': self.map_size,
+            'num_treasures': self.num_treasures,
+            'map': Grid(self.map_size, cells).encode(),
+            'room': [self.treasure_room_x, self.treasure_room_y],
+            'treasures_in_room': counters[0],
+            'collected_treasures': counters[1],
+            'players': players
+        })
+    
+    def maybe_save_snapshot(self):
+        if self.journal and time.monotonic() >= self.next_snapshot:
+            self.next_snapshot = time.monotonic() + self.snapshot_interval
+            self.save_snapshot()
+    
+    def close_journal(self):
+        if self.journal:
+            self.journal.close()
+    
+    def close_recorder(self):
+        if self.recorder:
+            self.recorder.close(self)
+    
+    def recording(self, player_id, command):
+        return self.recorder.entry(player_id, command) if self.recorder else nullcontext()
     
     def get_game_state(self):
+        encoded_map = self.encoded_view('map', self.main_map.encode)
         with self.player_lock:
             return {
-                'map': self.main_map,
-                'players': self.players,
+                'map': encoded_map,
+                'map_size': self.map_size,
+                'players': self.players.snapshot(),
                 'treasures_left': self.total_treasures - self.collected_treasures,
                 'room_treasures': self.treasures_in_room
             }
     
+    def get_snapshot(self):
+        with self.log_lock:
+            version = self.version
+        return {'type': 'state', 'version': version, 'state': self.get_game_state()}
+    
+    def get_state_since(self, version):
+        """Returns the changes after `version`, or a full snapshot if the log no longer covers it."""
+        with self.log_lock:
+            if self.change_log:
+                oldest = self.change_log[0]['v']
+            else:
+                oldest = self.version + 1
+            
+            if oldest <= version + 1 <= self.version + 1:
+                changes = list(islice(self.change_log, version + 1 - oldest, None))
+                return {'type': 'delta', 'from': version, 'version': self.version, 'changes': changes}
+        
+        return self.get_snapshot()
+    
+    def encoded_view(self, view, build):
+        """Returns `build()` for the current version, building it at most once per version and view."""
+        with self.log_lock:
+            version = self.version
+            data = self.encoded_cache.get(view)
+            if data is not None and data[0] == version:
+                return data[1]
+        
+        data = build()
+        with self.log_lock:
+            # Only cache it if nothing changed while it was being built
+            if self.version == version:
+                self.encoded_cache[view] = (version, data)
+        return data
+    
+    def encoded_state(self, codec=JSON):
+        return self.encoded_view(('state', codec), lambda: encode_message(self.get_game_state(), codec))
+    
+    def encoded_snapshot(self, codec=JSON):
+        return self.encoded_view(('snapshot', codec), lambda: encode_message(self.get_snapshot(), codec))
+    
+    def encoded_update(self, player_id):
+        """What a subscriber was not sent yet, as one frame, or None if it is up to date.
+
+        Built by the subscriber's outbox right before it writes, so one that fell behind gets all
+        it missed at once: a delta, or a snapshot once the change log no longer goes back that far.
+        """
+        with self.subscriber_lock:
+            since = self.subscribers.get(player_id)
+        if since is None:
+            return None
+        version, data = self.encoded_update_since(since, self.codecs.get(player_id, JSON))
+        if version == since:
+            return None
+        with self.subscriber_lock:
+            if player_id not in self.subscribers:
+                return None
+            if self.subscribers[player_id] == since:
+                self.subscribers[player_id] = version
+            self.metrics.add_bytes_out(player_id, len(data))
+        return data
+    
+    def encoded_update_since(self, since, codec):
+        """The update from `since` and the version it brings a subscriber to, shared by every subscriber there."""
+        def build():
+            update = self.get_state_since(since)
+            return update['version'], encode_message(update, codec)
+        return self.encoded_view(('update', since, codec), build)
+    
+    def encode_for(self, player_id, message):
+        return encode_message(message, self.codecs.get(player_id, JSON))
+    
+    def encode_response(self, player_id, response):
+        # Plain state replies are the same for everybody, so they reuse the cached frame
+        if 'status' not in response and 'type' not in response:
+            return self.encoded_state(self.codecs.get(player_id, JSON))
+        return self.encode_for(player_id, response)
+    
+    def _record(self, *changes):
+        with self.log_lock:
+            self.encoded_cache.clear()
+            for change in changes:
+                self.version += 1
+                change['v'] = self.version
+                self.change_log.append(change)
+                # Every score change is recorded as a player change, so the ranking never needs a scan
+                if change['op'] == 'player':
+                    self.leaderboard.update(int(change['id']), change['score'])
+                elif change['op'] == 'remove':
+                    self.leaderboard.remove(int(change['id']))
+            if self.interest.viewers:
+                self.interest.route(changes)
+            if self.journal:
+                self.journal.append(changes)
+    
+    def _player_change(self, player_id):
+        player = self.players[player_id]
+        return {'op': 'player', 'id': str(player_id), 'position': player['position'], 'score': player['score']}
+    
+    def _counters_change(self):
+        return {
+            'op': 'counters',
+            'treasures_left': self.total_treasures - self.collected_treasures,
+            'room_treasures': self.treasures_in_room
+        }
+    
+    def subscribe(self, player_id, client_socket, view=None):
+        """Pushes every change to the client, or only those within `view` cells of its player."""
+        if view is not None and (not isinstance(view, int) or view < 1):
+            self.send_to(player_id, client_socket, self.encode_for(player_id, {'status': 'error', 'message': 'Invalid view'}))
+            return
+        
+        self.unsubscribe(player_id)
+        if view is None:
+            with self.log_lock:
+                version = self.version
+            snapshot = self.encoded_snapshot(self.codecs.get(player_id, JSON))
+            # Queued before the subscriber is listed, so no pushed update can get ahead of it
+            with self.subscriber_lock:
+                self.send_to(player_id, client_socket, snapshot)
+                self.subscribers[player_id] = version
+            return
+        
+        with self.log_lock:
+            viewer = self.interest.add(player_id, client_socket, view)
+        with viewer.lock:
+            with self.log_lock:
+                snapshot = self.interest.snapshot(viewer)
+            self.send_to(player_id, client_socket, self.encode_for(player_id, snapshot))
+    
+    def unsubscribe(self, player_id):
+        with self.subscriber_lock:
+            self.subscribers.pop(player_id, None)
+        with self.log_lock:
+            self.interest.remove(player_id)
+    
+    def is_subscribed(self, player_id):
+        return player_id in self.subscribers or player_id in self.interest.viewers
+    
+    def ack_version(self, player_id):
+        # Viewers skip the versions they do not see, so they are acked in their own versions
+        with self.log_lock:
+            viewer = self.interest.viewers.get(player_id)
+            return self.version if viewer is None else self.interest.ack_version(viewer)
+    
+    def send_to(self, player_id, client_socket, data):
+        # Queued on the connection's outbox, so a client that does not read never blocks the game
+        self.outboxes[player_id].put(data)
+        self.metrics.add_bytes_out(player_id, len(data))
+    
+    def notify_state_change(self):
+        self.interest.flush()
+        with self.subscriber_lock:
+            subscribers = list(self.subscribers.items())
+        if not subscribers:
+            return
+        
+        with self.log_lock:
+            since, current = self.broadcast_version, self.version
+            self.broadcast_version = current
+        if since == current:
+            return
+        
+        # Subscribers keeping up all need the same update, so it is encoded here once per codec;
+        # the outboxes only build their own when they fell behind
+        for codec in {self.codecs.get(player_id, JSON) for player_id, version in subscribers if version == since}:
+            self.encoded_update_since(since, codec)
+        for player_id, _ in subscribers:
+            try:
+                self.outboxes[player_id].push(partial(self.encoded_update, player_id))
+            except (socket.error, KeyError):
+                self.unsubscribe(player_id)
+    
     def handle_client(self, client_socket, player_id):
+        reader = MessageReader(client_socket)
         try:
             while self.game_active:
                 try:
-                    data = client_socket.recv(1024).decode()
-                    if not data:
+                    command = reader.receive()
+                    if command is None:
                         break
+                    commands = self.read_moves(reader, command)
+                    self.metrics.set_bytes_in(player_id, reader.bytes_read)
                     
-                    command = json.loads(data)
-                    response = self.process_command(player_id, command)
-                    client_socket.send(json.dumps(response).encode())
-                    
-                    # Check if game should end
-                    if self.collected_treasures >= self.total_treasures:
-                        self.end_game()
+                    self.handle_commands(player_id, client_socket, commands)
                         
-                except (json.JSONDecodeError, socket.error):
+                except (json.JSONDecodeError, ProtocolError, socket.error):
                     break
         finally:
-            self.remove_player(player_id)
+            # Closing the outbox closes the socket, once the replies still queued are written
+            self.disconnect_player(player_id)
+    
+    @staticmethod
+    def read_moves(reader, command):
+        """`command`, followed by the moves that already arrived behind it (a held-down key)."""
+        commands = [command]
+        while command.get('type') == 'move' and len(commands) < MOVE_BATCH:
+            command = reader.buffered()
+            if command is None:
+                break
+            commands.append(command)
+        return commands
+    
+    def handle_command(self, player_id, connection, command):
+        self.handle_commands(player_id, connection, [command])
+    
+    def handle_commands(self, player_id, connection, commands):
+        """Handles commands that arrived together, in order; each run of moves is answered at once."""
+        moves = []
+        for command in commands:
+            if command.get('type') == 'move':
+                moves.append(self.apply_move(player_id, command))
+                continue
+            self.reply_to_moves(player_id, connection, moves)
+            moves = []
+            
+            if command.get('type') == 'subscribe':
+                self.subscribe(player_id, connection, command.get('view'))
+            elif command.get('type') == 'codec':
+                self.set_codec(player_id, connection, command)
+            else:
+                response = self.process_command(player_id, command)
+                if command.get('id') is not None:
+                    # Tagged requests always get a reply carrying their id, so pipelined clients can match every one
+                    self.send_to(player_id, connection, self.encode_for(player_id, dict(response, id=command['id'])))
+                else:
+                    self.send_to(player_id, connection, self.encode_response(player_id, response))
+        self.reply_to_moves(player_id, connection, moves)
+        
+        self.maybe_save_snapshot()
+        self.check_game_over()
+    
+    def apply_move(self, player_id, command):
+        return command, self.process_command(player_id, command), self.ack_version(player_id)
+    
+    def reply_to_moves(self, player_id, connection, moves):
+        """Answers a run of applied moves, as (command, response, version) triples, in one write.
+
+        Refused moves get their error and tagged moves a reply carrying their id, but only the last
+        move that went through carries the state, built once for all of them; the others are
+        acknowledged with the version they made, or not at all when untagged. A subscriber's moves
+        are only ever acknowledged, since its state is pushed anyway.
+        """
+        if not moves:
+            return
+        last = None
+        if not self.is_subscribed(player_id):
+            last = max((i for i, (_, response, _) in enumerate(moves) if 'status' not in response), default=None)
+        
+        frames = []
+        for i, (command, response, version) in enumerate(moves):
+            request_id = command.get('id')
+            if i == last:
+                if request_id is None:
+                    frames.append(self.encoded_state(self.codecs.get(player_id, JSON)))
+                    continue
+                response = self.get_game_state()
+            elif 'status' not in response:
+                if request_id is None:
+                    continue
+                response = {'status': 'success', 'version': version}
+            if request_id is not None:
+                response = dict(response, id=request_id)
+            frames.append(self.encode_for(player_id, response))
+        
+        self.metrics.count_merged_moves(len(moves) - 1)
+        if frames:
+            self.send_to(player_id, connection, b''.join(frames))
+    
+    def set_codec(self, player_id, connection, command):
+        """Switches what the server sends this connection to the codec it asked for."""
+        codec = command.get('codec')
+        if codec not in CODECS:
+            response = {'status': 'error', 'message': 'Unknown codec'}
+        else:
+            self.codecs[player_id] = codec
+            response = {'status': 'success', 'codec': codec}
+        if 'id' in command:
+            response['id'] = command['id']
+        self.send_to(player_id, connection, self.encode_for(player_id, response))
+    
+    def check_game_over(self):
+        if self.collected_treasures >= self.total_treasures:
+            self.end_game()
+    
+    def accept_client(self, client_socket):
+        """Adds a player for a new connection and sends the handshake; returns None if the map is full."""
+        player_id = self.connect_player()
+        if player_id is None:
+            send_message(client_socket, MAP_FULL)
             client_socket.close()
+            return None
+        
+        send_message(client_socket, player_id)
+        self.outboxes[player_id] = Outbox(client_socket, self.metrics.count_dropped_connection)
+        self.notify_state_change()
+        return player_id
+    
+    def connect_player(self):
+        player_id = self.player_ids.allocate()
+        if not self.add_player(player_id):
+            self.player_ids.release(player_id)
+            return None
+        return player_id
+    
+    def disconnect_player(self, player_id):
+        self.unsubscribe(player_id)
+        self.codecs.pop(player_id, None)
+        if self.udp:
+            self.udp.forget(player_id)
+        self.remove_player(player_id)
+        self.player_ids.release(player_id)
+        self.metrics.close_connection(player_id)
+        self.notify_state_change()
+        outbox = self.outboxes.pop(player_id, None)
+        if outbox is not None:
+            outbox.close()
     
     def process_command(self, player_id, command):
+        with self.recording(player_id, command):
+            return self.apply_command(player_id, command)
+    
+    def apply_command(self, player_id, command):
         cmd_type = command.get('type')
-        if cmd_type == 'move':
-            return self.move_player(player_id, command['direction'])
-        elif cmd_type == 'enter_room':
-            return self.handle_treasure_room(player_id)
-        elif cmd_type == 'get_state':
-            return self.get_game_state()
-        return {'status': 'error', 'message': 'Invalid command'}
+        started = time.perf_counter()
+        try:
+            if cmd_type == 'move':
+                return self.move_player(player_id, command['direction'])
+            elif cmd_type == 'enter_room':
+                return self.handle_treasure_room(player_id)
+            elif cmd_type == 'get_state':
+                viewer = self.interest.viewers.get(player_id)
+                if viewer is not None:
+                    # A viewer has no use for the whole map, it starts over from its square
+                    with viewer.lock, self.log_lock:
+                        return self.interest.snapshot(viewer)
+                if 'since' in command:
+                    return self.get_state_since(command['since'])
+                return self.get_game_state()
+            elif cmd_type == 'stats':
+                return {'status': 'success', 'stats': self.get_stats()}
+            elif cmd_type == 'udp':
+                return self.open_udp(player_id)
+            elif cmd_type == 'leaderboard':
+                k = command.get('k', 10)
+                if not isinstance(k, int) or k < 1:
+                    return {'status': 'error', 'message': 'Invalid leaderboard size'}
+                return self.get_leaderboard(player_id, min(k, LEADERBOARD_MAX))
+            return {'status': 'error', 'message': 'Invalid command'}
+        finally:
+            self.metrics.observe_command(cmd_type, time.perf_counter() - started)
+    
+    def open_udp(self, player_id):
+        if self.udp is None:
+            return {'status': 'error', 'message': 'UDP is not enabled'}
+        return self.udp.open(player_id)
+    
+    def serve_udp(self):
+        if self.udp:
+            print(f"Moves also accepted over UDP on {self.host}:{self.udp.port}")
+            threading.Thread(target=self.udp.serve, args=(self.handle_datagram,), daemon=True).start()
+    
+    def handle_datagram(self, data, address):
+        move = self.udp.accept(data)
+        if move is not None:
+            self.apply_datagram_move(*move, address)
+    
+    def apply_datagram_move(self, player_id, sequence, direction, address):
+        """Applies a move that came by UDP and acks it there with the player's new position."""
+        self.process_command(player_id, {'type': 'move', 'direction': direction})
+        player = self.players.get(player_id)
+        if player is not None:
+            self.udp.acknowledge(sequence, self.ack_version(player_id), player['position'], address)
+        self.maybe_save_snapshot()
+        self.check_game_over()
+    
+    def get_stats(self):
+        return self.metrics.snapshot(len(self.players))
+    
+    def get_leaderboard(self, player_id, k):
+        """The top `k` players and the rank of `player_id`, without looking at every player."""
+        with self.log_lock:
+            return self._leaderboard_reply(self.leaderboard, player_id, k)
+    
+    @staticmethod
+    def _leaderboard_reply(leaderboard, player_id, k):
+        return {
+            'status': 'success',
+            'leaderboard': [{'rank': rank, 'id': ranked_id, 'score': score}
+                            for rank, ranked_id, score in leaderboard.top(k)],
+            'rank': leaderboard.rank(player_id),
+            'players': len(leaderboard)
+        }
+    
+    def _region_of(self, position):
+        x, y = position
+        return (x // self.region_size) * self.regions_per_row + y // self.region_size
+    
+    def _lock_regions(self, *positions):
+        """Locks the regions holding the given cells, always in index order to avoid deadlocks."""
+        stack = ExitStack()
+        for region in sorted({self._region_of(position) for position in positions}):
+            stack.enter_context(self.region_locks[region])
+        return stack
+    
+    def _lock_all_regions(self):
+        stack = ExitStack()
+        for lock in self.region_locks:
+            stack.enter_context(lock)
+        return stack
+    
+    def _collect_treasure(self, player_id, points):
+        with self.counter_lock:
+            self.collected_treasures += 1
+            self.players[player_id]['score'] += points
+            return self._counters_change()
     
     def move_player(self, player_id, direction):
-        with self.map_lock:
-            if player_id not in self.players:
-                return {'status': 'error', 'message': 'Player not found'}
-            
-            x, y = self.players[player_id]['position']
+        player = self.players.get(player_id)
+        if not player:
+            return {'status': 'error', 'message': 'Player not found'}
+        
+        while True:
+            # Only this player's TCP and UDP moves change its position; if one of them gets in
+            # between reading the position and locking it, the move starts over from the new one
+            x, y = player['position']
             new_position = {
                 'up': (max(0, x - 1), y),
                 'down': (min(self.map_size - 1, x + 1), y),
                 'left': (x, max(0, y - 1)),
                 'right': (x, min(self.map_size - 1, y + 1))
             }.get(direction, (x, y))
-            
-            self.players[player_id]['position'] = new_position
             new_x, new_y = new_position
+            changed = new_position != (x, y)
             
-            if self.main_map[new_x][new_y].isdigit():
-                self.players[player_id]['score'] += int(self.main_map[new_x][new_y])
-                self.collected_treasures += 1
-                self.main_map[new_x][new_y] = "."
-            
-            return self.get_game_state()
+            with self._lock_regions((x, y), new_position):
+                # Ids are reused, so a player removed meanwhile must not move whoever gets its row next
+                if player_id not in self.players:
+                    return {'status': 'error', 'message': 'Player not found'}
+                if player['position'] != (x, y):
+                    continue
+                if changed:
+                    player['position'] = new_position
+                    self._vacate(player_id, (x, y))
+                    self._occupy(player_id, new_position)
+                
+                # The cell is only read and cleared under its region lock, so a treasure is collected once
+                if self.main_map.is_treasure(new_x, new_y):
+                    points = self.main_map[new_x, new_y]
+                    self.main_map[new_x, new_y] = EMPTY
+                    counters = self._collect_treasure(player_id, points)
+                    self._record({'op': 'cell', 'x': new_x, 'y': new_y, 'value': EMPTY}, counters)
+                
+                if changed:
+                    self._record(self._player_change(player_id))
+            break
+        
+        if changed:
+            self.notify_state_change()
+        return MOVED
     
     def handle_treasure_room(self, player_id):
         with self.room_lock:
@@ -124,50 +721,486 @@ class GameServer:
                 return {'status': 'error', 'message': 'Room is empty'}
             
             self.treasures_in_room -= 1
-            self.collected_treasures += 1
-            self.players[player_id]['score'] += 10
+            counters = self._collect_treasure(player_id, 10)
+            self._record(self._player_change(player_id), counters)
             
-            return {
+            response = {
                 'status': 'success',
                 'message': f'Found treasure! Room treasures left: {self.treasures_in_room}',
                 'state': self.get_game_state()
             }
+        
+        self.notify_state_change()
+        return response
     
     def add_player(self, player_id):
-        with self.player_lock:
-            start_x, start_y = random.randint(0, self.map_size - 1), random.randint(0, self.map_size - 1)
-            while self.main_map[start_x][start_y] != ".":
-                start_x, start_y = random.randint(0, self.map_size - 1), random.randint(0, self.map_size - 1)
+        """Places the player on a random free cell; returns False if the map is full."""
+        with self.recording(player_id, {'type': JOIN}):
+            with self.spawn_lock:
+                if not self.spawn_cells:
+                    return False
+                start_position = self.main_map.position(self.spawn_cells.choice(self.random))
             
-            self.players[player_id] = {
-                'position': (start_x, start_y),
-                'score': 0
-            }
+            with self._lock_regions(start_position), self.player_lock:
+                self.players[player_id] = {
+                    'position': start_position,
+                    'score': 0
+                }
+                self._occupy(player_id, start_position)
+                self._record(self._player_change(player_id))
+                return True
     
     def remove_player(self, player_id):
-        with self.player_lock:
-            if player_id in self.players:
-                del self.players[player_id]
+        with self.recording(player_id, {'type': LEAVE}):
+            player = self.players.get(player_id)
+            if player:
+                with self._lock_regions(player['position']), self.player_lock:
+                    self._vacate(player_id, player['position'])
+                    del self.players[player_id]
+                    self._record({'op': 'remove', 'id': str(player_id)})
+    
+    # Occupancy and the spawn pool are only touched with the region lock of the cell held
+    def _occupy(self, player_id, position):
+        index = self.main_map.index(*position)
+        self._add_occupant(index, player_id)
+        with self.spawn_lock:
+            self.spawn_cells.discard(index)
+    
+    def _add_occupant(self, index, player_id):
+        occupants = self.occupancy.get(index)
+        if occupants is None:
+            self.occupancy[index] = player_id
+        elif isinstance(occupants, set):
+            occupants.add(player_id)
+        elif occupants != player_id:
+            self.occupancy[index] = {occupants, player_id}
+    
+    def _vacate(self, player_id, position):
+        index = self.main_map.index(*position)
+        occupants = self.occupancy.get(index)
+        if isinstance(occupants, set):
+            occupants.discard(player_id)
+            if len(occupants) == 1:
+                self.occupancy[index] = occupants.pop()
+        elif occupants == player_id:
+            del self.occupancy[index]
+            if self.main_map.cells[index] == EMPTY:
+                with self.spawn_lock:
+                    self.spawn_cells.add(index)
+    
+    def players_at(self, x, y):
+        """Ids of the players standing on (x, y), in constant time."""
+        occupants = self.occupancy.get(self.main_map.index(x, y))
+        if occupants is None:
+            return set()
+        return occupants if isinstance(occupants, set) else {occupants}
     
     def end_game(self):
         self.game_active = False
-        winner_id = max(self.players.items(), key=lambda x: x[1]['score'])[0]
-        winner_score = self.players[winner_id]['score']
+        rankings = self.get_leaderboard(None, 10)['leaderboard']
+        winner = rankings[0] if rankings else {'id': None, 'score': 0}
         return {
             'status': 'game_over',
-            'winner': winner_id,
-            'score': winner_score
+            'winner': winner['id'],
+            'score': winner['score'],
+            'rankings': rankings
         }
     
     def run(self):
-        print(f"Server starting on {self.host}:{self.port}")
+        print(f"Server starting on {self.host}:{self.port} (seed {self.seed})")
+        self.serve_udp()
         try:
             while self.game_active:
                 client_socket, addr = self.server_socket.accept()
-                player_id = random.randint(1000, 9999)
-                self.add_player(player_id)
+                player_id = self.accept_client(client_socket)
+                if player_id is None:
+                    continue
                 
-                client_socket.send(str(player_id).encode())
+                thread = threading.Thread(target=self.handle_client, 
+                                       args=(client_socket, player_id))
+                thread.start()
+        finally:
+            self.server_socket.close()
+            if self.udp:
+                self.udp.close()
+            self.close_journal()
+            self.close_recorder()
+
+class AsyncGameServer(GameServer):
+    """Runs the same game on a single asyncio event loop instead of one thread per client.
+
+    Every command runs to completion on the loop, so the game locks are replaced by no-ops.
+    """
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.player_lock = self.room_lock = self.counter_lock = self.spawn_lock = nullcontext()
+        self.region_locks = [nullcontext()] * len(self.region_locks)
+        self.subscriber_lock = self.log_lock = nullcontext()
+        self.stopped = None
+    
+    def end_game(self):
+        result = super().end_game()
+        self.stopped.set()
+        return result
+    
+    async def handle_connection(self, reader, writer):
+        player_id = self.connect_player()
+        if player_id is None:
+            writer.write(encode_message(MAP_FULL))
+            writer.close()
+            return
+        
+        writer.write(encode_message(player_id))
+        outbox = self.outboxes[player_id] = AsyncOutbox(writer, self.metrics.count_dropped_connection)
+        self.notify_state_change()
+        messages = AsyncMessageReader(reader)
+        try:
+            while self.game_active:
+                command = await messages.receive_async()
+                if command is None:
+                    break
+                commands = self.read_moves(messages, command)
+                self.metrics.set_bytes_in(player_id, messages.bytes_read)
+                
+                self.handle_commands(player_id, writer, commands)
+                await outbox.drain()
+        except (json.JSONDecodeError, ProtocolError, ConnectionError):
+            pass
+        finally:
+            self.disconnect_player(player_id)
+            writer.close()
+    
+    async def serve(self):
+        self.stopped = asyncio.Event()
+        server = await asyncio.start_server(self.handle_connection, sock=self.server_socket, backlog=self.backlog)
+        if self.udp:
+            print(f"Moves also accepted over UDP on {self.host}:{self.udp.port}")
+            await asyncio.get_running_loop().create_datagram_endpoint(lambda: UdpDatagrams(self), sock=self.udp.socket)
+        async with server:
+            await self.stopped.wait()
+    
+    def run(self):
+        print(f"Async server starting on {self.host}:{self.port} (seed {self.seed})")
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.server_socket.close()
+            if self.udp:
+                self.udp.close()
+            self.close_journal()
+            self.close_recorder()
+
+class TickGameServer(GameServer):
+    """Authoritative fixed-tick mode: connection threads only queue commands, and one
+    simulation thread applies each tick's batch and broadcasts a single update.
+
+    Only the simulation thread touches game state, so the game locks are replaced by no-ops.
+    """
+    
+    # Queue markers for joins and leaves; compared by identity so clients cannot forge them
+    JOIN = {'type': 'join'}
+    LEAVE = {'type': 'leave'}
+    
+    def __init__(self, *args, tick_rate=20, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.tick_rate = tick_rate
+        self.commands = queue.SimpleQueue()
+        self.inboxes = {}  # player id -> semaphore counting the commands it may still have queued
+        self.tick_lock = Lock()  # held while a tick runs, so outboxes build updates between ticks
+        self.state_dirty = False
+        self.player_lock = self.room_lock = self.counter_lock = self.spawn_lock = nullcontext()
+        self.subscriber_lock = self.log_lock = nullcontext()
+        self.region_locks = [nullcontext()] * len(self.region_locks)
+    
+    def notify_state_change(self):
+        # Changes are broadcast once, at the end of the tick
+        self.state_dirty = True
+    
+    def check_game_over(self):
+        pass
+    
+    def encoded_update(self, player_id):
+        # Called from the outbox threads, and only the simulation thread may touch the game mid-tick
+        with self.tick_lock:
+            return super().encoded_update(player_id)
+    
+    def handle_client(self, client_socket, player_id):
+        reader = MessageReader(client_socket)
+        inbox = self.inboxes[player_id]
+        try:
+            while self.game_active:
+                command = reader.receive()
+                if command is None:
+                    break
+                self.metrics.set_bytes_in(player_id, reader.bytes_read)
+                # A client sending faster than the ticks apply its commands waits here, and then
+                # its socket buffers fill, instead of growing the queue
+                while not inbox.acquire(timeout=1):
+                    if not self.game_active:
+                        return
+                self.commands.put((player_id, client_socket, command))
+        except (json.JSONDecodeError, ProtocolError, socket.error):
+            pass
+        finally:
+            self.commands.put((player_id, client_socket, self.LEAVE))
+    
+    def handle_datagram(self, data, address):
+        # Applied on the simulation thread like every other command
+        move = self.udp.accept(data)
+        if move is not None:
+            player_id, sequence, direction = move
+            # Moves by UDP share the connection's inbox bound; past it they are dropped like a lost datagram
+            inbox = self.inboxes.get(player_id)
+            if inbox is not None and inbox.acquire(blocking=False):
+                self.commands.put((player_id, address, (sequence, direction)))
+    
+    def join_player(self, player_id, client_socket):
+        if not self.add_player(player_id):
+            # The id and the outbox go when the LEAVE queued by the connection thread is applied;
+            # until then, replies to commands it queued meanwhile are refused by the closed outbox
+            self.send_to(player_id, client_socket, encode_message(MAP_FULL))
+            self.outboxes[player_id].close()
+            return
+        self.send_to(player_id, client_socket, encode_message(player_id))
+        self.notify_state_change()
+    
+    def run_tick(self):
+        batch = []
+        try:
+            while True:
+                batch.append(self.commands.get_nowait())
+        except queue.Empty:
+            pass
+        
+        moves = {}  # player id -> (connection, the moves it sent this tick), answered after the batch
+        for player_id, client_socket, command in batch:
+            try:
+                if command is self.JOIN:
+                    self.join_player(player_id, client_socket)
+                elif command is self.LEAVE:
+                    moves.pop(player_id, None)
+                    self.inboxes.pop(player_id, None)
+                    self.disconnect_player(player_id)
+                elif isinstance(command, tuple):
+                    # A move that came by UDP, queued with the address to ack it at
+                    inbox = self.inboxes.get(player_id)
+                    if inbox is not None:
+                        inbox.release()
+                    self.apply_datagram_move(player_id, *command, client_socket)
+                else:
+                    self.inboxes[player_id].release()
+                    if command.get('type') == 'move':
+                        moves.setdefault(player_id, (client_socket, []))[1].append(self.apply_move(player_id, command))
+                    else:
+                        # Its earlier moves are answered first, so the replies keep the commands' order
+                        self.reply_to_moves(player_id, *moves.pop(player_id, (client_socket, [])))
+                        self.handle_command(player_id, client_socket, command)
+            except (socket.error, KeyError):
+                # A connection already gone must never take the simulation thread down with it
+                pass
+        for player_id, (client_socket, player_moves) in moves.items():
+            try:
+                self.reply_to_moves(player_id, client_socket, player_moves)
+            except (socket.error, KeyError):
+                pass
+        self.maybe_save_snapshot()
+        
+        if self.state_dirty:
+            self.state_dirty = False
+            GameServer.notify_state_change(self)
+        GameServer.check_game_over(self)
+    
+    def simulate(self):
+        interval = 1 / self.tick_rate
+        next_tick = time.monotonic()
+        while self.game_active:
+            with self.tick_lock:
+                self.run_tick()
+            next_tick += interval
+            delay = next_tick - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                # Running behind: skip the missed ticks instead of bursting to catch up
+                next_tick = time.monotonic()
+    
+    def run(self):
+        print(f"Tick server starting on {self.host}:{self.port} at {self.tick_rate} ticks/s (seed {self.seed})")
+        threading.Thread(target=self.simulate, daemon=True).start()
+        self.serve_udp()
+        try:
+            while self.game_active:
+                client_socket, addr = self.server_socket.accept()
+                player_id = self.player_ids.allocate()
+                self.outboxes[player_id] = Outbox(client_socket, self.metrics.count_dropped_connection)
+                self.inboxes[player_id] = threading.Semaphore(INBOX_LIMIT)
+                self.commands.put((player_id, client_socket, self.JOIN))
+                
+                thread = threading.Thread(target=self.handle_client, 
+                                       args=(client_socket, player_id))
+                thread.start()
+        finally:
+            self.server_socket.close()
+            if self.udp:
+                self.udp.close()
+            self.close_journal()
+            self.close_recorder()
+
+class SharedGameServer(GameServer):
+    """One of several processes serving the same match. The map, counters and player table
+    live in shared memory (see shared.py) and every process accepts on the same port, so one
+    big match runs on as many cores as there are processes.
+
+    Each process only sees the changes it made itself, so clients get full snapshots instead
+    of deltas and a watcher thread pushes the changes made by the other processes.
+    """
+    
+    collected_treasures = SharedCounter(COLLECTED)
+    treasures_in_room = SharedCounter(ROOM_TREASURES)
+    version = SharedCounter(VERSION)
+    
+    def __init__(self, game, host='localhost', port=5000, backlog=5, server_socket=None, watch_interval=0.05,
+                 worker=0):
+        # The match itself was set up by the parent; only the per-process parts are built here,
+        # with the same helpers as GameServer.__init__ (which would reset the shared counters)
+        self.game = game
+        self.host = host
+        self.port = port
+        self.backlog = backlog
+        self.journal = None
+        self.recorder = None  # commands from several processes have no single order to record
+        self.udp = None
+        # Each process draws its spawns from its own stream of the match's seed
+        self.seed = game.seed
+        self.random = random.Random(f"{game.seed}:{worker}")
+        self.map_size = game.map_size
+        self.total_treasures = game.total_treasures
+        self.main_map = Grid(self.map_size, game.cells)
+        self.treasure_room_x, self.treasure_room_y = game.room
+        self.watch_interval = watch_interval
+        
+        self._initialize_locks(game.region_size, game.locks, game.stripes)
+        self.players = SharedPlayers(game)
+        self.player_ids = SharedIds(game, self.player_lock)
+        self.broadcast_version = self.version
+        self._initialize_connections()
+        
+        # With SO_REUSEPORT every process binds its own socket and the kernel spreads the connections
+        self.server_socket = server_socket
+        if server_socket is None:
+            self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            self.server_socket.bind((self.host, self.port))
+            self.server_socket.listen(self.backlog)
+    
+    @property
+    def game_active(self):
+        return self.game.active
+    
+    @game_active.setter
+    def game_active(self, active):
+        self.game.counters[ACTIVE] = int(active)
+    
+    def _region_of(self, position):
+        # Regions share the striped locks round-robin
+        return super()._region_of(position) % len(self.region_locks)
+    
+    def _record(self, *changes):
+        with self.log_lock:
+            self.encoded_cache.clear()
+            for change in changes:
+                self.version += 1
+                change['v'] = self.version
+    
+    def get_game_state(self):
+        encoded_map = self.encoded_view('map', self.main_map.encode)
+        with self.player_lock:
+            players = self.players.snapshot()
+        return {
+            'map': encoded_map,
+            'map_size': self.map_size,
+            'players': players,
+            'treasures_left': self.total_treasures - self.collected_treasures,
+            'room_treasures': self.treasures_in_room
+        }
+    
+    def subscribe(self, player_id, client_socket, view=None):
+        # Other processes' changes never pass through _record here, so views would miss them
+        super().subscribe(player_id, client_socket)
+    
+    def get_leaderboard(self, player_id, k):
+        # Scores also change in the other processes, so the ranking is built from the shared table
+        with self.player_lock:
+            players = self.players.snapshot()
+        leaderboard = Leaderboard()
+        for ranked_id, player in players.items():
+            leaderboard.update(ranked_id, player['score'])
+        return self._leaderboard_reply(leaderboard, player_id, k)
+    
+    def get_state_since(self, version):
+        # There is no shared change log, so anything but the current version gets a snapshot
+        current = self.version
+        if version == current:
+            return {'type': 'delta', 'from': version, 'version': current, 'changes': []}
+        return self.get_snapshot()
+    
+    def add_player(self, player_id):
+        index = self._find_spawn_cell()
+        if index is None:
+            return False
+        start_position = self.main_map.position(index)
+        
+        with self._lock_regions(start_position), self.player_lock:
+            if self.players.full():
+                return False
+            self.players[player_id] = {'position': start_position, 'score': 0}
+            self._occupy(player_id, start_position)
+            self._record(self._player_change(player_id))
+            return True
+    
+    def _find_spawn_cell(self):
+        """A random empty cell nobody stands on; probes a few cells before scanning the map."""
+        cells, occupancy = self.game.cells, self.game.occupancy
+        total = len(cells)
+        for _ in range(32):
+            index = self.random.randrange(total)
+            if cells[index] == EMPTY and not occupancy[index]:
+                return index
+        start = self.random.randrange(total)
+        for offset in range(total):
+            index = (start + offset) % total
+            if cells[index] == EMPTY and not occupancy[index]:
+                return index
+        return None
+    
+    # Occupancy is a shared count per cell, changed with the region lock of the cell held
+    def _occupy(self, player_id, position):
+        self.game.occupancy[self.main_map.index(*position)] += 1
+    
+    def _vacate(self, player_id, position):
+        self.game.occupancy[self.main_map.index(*position)] -= 1
+    
+    def players_at(self, x, y):
+        return {player_id for player_id, player in self.players.items() if player['position'] == (x, y)}
+    
+    def watch_changes(self):
+        """Pushes the changes made by the other processes to this process's subscribers."""
+        while self.game_active:
+            time.sleep(self.watch_interval)
+            if self.version != self.broadcast_version:
+                self.notify_state_change()
+    
+    def run(self):
+        threading.Thread(target=self.watch_changes, daemon=True).start()
+        try:
+            while self.game_active:
+                client_socket, addr = self.server_socket.accept()
+                player_id = self.accept_client(client_socket)
+                if player_id is None:
+                    continue
                 
                 thread = threading.Thread(target=self.handle_client, 
                                        args=(client_socket, player_id))
@@ -175,6 +1208,99 @@ class GameServer:
         finally:
             self.server_socket.close()
 
+def serve_shared_worker(game, host, port, backlog, server_socket, metrics_port, worker):
+    server = SharedGameServer(game, host, port, backlog, server_socket, worker=worker)
+    if metrics_port:
+        serve_metrics(host, metrics_port, lambda: server.metrics.prometheus(len(server.players)))
+    try:
+        server.run()
+    except KeyboardInterrupt:
+        pass
+
+def run_shared(host, port, backlog, processes, map_size, num_treasures, region_size=4, metrics_port=None, seed=None):
+    """Runs one match on `processes` worker processes that share the game state."""
+    # A regular server lays out the map, which is then copied into shared memory
+    template = GameServer(map_size=map_size, num_treasures=num_treasures, region_size=region_size, listen=False,
+                          seed=seed)
+    game = SharedGame(map_size, template.main_map.cells, (template.treasure_room_x, template.treasure_room_y),
+                      template.treasures_in_room, template.total_treasures, region_size, template.seed)
+    
+    # Without SO_REUSEPORT the processes accept from one listening socket they all inherit
+    server_socket = None
+    if not hasattr(socket, 'SO_REUSEPORT'):
+        server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server_socket.bind((host, port))
+        server_socket.listen(backlog)
+    
+    workers = [
+        multiprocessing.Process(target=serve_shared_worker, args=(
+            game, host, port, backlog, server_socket, metrics_port and metrics_port + index, index
+        ))
+        for index in range(processes)
+    ]
+    print(f"Shared server starting on {host}:{port} with {processes} processes (seed {template.seed})")
+    for worker in workers:
+        worker.start()
+    # Being terminated must still stop the workers and free the shared memory
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        while game.active and all(worker.is_alive() for worker in workers):
+            time.sleep(0.5)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for worker in workers:
+            worker.terminate()
+            worker.join()
+        if server_socket:
+            server_socket.close()
+        game.close()
+        game.unlink()
+
 if __name__ == "__main__":
-    server = GameServer()
-    server.run()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Treasure hunt game server')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--backlog', type=int, default=5, help='listen backlog for pending connections')
+    parser.add_argument('--engine', choices=['threaded', 'asyncio', 'tick'], default='threaded',
+                        help='one thread per client, a single asyncio event loop, or fixed-tick batches')
+    parser.add_argument('--tick-rate', type=int, default=20, help='ticks per second for the tick engine')
+    parser.add_argument('--map-size', type=int, default=10)
+    parser.add_argument('--treasures', type=int, default=20, help='regular treasures on the map')
+    parser.add_argument('--metrics-port', type=int, help='serve Prometheus metrics on this port at /metrics')
+    parser.add_argument('--udp-port', type=int, help='also take moves as UDP datagrams on this port (0 picks one)')
+    parser.add_argument('--state', help='save the game to this snapshot file (plus a .journal next to it) and resume from it')
+    parser.add_argument('--snapshot-interval', type=float, default=30, help='seconds between snapshots')
+    parser.add_argument('--processes', type=int, default=1,
+                        help='run the match on this many processes sharing the game state (threaded engine only); '
+                             'each one serves its metrics on --metrics-port plus its index')
+    parser.add_argument('--seed', type=int, help='seed for the map, spawns and player ids (random if not given)')
+    parser.add_argument('--record', help='log every command applied to this file, for replay.py')
+    args = parser.parse_args()
+    
+    if args.processes > 1 and (args.engine != 'threaded' or args.state):
+        parser.error('--processes needs the threaded engine and cannot be combined with --state')
+    if args.processes > 1 and args.udp_port is not None:
+        parser.error('--udp-port cannot be combined with --processes')
+    if args.record and (args.processes > 1 or args.state):
+        parser.error('--record cannot be combined with --processes or --state')
+    
+    options = {'map_size': args.map_size, 'num_treasures': args.treasures,
+               'state_path': args.state, 'snapshot_interval': args.snapshot_interval, 'udp_port': args.udp_port,
+               'seed': args.seed, 'record_path': args.record}
+    if args.processes > 1:
+        run_shared(args.host, args.port, args.backlog, args.processes, args.map_size, args.treasures,
+                   metrics_port=args.metrics_port, seed=args.seed)
+    else:
+        if args.record:
+            # Being terminated must still end the recording with the final state
+            signal.signal(signal.SIGTERM, signal.default_int_handler)
+        if args.engine == 'asyncio':
+            server = AsyncGameServer(args.host, args.port, args.backlog, **options)
+        elif args.engine == 'tick':
+            server = TickGameServer(args.host, args.port, args.backlog, tick_rate=args.tick_rate, **options)
+        else:
+            server = GameServer(args.host, args.port, args.backlog, **options)
+        if args.metrics_port:
+            serve_metrics(args.host, args.metrics_port, lambda: server.metrics.prometheus(len(server.players)))
+        server.run()
\ No newline at end of file
@@ -0,0 +1,155 @@
+from bisect import bisect_left, insort
+from itertools import chain, islice
+
+CHUNK = 512  # ids per chunk of a bucket; a chunk past twice this is split in two
+
+
+class SortedIds:
+    """Player ids in increasing order, held in chunks of a bounded size.
+
+    Adding or removing an id shifts only the chunk it falls in, and the first k ids are read
+    straight off the front, so a bucket of many tied players costs no more than a small one.
+    """
+
+    __slots__ = ('chunks', 'maxes', 'size')
+
+    def __init__(self):
+        self.chunks = []  # sorted lists of ids, each holding only ids above the previous one's
+        self.maxes = []  # the last id of each chunk, to find the chunk an id belongs in
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def add(self, player_id):
+        if not self.chunks:
+            self.chunks.append([player_id])
+            self.maxes.append(player_id)
+        else:
+            index = min(bisect_left(self.maxes, player_id), len(self.chunks) - 1)
+            chunk = self.chunks[index]
+            insort(chunk, player_id)
+            self.maxes[index] = chunk[-1]
+            if len(chunk) > 2 * CHUNK:
+                self.chunks[index:index + 1] = chunk[:CHUNK], chunk[CHUNK:]
+                self.maxes[index:index + 1] = chunk[CHUNK - 1], chunk[-1]
+        self.size += 1
+
+    def remove(self, player_id):
+        index = bisect_left(self.maxes, player_id)
+        chunk = self.chunks[index]
+        del chunk[bisect_left(chunk, player_id)]
+        if chunk:
+            self.maxes[index] = chunk[-1]
+        else:
+            del self.chunks[index]
+            del self.maxes[index]
+        self.size -= 1
+
+    def first(self, k):
+        return islice(chain.from_iterable(self.chunks), k)
+
+
+class Leaderboard:
+    """Players ranked by score, kept up to date one score change at a time.
+
+    A Fenwick tree counts the players at each score, so a player's rank and the k-th best
+    score take O(log S) steps (S being the highest score) however many players there are.
+    Players with the same score share a rank and are listed by id, each bucket of them kept
+    in id order so that listing the top k reads only k ids.
+    """
+
+    __slots__ = ('scores', 'buckets', 'tree', 'capacity')
+
+    def __init__(self, capacity=64):
+        self.scores = {}  # player id -> score
+        self.buckets = {}  # score -> ids of the players with it
+        self.capacity = capacity  # always a power of two, for the descent in _score_at
+        self.tree = [0] * (capacity + 1)
+
+    def __len__(self):
+        return len(self.scores)
+
+    def __contains__(self, player_id):
+        return player_id in self.scores
+
+    def _count(self, score, delta):
+        if score >= self.capacity:
+            self._grow(score)
+        index = score + 1
+        while index <= self.capacity:
+            self.tree[index] += delta
+            index += index & -index
+
+    def _grow(self, score):
+        while self.capacity <= score:
+            self.capacity *= 2
+        self.tree = [0] * (self.capacity + 1)
+        for bucket_score, bucket in self.buckets.items():
+            index = bucket_score + 1
+            while index <= self.capacity:
+                self.tree[index] += len(bucket)
+                index += index & -index
+
+    def _count_upto(self, score):
+        """Number of players with at most `score` points."""
+        index, total = min(score + 1, self.capacity), 0
+        while index > 0:
+            total += self.tree[index]
+            index -= index & -index
+        return total
+
+    def _score_at(self, position):
+        """The score of the `position`-th player counting from the lowest score (1-based)."""
+        index, step = 0, self.capacity
+        while step:
+            if index + step <= self.capacity and self.tree[index + step] < position:
+                index += step
+                position -= self.tree[index]
+            step //= 2
+        return index
+
+    def update(self, player_id, score):
+        """Sets the player's score, adding the player if it is not ranked yet."""
+        old = self.scores.get(player_id)
+        if old == score:
+            return
+        if old is not None:
+            self._leave(player_id, old)
+        # Counted before joining its bucket, since growing the tree recounts the buckets
+        self._count(score, 1)
+        self.scores[player_id] = score
+        bucket = self.buckets.get(score)
+        if bucket is None:
+            bucket = self.buckets[score] = SortedIds()
+        bucket.add(player_id)
+
+    def remove(self, player_id):
+        score = self.scores.pop(player_id, None)
+        if score is not None:
+            self._leave(player_id, score)
+
+    def _leave(self, player_id, score):
+        bucket = self.buckets[score]
+        bucket.remove(player_id)
+        if not bucket:
+            del self.buckets[score]
+        self._count(score, -1)
+
+    def rank(self, player_id):
+        """1 plus the number of players with more points, or None for a player not ranked."""
+        score = self.scores.get(player_id)
+        if score is None:
+            return None
+        return len(self.scores) - self._count_upto(score) + 1
+
+    def top(self, k):
+        """The `k` best players as (rank, player id, score), best first."""
+        ranked = []
+        rank = 1
+        while len(ranked) < k and rank <= len(self.scores):
+            score = self._score_at(len(self.scores) - rank + 1)
+            bucket = self.buckets[score]
+            ranked.extend((rank, player_id, score) for player_id in bucket.first(k - len(ranked)))
+            rank += len(bucket)
+        return ranked
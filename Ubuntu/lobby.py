@@ -0,0 +1,271 @@
+"""Lobby that hosts many independent matches behind one port.
+
+Clients talk to the lobby first:
+
+    {'type': 'list_matches'}
+    {'type': 'create_match', 'map_size': 10, 'treasures': 20}
+    {'type': 'join_match', 'match': 3}
+
+Matches run in worker processes so the lobby can use every core. Joining hands the
+client's socket over to the worker that owns the match; from then on the connection
+speaks the normal game protocol, starting with the player id handshake.
+"""
+import argparse
+import itertools
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+import time
+from threading import Lock
+
+from jogo import GameServer
+from protocolo import MessageReader, ProtocolError, send_message
+
+MAX_MAP_SIZE = 256
+
+
+class MatchWorker:
+    """Runs the matches of one worker process; the lobby sends commands and sockets over a pipe."""
+
+    def __init__(self, connection, idle_timeout):
+        self.connection = connection
+        self.idle_timeout = idle_timeout
+        self.matches = {}
+        self.sockets = {}  # match id -> sockets of its players
+        self.last_seen = {}  # match id -> last time it had players
+        self.lock = Lock()
+        self.send_lock = Lock()
+
+    def notify(self, *message):
+        with self.send_lock:
+            self.connection.send(message)
+
+    def run(self):
+        threading.Thread(target=self.reap, daemon=True).start()
+        while True:
+            try:
+                message = self.connection.recv()
+            except EOFError:
+                break
+            if message[0] == 'create':
+                self.create(*message[1:])
+            elif message[0] == 'join':
+                self.join(*message[1:])
+
+    def create(self, match_id, map_size, treasures):
+        with self.lock:
+            self.matches[match_id] = GameServer(map_size=map_size, num_treasures=treasures, listen=False)
+            self.sockets[match_id] = set()
+            self.last_seen[match_id] = time.monotonic()
+
+    def join(self, match_id, client_socket):
+        with self.lock:
+            match = self.matches.get(match_id)
+            if match is not None and match.game_active:
+                self.sockets[match_id].add(client_socket)
+        if match is None or not match.game_active:
+            send_message(client_socket, {'status': 'error', 'message': 'Match not found'})
+            client_socket.close()
+            return
+
+        player_id = match.accept_client(client_socket)
+        if player_id is None:
+            self.forget(match_id, client_socket)
+            return
+        threading.Thread(target=self.play, args=(match_id, match, client_socket, player_id), daemon=True).start()
+
+    def play(self, match_id, match, client_socket, player_id):
+        try:
+            match.handle_client(client_socket, player_id)
+        finally:
+            self.forget(match_id, client_socket)
+
+    def forget(self, match_id, client_socket):
+        with self.lock:
+            if match_id in self.sockets:
+                self.sockets[match_id].discard(client_socket)
+
+    def reap(self):
+        """Closes finished or long-idle matches so their memory is freed, and reports player counts."""
+        reported = {}
+        while True:
+            time.sleep(1)
+            now = time.monotonic()
+            closed = []
+            with self.lock:
+                for match_id, match in list(self.matches.items()):
+                    if match.players:
+                        self.last_seen[match_id] = now
+                    if match.game_active and now - self.last_seen[match_id] < self.idle_timeout:
+                        continue
+                    del self.matches[match_id], self.last_seen[match_id]
+                    closed.append(self.sockets.pop(match_id))
+                    reported.pop(match_id, None)
+                    self.notify('closed', match_id)
+
+                counts = {match_id: len(match.players) for match_id, match in self.matches.items()}
+
+            # Waking the players' threads lets them clean up and drop the last references
+            for sockets in closed:
+                for client_socket in sockets:
+                    try:
+                        client_socket.shutdown(socket.SHUT_RDWR)
+                    except OSError:
+                        pass
+
+            for match_id, count in counts.items():
+                if reported.get(match_id) != count:
+                    reported[match_id] = count
+                    self.notify('players', match_id, count)
+
+
+def run_worker(connection, idle_timeout, lobby_ends):
+    # A forked worker holds copies of the lobby's ends of the pipes; while any is open, the
+    # worker never sees EOF on its own pipe and would outlive the lobby
+    for lobby_end in lobby_ends:
+        lobby_end.close()
+    MatchWorker(connection, idle_timeout).run()
+
+
+class Lobby:
+    def __init__(self, host='localhost', port=5000, backlog=5, workers=None, idle_timeout=300):
+        self.host = host
+        self.port = port
+        self.backlog = backlog
+        self.idle_timeout = idle_timeout
+        self.workers = []
+        self.worker_count = workers or os.cpu_count() or 1
+        self.matches = {}  # match id -> {'id', 'map_size', 'treasures', 'players', 'worker'}
+        self.match_ids = itertools.count(1)
+        self.lock = Lock()
+        self.server_socket = None  # bound once the workers are running, so they never inherit it
+
+    def start_workers(self):
+        for index in range(self.worker_count):
+            connection, worker_connection = multiprocessing.Pipe()
+            lobby_ends = [worker['connection'] for worker in self.workers] + [connection]
+            process = multiprocessing.Process(target=run_worker, args=(worker_connection, self.idle_timeout, lobby_ends),
+                                              daemon=True)
+            process.start()
+            worker_connection.close()
+            worker = {'index': index, 'process': process, 'connection': connection, 'send_lock': Lock(), 'matches': 0}
+            self.workers.append(worker)
+            threading.Thread(target=self.listen_worker, args=(worker,), daemon=True).start()
+
+    def send_worker(self, worker, *message):
+        with worker['send_lock']:
+            worker['connection'].send(message)
+
+    def listen_worker(self, worker):
+        while True:
+            try:
+                message = worker['connection'].recv()
+            except EOFError:
+                break
+            with self.lock:
+                match = self.matches.get(message[1])
+                if match is None:
+                    continue
+                if message[0] == 'players':
+                    match['players'] = message[2]
+                elif message[0] == 'closed':
+                    del self.matches[message[1]]
+                    worker['matches'] -= 1
+
+    def list_matches(self):
+        with self.lock:
+            matches = [dict(match, worker=match['worker']['index']) for match in self.matches.values()]
+        return {'status': 'success', 'matches': matches}
+
+    def create_match(self, command):
+        map_size = command.get('map_size', 10)
+        treasures = command.get('treasures', 20)
+        if not (isinstance(map_size, int) and isinstance(treasures, int)
+                and 2 <= map_size <= MAX_MAP_SIZE and 0 <= treasures < map_size * map_size):
+            return {'status': 'error', 'message': 'Invalid match settings'}
+
+        with self.lock:
+            # New matches go to the worker running the fewest
+            worker = min(self.workers, key=lambda worker: worker['matches'])
+            worker['matches'] += 1
+            match_id = next(self.match_ids)
+            self.matches[match_id] = {'id': match_id, 'map_size': map_size, 'treasures': treasures,
+                                      'players': 0, 'worker': worker}
+        self.send_worker(worker, 'create', match_id, map_size, treasures)
+        return {'status': 'success', 'match': match_id}
+
+    def join_match(self, client_socket, match_id):
+        with self.lock:
+            match = self.matches.get(match_id)
+        if match is None:
+            return False
+        # The socket is duplicated into the worker, so the lobby's copy can be closed right away
+        self.send_worker(match['worker'], 'join', match_id, client_socket)
+        return True
+
+    def handle_client(self, client_socket):
+        reader = MessageReader(client_socket)
+        try:
+            while True:
+                command = reader.receive()
+                if command is None:
+                    break
+
+                cmd_type = command.get('type')
+                if cmd_type == 'list_matches':
+                    response = self.list_matches()
+                elif cmd_type == 'create_match':
+                    response = self.create_match(command)
+                elif cmd_type == 'join_match':
+                    # Clients wait for the handshake after joining, so nothing is left unread here
+                    if self.join_match(client_socket, command.get('match')):
+                        break
+                    response = {'status': 'error', 'message': 'Match not found'}
+                else:
+                    response = {'status': 'error', 'message': 'Invalid command'}
+                if 'id' in command:
+                    response = dict(response, id=command['id'])
+                send_message(client_socket, response)
+        except (ValueError, ProtocolError, socket.error):
+            pass
+        finally:
+            client_socket.close()
+
+    def run(self):
+        print(f"Lobby starting on {self.host}:{self.port} with {self.worker_count} workers")
+        try:
+            self.start_workers()
+            # Being terminated must still stop the workers, which daemon=True only does on a normal exit
+            signal.signal(signal.SIGTERM, signal.default_int_handler)
+            self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.server_socket.bind((self.host, self.port))
+            self.server_socket.listen(self.backlog)
+            while True:
+                client_socket, addr = self.server_socket.accept()
+                threading.Thread(target=self.handle_client, args=(client_socket,), daemon=True).start()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if self.server_socket is not None:
+                self.server_socket.close()
+            self.stop_workers()
+
+    def stop_workers(self):
+        for worker in self.workers:
+            worker['process'].terminate()
+            worker['process'].join()
+            worker['connection'].close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Treasure hunt lobby hosting many matches')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--backlog', type=int, default=5, help='listen backlog for pending connections')
+    parser.add_argument('--workers', type=int, help='match worker processes (default: one per core)')
+    parser.add_argument('--idle-timeout', type=float, default=300, help='seconds before an empty match is closed')
+    args = parser.parse_args()
+
+    Lobby(args.host, args.port, args.backlog, args.workers, args.idle_timeout).run()
@@ -0,0 +1,225 @@
+"""Server instrumentation: command latency histograms, lock wait/hold times and traffic counters.
+
+Everything is kept in fixed-size histograms and plain counters, so recording costs a couple
+of clock reads and a bucket increment and can stay on in production. The numbers are read
+through the `stats` command or served as Prometheus text by `serve_metrics`.
+"""
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock
+
+# Upper bounds of the histogram buckets, in seconds; the last bucket catches everything above
+BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025,
+           0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+COMMAND_TYPES = ('move', 'enter_room', 'get_state', 'stats', 'leaderboard')
+
+
+class Histogram:
+    __slots__ = ('counts', 'total', 'lock')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.lock = Lock()
+
+    def observe(self, seconds):
+        bucket = bisect_left(BUCKETS, seconds)
+        with self.lock:
+            self.counts[bucket] += 1
+            self.total += seconds
+
+    def count(self):
+        return sum(self.counts)
+
+    def quantile(self, fraction):
+        """Upper bound of the bucket holding the given quantile, or None if nothing was observed."""
+        counts = list(self.counts)
+        rank = fraction * sum(counts)
+        seen = 0
+        for bound, count in zip(BUCKETS + (float('inf'),), counts):
+            seen += count
+            if count and seen >= rank:
+                return bound
+        return None
+
+    def summary(self):
+        count = self.count()
+        return {
+            'count': count,
+            'mean_ms': self.total / count * 1000 if count else 0,
+            'p50_ms': _milliseconds(self.quantile(0.5)),
+            'p99_ms': _milliseconds(self.quantile(0.99))
+        }
+
+
+def _milliseconds(seconds):
+    return None if seconds is None or seconds == float('inf') else seconds * 1000
+
+
+class TimedLock:
+    """Wraps a lock and records how long callers wait for it and how long they hold it."""
+
+    __slots__ = ('lock', 'wait', 'hold', 'acquired_at')
+
+    def __init__(self, lock, wait, hold):
+        self.lock = lock
+        self.wait = wait
+        self.hold = hold
+        self.acquired_at = 0.0
+
+    def __enter__(self):
+        started = time.perf_counter()
+        self.lock.acquire()
+        # Only the holder writes acquired_at, so it needs no extra locking
+        self.acquired_at = time.perf_counter()
+        self.wait.observe(self.acquired_at - started)
+        return self
+
+    def __exit__(self, *exc_info):
+        held = time.perf_counter() - self.acquired_at
+        self.lock.release()
+        self.hold.observe(held)
+        return False
+
+
+class Metrics:
+    def __init__(self):
+        self.started = time.time()
+        self.commands = {command_type: Histogram() for command_type in COMMAND_TYPES + ('invalid',)}
+        self.lock_wait = {}
+        self.lock_hold = {}
+
+        # player id -> [bytes in, bytes out]; each entry is only updated by that player's reads and sends
+        self.connections = {}
+        self.closed_bytes = [0, 0]
+        self.closed_lock = Lock()
+
+        # Moves answered together with a later one, and clients dropped for not reading
+        self.merged_moves = 0
+        self.dropped_connections = 0
+        self.counter_lock = Lock()
+
+    def timed_lock(self, name, lock=None):
+        """Returns a lock whose wait and hold times are recorded under `name`; locks may share a name."""
+        wait = self.lock_wait.setdefault(name, Histogram())
+        hold = self.lock_hold.setdefault(name, Histogram())
+        return TimedLock(lock or Lock(), wait, hold)
+
+    def observe_command(self, command_type, seconds):
+        histogram = self.commands.get(command_type) or self.commands['invalid']
+        histogram.observe(seconds)
+
+    def set_bytes_in(self, player_id, total):
+        self.connections.setdefault(player_id, [0, 0])[0] = total
+
+    def add_bytes_out(self, player_id, count):
+        self.connections.setdefault(player_id, [0, 0])[1] += count
+
+    def count_merged_moves(self, count):
+        if count:
+            with self.counter_lock:
+                self.merged_moves += count
+
+    def count_dropped_connection(self):
+        with self.counter_lock:
+            self.dropped_connections += 1
+
+    def close_connection(self, player_id):
+        traffic = self.connections.pop(player_id, None)
+        if traffic:
+            with self.closed_lock:
+                self.closed_bytes[0] += traffic[0]
+                self.closed_bytes[1] += traffic[1]
+
+    def bytes_total(self):
+        with self.closed_lock:
+            received, sent = self.closed_bytes
+        for traffic in list(self.connections.values()):
+            received += traffic[0]
+            sent += traffic[1]
+        return received, sent
+
+    def snapshot(self, active_players):
+        received, sent = self.bytes_total()
+        return {
+            'uptime': time.time() - self.started,
+            'active_players': active_players,
+            'commands': {name: histogram.summary() for name, histogram in self.commands.items() if histogram.count()},
+            'lock_wait': {name: histogram.summary() for name, histogram in self.lock_wait.items()},
+            'lock_hold': {name: histogram.summary() for name, histogram in self.lock_hold.items()},
+            'bytes_in': received,
+            'bytes_out': sent,
+            'merged_moves': self.merged_moves,
+            'dropped_connections': self.dropped_connections,
+            'connections': {str(player_id): {'bytes_in': traffic[0], 'bytes_out': traffic[1]}
+                            for player_id, traffic in list(self.connections.items())}
+        }
+
+    def prometheus(self, active_players):
+        """Renders the metrics in the Prometheus text exposition format."""
+        lines = []
+
+        def histogram(name, help_text, label, histograms):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} histogram')
+            for value, data in histograms.items():
+                counts = list(data.counts)
+                cumulative = 0
+                for bound, count in zip(BUCKETS, counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{{label}="{value}",le="{bound}"}} {cumulative}')
+                cumulative += counts[-1]
+                lines.append(f'{name}_bucket{{{label}="{value}",le="+Inf"}} {cumulative}')
+                lines.append(f'{name}_sum{{{label}="{value}"}} {data.total}')
+                lines.append(f'{name}_count{{{label}="{value}"}} {cumulative}')
+
+        histogram('treasure_command_seconds', 'Time spent processing commands.', 'type', self.commands)
+        histogram('treasure_lock_wait_seconds', 'Time spent waiting for game locks.', 'lock', self.lock_wait)
+        histogram('treasure_lock_hold_seconds', 'Time game locks were held.', 'lock', self.lock_hold)
+
+        received, sent = self.bytes_total()
+        lines += [
+            '# HELP treasure_received_bytes_total Bytes read from clients.',
+            '# TYPE treasure_received_bytes_total counter',
+            f'treasure_received_bytes_total {received}',
+            '# HELP treasure_sent_bytes_total Bytes written to clients.',
+            '# TYPE treasure_sent_bytes_total counter',
+            f'treasure_sent_bytes_total {sent}',
+            '# HELP treasure_merged_moves_total Moves answered together with a later move of the same client.',
+            '# TYPE treasure_merged_moves_total counter',
+            f'treasure_merged_moves_total {self.merged_moves}',
+            '# HELP treasure_dropped_connections_total Clients disconnected for not reading what was sent to them.',
+            '# TYPE treasure_dropped_connections_total counter',
+            f'treasure_dropped_connections_total {self.dropped_connections}',
+            '# HELP treasure_active_players Players currently in the game.',
+            '# TYPE treasure_active_players gauge',
+            f'treasure_active_players {active_players}'
+        ]
+        return '\n'.join(lines) + '\n'
+
+
+def serve_metrics(host, port, render):
+    """Serves `render()` as Prometheus text on http://host:port/metrics from a daemon thread."""
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != '/metrics':
+                self.send_error(404)
+                return
+            body = render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
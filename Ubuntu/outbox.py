@@ -0,0 +1,219 @@
+"""Per-connection output queues, so a client that reads slowly only ever slows itself down.
+
+Everything the server sends a connection goes through its outbox, written out by a thread of
+its own (or by the event loop, on the asyncio engine). There are two kinds of output:
+
+- replies are queued in order. A connection with more than `limit` bytes of them waiting, or
+  whose socket has taken nothing for `stall_timeout` seconds, is not reading and is dropped;
+- pushed state is never queued. The outbox only keeps the latest way to build it and builds it
+  right before writing, so a subscriber that falls behind gets one delta covering everything it
+  missed (or a snapshot, once the change log no longer goes back that far) instead of a backlog.
+"""
+import asyncio
+import socket
+import threading
+import time
+from collections import deque
+
+OUTBOX_LIMIT = 1024 * 1024  # bytes of replies a connection may have waiting
+STALL_TIMEOUT = 5.0  # seconds a write may block before the client is taken as not reading
+
+
+class Outbox:
+    """Output of one socket, written by a daemon thread so that no game thread ever blocks on it."""
+
+    def __init__(self, sock, on_drop=None, limit=OUTBOX_LIMIT, stall_timeout=STALL_TIMEOUT):
+        self.sock = sock
+        self.on_drop = on_drop
+        self.limit = limit
+        self.stall_timeout = stall_timeout
+        self.frames = deque()
+        self.size = 0
+        self.update = None  # builds the pending state push, or None when there is none
+        self.writing = False  # whether a thread is writing to the socket
+        self.sending_since = None  # when the writer thread's write in progress started
+        self.closed = False
+        self.ready = threading.Condition()
+        threading.Thread(target=self._write_loop, daemon=True).start()
+
+    def put(self, data):
+        """Queues a frame; raises ConnectionError if the connection is closed or had to be dropped.
+
+        With nothing waiting, the frame is written right away for as much as the socket takes
+        without blocking, which saves the hop to the writer thread for most replies.
+        """
+        with self.ready:
+            if self.closed:
+                raise ConnectionError('connection closed')
+            if self.size + len(data) > self.limit or self._stalled():
+                self._drop()
+            if self.writing or self.frames or self.update:
+                self.frames.append(data)
+                self.size += len(data)
+                self.ready.notify()
+                return
+            self.writing = True
+
+        try:
+            sent = self.sock.send(data, socket.MSG_DONTWAIT)
+        except BlockingIOError:
+            sent = 0
+        except OSError:
+            # The connection's reader sees it fail too and disconnects the player
+            sent = len(data)
+        with self.ready:
+            self.writing = False
+            if sent < len(data):
+                # Frames queued meanwhile came after this one
+                self.frames.appendleft(memoryview(data)[sent:])
+                self.size += len(data) - sent
+            # Only wake the writer thread for output it has to write
+            if self.frames or self.update or self.closed:
+                self.ready.notify()
+
+    def push(self, update):
+        """Replaces the state push not written yet, if any, with `update()`, a frame or None."""
+        with self.ready:
+            if self.closed:
+                raise ConnectionError('connection closed')
+            if self._stalled():
+                self._drop()
+            self.update = update
+            self.ready.notify()
+
+    def close(self):
+        """Takes no more output and closes the socket once what is queued has been written."""
+        with self.ready:
+            self.closed = True
+            writing = self.sending_since is not None
+            self.ready.notify()
+        if writing:
+            # A client that stopped reading would keep the writer blocked for good
+            timer = threading.Timer(self.stall_timeout, self._shutdown_if_writing)
+            timer.daemon = True
+            timer.start()
+
+    def _stalled(self):
+        return self.sending_since is not None and time.monotonic() - self.sending_since > self.stall_timeout
+
+    def _drop(self):
+        # Called with the condition held; the shutdown also wakes the connection's reader
+        self.closed = True
+        self.frames.clear()
+        self.size = 0
+        self.update = None
+        self._shutdown()
+        if self.on_drop:
+            self.on_drop()
+        raise ConnectionError('client is not reading')
+
+    def _shutdown_if_writing(self):
+        with self.ready:
+            writing = self.sending_since is not None
+        if writing:
+            self._shutdown()
+
+    def _shutdown(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def _write_loop(self):
+        while True:
+            with self.ready:
+                while self.writing or not (self.frames or self.update or self.closed):
+                    self.ready.wait()
+                if not (self.frames or self.update):
+                    break
+                frames, self.frames, self.size = self.frames, deque(), 0
+                update, self.update = self.update, None
+                self.writing = True
+                self.sending_since = time.monotonic()
+
+            if update is not None:
+                data = update()
+                if data:
+                    frames.append(data)
+            try:
+                self.sock.sendall(b''.join(frames))
+            except OSError:
+                with self.ready:
+                    self.closed = True
+                    self.frames.clear()
+                    self.update = None
+                break
+            with self.ready:
+                self.writing = False
+                self.sending_since = None
+
+        self._shutdown()
+        self.sock.close()
+
+
+class AsyncOutbox:
+    """The same outbox over an asyncio StreamWriter; all its methods run on the event loop."""
+
+    def __init__(self, writer, on_drop=None, limit=OUTBOX_LIMIT, stall_timeout=STALL_TIMEOUT):
+        self.writer = writer
+        self.on_drop = on_drop
+        self.limit = limit
+        self.stall_timeout = stall_timeout
+        self.update = None
+        self.catching_up = False
+        self.closed = False
+
+    def put(self, data):
+        if self.closed:
+            raise ConnectionError('connection closed')
+        if self.writer.transport.get_write_buffer_size() + len(data) > self.limit:
+            self._drop()
+        self.writer.write(data)
+
+    def push(self, update):
+        if self.closed:
+            raise ConnectionError('connection closed')
+        self.update = update
+        # With nothing waiting the update goes out now; otherwise once the transport has drained
+        if not self.catching_up:
+            if self.writer.transport.get_write_buffer_size():
+                self.catching_up = True
+                asyncio.get_running_loop().create_task(self._catch_up())
+            else:
+                self._write_update()
+
+    async def drain(self):
+        """Waits for the transport to take what was written; drops the client if it takes too long."""
+        try:
+            await asyncio.wait_for(self.writer.drain(), self.stall_timeout)
+        except asyncio.TimeoutError:
+            self._drop()
+
+    def close(self):
+        self.closed = True
+        self.update = None
+
+    def _write_update(self):
+        update, self.update = self.update, None
+        data = update()
+        if data:
+            self.writer.write(data)
+
+    async def _catch_up(self):
+        try:
+            while self.update is not None and not self.closed:
+                await self.drain()
+                if self.update is not None and not self.closed:
+                    self._write_update()
+        except ConnectionError:
+            pass
+        finally:
+            self.catching_up = False
+
+    def _drop(self):
+        self.closed = True
+        self.update = None
+        self.writer.transport.abort()
+        if self.on_drop:
+            self.on_drop()
+        raise ConnectionError('client is not reading')
@@ -0,0 +1,128 @@
+"""Durable game state: an append-only journal of change records plus periodic snapshots.
+
+The journal holds the same versioned changes the server already keeps for deltas, one
+JSON line per recorded batch. A background writer thread appends them and fsyncs once
+per batch it drains (group commit), so recording a change never waits for the disk.
+Snapshots are written by the same thread, after which the journal is cut down to the
+records newer than the snapshot, so recovery reads one snapshot and a short tail.
+"""
+import json
+import os
+import queue
+import threading
+
+CHANGES, SNAPSHOT, CLOSE = range(3)
+
+
+def _fsync_directory(path):
+    # Makes a rename durable; not every platform lets you open a directory
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _replace(path, data):
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as file:
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary, path)
+    _fsync_directory(path)
+
+
+def load_state(snapshot_path, journal_path):
+    """Returns the saved snapshot and the journaled changes made after it, or (None, [])."""
+    try:
+        with open(snapshot_path, 'rb') as file:
+            snapshot = json.load(file)
+    except (OSError, ValueError):
+        return None, []
+    if not isinstance(snapshot, dict) or 'version' not in snapshot:
+        # Not a snapshot written by this module (e.g. an old state dump)
+        return None, []
+
+    changes = []
+    try:
+        with open(journal_path, 'rb') as file:
+            for line in file:
+                try:
+                    batch = json.loads(line)
+                except ValueError:
+                    break  # torn write at the end of the journal
+                changes.extend(change for change in batch if change['v'] > snapshot['version'])
+    except OSError:
+        pass
+    return snapshot, changes
+
+
+class Journal:
+    def __init__(self, snapshot_path, journal_path, fresh=False):
+        self.snapshot_path = snapshot_path
+        self.journal_path = journal_path
+        self.queue = queue.SimpleQueue()
+        # A new game must not pick up records left over from an older one
+        self.file = open(journal_path, 'wb' if fresh else 'ab')
+        self.writer = threading.Thread(target=self._write_loop, daemon=True)
+        self.writer.start()
+
+    def append(self, changes):
+        """Queues a batch of recorded changes; called in version order."""
+        self.queue.put((CHANGES, changes))
+
+    def save_snapshot(self, snapshot):
+        self.queue.put((SNAPSHOT, snapshot))
+
+    def close(self):
+        self.queue.put((CLOSE, None))
+        self.writer.join()
+
+    def _write_loop(self):
+        running = True
+        while running:
+            batch = [self.queue.get()]
+            try:
+                while True:
+                    batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+
+            lines, snapshot = [], None
+            for kind, payload in batch:
+                if kind == CHANGES:
+                    lines.append(json.dumps(payload).encode() + b'\n')
+                elif kind == SNAPSHOT:
+                    snapshot = payload
+                else:
+                    running = False
+
+            if lines:
+                self.file.write(b''.join(lines))
+                self.file.flush()
+                os.fsync(self.file.fileno())
+            if snapshot is not None:
+                _replace(self.snapshot_path, json.dumps(snapshot).encode())
+                self._compact(snapshot['version'])
+        self.file.close()
+
+    def _compact(self, version):
+        # Keep only the records the snapshot does not already cover
+        self.file.close()
+        kept = []
+        with open(self.journal_path, 'rb') as file:
+            for line in file:
+                try:
+                    batch = json.loads(line)
+                except ValueError:
+                    break
+                if batch and batch[-1]['v'] > version:
+                    kept.append(line)
+        _replace(self.journal_path, b''.join(kept))
+        self.file = open(self.journal_path, 'ab')
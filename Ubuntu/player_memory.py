@@ -0,0 +1,59 @@
+"""Measures what a player costs in memory by filling one match with synthetic players.
+
+Players are added straight to a socket-free server, so the numbers cover the game state
+(player table, occupancy, leaderboard, change log) and not the per-connection buffers.
+Removing and adding them all again (untraced, so the timings are real) checks that removal
+is O(1) and that the ids are reused.
+
+Usage: python player_memory.py [--players 100000]
+"""
+import argparse
+import math
+import os
+import time
+import tracemalloc
+
+from jogo import GameServer
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Memory per player at a large player count')
+    parser.add_argument('--players', type=int, default=100000)
+    parser.add_argument('--treasures', type=int, default=1000)
+    args = parser.parse_args()
+
+    # Roughly half the cells empty, so spawning never runs out of room
+    map_size = math.isqrt(2 * (args.players + args.treasures)) + 1
+    server = GameServer(map_size=map_size, num_treasures=args.treasures, listen=False, seed=1)
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for _ in range(args.players):
+        server.add_player(server.player_ids.allocate())
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    print(f"{args.players} players on a {map_size}x{map_size} map")
+    total = 0
+    for stat in after.compare_to(before, 'filename'):
+        total += stat.size_diff
+        if stat.size_diff > 0.01 * args.players:
+            print(f"  {os.path.basename(stat.traceback[0].filename):>16}: {stat.size_diff / args.players:6.1f} B/player")
+    print(f"  {'total':>16}: {total / args.players:6.1f} B/player")
+
+    player_ids = list(server.players)
+    started = time.perf_counter()
+    for player_id in player_ids:
+        server.remove_player(player_id)
+        server.player_ids.release(player_id)
+    removed = time.perf_counter() - started
+    started = time.perf_counter()
+    for _ in range(args.players):
+        server.add_player(server.player_ids.allocate())
+    added = time.perf_counter() - started
+    print(f"add {added / args.players * 1e6:.2f}us, remove {removed / args.players * 1e6:.2f}us per player; "
+          f"highest id after adding them all again: {max(server.players)}")
+
+
+if __name__ == "__main__":
+    main()
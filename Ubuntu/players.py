@@ -0,0 +1,148 @@
+"""Compact player store: one row of int64 fields per player in a single flat array.
+
+A player dict with its position tuple costs a few hundred bytes; a row costs 32. Player ids are
+dense (see IdAllocator) and double as row numbers, so finding, adding and removing a player are
+O(1) with no index on the side. The shared-memory table in shared.py uses the same rows.
+
+    row   q id (0 marks a free row), q x, q y, q score
+"""
+import threading
+from array import array
+
+PLAYER_ID, PLAYER_X, PLAYER_Y, PLAYER_SCORE = range(4)
+PLAYER_FIELDS = 4
+
+
+class PlayerRecord:
+    """One row of a player table, read and written like the player dicts."""
+
+    __slots__ = ('table', 'base')
+
+    def __init__(self, table, slot):
+        self.table = table
+        self.base = slot * PLAYER_FIELDS
+
+    def __getitem__(self, key):
+        if key == 'position':
+            return (self.table[self.base + PLAYER_X], self.table[self.base + PLAYER_Y])
+        if key == 'score':
+            return self.table[self.base + PLAYER_SCORE]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key == 'position':
+            self.table[self.base + PLAYER_X], self.table[self.base + PLAYER_Y] = value
+        elif key == 'score':
+            self.table[self.base + PLAYER_SCORE] = value
+        else:
+            raise KeyError(key)
+
+
+class PlayerTable:
+    """Player id -> record, used like the dict of player dicts it replaces.
+
+    Row `player_id` holds that player; the table grows by doubling when a bigger id is added.
+    """
+
+    __slots__ = ('table', 'count')
+
+    def __init__(self, players=None, capacity=64):
+        self.table = array('q', bytes(8 * PLAYER_FIELDS * capacity))
+        self.count = 0
+        for player_id, player in (players or {}).items():
+            self[player_id] = player
+
+    def __contains__(self, player_id):
+        base = player_id * PLAYER_FIELDS
+        return 0 < player_id and base < len(self.table) and self.table[base + PLAYER_ID] == player_id
+
+    def get(self, player_id, default=None):
+        return PlayerRecord(self.table, player_id) if player_id in self else default
+
+    def __getitem__(self, player_id):
+        if player_id not in self:
+            raise KeyError(player_id)
+        return PlayerRecord(self.table, player_id)
+
+    def __setitem__(self, player_id, player):
+        if player_id <= 0:
+            raise KeyError(player_id)
+        base = player_id * PLAYER_FIELDS
+        if base >= len(self.table):
+            rows = max(len(self.table) // PLAYER_FIELDS, player_id + 1)
+            self.table.frombytes(bytes(8 * PLAYER_FIELDS * rows))
+        if self.table[base + PLAYER_ID] != player_id:
+            self.count += 1
+        record = PlayerRecord(self.table, player_id)
+        record['position'] = player['position']
+        record['score'] = player['score']
+        self.table[base + PLAYER_ID] = player_id
+
+    def __delitem__(self, player_id):
+        if player_id not in self:
+            raise KeyError(player_id)
+        self.table[player_id * PLAYER_FIELDS + PLAYER_ID] = 0
+        self.count -= 1
+
+    def pop(self, player_id, default=None):
+        player = self.get(player_id)
+        if player is None:
+            return default
+        player = {'position': player['position'], 'score': player['score']}
+        del self[player_id]
+        return player
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        return (player_id for player_id in self.table[PLAYER_ID::PLAYER_FIELDS] if player_id)
+
+    def items(self):
+        return ((player_id, PlayerRecord(self.table, player_id)) for player_id in self)
+
+    def values(self):
+        return (player for _, player in self.items())
+
+    def snapshot(self):
+        """A dict of plain player dicts, for sending or saving; column slices keep it in C loops."""
+        table = self.table
+        return {
+            player_id: {'position': (x, y), 'score': score}
+            for player_id, x, y, score in zip(table[PLAYER_ID::PLAYER_FIELDS], table[PLAYER_X::PLAYER_FIELDS],
+                                              table[PLAYER_Y::PLAYER_FIELDS], table[PLAYER_SCORE::PLAYER_FIELDS])
+            if player_id
+        }
+
+
+class IdAllocator:
+    """Hands out player ids from 1 up, reusing released ones first; both steps are O(1).
+
+    Ids never collide while their player is in the game, and staying dense keeps the
+    player table as small as the most players the match has had at once. Releasing an id
+    that is already free, or was never handed out, does nothing.
+    """
+
+    def __init__(self, taken=()):
+        taken = set(taken)
+        self.next_id = max(taken, default=0) + 1
+        self.free = [player_id for player_id in range(self.next_id - 1, 0, -1) if player_id not in taken]
+        self.free_ids = set(self.free)  # the same ids, to tell a repeated release apart
+        self.lock = threading.Lock()
+
+    def allocate(self):
+        with self.lock:
+            if self.free:
+                player_id = self.free.pop()
+                self.free_ids.discard(player_id)
+                return player_id
+            player_id = self.next_id
+            self.next_id += 1
+            return player_id
+
+    def release(self, player_id):
+        with self.lock:
+            if player_id in self.free_ids or not 0 < player_id < self.next_id:
+                return
+            self.free.append(player_id)
+            self.free_ids.add(player_id)
@@ -0,0 +1,227 @@
+import itertools
+import json
+import queue
+import socket
+import struct
+import threading
+
+from codec import JSON, decode_binary, encode_binary, is_binary
+
+# Every message is a 4-byte big-endian length followed by a JSON payload, or a binary one
+# (see codec.py) once a connection has switched to it
+# A command may carry an 'id'; the server then echoes it in the reply to that command
+HEADER = struct.Struct('!I')
+MAX_MESSAGE_SIZE = 16 * 1024 * 1024
+
+
+class ProtocolError(ValueError):
+    pass
+
+
+def encode_message(message, codec=JSON):
+    payload = None
+    if codec != JSON:
+        payload = encode_binary(message)
+    if payload is None:
+        payload = json.dumps(message).encode()
+    return HEADER.pack(len(payload)) + payload
+
+
+def decode_payload(payload):
+    """Decodes one payload, binary or JSON; each frame says which it is."""
+    if is_binary(payload):
+        try:
+            return decode_binary(payload)
+        except ValueError as e:
+            raise ProtocolError(str(e)) from e
+    return json.loads(str(payload, 'utf-8'))
+
+
+def send_message(sock, message, codec=JSON):
+    sock.sendall(encode_message(message, codec))
+
+
+class MessageReader:
+    """Reads length-prefixed messages from a socket into one reusable buffer.
+
+    Handles partial reads and several messages arriving in a single recv.
+    """
+
+    def __init__(self, sock, buffer_size=64 * 1024):
+        self.sock = sock
+        self.buffer = bytearray(buffer_size)
+        self.view = memoryview(self.buffer)
+        self.start = 0
+        self.end = 0
+        self.bytes_read = 0
+
+    def _next_frame(self):
+        available = self.end - self.start
+        if available < HEADER.size:
+            return None
+
+        (length,) = HEADER.unpack_from(self.buffer, self.start)
+        if length > MAX_MESSAGE_SIZE:
+            raise ProtocolError(f'Message too large: {length} bytes')
+        if available < HEADER.size + length:
+            self._reserve(HEADER.size + length)
+            return None
+
+        begin = self.start + HEADER.size
+        self.start = begin + length
+        return self.view[begin:self.start]
+
+    def _reserve(self, needed):
+        # Make room for a whole frame: move pending bytes to the front, grow only if still too small
+        if self.start > 0 and len(self.buffer) - self.start < needed:
+            pending = self.end - self.start
+            self.buffer[:pending] = self.view[self.start:self.end]
+            self.start, self.end = 0, pending
+        if len(self.buffer) < needed:
+            self.view.release()
+            self.buffer.extend(bytes(needed - len(self.buffer)))
+            self.view = memoryview(self.buffer)
+
+    def _make_room(self):
+        if self.start == self.end:
+            self.start = self.end = 0
+        elif self.end == len(self.buffer):
+            self._reserve(self.end - self.start + HEADER.size)
+
+    def _received(self, count):
+        self.end += count
+        self.bytes_read += count
+        return count > 0
+
+    def _fill(self):
+        self._make_room()
+        return self._received(self.sock.recv_into(self.view[self.end:]))
+
+    def read_frame(self):
+        """Returns the next payload as a memoryview (valid until the next call), or None on EOF."""
+        while True:
+            frame = self._next_frame()
+            if frame is not None:
+                return frame
+            if not self._fill():
+                return None
+
+    def receive(self):
+        frame = self.read_frame()
+        if frame is None:
+            return None
+        with frame:
+            return decode_payload(frame)
+
+    def buffered(self):
+        """Returns the next message if it has already arrived in full, without reading; None otherwise."""
+        frame = self._next_frame()
+        if frame is None:
+            return None
+        with frame:
+            return decode_payload(frame)
+
+
+class AsyncMessageReader(MessageReader):
+    """A MessageReader over an asyncio StreamReader, reading whatever has arrived at each wait."""
+
+    def __init__(self, stream, buffer_size=64 * 1024):
+        super().__init__(None, buffer_size)
+        self.stream = stream
+
+    async def receive_async(self):
+        while True:
+            frame = self._next_frame()
+            if frame is not None:
+                with frame:
+                    return decode_payload(frame)
+            self._make_room()
+            data = await self.stream.read(len(self.buffer) - self.end)
+            self.view[self.end:self.end + len(data)] = data
+            if not self._received(len(data)):
+                return None
+
+
+class Connection:
+    """Client side of a game connection, with one reader thread and one writer thread.
+
+    Commands are queued and sent without waiting for replies; whatever piles up while a write
+    is in flight goes out in the next one. `request` tags a command with an id, which the server
+    echoes in its reply, so replies reach the callback of the request that caused them. Pushed
+    state and untagged replies go to `on_message`.
+    """
+
+    def __init__(self, sock, reader=None):
+        self.sock = sock
+        self.reader = reader or MessageReader(sock)
+        self.codec = JSON
+        self.outbox = queue.SimpleQueue()
+        self.pending = {}  # request id -> callback for its reply
+        self.pending_lock = threading.Lock()
+        self.request_ids = itertools.count(1)
+        # Writes are already batched, so Nagle would only delay them
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def start(self, on_message, on_close=None):
+        threading.Thread(target=self._read_loop, args=(on_message, on_close), daemon=True).start()
+        threading.Thread(target=self._write_loop, daemon=True).start()
+
+    def send(self, command):
+        self.outbox.put(encode_message(command, self.codec))
+    
+    def use_codec(self, codec):
+        """Asks the server to switch this connection to `codec`, and sends in it from now on."""
+        self.send({'type': 'codec', 'codec': codec})
+        # The server reads both encodings, so there is no need to wait for its answer
+        self.codec = codec
+
+    def request(self, command, callback=None):
+        """Sends a command tagged with a new request id and returns the id.
+
+        The reply goes to `callback`, or to `on_message` when there is none.
+        """
+        request_id = next(self.request_ids)
+        with self.pending_lock:
+            self.pending[request_id] = callback
+        self.send(dict(command, id=request_id))
+        return request_id
+
+    def close(self):
+        self.outbox.put(None)
+        self.sock.close()
+
+    def _read_loop(self, on_message, on_close):
+        error = None
+        try:
+            while True:
+                message = self.reader.receive()
+                if message is None:
+                    break
+
+                callback = None
+                if isinstance(message, dict) and 'id' in message:
+                    with self.pending_lock:
+                        callback = self.pending.pop(message['id'], None)
+                (callback or on_message)(message)
+        except (socket.error, ValueError) as e:
+            error = e
+        finally:
+            if on_close:
+                on_close(error)
+
+    def _write_loop(self):
+        while True:
+            frames = [self.outbox.get()]
+            try:
+                while True:
+                    frames.append(self.outbox.get_nowait())
+            except queue.Empty:
+                pass
+
+            closing = None in frames
+            try:
+                self.sock.sendall(b''.join(frame for frame in frames if frame is not None))
+            except socket.error:
+                return
+            if closing:
+                return
@@ -0,0 +1,73 @@
+"""Command recordings: every command a match applied, in order, so it can be replayed offline.
+
+A recording is a JSON-lines file. The first line describes the match, every following line is
+one command as [seconds since the start, player id, command], and the last line holds a digest
+of the final state:
+
+    {"seed": 1234, "map_size": 64, "num_treasures": 1000, "region_size": 4}
+    [0.0012, 3, {"type": "join"}]
+    [0.0153, 3, {"type": "move", "direction": "up", "id": 1}]
+    [2.5017, 3, {"type": "leave"}]
+    {"final": "9f86d0...", "version": 812}
+
+A seeded server lays out the same map and spawns players on the same cells, so feeding it the
+same commands in the same order ends in the same state (see replay.py). Joins and leaves are
+recorded as the pseudo-commands above because they decide where later players spawn.
+"""
+import hashlib
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+JOIN = 'join'
+LEAVE = 'leave'
+
+
+def state_digest(server):
+    """Hash of everything a match's state holds, for checking that two runs ended the same."""
+    snapshot = server.get_snapshot()
+    return hashlib.sha256(json.dumps(snapshot, sort_keys=True).encode()).hexdigest(), snapshot['version']
+
+
+def load_recording(path):
+    """Returns the header, the [time, player id, command] entries and the final line (None if cut short)."""
+    entries, final = [], None
+    with open(path) as file:
+        header = json.loads(file.readline())
+        for line in file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break  # the server stopped in the middle of a write
+            if isinstance(record, dict):
+                final = record
+                break
+            entries.append(record)
+    return header, entries, final
+
+
+class Recorder:
+    def __init__(self, path, header):
+        self.file = open(path, 'w')
+        self.file.write(json.dumps(header) + '\n')
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+
+    @contextmanager
+    def entry(self, player_id, command):
+        """Logs a command and holds the other commands back until it has been applied,
+        so the log has the order the game applied them in."""
+        with self.lock:
+            if self.file:
+                elapsed = round(time.monotonic() - self.started, 6)
+                self.file.write(json.dumps([elapsed, player_id, command]) + '\n')
+            yield
+
+    def close(self, server):
+        with self.lock:
+            if self.file:
+                digest, version = state_digest(server)
+                self.file.write(json.dumps({'final': digest, 'version': version}) + '\n')
+                self.file.close()
+                self.file = None
@@ -0,0 +1,66 @@
+"""Replays a recorded match (see recording.py) straight into the game core, without sockets.
+
+Commands are applied back to back, as fast as the engine takes them, so the run measures the
+CPU cost of the game itself. Every run must end in the state the recording ended in; a run that
+does not is reported, because its timing would not be measuring the same work.
+
+Usage: python replay.py SESSION [--engine threaded|asyncio] [--repeat 3]
+"""
+import argparse
+import sys
+import time
+
+from jogo import AsyncGameServer, GameServer
+from recording import JOIN, LEAVE, load_recording, state_digest
+
+# The asyncio engine runs the same game with its locks replaced by no-ops
+ENGINES = {'threaded': GameServer, 'asyncio': AsyncGameServer}
+
+
+def replay(engine, header, entries):
+    """Plays the entries on a fresh server; returns the seconds it took and the server."""
+    server = ENGINES[engine](map_size=header['map_size'], num_treasures=header['num_treasures'],
+                             region_size=header['region_size'], seed=header['seed'], listen=False)
+    started = time.perf_counter()
+    for _, player_id, command in entries:
+        kind = command.get('type')
+        if kind == JOIN:
+            server.add_player(player_id)
+        elif kind == LEAVE:
+            server.remove_player(player_id)
+        else:
+            server.process_command(player_id, command)
+    return time.perf_counter() - started, server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a recorded match as a CPU benchmark')
+    parser.add_argument('session', help='file written by jogo.py --record')
+    parser.add_argument('--engine', choices=sorted(ENGINES), default='threaded')
+    parser.add_argument('--repeat', type=int, default=3, help='runs; the fastest one is reported')
+    args = parser.parse_args()
+
+    header, entries, final = load_recording(args.session)
+    recorded = entries[-1][0] if entries else 0
+    print(f"{args.session}: seed {header['seed']}, {len(entries)} commands over {recorded:.1f}s")
+    if final is None:
+        print('the recording has no final state (the server did not shut down cleanly); runs are only compared with each other')
+
+    best, digests = None, set()
+    for _ in range(args.repeat):
+        elapsed, server = replay(args.engine, header, entries)
+        digest, version = state_digest(server)
+        digests.add(digest)
+        best = elapsed if best is None else min(best, elapsed)
+    print(f"{args.engine}: {len(entries) / best:,.0f} commands/s ({best * 1000:.1f}ms for the session), "
+          f"final version {version}, state {digest[:16]}")
+
+    expected = {final['final']} if final else set()
+    if len(digests) > 1 or (expected and digests != expected):
+        print('final state differs from the recorded one' if len(digests) == 1 else 'runs ended in different states')
+        sys.exit(1)
+    print('final state identical to the recording' if final else 'final state identical across runs')
+
+
+if __name__ == "__main__":
+    main()
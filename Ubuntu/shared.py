@@ -0,0 +1,185 @@
+"""Game state kept in shared memory, so several server processes can run one match.
+
+The block holds, native-endian and naturally aligned:
+
+    counters   8 int64: collected treasures, room treasures, version, active flag, player slots in use,
+               last player id handed out, players in the table
+    players    one row per slot, laid out as in players.py; id 0 marks a free slot
+    occupancy  one int32 per cell: how many players stand on it
+    cells      one byte per cell: the map grid
+
+Cells are guarded by striped locks (each multiprocessing lock covers every region whose
+index falls on it), so the number of semaphores stays fixed however big the map is. The
+player table, the counters and the version each have a lock of their own.
+"""
+import multiprocessing
+from multiprocessing import shared_memory
+
+from players import PLAYER_FIELDS, PLAYER_ID, PlayerRecord
+
+COLLECTED, ROOM_TREASURES, VERSION, ACTIVE, SLOTS, LAST_ID, PLAYERS = range(7)
+COUNTERS = 8
+
+
+class SharedGame:
+    """Shared match state; created once by the parent and handed to every worker process."""
+
+    def __init__(self, map_size, cells, room, treasures_in_room, total_treasures, region_size, seed, stripes=64):
+        self.map_size = map_size
+        self.seed = seed  # the match's seed, from which each process seeds its own spawns
+        self.room = room
+        self.total_treasures = total_treasures
+        self.region_size = region_size
+        self.capacity = map_size * map_size
+
+        regions_per_row = -(-map_size // region_size)
+        self.stripes = [multiprocessing.Lock() for _ in range(min(stripes, regions_per_row * regions_per_row))]
+        self.locks = {name: multiprocessing.Lock() for name in ('player', 'room', 'counter', 'log')}
+
+        self.shm = shared_memory.SharedMemory(create=True, size=self._size())
+        self._attach()
+        self.cells[:] = cells
+        self.counters[ROOM_TREASURES] = treasures_in_room
+        self.counters[ACTIVE] = 1
+
+    def _size(self):
+        return COUNTERS * 8 + self.capacity * PLAYER_FIELDS * 8 + self.capacity * 4 + self.capacity
+
+    def _attach(self):
+        buffer = self.shm.buf
+        start, end = 0, COUNTERS * 8
+        self.counters = buffer[start:end].cast('q')
+        start, end = end, end + self.capacity * PLAYER_FIELDS * 8
+        self.players = buffer[start:end].cast('q')
+        start, end = end, end + self.capacity * 4
+        self.occupancy = buffer[start:end].cast('i')
+        self.cells = buffer[end:end + self.capacity]
+
+    def __getstate__(self):
+        # Views cannot be pickled; the worker maps the block again by name
+        state = self.__dict__.copy()
+        for view in ('counters', 'players', 'occupancy', 'cells'):
+            del state[view]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._attach()
+
+    @property
+    def active(self):
+        return bool(self.counters[ACTIVE])
+
+    def close(self):
+        for view in (self.counters, self.players, self.occupancy, self.cells):
+            view.release()
+        self.shm.close()
+
+    def unlink(self):
+        self.shm.unlink()
+
+
+class SharedCounter:
+    """Attribute stored in the shared counters, so every process reads and writes the same value."""
+
+    def __init__(self, index):
+        self.index = index
+
+    def __get__(self, server, owner=None):
+        if server is None:
+            return self
+        return server.game.counters[self.index]
+
+    def __set__(self, server, value):
+        server.game.counters[self.index] = value
+
+
+class SharedIds:
+    """Player ids for a match served by several processes, drawn from one shared counter so
+    no two processes hand out the same id. Ids are not reused, but table rows are."""
+
+    def __init__(self, game, lock):
+        self.game = game
+        self.lock = lock
+
+    def allocate(self):
+        with self.lock:
+            self.game.counters[LAST_ID] += 1
+            return self.game.counters[LAST_ID]
+
+    def release(self, player_id):
+        pass
+
+
+class SharedPlayers:
+    """The shared player table seen as a dict of player id -> record.
+
+    Only the process that added a player moves it, so each process keeps the slots of its own
+    players; looking up anybody else scans the slots in use. Adding and removing need the player lock,
+    which also guards the shared count of players.
+    """
+
+    def __init__(self, game):
+        self.game = game
+        self.table = game.players
+        self.slots = {}
+
+    def _find(self, player_id):
+        slot = self.slots.get(player_id)
+        if slot is not None:
+            return slot
+        for slot in range(self.game.counters[SLOTS]):
+            if self.table[slot * PLAYER_FIELDS + PLAYER_ID] == player_id:
+                return slot
+        return None
+
+    def __contains__(self, player_id):
+        return self._find(player_id) is not None
+
+    def get(self, player_id, default=None):
+        slot = self._find(player_id)
+        return default if slot is None else PlayerRecord(self.table, slot)
+
+    def __getitem__(self, player_id):
+        slot = self._find(player_id)
+        if slot is None:
+            raise KeyError(player_id)
+        return PlayerRecord(self.table, slot)
+
+    def full(self):
+        return self.game.counters[PLAYERS] >= self.game.capacity
+
+    def __setitem__(self, player_id, player):
+        used = self.game.counters[SLOTS]
+        slot = used
+        # Only a table with holes in it is searched for a free row
+        if self.game.counters[PLAYERS] < used:
+            slot = next(slot for slot in range(used) if not self.table[slot * PLAYER_FIELDS + PLAYER_ID])
+        if slot == used:
+            self.game.counters[SLOTS] = used + 1
+
+        record = PlayerRecord(self.table, slot)
+        record['position'] = player['position']
+        record['score'] = player['score']
+        # Written last, so readers never see the id next to a half-written row
+        self.table[slot * PLAYER_FIELDS + PLAYER_ID] = player_id
+        self.slots[player_id] = slot
+        self.game.counters[PLAYERS] += 1
+
+    def __delitem__(self, player_id):
+        slot = self.slots.pop(player_id)
+        self.table[slot * PLAYER_FIELDS + PLAYER_ID] = 0
+        self.game.counters[PLAYERS] -= 1
+
+    def items(self):
+        for slot in range(self.game.counters[SLOTS]):
+            player_id = self.table[slot * PLAYER_FIELDS + PLAYER_ID]
+            if player_id:
+                yield player_id, PlayerRecord(self.table, slot)
+
+    def __len__(self):
+        return self.game.counters[PLAYERS]
+
+    def snapshot(self):
+        return {player_id: {'position': player['position'], 'score': player['score']}
+                for player_id, player in self.items()}
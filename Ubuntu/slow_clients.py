@@ -0,0 +1,115 @@
+"""Checks that clients which do not read cannot slow the others down.
+
+Starts a server, then runs the benchmark bots next to two misbehaving clients: one floods
+moves without ever reading a reply, the other subscribes to pushed updates and never reads
+them. The bots' latency should stay close to what it is without them; a misbehaving client
+is dropped once its socket buffers and then its outbox fill up or stall (see outbox.py).
+
+Usage: python slow_clients.py [--engine threaded asyncio tick] [--players 20] [--duration 10]
+"""
+import argparse
+import socket
+import threading
+
+from benchmark import ServerProcess, free_port, percentile, run_bots
+from protocolo import MessageReader, encode_message, send_message
+
+FLOOD_BATCH = 64  # moves the flooder writes at once
+
+
+def connect(port):
+    client = socket.create_connection(('localhost', port))
+    reader = MessageReader(client)
+    reader.receive()  # the player id
+    return client, reader
+
+
+def flood(port, stop, sent):
+    """Sends moves as fast as the socket takes them and reads nothing, counting them in `sent[0]`.
+
+    A server that stopped reading leaves the last write blocked, so the count is kept as it goes.
+    """
+    client, _ = connect(port)
+    batch = b''.join(encode_message({'type': 'move', 'direction': direction})
+                     for direction in ('up', 'left', 'down', 'right') * (FLOOD_BATCH // 4))
+    try:
+        while not stop.is_set():
+            client.sendall(batch)
+            sent[0] += FLOOD_BATCH
+    except OSError:
+        pass
+    finally:
+        client.close()
+
+
+def stall(port, stop):
+    """Subscribes and never reads what is pushed."""
+    client, _ = connect(port)
+    send_message(client, {'type': 'subscribe'})
+    stop.wait()
+    client.close()
+
+
+def server_stats(port):
+    client, reader = connect(port)
+    with client:
+        send_message(client, {'type': 'stats'})
+        return reader.receive()['stats']
+
+
+def measure(engine, args, misbehave):
+    port = free_port()
+    server = ServerProcess(engine, port, args.players + 3, args.map_size, args.treasures)
+    stop = threading.Event()
+    flooded = [0]
+    try:
+        server.wait_ready()
+        threads = []
+        if misbehave:
+            threads = [threading.Thread(target=flood, args=(port, stop, flooded), daemon=True),
+                       threading.Thread(target=stall, args=(port, stop), daemon=True)]
+        for thread in threads:
+            thread.start()
+        latencies, commands, errors, _ = run_bots(port, args.players, 'random', args.duration, args.rate / args.players)
+        stop.set()
+        for thread in threads:
+            thread.join(timeout=5)
+        stats = server_stats(port)
+    finally:
+        stop.set()
+        server.stop()
+
+    latencies.sort()
+    return {
+        'commands': commands,
+        'errors': errors,
+        'p50_ms': (percentile(latencies, 0.5) or 0) * 1000,
+        'p99_ms': (percentile(latencies, 0.99) or 0) * 1000,
+        'flooded': flooded[0],
+        'merged_moves': stats.get('merged_moves'),
+        'dropped_connections': stats.get('dropped_connections')
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Latency of well-behaved clients next to ones that do not read')
+    parser.add_argument('--engine', nargs='+', choices=['threaded', 'asyncio', 'tick'], default=['threaded'])
+    parser.add_argument('--players', type=int, default=20)
+    parser.add_argument('--rate', type=float, default=400, help='target commands per second across the bots')
+    parser.add_argument('--duration', type=float, default=10, help='seconds of load per run')
+    parser.add_argument('--map-size', type=int, default=64)
+    parser.add_argument('--treasures', type=int, default=1000)
+    args = parser.parse_args()
+
+    for engine in args.engine:
+        alone = measure(engine, args, misbehave=False)
+        crowded = measure(engine, args, misbehave=True)
+        print(f"{engine:>8}: bots alone p50 {alone['p50_ms']:.2f}ms p99 {alone['p99_ms']:.2f}ms; "
+              f"next to slow clients p50 {crowded['p50_ms']:.2f}ms p99 {crowded['p99_ms']:.2f}ms, "
+              f"{crowded['errors']} errors")
+        print(f"{'':>8}  flooder sent {crowded['flooded']} moves, {crowded['merged_moves']} answered together; "
+              f"{crowded['dropped_connections']} clients dropped for not reading")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Stress check for concurrent moves: many threads move players at once and
+the treasure totals must still add up exactly.
+
+Usage: python stress_moves.py [--threads 32] [--moves 2000]
+"""
+import argparse
+import random
+import sys
+import threading
+
+from grade import TREASURE_ROOM
+from jogo import GameServer
+
+
+def treasure_totals(server):
+    values = [value for value in server.main_map.cells if 0 < value < TREASURE_ROOM]
+    return len(values), sum(values)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Concurrent move stress check')
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--moves', type=int, default=2000)
+    parser.add_argument('--map-size', type=int, default=64)
+    parser.add_argument('--treasures', type=int, default=2000)
+    parser.add_argument('--region-size', type=int, default=8)
+    args = parser.parse_args()
+
+    # Switch threads as often as possible to provoke races
+    sys.setswitchinterval(1e-6)
+
+    server = GameServer(port=0, map_size=args.map_size, num_treasures=args.treasures, region_size=args.region_size)
+    start_count, start_points = treasure_totals(server)
+    room_treasures = server.treasures_in_room
+
+    movers = list(range(1, args.threads + 1))
+    for player_id in movers:
+        server.add_player(player_id)
+
+    # A few extra players all standing on the treasure room, fighting over it
+    room_players = list(range(args.threads + 1, args.threads + 9))
+    room = (server.treasure_room_x, server.treasure_room_y)
+    for player_id in room_players:
+        server.players[player_id] = {'position': room, 'score': 0}
+        server._occupy(player_id, room)
+
+    def move_randomly(player_id):
+        for _ in range(args.moves):
+            server.move_player(player_id, random.choice(['up', 'down', 'left', 'right']))
+
+    def loot_room(player_id):
+        for _ in range(room_treasures):
+            server.handle_treasure_room(player_id)
+
+    threads = [threading.Thread(target=move_randomly, args=(player_id,)) for player_id in movers]
+    threads += [threading.Thread(target=loot_room, args=(player_id,)) for player_id in room_players]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    end_count, end_points = treasure_totals(server)
+    scores = sum(player['score'] for player in server.players.values())
+    expected_collected = (start_count - end_count) + room_treasures
+    expected_points = (start_points - end_points) + room_treasures * 10
+
+    print(f"collected {server.collected_treasures} treasures (expected {expected_collected})")
+    print(f"scored {scores} points (expected {expected_points})")
+    print(f"treasures left in room: {server.treasures_in_room}")
+    server.server_socket.close()
+
+    if server.collected_treasures != expected_collected or scores != expected_points or server.treasures_in_room != 0:
+        print("FAIL: treasure accounting is off")
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
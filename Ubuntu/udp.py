@@ -0,0 +1,146 @@
+"""Optional UDP channel for moves, next to each player's TCP connection.
+
+Over TCP one lost segment holds back every move sent after it until it is retransmitted.
+Datagrams do not wait for each other: a lost move is simply gone, and a move that arrives after
+a newer one is dropped as stale. Entering the room, state, scores and everything else stay on TCP.
+
+A client asks for the channel over its TCP connection and gets the port and a token back:
+
+    {'type': 'udp'}  ->  {'status': 'success', 'port': 5001, 'token': 1234...}
+
+Datagrams are big-endian structs:
+
+    move   I player id, Q token, I sequence (from 1, increasing), B direction
+    ack    I sequence, q version, I x, I y
+
+The server answers every move it applies with an ack holding the player's position after it and
+the version it appeared in, so the client can settle its prediction without waiting for TCP.
+"""
+import asyncio
+import secrets
+import socket
+import struct
+import threading
+
+from codec import DIRECTION_CODES, DIRECTIONS
+
+MOVE = struct.Struct('!IQIB')
+ACK = struct.Struct('!IqII')
+
+
+def encode_move(player_id, token, sequence, direction):
+    return MOVE.pack(player_id, token, sequence, DIRECTION_CODES[direction])
+
+
+def decode_ack(data):
+    """(sequence, version, (x, y)) of an ack, or None if `data` is not one."""
+    if len(data) != ACK.size:
+        return None
+    sequence, version, x, y = ACK.unpack(data)
+    return sequence, version, (x, y)
+
+
+class UdpChannel:
+    """The server side: hands out tokens over TCP and turns valid datagrams into moves."""
+
+    def __init__(self, host, port=0):
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind((host, port))
+        self.port = self.socket.getsockname()[1]
+        self.sendto = self.socket.sendto  # an asyncio server sends through its transport instead
+        self.tokens = {}  # player id -> token handed out over its TCP connection
+        self.sequences = {}  # player id -> sequence of the last move accepted
+        self.lock = threading.Lock()
+
+    def open(self, player_id):
+        """The reply to a player asking for the channel; asking again keeps the same token."""
+        with self.lock:
+            token = self.tokens.get(player_id)
+            if token is None:
+                token = self.tokens[player_id] = secrets.randbits(64)
+                self.sequences[player_id] = 0
+        return {'status': 'success', 'port': self.port, 'token': token}
+
+    def forget(self, player_id):
+        with self.lock:
+            self.tokens.pop(player_id, None)
+            self.sequences.pop(player_id, None)
+
+    def accept(self, data):
+        """(player id, sequence, direction) of a move, or None if it is malformed, forged or stale."""
+        if len(data) != MOVE.size:
+            return None
+        player_id, token, sequence, direction = MOVE.unpack(data)
+        if direction >= len(DIRECTIONS):
+            return None
+        with self.lock:
+            # The token proves the sender holds the player's TCP connection
+            if self.tokens.get(player_id) != token or sequence <= self.sequences[player_id]:
+                return None
+            self.sequences[player_id] = sequence
+        return player_id, sequence, DIRECTIONS[direction]
+
+    def acknowledge(self, sequence, version, position, address):
+        x, y = position
+        try:
+            self.sendto(ACK.pack(sequence, version, x, y), address)
+        except OSError:
+            pass  # acks are as unreliable as the moves; the next one or the TCP state catches up
+
+    def serve(self, handle):
+        """Passes every datagram to `handle(data, address)` until the socket is closed."""
+        while True:
+            try:
+                data, address = self.socket.recvfrom(512)
+            except OSError:
+                return
+            handle(data, address)
+
+    def close(self):
+        self.socket.close()
+
+
+class UdpDatagrams(asyncio.DatagramProtocol):
+    """Hands the datagrams of a UdpChannel to a server running on an asyncio event loop."""
+
+    def __init__(self, server):
+        self.server = server
+
+    def connection_made(self, transport):
+        self.server.udp.sendto = transport.sendto
+
+    def datagram_received(self, data, address):
+        self.server.handle_datagram(data, address)
+
+
+class UdpMoves:
+    """The client side: sends numbered moves from a socket of its own and reads the acks."""
+
+    def __init__(self, host, port, player_id, token, timeout=None):
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.settimeout(timeout)
+        self.socket.connect((host, port))  # only the server's datagrams get through
+        self.player_id = player_id
+        self.token = token
+        self.sequence = 0
+
+    def move(self, direction):
+        """Sends a move and returns its sequence number, which its ack will carry."""
+        self.sequence += 1
+        self.socket.send(encode_move(self.player_id, self.token, self.sequence, direction))
+        return self.sequence
+
+    def receive(self):
+        """The next ack as (sequence, version, (x, y)), or None on a timeout or once the socket is closed."""
+        while True:
+            try:
+                ack = decode_ack(self.socket.recv(512))
+            except ConnectionRefusedError:
+                continue  # an earlier datagram found no server listening; moves are best effort
+            except OSError:
+                return None
+            if ack is not None:
+                return ack
+
+    def close(self):
+        self.socket.close()
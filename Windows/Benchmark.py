@@ -0,0 +1,229 @@
+# Benchmark.py - teste de carga: sobe um servidor local e coloca jogadores simulados contra ele.
+#
+# Mostra vazão, latência p50/p99/p999 dos comandos e CPU/RSS do servidor para cada motor,
+# e pode salvar os resultados para comparar mudanças futuras com uma linha de base.
+#
+# Uso: python Benchmark.py [--motor threads asyncio ticks] [--jogadores 50] [--taxa 1000]
+#                          [--duracao 10] [--estrategia aleatoria|tesouro] [--processos-servidor 1] [--codec json|binary]
+#                          [--udp] [--semente N] [--gravar ARQ]
+#                          [--salvar ARQ] [--base ARQ]
+# CPU e RSS são lidos do /proc, então só aparecem no Linux.
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from CodecBinario import CODECS, JSON
+from Robo import ESTRATEGIAS, Robo
+
+PASTA = os.path.dirname(os.path.abspath(__file__))
+TICKS_RELOGIO = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+
+class ProcessoServidor:
+    """Servidor do jogo em um processo filho, amostrado pelo /proc para CPU e memória.
+
+    Com --processos o servidor cria trabalhadores, então as amostras cobrem a árvore de processos toda.
+    """
+
+    def __init__(self, motor, porta, jogadores, tamanhoMapa, tesouros, processos=1, udp=False, semente=None, gravar=None):
+        self.porta = porta
+        self.processo = subprocess.Popen(
+            [sys.executable, os.path.join(PASTA, 'Jogo.py'), '--port', str(porta), '--motor', motor,
+             '--backlog', str(max(jogadores, 5)), '--tamanho-mapa', str(tamanhoMapa), '--tesouros', str(tesouros),
+             '--processos', str(processos)] + (['--porta-udp', '0'] if udp else []) +
+            (['--semente', str(semente)] if semente is not None else []) + (['--gravar', gravar] if gravar else []),
+            stdout=subprocess.DEVNULL
+        )
+
+    def esperarPronto(self, limite=10):
+        prazo = time.monotonic() + limite
+        while time.monotonic() < prazo:
+            if self.processo.poll() is not None:
+                raise RuntimeError(f'o servidor saiu com código {self.processo.returncode}')
+            # A sonda entra como jogador e sai logo em seguida, como qualquer desconexão
+            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sonda:
+                if sonda.connect_ex(('localhost', self.porta)) == 0:
+                    return
+            time.sleep(0.05)
+        raise RuntimeError('o servidor não subiu a tempo')
+
+    def pids(self):
+        pids, pendentes = [], [self.processo.pid]
+        while pendentes:
+            pid = pendentes.pop()
+            pids.append(pid)
+            try:
+                with open(f'/proc/{pid}/task/{pid}/children') as filhos:
+                    pendentes.extend(int(filho) for filho in filhos.read().split())
+            except OSError:
+                pass
+        return pids
+
+    def segundosCpu(self):
+        try:
+            total = 0
+            for pid in self.pids():
+                with open(f'/proc/{pid}/stat') as stat:
+                    # Campos depois do nome do comando; utime e stime são o 12º e o 13º
+                    campos = stat.read().rsplit(')', 1)[1].split()
+                total += int(campos[11]) + int(campos[12])
+            return total / TICKS_RELOGIO
+        except OSError:
+            return None
+
+    def picoRss(self):
+        # Páginas divididas entre os processos contam uma vez por processo
+        total = 0
+        try:
+            for pid in self.pids():
+                with open(f'/proc/{pid}/status') as status:
+                    for linha in status:
+                        if linha.startswith('VmHWM:'):
+                            total += int(linha.split()[1]) * 1024
+        except OSError:
+            return None
+        return total or None
+
+    def parar(self):
+        self.processo.terminate()
+        try:
+            self.processo.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self.processo.kill()
+            self.processo.wait()
+
+
+def portaLivre():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sonda:
+        sonda.bind(('localhost', 0))
+        return sonda.getsockname()[1]
+
+
+def rodarRobos(porta, quantidade, estrategia, duracao, taxa, codec=JSON, udp=False):
+    """Roda `quantidade` robôs em threads neste processo; retorna latências, comandos, erros e robôs conectados."""
+    robos = [Robo(port=porta, estrategia=estrategia, codec=codec, udp=udp) for _ in range(quantidade)]
+    robos = [robo for robo in robos if robo.conectar()]
+    threads = [threading.Thread(target=robo.jogar, args=(duracao, taxa)) for robo in robos]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    latencias = [latencia for robo in robos for latencia in robo.latencias]
+    return latencias, len(latencias), sum(robo.erros for robo in robos), len(robos)
+
+
+def percentil(ordenadas, fracao):
+    if not ordenadas:
+        return None
+    return ordenadas[min(len(ordenadas) - 1, max(0, math.ceil(fracao * len(ordenadas)) - 1))]
+
+
+def medir(motor, argumentos):
+    porta = portaLivre()
+    servidor = ProcessoServidor(motor, porta, argumentos.jogadores, argumentos.tamanho_mapa, argumentos.tesouros,
+                                argumentos.processos_servidor, argumentos.udp, argumentos.semente, argumentos.gravar)
+    try:
+        servidor.esperarPronto()
+        # Os robôs são divididos entre processos para o gerador de carga não disputar um único GIL
+        processos = max(1, min(argumentos.processos, argumentos.jogadores))
+        partes = [argumentos.jogadores // processos + (i < argumentos.jogadores % processos) for i in range(processos)]
+        taxaPorRobo = argumentos.taxa / argumentos.jogadores
+
+        cpuInicio = servidor.segundosCpu()
+        inicio = time.perf_counter()
+        with multiprocessing.Pool(processos) as pool:
+            resultados = pool.starmap(rodarRobos, [
+                (porta, parte, argumentos.estrategia, argumentos.duracao, taxaPorRobo, argumentos.codec, argumentos.udp) for parte in partes
+            ])
+        decorrido = time.perf_counter() - inicio
+        cpuFim = servidor.segundosCpu()
+        rss = servidor.picoRss()
+    finally:
+        servidor.parar()
+
+    latencias = sorted(latencia for resultado in resultados for latencia in resultado[0])
+    comandos = sum(resultado[1] for resultado in resultados)
+    cpu = None if cpuInicio is None or cpuFim is None else cpuFim - cpuInicio
+    rotulo = motor if argumentos.processos_servidor == 1 else f'{motor}x{argumentos.processos_servidor}'
+    if argumentos.codec != JSON:
+        rotulo += f'/{argumentos.codec}'
+    return {
+        'motor': rotulo + '+udp' if argumentos.udp else rotulo,
+        'jogadores': sum(resultado[3] for resultado in resultados),
+        'comandos': comandos,
+        'erros': sum(resultado[2] for resultado in resultados),
+        'vazao': comandos / decorrido,
+        'p50_ms': (percentil(latencias, 0.5) or 0) * 1000,
+        'p99_ms': (percentil(latencias, 0.99) or 0) * 1000,
+        'p999_ms': (percentil(latencias, 0.999) or 0) * 1000,
+        'cpu_porcento': None if cpu is None else cpu / decorrido * 100,
+        'rss_mb': None if rss is None else rss / (1024 * 1024)
+    }
+
+
+def formatarResultado(resultado, base=None):
+    def valor(chave, unidade, formato='.1f'):
+        if resultado[chave] is None:
+            return f"{chave}=n/d"
+        texto = f"{chave}={resultado[chave]:{formato}}{unidade}"
+        if base and base.get(chave):
+            texto += f" ({(resultado[chave] / base[chave] - 1) * 100:+.0f}%)"
+        return texto
+
+    return ' '.join([
+        f"{resultado['motor']:>8}: {resultado['jogadores']} jogadores, {resultado['comandos']} comandos, {resultado['erros']} erros,",
+        valor('vazao', '/s'), valor('p50_ms', 'ms', '.2f'), valor('p99_ms', 'ms', '.2f'),
+        valor('p999_ms', 'ms', '.2f'), valor('cpu_porcento', '%'), valor('rss_mb', 'MB')
+    ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Teste de carga do Caça ao Tesouro')
+    parser.add_argument('--motor', nargs='+', choices=['threads', 'asyncio', 'ticks'], default=['threads'])
+    parser.add_argument('--jogadores', type=int, default=50)
+    parser.add_argument('--taxa', type=float, default=1000, help='comandos por segundo somando todos os jogadores')
+    parser.add_argument('--duracao', type=float, default=10, help='segundos de carga por motor')
+    parser.add_argument('--estrategia', choices=sorted(ESTRATEGIAS), default='aleatoria')
+    parser.add_argument('--processos', type=int, default=os.cpu_count() or 1, help='processos que rodam os robôs')
+    parser.add_argument('--tamanho-mapa', type=int, default=64)
+    parser.add_argument('--tesouros', type=int, default=1000)
+    parser.add_argument('--processos-servidor', type=int, default=1,
+                        help='processos do servidor dividindo a partida (só no motor threads)')
+    parser.add_argument('--codec', choices=CODECS, default=JSON, help='codificação que os robôs pedem ao servidor')
+    parser.add_argument('--udp', action='store_true', help='os robôs enviam os movimentos por UDP (perdidos contam como erros)')
+    parser.add_argument('--semente', type=int, help='semente do servidor, para toda execução jogar no mesmo mapa')
+    parser.add_argument('--gravar', help='o servidor grava os comandos neste arquivo, para o Reproducao.py')
+    parser.add_argument('--salvar', help='grava os resultados neste arquivo JSON')
+    parser.add_argument('--base', help='compara com resultados salvos antes com --salvar')
+    argumentos = parser.parse_args()
+    if argumentos.udp and argumentos.processos_servidor > 1:
+        parser.error('--udp não pode ser usado com --processos-servidor')
+    if argumentos.gravar and (len(argumentos.motor) > 1 or argumentos.processos_servidor > 1):
+        parser.error('--gravar precisa de um único motor e não pode ser usado com --processos-servidor')
+
+    base = {}
+    if argumentos.base:
+        with open(argumentos.base) as arquivo:
+            base = {resultado['motor']: resultado for resultado in json.load(arquivo)}
+
+    resultados = []
+    for motor in argumentos.motor:
+        resultado = medir(motor, argumentos)
+        resultados.append(resultado)
+        print(formatarResultado(resultado, base.get(resultado['motor'])))
+
+    if argumentos.salvar:
+        with open(argumentos.salvar, 'w') as arquivo:
+            json.dump(resultados, arquivo, indent=2)
+
+
+if __name__ == "__main__":
+    main()
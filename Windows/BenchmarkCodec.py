@@ -0,0 +1,60 @@
+# BenchmarkCodec.py - compara o codec binário com o JSON: bytes na rede e tempo de codificar/decodificar.
+#
+# As mensagens vêm de um jogo de verdade, então têm a forma e o tamanho das que o servidor envia.
+#
+# Uso: python BenchmarkCodec.py [--tamanho-mapa 64] [--jogadores 50] [--repeticoes 2000]
+import argparse
+import random
+import timeit
+
+from CodecBinario import BINARIO, JSON
+from Jogo import Jogo
+from Protocolo import CABECALHO, codificarMensagem, decodificarConteudo
+
+
+def mensagensDeExemplo(argumentos):
+    jogo = Jogo(tamanhoMapa=argumentos.tamanho_mapa, numeroTesouros=argumentos.tamanho_mapa * argumentos.tamanho_mapa // 4,
+                escutar=False)
+    for idJogador in range(1, 1 + argumentos.jogadores):
+        jogo.adicionarJogador(idJogador)
+    inicio = jogo.versao
+    for idJogador in random.sample(sorted(jogo.jogadores), min(8, argumentos.jogadores)):
+        jogo.moverJogador(idJogador, random.choice(['up', 'down', 'left', 'right']))
+
+    observador = jogo.interesse.adicionar(1, None, 8)
+    return {
+        'move': {'type': 'move', 'direction': 'up', 'id': 41},
+        'get_state': {'type': 'get_state', 'since': inicio, 'id': 42},
+        'ack': {'status': 'success', 'version': jogo.versao, 'id': 41},
+        'delta': jogo.obterEstadoDesde(inicio),
+        'estado': jogo.obterEstadoJogo(),
+        'snapshot': jogo.obterSnapshot(),
+        'visao': jogo.interesse.snapshot(observador)
+    }
+
+
+def medir(mensagem, codec, repeticoes):
+    quadro = codificarMensagem(mensagem, codec)
+    conteudo = quadro[CABECALHO.size:]
+    codificar = min(timeit.repeat(lambda: codificarMensagem(mensagem, codec), number=repeticoes, repeat=3)) / repeticoes
+    decodificar = min(timeit.repeat(lambda: decodificarConteudo(conteudo), number=repeticoes, repeat=3)) / repeticoes
+    return len(quadro), codificar, decodificar
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Codec binário contra JSON')
+    parser.add_argument('--tamanho-mapa', type=int, default=64)
+    parser.add_argument('--jogadores', type=int, default=50)
+    parser.add_argument('--repeticoes', type=int, default=2000, help='execuções por medida')
+    argumentos = parser.parse_args()
+
+    print(f"{'mensagem':>10} {'json B':>8} {'bin B':>8} {'json cod':>10} {'bin cod':>10} {'json dec':>10} {'bin dec':>10}")
+    for nome, mensagem in mensagensDeExemplo(argumentos).items():
+        tamanhoJson, codificarJson, decodificarJson = medir(mensagem, JSON, argumentos.repeticoes)
+        tamanhoBinario, codificarBinario, decodificarBinario = medir(mensagem, BINARIO, argumentos.repeticoes)
+        print(f"{nome:>10} {tamanhoJson:>8} {tamanhoBinario:>8} {codificarJson * 1e6:>8.2f}us {codificarBinario * 1e6:>8.2f}us "
+              f"{decodificarJson * 1e6:>8.2f}us {decodificarBinario * 1e6:>8.2f}us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+# CaixaSaida.py - filas de saída por conexão, para que um cliente que lê devagar só atrase a si mesmo.
+#
+# Tudo o que o servidor envia a uma conexão passa pela caixa de saída dela, escrita por uma thread
+# própria (ou pelo event loop, no modo assíncrono). Há dois tipos de saída:
+#
+# - respostas entram na fila em ordem. Uma conexão com mais de `limite` bytes delas esperando, ou
+#   cujo socket não aceitou nada por `prazoTravada` segundos, não está lendo e é derrubada;
+# - o estado enviado por push nunca entra na fila. A caixa só guarda a forma mais recente de gerá-lo
+#   e o gera logo antes de escrever, então um inscrito que ficou para trás recebe um delta com tudo
+#   o que perdeu (ou um snapshot, se o log de mudanças já não vai tão longe) em vez de um acúmulo.
+import asyncio
+import socket
+import threading
+import time
+from collections import deque
+
+from Temporizadores import rodaGlobal
+
+LIMITE_CAIXA = 1024 * 1024  # bytes de respostas que uma conexão pode ter esperando
+PRAZO_TRAVADA = 5.0  # segundos que uma escrita pode ficar bloqueada até o cliente ser tido como parado
+# Sem esta flag (no Windows) toda escrita fica com a thread da caixa
+ENVIO_SEM_ESPERA = getattr(socket, 'MSG_DONTWAIT', None)
+
+
+class CaixaSaida:
+    """Saída de um socket, escrita por uma thread daemon para que nenhuma thread do jogo bloqueie nela."""
+
+    def __init__(self, sock, aoDerrubar=None, limite=LIMITE_CAIXA, prazoTravada=PRAZO_TRAVADA):
+        self.sock = sock
+        self.aoDerrubar = aoDerrubar
+        self.limite = limite
+        self.prazoTravada = prazoTravada
+        self.quadros = deque()
+        self.tamanho = 0
+        self.atualizacao = None  # gera o push de estado pendente, ou None quando não há
+        self.escrevendo = False  # se alguma thread está escrevendo no socket
+        self.enviandoDesde = None  # quando começou a escrita em andamento da thread da caixa
+        self.fechada = False
+        self.pronta = threading.Condition()
+        threading.Thread(target=self._escrever, daemon=True).start()
+
+    def colocar(self, dados):
+        """Enfileira um quadro; levanta ConnectionError se a conexão fechou ou teve de ser derrubada.
+
+        Sem nada esperando, o quadro é escrito na hora, até onde o socket aceitar sem bloquear, o
+        que poupa a passagem pela thread da caixa na maioria das respostas.
+        """
+        with self.pronta:
+            if self.fechada:
+                raise ConnectionError('conexão fechada')
+            if self.tamanho + len(dados) > self.limite or self._travada():
+                self._derrubar()
+            if ENVIO_SEM_ESPERA is None or self.escrevendo or self.quadros or self.atualizacao:
+                self.quadros.append(dados)
+                self.tamanho += len(dados)
+                self.pronta.notify()
+                return
+            self.escrevendo = True
+
+        try:
+            enviados = self.sock.send(dados, ENVIO_SEM_ESPERA)
+        except BlockingIOError:
+            enviados = 0
+        except OSError:
+            # A leitura da conexão também vê a falha e desconecta o jogador
+            enviados = len(dados)
+        with self.pronta:
+            self.escrevendo = False
+            if enviados < len(dados):
+                # O que foi enfileirado enquanto isso veio depois deste quadro
+                self.quadros.appendleft(memoryview(dados)[enviados:])
+                self.tamanho += len(dados) - enviados
+            # Só acorda a thread da caixa quando ela tem o que escrever
+            if self.quadros or self.atualizacao or self.fechada:
+                self.pronta.notify()
+
+    def empurrar(self, atualizacao):
+        """Troca o push de estado ainda não escrito, se houver, por `atualizacao()`, um quadro ou None."""
+        with self.pronta:
+            if self.fechada:
+                raise ConnectionError('conexão fechada')
+            if self._travada():
+                self._derrubar()
+            self.atualizacao = atualizacao
+            self.pronta.notify()
+
+    def fechar(self):
+        """Não aceita mais saída e fecha o socket depois de escrever o que está na fila."""
+        with self.pronta:
+            self.fechada = True
+            escrevendo = self.escrevendo
+            self.pronta.notify()
+        if escrevendo:
+            # Um cliente que parou de ler deixaria a thread da caixa bloqueada para sempre
+            rodaGlobal.agendar(self.prazoTravada, self._encerrarSeEscrevendo)
+
+    def _travada(self):
+        return self.enviandoDesde is not None and time.monotonic() - self.enviandoDesde > self.prazoTravada
+
+    def _derrubar(self):
+        # Chamado com a condição presa; o encerramento também acorda a leitura da conexão
+        self.fechada = True
+        self.quadros.clear()
+        self.tamanho = 0
+        self.atualizacao = None
+        self._encerrar()
+        if self.aoDerrubar:
+            self.aoDerrubar()
+        raise ConnectionError('o cliente não está lendo')
+
+    def _encerrarSeEscrevendo(self):
+        with self.pronta:
+            escrevendo = self.escrevendo
+        if escrevendo:
+            self._encerrar()
+
+    def _encerrar(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def _escrever(self):
+        while True:
+            with self.pronta:
+                while self.escrevendo or not (self.quadros or self.atualizacao or self.fechada):
+                    self.pronta.wait()
+                if not (self.quadros or self.atualizacao):
+                    break
+                quadros, self.quadros, self.tamanho = self.quadros, deque(), 0
+                atualizacao, self.atualizacao = self.atualizacao, None
+                self.escrevendo = True
+                self.enviandoDesde = time.monotonic()
+
+            if atualizacao is not None:
+                dados = atualizacao()
+                if dados:
+                    quadros.append(dados)
+            try:
+                self.sock.sendall(b''.join(quadros))
+            except OSError:
+                with self.pronta:
+                    self.fechada = True
+                    self.quadros.clear()
+                    self.atualizacao = None
+                break
+            with self.pronta:
+                self.escrevendo = False
+                self.enviandoDesde = None
+
+        self._encerrar()
+        self.sock.close()
+
+
+class CaixaSaidaAssincrona:
+    """A mesma caixa de saída sobre um StreamWriter do asyncio; todos os métodos rodam no event loop."""
+
+    def __init__(self, escritor, aoDerrubar=None, limite=LIMITE_CAIXA, prazoTravada=PRAZO_TRAVADA):
+        self.escritor = escritor
+        self.aoDerrubar = aoDerrubar
+        self.limite = limite
+        self.prazoTravada = prazoTravada
+        self.atualizacao = None
+        self.alcancando = False
+        self.fechada = False
+
+    def colocar(self, dados):
+        if self.fechada:
+            raise ConnectionError('conexão fechada')
+        if self.escritor.transport.get_write_buffer_size() + len(dados) > self.limite:
+            self._derrubar()
+        self.escritor.write(dados)
+
+    def empurrar(self, atualizacao):
+        if self.fechada:
+            raise ConnectionError('conexão fechada')
+        self.atualizacao = atualizacao
+        # Sem nada esperando a atualização sai agora; senão, quando o transporte esvaziar
+        if not self.alcancando:
+            if self.escritor.transport.get_write_buffer_size():
+                self.alcancando = True
+                asyncio.get_running_loop().create_task(self._alcancar())
+            else:
+                self._escreverAtualizacao()
+
+    async def esvaziar(self):
+        """Espera o transporte aceitar o que foi escrito; derruba o cliente se demorar demais."""
+        try:
+            await asyncio.wait_for(self.escritor.drain(), self.prazoTravada)
+        except asyncio.TimeoutError:
+            self._derrubar()
+
+    def fechar(self):
+        self.fechada = True
+        self.atualizacao = None
+
+    def _escreverAtualizacao(self):
+        atualizacao, self.atualizacao = self.atualizacao, None
+        dados = atualizacao()
+        if dados:
+            self.escritor.write(dados)
+
+    async def _alcancar(self):
+        try:
+            while self.atualizacao is not None and not self.fechada:
+                await self.esvaziar()
+                if self.atualizacao is not None and not self.fechada:
+                    self._escreverAtualizacao()
+        except ConnectionError:
+            pass
+        finally:
+            self.alcancando = False
+
+    def _derrubar(self):
+        self.fechada = True
+        self.atualizacao = None
+        self.escritor.transport.abort()
+        if self.aoDerrubar:
+            self.aoDerrubar()
+        raise ConnectionError('o cliente não está lendo')
@@ -0,0 +1,150 @@
+# CanalUdp.py - canal UDP opcional para os movimentos, ao lado da conexão TCP de cada jogador.
+#
+# No TCP um segmento perdido segura todos os movimentos enviados depois dele até ser retransmitido.
+# Datagramas não esperam uns pelos outros: um movimento perdido simplesmente some, e um que chega
+# depois de outro mais novo é descartado como velho. Entrar na sala, estado, pontos e todo o resto
+# continuam no TCP.
+#
+# O cliente pede o canal pela sua conexão TCP e recebe a porta e um token:
+#
+#   {'type': 'udp'}  ->  {'status': 'success', 'port': 5001, 'token': 1234...}
+#
+# Os datagramas são structs big-endian:
+#
+#   movimento     I id do jogador, Q token, I sequência (a partir de 1, crescente), B direção
+#   confirmação   I sequência, q versão, B área (0 o mapa, 1 a sala), I x, I y
+#
+# O servidor responde a cada movimento que aplica com uma confirmação com a posição do jogador
+# depois dele e a versão em que ela apareceu, para o cliente acertar sua previsão sem esperar o TCP.
+import asyncio
+import secrets
+import socket
+import struct
+import threading
+
+from CodecBinario import AREAS, CODIGOS_AREA, CODIGOS_DIRECAO, DIRECOES
+
+MOVIMENTO = struct.Struct('!IQIB')
+CONFIRMACAO = struct.Struct('!IqBII')
+
+
+def codificarMovimento(idJogador, token, sequencia, direcao):
+    return MOVIMENTO.pack(idJogador, token, sequencia, CODIGOS_DIRECAO[direcao])
+
+
+def decodificarConfirmacao(dados):
+    """(sequência, versão, área, (x, y)) de uma confirmação, ou None se `dados` não for uma."""
+    if len(dados) != CONFIRMACAO.size:
+        return None
+    sequencia, versao, area, x, y = CONFIRMACAO.unpack(dados)
+    if area >= len(AREAS):
+        return None
+    return sequencia, versao, AREAS[area], (x, y)
+
+
+class CanalUdp:
+    """O lado do servidor: entrega os tokens pelo TCP e transforma datagramas válidos em movimentos."""
+
+    def __init__(self, host, port=0):
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind((host, port))
+        self.port = self.socket.getsockname()[1]
+        self.enviarPara = self.socket.sendto  # o servidor assíncrono envia pelo seu transporte
+        self.tokens = {}  # id do jogador -> token entregue pela conexão TCP dele
+        self.sequencias = {}  # id do jogador -> sequência do último movimento aceito
+        self.trava = threading.Lock()
+
+    def abrir(self, idJogador):
+        """A resposta ao jogador que pede o canal; pedir de novo mantém o mesmo token."""
+        with self.trava:
+            token = self.tokens.get(idJogador)
+            if token is None:
+                token = self.tokens[idJogador] = secrets.randbits(64)
+                self.sequencias[idJogador] = 0
+        return {'status': 'success', 'port': self.port, 'token': token}
+
+    def esquecer(self, idJogador):
+        with self.trava:
+            self.tokens.pop(idJogador, None)
+            self.sequencias.pop(idJogador, None)
+
+    def aceitar(self, dados):
+        """(id do jogador, sequência, direção) de um movimento, ou None se for inválido, forjado ou velho."""
+        if len(dados) != MOVIMENTO.size:
+            return None
+        idJogador, token, sequencia, direcao = MOVIMENTO.unpack(dados)
+        if direcao >= len(DIRECOES):
+            return None
+        with self.trava:
+            # O token prova que quem envia tem a conexão TCP do jogador
+            if self.tokens.get(idJogador) != token or sequencia <= self.sequencias[idJogador]:
+                return None
+            self.sequencias[idJogador] = sequencia
+        return idJogador, sequencia, DIRECOES[direcao]
+
+    def confirmar(self, sequencia, versao, area, posicao, endereco):
+        x, y = posicao
+        try:
+            self.enviarPara(CONFIRMACAO.pack(sequencia, versao, CODIGOS_AREA[area], x, y), endereco)
+        except OSError:
+            pass  # confirmações são tão pouco confiáveis quanto os movimentos; a próxima ou o TCP corrige
+
+    def servir(self, tratar):
+        """Passa cada datagrama para `tratar(dados, endereco)` até o socket ser fechado."""
+        while True:
+            try:
+                dados, endereco = self.socket.recvfrom(512)
+            except ConnectionResetError:
+                continue  # no Windows, o aviso de que uma confirmação anterior não achou o cliente
+            except OSError:
+                return
+            tratar(dados, endereco)
+
+    def fechar(self):
+        self.socket.close()
+
+
+class DatagramasUdp(asyncio.DatagramProtocol):
+    """Entrega os datagramas de um CanalUdp a um servidor rodando num event loop do asyncio."""
+
+    def __init__(self, jogo):
+        self.jogo = jogo
+
+    def connection_made(self, transporte):
+        self.jogo.udp.enviarPara = transporte.sendto
+
+    def datagram_received(self, dados, endereco):
+        self.jogo.tratarDatagrama(dados, endereco)
+
+
+class MovimentosUdp:
+    """O lado do cliente: envia movimentos numerados de um socket próprio e lê as confirmações."""
+
+    def __init__(self, host, port, idJogador, token, tempoLimite=None):
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.settimeout(tempoLimite)
+        self.socket.connect((host, port))  # só os datagramas do servidor passam
+        self.idJogador = idJogador
+        self.token = token
+        self.sequencia = 0
+
+    def mover(self, direcao):
+        """Envia um movimento e retorna o número de sequência, que vem na confirmação dele."""
+        self.sequencia += 1
+        self.socket.send(codificarMovimento(self.idJogador, self.token, self.sequencia, direcao))
+        return self.sequencia
+
+    def receber(self):
+        """A próxima confirmação como (sequência, versão, área, (x, y)), ou None no tempo limite ou com o socket fechado."""
+        while True:
+            try:
+                confirmacao = decodificarConfirmacao(self.socket.recv(512))
+            except ConnectionError:
+                continue  # um datagrama anterior não achou o servidor; movimentos são só tentativas
+            except OSError:
+                return None
+            if confirmacao is not None:
+                return confirmacao
+
+    def fechar(self):
+        self.socket.close()
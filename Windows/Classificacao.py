@@ -0,0 +1,156 @@
+# Classificacao.py - ranking dos jogadores por pontuação, atualizado a cada mudança de pontos
+from bisect import bisect_left, insort
+from itertools import chain, islice
+
+PEDACO = 512  # ids por pedaço de um grupo; um pedaço com mais do que o dobro disso é dividido em dois
+
+
+class IdsOrdenados:
+    """Ids de jogadores em ordem crescente, guardados em pedaços de tamanho limitado.
+
+    Incluir ou retirar um id só desloca o pedaço onde ele cai, e os k primeiros ids são lidos direto
+    do começo, então um grupo com muitos empatados não custa mais do que um pequeno.
+    """
+
+    __slots__ = ('pedacos', 'maiores', 'tamanho')
+
+    def __init__(self):
+        self.pedacos = []  # listas ordenadas de ids, cada uma só com ids acima dos da anterior
+        self.maiores = []  # o último id de cada pedaço, para achar o pedaço de um id
+        self.tamanho = 0
+
+    def __len__(self):
+        return self.tamanho
+
+    def incluir(self, idJogador):
+        if not self.pedacos:
+            self.pedacos.append([idJogador])
+            self.maiores.append(idJogador)
+        else:
+            indice = min(bisect_left(self.maiores, idJogador), len(self.pedacos) - 1)
+            pedaco = self.pedacos[indice]
+            insort(pedaco, idJogador)
+            self.maiores[indice] = pedaco[-1]
+            if len(pedaco) > 2 * PEDACO:
+                self.pedacos[indice:indice + 1] = pedaco[:PEDACO], pedaco[PEDACO:]
+                self.maiores[indice:indice + 1] = pedaco[PEDACO - 1], pedaco[-1]
+        self.tamanho += 1
+
+    def retirar(self, idJogador):
+        indice = bisect_left(self.maiores, idJogador)
+        pedaco = self.pedacos[indice]
+        del pedaco[bisect_left(pedaco, idJogador)]
+        if pedaco:
+            self.maiores[indice] = pedaco[-1]
+        else:
+            del self.pedacos[indice]
+            del self.maiores[indice]
+        self.tamanho -= 1
+
+    def primeiros(self, k):
+        return islice(chain.from_iterable(self.pedacos), k)
+
+
+class Classificacao:
+    """Jogadores ordenados pela pontuação, mantidos em dia uma mudança de pontos por vez.
+
+    Uma árvore de Fenwick conta os jogadores em cada pontuação, então a posição de um jogador e
+    a k-ésima maior pontuação custam O(log P) passos (P é a maior pontuação), não importa quantos
+    jogadores haja. Empatados dividem a posição e são listados pelo id, cada grupo deles mantido
+    em ordem de id para que listar os k melhores leia só k ids.
+    """
+
+    __slots__ = ('pontos', 'grupos', 'arvore', 'capacidade')
+
+    def __init__(self, capacidade=64):
+        self.pontos = {}  # id do jogador -> pontuação
+        self.grupos = {}  # pontuação -> ids dos jogadores com ela
+        self.capacidade = capacidade  # sempre uma potência de dois, para a descida em _pontuacaoNa
+        self.arvore = [0] * (capacidade + 1)
+
+    def __len__(self):
+        return len(self.pontos)
+
+    def __contains__(self, idJogador):
+        return idJogador in self.pontos
+
+    def _contar(self, pontuacao, delta):
+        if pontuacao >= self.capacidade:
+            self._crescer(pontuacao)
+        indice = pontuacao + 1
+        while indice <= self.capacidade:
+            self.arvore[indice] += delta
+            indice += indice & -indice
+
+    def _crescer(self, pontuacao):
+        while self.capacidade <= pontuacao:
+            self.capacidade *= 2
+        self.arvore = [0] * (self.capacidade + 1)
+        for pontuacaoGrupo, grupo in self.grupos.items():
+            indice = pontuacaoGrupo + 1
+            while indice <= self.capacidade:
+                self.arvore[indice] += len(grupo)
+                indice += indice & -indice
+
+    def _contarAte(self, pontuacao):
+        """Quantos jogadores têm no máximo `pontuacao` pontos."""
+        indice, total = min(pontuacao + 1, self.capacidade), 0
+        while indice > 0:
+            total += self.arvore[indice]
+            indice -= indice & -indice
+        return total
+
+    def _pontuacaoNa(self, posicao):
+        """A pontuação do `posicao`-ésimo jogador contando da menor pontuação (a partir de 1)."""
+        indice, passo = 0, self.capacidade
+        while passo:
+            if indice + passo <= self.capacidade and self.arvore[indice + passo] < posicao:
+                indice += passo
+                posicao -= self.arvore[indice]
+            passo //= 2
+        return indice
+
+    def atualizar(self, idJogador, pontuacao):
+        """Define a pontuação do jogador, incluindo-o se ainda não estiver na classificação."""
+        antiga = self.pontos.get(idJogador)
+        if antiga == pontuacao:
+            return
+        if antiga is not None:
+            self._sair(idJogador, antiga)
+        # Contado antes de entrar no grupo, já que crescer a árvore reconta os grupos
+        self._contar(pontuacao, 1)
+        self.pontos[idJogador] = pontuacao
+        grupo = self.grupos.get(pontuacao)
+        if grupo is None:
+            grupo = self.grupos[pontuacao] = IdsOrdenados()
+        grupo.incluir(idJogador)
+
+    def remover(self, idJogador):
+        pontuacao = self.pontos.pop(idJogador, None)
+        if pontuacao is not None:
+            self._sair(idJogador, pontuacao)
+
+    def _sair(self, idJogador, pontuacao):
+        grupo = self.grupos[pontuacao]
+        grupo.retirar(idJogador)
+        if not grupo:
+            del self.grupos[pontuacao]
+        self._contar(pontuacao, -1)
+
+    def posicao(self, idJogador):
+        """1 mais o número de jogadores com mais pontos, ou None para quem não está na classificação."""
+        pontuacao = self.pontos.get(idJogador)
+        if pontuacao is None:
+            return None
+        return len(self.pontos) - self._contarAte(pontuacao) + 1
+
+    def melhores(self, k):
+        """Os `k` melhores jogadores como (posição, id, pontuação), do primeiro em diante."""
+        ranking = []
+        posicao = 1
+        while len(ranking) < k and posicao <= len(self.pontos):
+            pontuacao = self._pontuacaoNa(len(self.pontos) - posicao + 1)
+            grupo = self.grupos[pontuacao]
+            ranking.extend((posicao, idJogador, pontuacao) for idJogador in grupo.primeiros(k - len(ranking)))
+            posicao += len(grupo)
+        return ranking
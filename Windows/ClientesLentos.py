@@ -0,0 +1,114 @@
+# ClientesLentos.py - confere que clientes que não leem não conseguem atrasar os outros.
+#
+# Sobe um servidor e roda os robôs do Benchmark ao lado de dois clientes mal-comportados: um envia
+# movimentos sem parar e nunca lê as respostas, o outro se inscreve para o estado por push e nunca
+# o lê. A latência dos robôs deve ficar perto da que eles têm sozinhos; um cliente mal-comportado é
+# derrubado quando os buffers do socket e depois a caixa de saída dele enchem ou travam (veja CaixaSaida.py).
+#
+# Uso: python ClientesLentos.py [--motor threads asyncio ticks] [--jogadores 20] [--duracao 10]
+import argparse
+import socket
+import threading
+
+from Benchmark import ProcessoServidor, percentil, portaLivre, rodarRobos
+from Protocolo import LeitorMensagens, codificarMensagem, enviarMensagem
+
+LOTE_INUNDACAO = 64  # movimentos que o inundador escreve de uma vez
+
+
+def conectar(porta):
+    cliente = socket.create_connection(('localhost', porta))
+    leitor = LeitorMensagens(cliente)
+    leitor.receber()  # o id do jogador
+    return cliente, leitor
+
+
+def inundar(porta, parar, enviados):
+    """Envia movimentos o mais rápido que o socket aceita e não lê nada, contando-os em `enviados[0]`.
+
+    Um servidor que parou de ler deixa a última escrita bloqueada, então a contagem é feita durante o envio.
+    """
+    cliente, _ = conectar(porta)
+    lote = b''.join(codificarMensagem({'type': 'move', 'direction': direcao})
+                    for direcao in ('up', 'left', 'down', 'right') * (LOTE_INUNDACAO // 4))
+    try:
+        while not parar.is_set():
+            cliente.sendall(lote)
+            enviados[0] += LOTE_INUNDACAO
+    except OSError:
+        pass
+    finally:
+        cliente.close()
+
+
+def travar(porta, parar):
+    """Se inscreve e nunca lê o que é enviado."""
+    cliente, _ = conectar(porta)
+    enviarMensagem(cliente, {'type': 'subscribe'})
+    parar.wait()
+    cliente.close()
+
+
+def estatisticasServidor(porta):
+    cliente, leitor = conectar(porta)
+    with cliente:
+        enviarMensagem(cliente, {'type': 'stats'})
+        return leitor.receber()['stats']
+
+
+def medir(motor, argumentos, malComportados):
+    porta = portaLivre()
+    servidor = ProcessoServidor(motor, porta, argumentos.jogadores + 3, argumentos.tamanho_mapa, argumentos.tesouros)
+    parar = threading.Event()
+    inundados = [0]
+    try:
+        servidor.esperarPronto()
+        threads = []
+        if malComportados:
+            threads = [threading.Thread(target=inundar, args=(porta, parar, inundados), daemon=True),
+                       threading.Thread(target=travar, args=(porta, parar), daemon=True)]
+        for thread in threads:
+            thread.start()
+        latencias, comandos, erros, _ = rodarRobos(porta, argumentos.jogadores, 'aleatoria', argumentos.duracao,
+                                                   argumentos.taxa / argumentos.jogadores)
+        parar.set()
+        for thread in threads:
+            thread.join(timeout=5)
+        estatisticas = estatisticasServidor(porta)
+    finally:
+        parar.set()
+        servidor.parar()
+
+    latencias.sort()
+    return {
+        'comandos': comandos,
+        'erros': erros,
+        'p50_ms': (percentil(latencias, 0.5) or 0) * 1000,
+        'p99_ms': (percentil(latencias, 0.99) or 0) * 1000,
+        'inundados': inundados[0],
+        'agrupados': estatisticas.get('merged_moves'),
+        'derrubados': estatisticas.get('dropped_connections')
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Latência de clientes bem-comportados ao lado de clientes que não leem')
+    parser.add_argument('--motor', nargs='+', choices=['threads', 'asyncio', 'ticks'], default=['threads'])
+    parser.add_argument('--jogadores', type=int, default=20)
+    parser.add_argument('--taxa', type=float, default=400, help='comandos por segundo somando todos os robôs')
+    parser.add_argument('--duracao', type=float, default=10, help='segundos de carga por execução')
+    parser.add_argument('--tamanho-mapa', type=int, default=64)
+    parser.add_argument('--tesouros', type=int, default=1000)
+    argumentos = parser.parse_args()
+
+    for motor in argumentos.motor:
+        sozinhos = medir(motor, argumentos, malComportados=False)
+        juntos = medir(motor, argumentos, malComportados=True)
+        print(f"{motor:>8}: robôs sozinhos p50 {sozinhos['p50_ms']:.2f}ms p99 {sozinhos['p99_ms']:.2f}ms; "
+              f"com clientes lentos p50 {juntos['p50_ms']:.2f}ms p99 {juntos['p99_ms']:.2f}ms, {juntos['erros']} erros")
+        print(f"{'':>8}  o inundador enviou {juntos['inundados']} movimentos, {juntos['agrupados']} respondidos juntos; "
+              f"{juntos['derrubados']} clientes derrubados por não lerem")
+
+
+if __name__ == "__main__":
+    main()
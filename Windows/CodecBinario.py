@@ -0,0 +1,257 @@
+# CodecBinario.py - forma binária compacta das mensagens mais frequentes, negociada por conexão
+#
+# JSON continua sendo o padrão, e toda mensagem sem forma binária abaixo continua indo em JSON,
+# então uma captura fica legível a não ser que o cliente peça o contrário com
+#
+#   {'type': 'codec', 'codec': 'binary'}
+#
+# O servidor passa então a enviar confirmações de movimento, estados e deltas em binário. Os comandos
+# podem ir de qualquer forma a qualquer momento: um conteúdo binário começa com um byte de opcode
+# abaixo de 0x20, coisa que um texto JSON nunca faz, então cada quadro diz como está codificado.
+# Números são big-endian; id de pedido 0 quer dizer que a mensagem não tem 'id'. Área 0 é o mapa, 1 a sala.
+#
+#   move        B op, B direção, I id do pedido
+#   enter_room  B op, I id do pedido
+#   get_state   B op, I id do pedido, q since (SEM_DESDE quando ausente)
+#   confirmação B op, I id do pedido, q versão
+#   estado      B op, I id do pedido, q versão (-1 para a resposta de estado simples), I tamanho do mapa,
+#               I tamanho da sala, I tesouros restantes, I jogadores, B tem visão;
+#               com visão: B área, I x, I y, I linhas, I colunas e as células do quadrado em bytes;
+#               sem: as células do mapa e as da sala em bytes. Depois um registro por jogador
+#   delta       B op, I id do pedido, q from, q versão, I mudanças, e um registro por mudança
+import base64
+import struct
+
+JSON = 'json'
+BINARIO = 'binary'
+CODECS = (JSON, BINARIO)
+
+OP_MOVE, OP_ENTER_ROOM, OP_GET_STATE, OP_CONFIRMACAO, OP_ESTADO, OP_DELTA = range(1, 7)
+MUDANCA_CELULA, MUDANCA_JOGADOR, MUDANCA_REMOCAO, MUDANCA_CONTADORES, MUDANCA_AREA = range(1, 6)
+
+DIRECOES = ('up', 'down', 'left', 'right')
+CODIGOS_DIRECAO = {direcao: codigo for codigo, direcao in enumerate(DIRECOES)}
+AREAS = ('map', 'room')
+CODIGOS_AREA = {area: codigo for codigo, area in enumerate(AREAS)}
+SEM_DESDE = -2 ** 63
+ESTADO_SIMPLES = -1
+
+MOVE = struct.Struct('!BBI')
+ENTER_ROOM = struct.Struct('!BI')
+GET_STATE = struct.Struct('!BIq')
+CONFIRMACAO = struct.Struct('!BIq')
+ESTADO = struct.Struct('!BIqIIIIB')
+VISAO = struct.Struct('!BIIII')  # área, x, y, linhas, colunas
+JOGADOR = struct.Struct('!IIIIB')  # id, x, y, pontos, na sala
+DELTA = struct.Struct('!BIqqI')
+REGISTRO_CELULA = struct.Struct('!BIBIIB')  # op, v, área, x, y, valor
+REGISTRO_JOGADOR = struct.Struct('!BIIIIIB')  # op, v, id, x, y, pontos, na sala
+REGISTRO_REMOCAO = struct.Struct('!BII')  # op, v, id
+REGISTRO_CONTADORES = struct.Struct('!BII')  # op, v, tesouros restantes
+REGISTRO_AREA = struct.Struct('!BIBIIII')  # op, v, área, x, y, linhas, colunas, depois as células
+
+CHAVES_ESTADO = {'map', 'map_size', 'room', 'room_size', 'jogadores', 'treasures_left'}
+CHAVES_ESTADO_VISAO = {'view', 'map_size', 'room_size', 'jogadores', 'treasures_left'}
+
+
+def ehBinaria(conteudo):
+    return len(conteudo) > 0 and conteudo[0] in DECODIFICADORES
+
+
+def _celulas(dados):
+    # O servidor guarda as células em base64 para as respostas JSON; o binário leva os bytes
+    return base64.b64decode(dados) if isinstance(dados, str) else bytes(dados)
+
+
+def _idPedido(mensagem, chaves):
+    """O id de pedido da mensagem (0 se não tiver), conferindo que ela não tem chaves além de `chaves`."""
+    if not mensagem.keys() - {'id'} <= chaves:
+        raise KeyError('sem forma binária')
+    idPedido = mensagem.get('id', 0)
+    if 'id' in mensagem and (type(idPedido) is not int or idPedido < 1):
+        raise TypeError('ids de pedido em binário são inteiros positivos')
+    return idPedido
+
+
+def codificarBinaria(mensagem):
+    """O conteúdo binário de `mensagem`, ou None quando ela não tem forma binária e vai em JSON."""
+    if not isinstance(mensagem, dict):
+        return None
+    try:
+        tipo = mensagem.get('type')
+        if tipo == 'move':
+            return MOVE.pack(OP_MOVE, CODIGOS_DIRECAO[mensagem['direction']],
+                             _idPedido(mensagem, {'type', 'direction'}))
+        if tipo == 'enter_room':
+            return ENTER_ROOM.pack(OP_ENTER_ROOM, _idPedido(mensagem, {'type'}))
+        if tipo == 'get_state':
+            return GET_STATE.pack(OP_GET_STATE, _idPedido(mensagem, {'type', 'since'}), mensagem.get('since', SEM_DESDE))
+        if tipo == 'state':
+            return _codificarEstado(_idPedido(mensagem, {'type', 'version', 'state'}), mensagem['version'], mensagem['state'])
+        if tipo == 'delta':
+            return _codificarDelta(mensagem)
+        if tipo is None and mensagem.get('status') == 'success' and 'version' in mensagem and 'id' in mensagem:
+            return CONFIRMACAO.pack(OP_CONFIRMACAO, _idPedido(mensagem, {'status', 'version'}), mensagem['version'])
+        if tipo is None and 'map' in mensagem:
+            return _codificarEstado(_idPedido(mensagem, CHAVES_ESTADO), ESTADO_SIMPLES, mensagem)
+    except (KeyError, TypeError, ValueError, struct.error):
+        pass
+    return None
+
+
+def _codificarEstado(idPedido, versao, estado):
+    chaves = estado.keys() - {'id'}
+    if chaves != CHAVES_ESTADO and chaves != CHAVES_ESTADO_VISAO:
+        raise KeyError('sem forma binária')
+    visao = estado.get('view')
+    jogadores = estado['jogadores']
+    partes = [ESTADO.pack(OP_ESTADO, idPedido, versao, estado['map_size'], estado['room_size'],
+                          estado['treasures_left'], len(jogadores), visao is not None)]
+    if visao is None:
+        mapa, sala = _celulas(estado['map']), _celulas(estado['room'])
+        if len(mapa) != estado['map_size'] ** 2 or len(sala) != estado['room_size'] ** 2:
+            raise ValueError('mapa ou sala não batem com o tamanho')
+        partes += [mapa, sala]
+    else:
+        celulas = _celulas(visao['cells'])
+        if len(celulas) != visao['rows'] * visao['cols']:
+            raise ValueError('visão não bate com o tamanho')
+        partes += [VISAO.pack(CODIGOS_AREA[visao['area']], visao['x'], visao['y'], visao['rows'], visao['cols']), celulas]
+    for idJogador, jogador in jogadores.items():
+        x, y = jogador['position']
+        partes.append(JOGADOR.pack(int(idJogador), x, y, jogador['score'], jogador['naSala']))
+    return b''.join(partes)
+
+
+def _codificarDelta(mensagem):
+    mudancas = mensagem['changes']
+    partes = [DELTA.pack(OP_DELTA, _idPedido(mensagem, {'type', 'from', 'version', 'changes'}),
+                         mensagem['from'], mensagem['version'], len(mudancas))]
+    for mudanca in mudancas:
+        op = mudanca['op']
+        if op == 'cell':
+            partes.append(REGISTRO_CELULA.pack(MUDANCA_CELULA, mudanca['v'], CODIGOS_AREA[mudanca['area']],
+                                               mudanca['x'], mudanca['y'], mudanca['value']))
+        elif op == 'player':
+            x, y = mudanca['position']
+            partes.append(REGISTRO_JOGADOR.pack(MUDANCA_JOGADOR, mudanca['v'], int(mudanca['id']), x, y,
+                                                mudanca['score'], mudanca['naSala']))
+        elif op == 'remove':
+            partes.append(REGISTRO_REMOCAO.pack(MUDANCA_REMOCAO, mudanca['v'], int(mudanca['id'])))
+        elif op == 'counters':
+            partes.append(REGISTRO_CONTADORES.pack(MUDANCA_CONTADORES, mudanca['v'], mudanca['treasures_left']))
+        elif op == 'area':
+            celulas = _celulas(mudanca['cells'])
+            if len(celulas) != mudanca['rows'] * mudanca['cols']:
+                raise ValueError('área não bate com o tamanho')
+            partes += [REGISTRO_AREA.pack(MUDANCA_AREA, mudanca['v'], CODIGOS_AREA[mudanca['area']], mudanca['x'],
+                                          mudanca['y'], mudanca['rows'], mudanca['cols']), celulas]
+        else:
+            raise KeyError(op)
+    return b''.join(partes)
+
+
+def _marcar(mensagem, idPedido):
+    if idPedido:
+        mensagem['id'] = idPedido
+    return mensagem
+
+
+def _decodificarMove(conteudo):
+    _, direcao, idPedido = MOVE.unpack_from(conteudo)
+    return _marcar({'type': 'move', 'direction': DIRECOES[direcao]}, idPedido)
+
+
+def _decodificarEnterRoom(conteudo):
+    _, idPedido = ENTER_ROOM.unpack_from(conteudo)
+    return _marcar({'type': 'enter_room'}, idPedido)
+
+
+def _decodificarGetState(conteudo):
+    _, idPedido, desde = GET_STATE.unpack_from(conteudo)
+    mensagem = {'type': 'get_state'}
+    if desde != SEM_DESDE:
+        mensagem['since'] = desde
+    return _marcar(mensagem, idPedido)
+
+
+def _decodificarConfirmacao(conteudo):
+    _, idPedido, versao = CONFIRMACAO.unpack_from(conteudo)
+    return _marcar({'status': 'success', 'version': versao}, idPedido)
+
+
+def _decodificarEstado(conteudo):
+    _, idPedido, versao, tamanhoMapa, tamanhoSala, restantes, quantos, temVisao = ESTADO.unpack_from(conteudo)
+    posicao = ESTADO.size
+    estado = {'map_size': tamanhoMapa, 'room_size': tamanhoSala}
+    if temVisao:
+        area, x, y, linhas, colunas = VISAO.unpack_from(conteudo, posicao)
+        posicao += VISAO.size
+        estado['view'] = {'area': AREAS[area], 'x': x, 'y': y, 'rows': linhas, 'cols': colunas,
+                          'cells': bytes(conteudo[posicao:posicao + linhas * colunas])}
+        posicao += linhas * colunas
+    else:
+        estado['map'] = bytes(conteudo[posicao:posicao + tamanhoMapa * tamanhoMapa])
+        posicao += tamanhoMapa * tamanhoMapa
+        estado['room'] = bytes(conteudo[posicao:posicao + tamanhoSala * tamanhoSala])
+        posicao += tamanhoSala * tamanhoSala
+
+    jogadores = {}
+    for idJogador, x, y, pontos, naSala in JOGADOR.iter_unpack(conteudo[posicao:posicao + quantos * JOGADOR.size]):
+        jogadores[str(idJogador)] = {'position': [x, y], 'score': pontos, 'naSala': bool(naSala)}
+    estado.update(jogadores=jogadores, treasures_left=restantes)
+
+    if versao == ESTADO_SIMPLES:
+        return _marcar(estado, idPedido)
+    return _marcar({'type': 'state', 'version': versao, 'state': estado}, idPedido)
+
+
+def _decodificarDelta(conteudo):
+    _, idPedido, desde, versao, quantas = DELTA.unpack_from(conteudo)
+    posicao = DELTA.size
+    mudancas = []
+    for _ in range(quantas):
+        op = conteudo[posicao]
+        if op == MUDANCA_CELULA:
+            _, v, area, x, y, valor = REGISTRO_CELULA.unpack_from(conteudo, posicao)
+            posicao += REGISTRO_CELULA.size
+            mudancas.append({'op': 'cell', 'area': AREAS[area], 'x': x, 'y': y, 'value': valor, 'v': v})
+        elif op == MUDANCA_JOGADOR:
+            _, v, idJogador, x, y, pontos, naSala = REGISTRO_JOGADOR.unpack_from(conteudo, posicao)
+            posicao += REGISTRO_JOGADOR.size
+            mudancas.append({'op': 'player', 'id': str(idJogador), 'position': [x, y], 'score': pontos,
+                             'naSala': bool(naSala), 'v': v})
+        elif op == MUDANCA_REMOCAO:
+            _, v, idJogador = REGISTRO_REMOCAO.unpack_from(conteudo, posicao)
+            posicao += REGISTRO_REMOCAO.size
+            mudancas.append({'op': 'remove', 'id': str(idJogador), 'v': v})
+        elif op == MUDANCA_CONTADORES:
+            _, v, restantes = REGISTRO_CONTADORES.unpack_from(conteudo, posicao)
+            posicao += REGISTRO_CONTADORES.size
+            mudancas.append({'op': 'counters', 'treasures_left': restantes, 'v': v})
+        elif op == MUDANCA_AREA:
+            _, v, area, x, y, linhas, colunas = REGISTRO_AREA.unpack_from(conteudo, posicao)
+            posicao += REGISTRO_AREA.size
+            mudancas.append({'op': 'area', 'area': AREAS[area], 'x': x, 'y': y, 'rows': linhas, 'cols': colunas,
+                             'cells': bytes(conteudo[posicao:posicao + linhas * colunas]), 'v': v})
+            posicao += linhas * colunas
+        else:
+            raise ValueError(f'Mudança desconhecida {op}')
+    return _marcar({'type': 'delta', 'from': desde, 'version': versao, 'changes': mudancas}, idPedido)
+
+
+DECODIFICADORES = {
+    OP_MOVE: _decodificarMove,
+    OP_ENTER_ROOM: _decodificarEnterRoom,
+    OP_GET_STATE: _decodificarGetState,
+    OP_CONFIRMACAO: _decodificarConfirmacao,
+    OP_ESTADO: _decodificarEstado,
+    OP_DELTA: _decodificarDelta
+}
+
+
+def decodificarBinaria(conteudo):
+    try:
+        return DECODIFICADORES[conteudo[0]](conteudo)
+    except (IndexError, struct.error) as e:
+        raise ValueError(f'Mensagem binária malformada: {e}') from e
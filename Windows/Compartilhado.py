@@ -0,0 +1,199 @@
+# Compartilhado.py - estado do jogo em memória compartilhada, para vários processos servirem uma partida.
+#
+# O bloco guarda, na ordem de bytes nativa e com alinhamento natural:
+#
+#   contadores     8 int64: tesouros coletados, versão, sala ocupada, jogador na sala, vagas em uso,
+#                  último id de jogador entregue, jogadores na tabela
+#   jogadores      uma linha por vaga, no formato de Jogadores.py; id 0 marca vaga livre
+#   ocupacaoMapa   um int32 por célula do mapa: quantos jogadores estão nela
+#   ocupacaoSala   um int32 por célula da sala do tesouro
+#   celulasMapa    um byte por célula do mapa
+#   celulasSala    um byte por célula da sala
+#
+# As células são protegidas por travas listradas (cada trava do multiprocessing cobre todas as
+# regiões cujo índice cai nela), então o número de semáforos não cresce com o mapa. Sala,
+# contadores e versão têm travas próprias.
+import multiprocessing
+from multiprocessing import shared_memory
+
+from Jogadores import CAMPOS_JOGADOR, ID, RegistroJogador
+
+COLETADOS, VERSAO, SALA_OCUPADA, JOGADOR_NA_SALA, VAGAS, ULTIMO_ID, JOGADORES = range(7)
+CONTADORES = 8
+
+
+class EstadoCompartilhado:
+    """Estado compartilhado da partida; criado uma vez pelo pai e entregue a cada processo trabalhador."""
+
+    def __init__(self, tamanhoMapa, celulasMapa, tamanhoSala, celulasSala, posicaoSala, tesourosTotais,
+                 tamanhoRegiao, semente, listras=64):
+        self.tamanhoMapa = tamanhoMapa
+        self.semente = semente  # a semente da partida, de onde cada processo tira a das suas entradas
+        self.tamanhoSala = tamanhoSala
+        self.posicaoSala = posicaoSala
+        self.tesourosTotais = tesourosTotais
+        self.tamanhoRegiao = tamanhoRegiao
+        self.capacidade = tamanhoMapa * tamanhoMapa
+
+        regioesPorLinha = -(-tamanhoMapa // tamanhoRegiao)
+        self.listras = [multiprocessing.Lock() for _ in range(min(listras, regioesPorLinha * regioesPorLinha))]
+        self.travas = {nome: multiprocessing.Lock() for nome in ('area_sala', 'sala', 'contadores', 'log')}
+
+        self.memoria = shared_memory.SharedMemory(create=True, size=self._tamanho())
+        self._mapear()
+        self.celulasMapa[:] = celulasMapa
+        self.celulasSala[:] = celulasSala
+
+    def _tamanho(self):
+        celulasSala = self.tamanhoSala * self.tamanhoSala
+        return (CONTADORES * 8 + self.capacidade * CAMPOS_JOGADOR * 8
+                + (self.capacidade + celulasSala) * 4 + self.capacidade + celulasSala)
+
+    def _mapear(self):
+        buffer = self.memoria.buf
+        celulasSala = self.tamanhoSala * self.tamanhoSala
+        inicio, fim = 0, CONTADORES * 8
+        self.contadores = buffer[inicio:fim].cast('q')
+        inicio, fim = fim, fim + self.capacidade * CAMPOS_JOGADOR * 8
+        self.jogadores = buffer[inicio:fim].cast('q')
+        inicio, fim = fim, fim + self.capacidade * 4
+        self.ocupacaoMapa = buffer[inicio:fim].cast('i')
+        inicio, fim = fim, fim + celulasSala * 4
+        self.ocupacaoSala = buffer[inicio:fim].cast('i')
+        inicio, fim = fim, fim + self.capacidade
+        self.celulasMapa = buffer[inicio:fim]
+        self.celulasSala = buffer[fim:fim + celulasSala]
+
+    def __getstate__(self):
+        # Visões não podem ser serializadas; o trabalhador mapeia o bloco de novo pelo nome
+        estado = self.__dict__.copy()
+        for visao in ('contadores', 'jogadores', 'ocupacaoMapa', 'ocupacaoSala', 'celulasMapa', 'celulasSala'):
+            del estado[visao]
+        return estado
+
+    def __setstate__(self, estado):
+        self.__dict__.update(estado)
+        self._mapear()
+
+    def terminou(self):
+        return self.contadores[COLETADOS] >= self.tesourosTotais
+
+    def fechar(self):
+        for visao in (self.contadores, self.jogadores, self.ocupacaoMapa, self.ocupacaoSala,
+                      self.celulasMapa, self.celulasSala):
+            visao.release()
+        self.memoria.close()
+
+    def remover(self):
+        self.memoria.unlink()
+
+
+class ContadorCompartilhado:
+    """Atributo guardado nos contadores compartilhados, então todo processo lê e escreve o mesmo valor."""
+
+    def __init__(self, indice):
+        self.indice = indice
+
+    def __get__(self, jogo, dono=None):
+        if jogo is None:
+            return self
+        return jogo.estado.contadores[self.indice]
+
+    def __set__(self, jogo, valor):
+        jogo.estado.contadores[self.indice] = valor
+
+
+class IdsCompartilhados:
+    """Ids de jogador de uma partida servida por vários processos, tirados de um contador compartilhado
+    para dois processos nunca darem o mesmo id. Os ids não são reaproveitados, as vagas da tabela sim."""
+
+    def __init__(self, estado, trava):
+        self.estado = estado
+        self.trava = trava
+
+    def alocar(self):
+        with self.trava:
+            self.estado.contadores[ULTIMO_ID] += 1
+            return self.estado.contadores[ULTIMO_ID]
+
+    def liberar(self, idJogador):
+        pass
+
+
+class JogadoresCompartilhados:
+    """A tabela compartilhada de jogadores vista como um dict de id do jogador -> registro.
+
+    Só o processo que adicionou um jogador mexe nele, então cada processo guarda as vagas dos
+    seus jogadores; procurar os dos outros percorre as vagas em uso. Quem adiciona segura todas
+    as travas de região, então duas entradas nunca disputam a mesma vaga. Quem sai só segura a
+    trava da sua região, então a contagem compartilhada de jogadores muda com a `trava` dos contadores.
+    """
+
+    def __init__(self, estado, trava):
+        self.estado = estado
+        self.trava = trava
+        self.tabela = estado.jogadores
+        self.vagas = {}
+
+    def _procurar(self, idJogador):
+        vaga = self.vagas.get(idJogador)
+        if vaga is not None:
+            return vaga
+        for vaga in range(self.estado.contadores[VAGAS]):
+            if self.tabela[vaga * CAMPOS_JOGADOR + ID] == idJogador:
+                return vaga
+        return None
+
+    def __contains__(self, idJogador):
+        return self._procurar(idJogador) is not None
+
+    def get(self, idJogador, padrao=None):
+        vaga = self._procurar(idJogador)
+        return padrao if vaga is None else RegistroJogador(self.tabela, vaga)
+
+    def __getitem__(self, idJogador):
+        vaga = self._procurar(idJogador)
+        if vaga is None:
+            raise KeyError(idJogador)
+        return RegistroJogador(self.tabela, vaga)
+
+    def cheio(self):
+        return self.estado.contadores[JOGADORES] >= self.estado.capacidade
+
+    def __setitem__(self, idJogador, jogador):
+        emUso = self.estado.contadores[VAGAS]
+        vaga = emUso
+        # Só uma tabela com buracos é percorrida atrás de uma vaga livre
+        if self.estado.contadores[JOGADORES] < emUso:
+            vaga = next(vaga for vaga in range(emUso) if not self.tabela[vaga * CAMPOS_JOGADOR + ID])
+        if vaga == emUso:
+            self.estado.contadores[VAGAS] = emUso + 1
+
+        registro = RegistroJogador(self.tabela, vaga)
+        registro['position'] = jogador['position']
+        registro['score'] = jogador['score']
+        registro['naSala'] = jogador['naSala']
+        # Escrito por último, para ninguém ver o id ao lado de uma linha pela metade
+        self.tabela[vaga * CAMPOS_JOGADOR + ID] = idJogador
+        self.vagas[idJogador] = vaga
+        with self.trava:
+            self.estado.contadores[JOGADORES] += 1
+
+    def __delitem__(self, idJogador):
+        vaga = self.vagas.pop(idJogador)
+        self.tabela[vaga * CAMPOS_JOGADOR + ID] = 0
+        with self.trava:
+            self.estado.contadores[JOGADORES] -= 1
+
+    def items(self):
+        for vaga in range(self.estado.contadores[VAGAS]):
+            idJogador = self.tabela[vaga * CAMPOS_JOGADOR + ID]
+            if idJogador:
+                yield idJogador, RegistroJogador(self.tabela, vaga)
+
+    def __len__(self):
+        return self.estado.contadores[JOGADORES]
+
+    def snapshot(self):
+        return {idJogador: {'position': jogador['position'], 'score': jogador['score'], 'naSala': jogador['naSala']}
+                for idJogador, jogador in self.items()}
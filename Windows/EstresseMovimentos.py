@@ -0,0 +1,81 @@
+# EstresseMovimentos.py - muitas threads movendo jogadores ao mesmo tempo;
+# no final a contagem de tesouros e pontos tem que bater exatamente.
+#
+# Uso: python EstresseMovimentos.py [--threads 32] [--movimentos 2000]
+import argparse
+import random
+import sys
+import threading
+
+from Grade import SALA_TESOURO
+from Jogo import Jogo
+
+
+def totaisTesouros(grade):
+    valores = [valor for valor in grade.celulas if 0 < valor < SALA_TESOURO]
+    return len(valores), sum(valores)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Teste de estresse de movimentos concorrentes')
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--movimentos', type=int, default=2000)
+    parser.add_argument('--tamanho-mapa', type=int, default=64)
+    parser.add_argument('--tesouros', type=int, default=2000)
+    parser.add_argument('--tamanho-regiao', type=int, default=8)
+    argumentos = parser.parse_args()
+
+    # Troca de thread o mais rápido possível para provocar corridas
+    sys.setswitchinterval(1e-6)
+
+    jogo = Jogo(port=0, tamanhoMapa=argumentos.tamanho_mapa, numeroTesouros=argumentos.tesouros,
+                tamanhoRegiao=argumentos.tamanho_regiao)
+    jogo._agendarSaidaSala = lambda idJogador: None  # a saída é feita pela thread da sala abaixo
+    contagemMapa, pontosMapa = totaisTesouros(jogo.mapa)
+    contagemSala, pontosSala = totaisTesouros(jogo.salaTesouro)
+
+    moventes = list(range(1, argumentos.threads + 1))
+    for idJogador in moventes:
+        jogo.adicionarJogador(idJogador)
+
+    # Um jogador extra que entra e sai da sala enquanto os outros se movem
+    idSala = argumentos.threads + 1
+    jogo.jogadores[idSala] = {'position': jogo.posicaoSala, 'score': 0, 'naSala': False}
+    jogo._ocupar(idSala)
+
+    def moverAleatorio(idJogador):
+        for _ in range(argumentos.movimentos):
+            jogo.moverJogador(idJogador, random.choice(['up', 'down', 'left', 'right']))
+
+    def saquearSala():
+        for _ in range(argumentos.movimentos // 10):
+            jogo.entrarSalaTesouro(idSala)
+            for _ in range(10):
+                jogo.moverJogador(idSala, random.choice(['down', 'right']))
+            jogo.sairSalaTesouro(idSala)
+
+    threads = [threading.Thread(target=moverAleatorio, args=(idJogador,)) for idJogador in moventes]
+    threads.append(threading.Thread(target=saquearSala))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    contagemMapaFinal, pontosMapaFinal = totaisTesouros(jogo.mapa)
+    contagemSalaFinal, pontosSalaFinal = totaisTesouros(jogo.salaTesouro)
+    pontos = sum(jogador['score'] for jogador in jogo.jogadores.values())
+    coletadosEsperados = (contagemMapa - contagemMapaFinal) + (contagemSala - contagemSalaFinal)
+    pontosEsperados = (pontosMapa - pontosMapaFinal) + (pontosSala - pontosSalaFinal)
+
+    print(f"{jogo.tesourosColetados} tesouros coletados (esperado {coletadosEsperados})")
+    print(f"{pontos} pontos (esperado {pontosEsperados})")
+    jogo.socketServidor.close()
+
+    if jogo.tesourosColetados != coletadosEsperados or pontos != pontosEsperados:
+        print("FALHA: a contagem de tesouros não bate")
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
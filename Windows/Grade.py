@@ -0,0 +1,112 @@
+# Grade.py - mapa compacto guardado em um único bytearray
+import base64
+import random
+from array import array
+
+# Códigos das células: 0 é célula vazia, 1-253 é um tesouro com esse valor
+VAZIA = 0
+SALA_TESOURO = 254
+FECHADA = 255
+
+SIMBOLOS = {VAZIA: ".", SALA_TESOURO: "X", FECHADA: "#"}
+
+
+def simbolo(valor):
+    return SIMBOLOS.get(valor) or str(valor)
+
+
+class Grade:
+    """Mapa quadrado em um bytearray contínuo, um byte por célula (linha a linha)."""
+
+    __slots__ = ('tamanho', 'celulas')
+
+    def __init__(self, tamanho, celulas=None):
+        self.tamanho = tamanho
+        self.celulas = celulas if celulas is not None else bytearray(tamanho * tamanho)
+
+    def __getitem__(self, posicao):
+        x, y = posicao
+        return self.celulas[x * self.tamanho + y]
+
+    def __setitem__(self, posicao, valor):
+        x, y = posicao
+        self.celulas[x * self.tamanho + y] = valor
+
+    def indice(self, x, y):
+        return x * self.tamanho + y
+
+    def posicao(self, indice):
+        return divmod(indice, self.tamanho)
+
+    def temTesouro(self, x, y):
+        return VAZIA < self.celulas[x * self.tamanho + y] < SALA_TESOURO
+
+    def vazia(self):
+        return not any(self.celulas)
+
+    def preencher(self, valor):
+        self.celulas[:] = bytes([valor]) * len(self.celulas)
+
+    def linha(self, x):
+        return self.celulas[x * self.tamanho:(x + 1) * self.tamanho]
+
+    def codificar(self):
+        return base64.b64encode(self.celulas).decode('ascii')
+
+    @classmethod
+    def decodificar(cls, tamanho, dados):
+        # O JSON leva as células em base64, o codec binário leva os bytes
+        return cls(tamanho, bytearray(base64.b64decode(dados) if isinstance(dados, str) else dados))
+
+    def codificarArea(self, x, y, linhas, colunas):
+        """Codifica o bloco linhas x colunas cujo canto superior esquerdo é (x, y)."""
+        inicio = x * self.tamanho + y
+        return base64.b64encode(b''.join(
+            self.celulas[inicio + linha * self.tamanho:inicio + linha * self.tamanho + colunas] for linha in range(linhas)
+        )).decode('ascii')
+
+    def carregarArea(self, x, y, linhas, colunas, dados):
+        """Escreve de volta em (x, y) um bloco gerado por codificarArea (ou os bytes dele)."""
+        celulas = base64.b64decode(dados) if isinstance(dados, str) else dados
+        inicio = x * self.tamanho + y
+        for linha in range(linhas):
+            self.celulas[inicio + linha * self.tamanho:inicio + linha * self.tamanho + colunas] = celulas[linha * colunas:(linha + 1) * colunas]
+
+
+class ConjuntoCelulas:
+    """Conjunto de índices de células com add, discard e sorteio em O(1).
+
+    Usa dois arrays de inteiros, então continua compacto mesmo em mapas enormes.
+    """
+
+    __slots__ = ('celulas', 'posicoes')
+
+    def __init__(self, capacidade, celulas=()):
+        self.celulas = array('l', celulas)
+        self.posicoes = array('l', [-1]) * capacidade
+        for posicao, celula in enumerate(self.celulas):
+            self.posicoes[celula] = posicao
+
+    def __len__(self):
+        return len(self.celulas)
+
+    def __contains__(self, celula):
+        return self.posicoes[celula] >= 0
+
+    def add(self, celula):
+        if self.posicoes[celula] < 0:
+            self.posicoes[celula] = len(self.celulas)
+            self.celulas.append(celula)
+
+    def discard(self, celula):
+        posicao = self.posicoes[celula]
+        if posicao < 0:
+            return
+        self.posicoes[celula] = -1
+        ultima = self.celulas.pop()
+        if posicao < len(self.celulas):
+            self.celulas[posicao] = ultima
+            self.posicoes[ultima] = posicao
+
+    def sortear(self, aleatorio=random):
+        return self.celulas[aleatorio.randrange(len(self.celulas))]
@@ -0,0 +1,73 @@
+# Gravacao.py - gravação dos comandos de uma partida, na ordem em que foram aplicados, para repeti-la offline.
+#
+# A gravação é um arquivo JSON-lines. A primeira linha descreve a partida, cada linha seguinte é um
+# comando como [segundos desde o início, id do jogador, comando] e a última traz um resumo do estado final:
+#
+#   {"seed": 1234, "map_size": 64, "num_treasures": 1000, "region_size": 4}
+#   [0.0012, 3, {"type": "join"}]
+#   [0.0153, 3, {"type": "move", "direction": "up", "id": 1}]
+#   [10.0161, 3, {"type": "leave_room"}]
+#   [12.5017, 3, {"type": "leave"}]
+#   {"final": "9f86d0...", "version": 812}
+#
+# Um servidor com semente monta o mesmo mapa e a mesma sala e sorteia as mesmas células para os
+# jogadores, então os mesmos comandos na mesma ordem terminam no mesmo estado (veja Reproducao.py).
+# Entradas, saídas e o fim do prazo na sala são gravados como os pseudo-comandos acima porque
+# decidem onde os próximos jogadores aparecem e quem usa a sala.
+import hashlib
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+ENTRAR = 'join'
+SAIR = 'leave'
+SAIR_SALA = 'leave_room'
+
+
+def resumoEstado(jogo):
+    """Hash de tudo o que o estado da partida guarda, para conferir se duas execuções terminaram iguais."""
+    snapshot = jogo.obterSnapshot()
+    return hashlib.sha256(json.dumps(snapshot, sort_keys=True).encode()).hexdigest(), snapshot['version']
+
+
+def carregarGravacao(caminho):
+    """Retorna o cabeçalho, as entradas [tempo, id do jogador, comando] e a linha final (None se faltar)."""
+    entradas, final = [], None
+    with open(caminho) as arquivo:
+        cabecalho = json.loads(arquivo.readline())
+        for linha in arquivo:
+            try:
+                registro = json.loads(linha)
+            except ValueError:
+                break  # o servidor parou no meio de uma escrita
+            if isinstance(registro, dict):
+                final = registro
+                break
+            entradas.append(registro)
+    return cabecalho, entradas, final
+
+
+class Gravador:
+    def __init__(self, caminho, cabecalho):
+        self.arquivo = open(caminho, 'w')
+        self.arquivo.write(json.dumps(cabecalho) + '\n')
+        self.trava = threading.Lock()
+        self.inicio = time.monotonic()
+
+    @contextmanager
+    def entrada(self, idJogador, comando):
+        """Grava um comando e segura os outros até ele ser aplicado, para o log ter a ordem em que o jogo os aplicou."""
+        with self.trava:
+            if self.arquivo:
+                decorrido = round(time.monotonic() - self.inicio, 6)
+                self.arquivo.write(json.dumps([decorrido, idJogador, comando]) + '\n')
+            yield
+
+    def fechar(self, jogo):
+        with self.trava:
+            if self.arquivo:
+                resumo, versao = resumoEstado(jogo)
+                self.arquivo.write(json.dumps({'final': resumo, 'version': versao}) + '\n')
+                self.arquivo.close()
+                self.arquivo = None
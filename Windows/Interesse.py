@@ -0,0 +1,265 @@
+# Interesse.py - filtro por área de interesse: o cliente só recebe a parte do jogo perto do jogador.
+#
+# O cliente pede isso ao se inscrever com um raio de visão:
+#
+#   {'type': 'subscribe', 'view': 8}
+#
+# Ele recebe então o snapshot do quadrado de lado 2 * view + 1 em volta do jogador (cortado nas
+# bordas), na área onde o jogador está (o mapa, ou a sala do tesouro), e deltas só com o que
+# acontece dentro desse quadrado:
+#
+#   {'op': 'area', 'area', 'x', 'y', 'rows', 'cols', 'cells'}   células que o quadrado descobre ao andar
+#   {'op': 'player', ...}                                      jogador andando dentro, ou entrando nele
+#   {'op': 'remove', 'id'}                                     jogador saindo do quadrado, ou do jogo
+#
+# Os observadores ficam indexados pelas regiões que o quadrado cobre, então uma mudança só custa
+# os observadores que podem vê-la, não importa quantos jogadores a partida tenha.
+import socket
+import threading
+
+
+def descobertas(nova, antiga):
+    """Divide a parte da janela `nova` fora da janela `antiga` em até quatro retângulos."""
+    if antiga is None or nova[0] != antiga[0]:
+        return [nova]
+    area, novoTopo, novaEsquerda, novaBase, novaDireita = nova
+    _, antigoTopo, antigaEsquerda, antigaBase, antigaDireita = antiga
+    if antigoTopo > novaBase or antigaBase < novoTopo or antigaEsquerda > novaDireita or antigaDireita < novaEsquerda:
+        return [nova]
+
+    partes = []
+    if novoTopo < antigoTopo:
+        partes.append((area, novoTopo, novaEsquerda, antigoTopo - 1, novaDireita))
+    if novaBase > antigaBase:
+        partes.append((area, antigaBase + 1, novaEsquerda, novaBase, novaDireita))
+    topo, base = max(novoTopo, antigoTopo), min(novaBase, antigaBase)
+    if novaEsquerda < antigaEsquerda:
+        partes.append((area, topo, novaEsquerda, base, antigaEsquerda - 1))
+    if novaDireita > antigaDireita:
+        partes.append((area, topo, antigaDireita + 1, base, novaDireita))
+    return partes
+
+
+class Observador:
+    """Um inscrito que só vê o quadrado de células em volta do próprio jogador."""
+
+    __slots__ = ('idJogador', 'conexao', 'raio', 'janela', 'regioes', 'visiveis', 'pendentes', 'versao', 'trava')
+
+    def __init__(self, idJogador, conexao, raio):
+        self.idJogador = idJogador
+        self.conexao = conexao
+        self.raio = raio
+        self.janela = None  # (area, topo, esquerda, base, direita), inclusive
+        self.regioes = ()
+        self.visiveis = set()  # ids dos jogadores de que este observador sabe
+        self.pendentes = []  # mudanças ainda não enviadas
+        self.versao = 0  # versão do último delta ou snapshot enviado
+        self.trava = threading.Lock()  # mantém as mensagens deste observador em ordem
+
+    def ve(self, area, x, y):
+        areaJanela, topo, esquerda, base, direita = self.janela
+        return area == areaJanela and topo <= x <= base and esquerda <= y <= direita
+
+
+class Interesse:
+    """Os observadores de um jogo, e a entrega das mudanças dele a cada um.
+
+    Tudo menos `despachar` roda com a trava do log do jogo presa, então os observadores veem as
+    mudanças na ordem das versões.
+    """
+
+    def __init__(self, jogo):
+        self.jogo = jogo
+        self.observadores = {}  # id do jogador -> observador
+        self.regioes = {}  # (área, índice da região) -> observadores cujo quadrado a cobre
+        self.vigias = {}  # id do jogador (str) -> observadores que sabem dele
+        self.sujos = set()  # observadores com mudanças pendentes
+
+    def _tamanho(self, area):
+        return self.jogo.tamanhoSala if area == 'room' else self.jogo.tamanhoMapa
+
+    def _janela(self, jogador, raio):
+        area = 'room' if jogador['naSala'] else 'map'
+        x, y = jogador['position']
+        ultima = self._tamanho(area) - 1
+        return (area, max(0, x - raio), max(0, y - raio), min(ultima, x + raio), min(ultima, y + raio))
+
+    def _regiao(self, area, x, y):
+        tamanhoRegiao = self.jogo.tamanhoRegiao
+        porLinha = -(-self._tamanho(area) // tamanhoRegiao)
+        return (area, (x // tamanhoRegiao) * porLinha + y // tamanhoRegiao)
+
+    def _moverJanela(self, observador, janela):
+        area, topo, esquerda, base, direita = janela
+        tamanhoRegiao = self.jogo.tamanhoRegiao
+        regioes = [self._regiao(area, x, y)
+                   for x in range(topo - topo % tamanhoRegiao, base + 1, tamanhoRegiao)
+                   for y in range(esquerda - esquerda % tamanhoRegiao, direita + 1, tamanhoRegiao)]
+        if regioes != observador.regioes:
+            for regiao in observador.regioes:
+                self.regioes[regiao].discard(observador)
+            for regiao in regioes:
+                self.regioes.setdefault(regiao, set()).add(observador)
+            observador.regioes = regioes
+        observador.janela = janela
+
+    def _candidatos(self, area, x, y):
+        return self.regioes.get(self._regiao(area, x, y), ())
+
+    def _enfileirar(self, observador, mudanca):
+        observador.pendentes.append(mudanca)
+        self.sujos.add(observador)
+
+    def _mostrar(self, observador, idJogador, mudanca):
+        self._enfileirar(observador, mudanca)
+        if idJogador not in observador.visiveis:
+            observador.visiveis.add(idJogador)
+            self.vigias.setdefault(idJogador, set()).add(observador)
+
+    def _esquecer(self, observador, idJogador):
+        observador.visiveis.discard(idJogador)
+        vigias = self.vigias.get(idJogador)
+        if vigias:
+            vigias.discard(observador)
+            if not vigias:
+                del self.vigias[idJogador]
+
+    def _jogadoresEm(self, janela):
+        """Gera (id, jogador) para todos que estão dentro da `janela`."""
+        jogo = self.jogo
+        area, topo, esquerda, base, direita = janela
+        for x in range(topo, base + 1):
+            for y in range(esquerda, direita + 1):
+                for idJogador in tuple(jogo.jogadoresEm(area, x, y)):
+                    jogador = jogo.jogadores.get(idJogador)
+                    if jogador:
+                        yield str(idJogador), jogador
+
+    def adicionar(self, idJogador, conexao, raio):
+        observador = Observador(idJogador, conexao, raio)
+        self.observadores[idJogador] = observador
+        return observador
+
+    def remover(self, idJogador):
+        observador = self.observadores.pop(idJogador, None)
+        if observador is None:
+            return
+        for regiao in observador.regioes:
+            self.regioes[regiao].discard(observador)
+        for idVisivel in list(observador.visiveis):
+            self._esquecer(observador, idVisivel)
+        self.sujos.discard(observador)
+
+    def snapshot(self, observador):
+        """Recomeça o observador do quadrado em volta do jogador e retorna a mensagem de estado."""
+        jogo = self.jogo
+        jogador = jogo.jogadores.get(observador.idJogador) or {'position': (0, 0), 'naSala': False}
+        self._moverJanela(observador, self._janela(jogador, observador.raio))
+        for idVisivel in list(observador.visiveis):
+            self._esquecer(observador, idVisivel)
+        observador.pendentes = []
+        observador.versao = jogo.versao
+
+        jogadores = {}
+        for idJogador, jogador in self._jogadoresEm(observador.janela):
+            jogadores[idJogador] = {'position': jogador['position'], 'score': jogador['score'], 'naSala': jogador['naSala']}
+            observador.visiveis.add(idJogador)
+            self.vigias.setdefault(idJogador, set()).add(observador)
+
+        area, topo, esquerda, base, direita = observador.janela
+        linhas, colunas = base - topo + 1, direita - esquerda + 1
+        grade = jogo.salaTesouro if area == 'room' else jogo.mapa
+        return {'type': 'state', 'version': jogo.versao, 'state': {
+            'map_size': jogo.tamanhoMapa,
+            'room_size': jogo.tamanhoSala,
+            'view': {'area': area, 'x': topo, 'y': esquerda, 'rows': linhas, 'cols': colunas,
+                     'cells': grade.codificarArea(topo, esquerda, linhas, colunas)},
+            'jogadores': jogadores,
+            'treasures_left': jogo.tesourosTotais - jogo.tesourosColetados
+        }}
+
+    def versaoConfirmacao(self, observador):
+        """A versão em que um movimento confirmado agora aparece, nas versões que este observador recebe."""
+        # O que está pendente sai com a versão atual; sem nada pendente o observador já está em dia
+        return self.jogo.versao if observador.pendentes else observador.versao
+
+    def distribuir(self, mudancas):
+        """Enfileira cada mudança registrada para os observadores que podem vê-la."""
+        for mudanca in mudancas:
+            op = mudanca['op']
+            if op == 'cell':
+                area, x, y = mudanca['area'], mudanca['x'], mudanca['y']
+                for observador in self._candidatos(area, x, y):
+                    if observador.ve(area, x, y):
+                        self._enfileirar(observador, mudanca)
+            elif op == 'player':
+                self._distribuirJogador(mudanca)
+            elif op == 'remove':
+                for observador in list(self.vigias.get(mudanca['id'], ())):
+                    self._enfileirar(observador, mudanca)
+                    self._esquecer(observador, mudanca['id'])
+            else:
+                # Os contadores valem para o jogo todo
+                for observador in self.observadores.values():
+                    self._enfileirar(observador, mudanca)
+
+    def _distribuirJogador(self, mudanca):
+        idJogador = mudanca['id']
+        area = 'room' if mudanca['naSala'] else 'map'
+        x, y = mudanca['position']
+        proprio = self.observadores.get(int(idJogador))
+        if proprio is not None:
+            self._recentrar(proprio, mudanca)
+
+        for observador in set(self._candidatos(area, x, y)) | self.vigias.get(idJogador, set()):
+            if observador.ve(area, x, y):
+                self._mostrar(observador, idJogador, mudanca)
+            elif idJogador in observador.visiveis:
+                self._enfileirar(observador, {'op': 'remove', 'id': idJogador, 'v': mudanca['v']})
+                self._esquecer(observador, idJogador)
+
+    def _recentrar(self, observador, mudanca):
+        """Move o quadrado do observador: envia as células e jogadores descobertos e tira os que ficaram de fora."""
+        antiga = observador.janela
+        self._moverJanela(observador, self._janela(mudanca, observador.raio))
+        if observador.janela == antiga:
+            return
+
+        jogo, versao = self.jogo, mudanca['v']
+        for idVisivel in list(observador.visiveis):
+            jogador = jogo.jogadores.get(int(idVisivel))
+            if jogador is None or not observador.ve('room' if jogador['naSala'] else 'map', *jogador['position']):
+                self._enfileirar(observador, {'op': 'remove', 'id': idVisivel, 'v': versao})
+                self._esquecer(observador, idVisivel)
+
+        for janela in descobertas(observador.janela, antiga):
+            area, topo, esquerda, base, direita = janela
+            linhas, colunas = base - topo + 1, direita - esquerda + 1
+            grade = jogo.salaTesouro if area == 'room' else jogo.mapa
+            self._enfileirar(observador, {'op': 'area', 'area': area, 'x': topo, 'y': esquerda, 'rows': linhas,
+                                          'cols': colunas, 'cells': grade.codificarArea(topo, esquerda, linhas, colunas),
+                                          'v': versao})
+            for idJogador, jogador in self._jogadoresEm(janela):
+                self._mostrar(observador, idJogador, {'op': 'player', 'id': idJogador, 'position': jogador['position'],
+                                                      'score': jogador['score'], 'naSala': jogador['naSala'], 'v': versao})
+
+    def despachar(self):
+        """Envia a cada observador com mudanças pendentes um delta com elas. Chamado sem a trava do log."""
+        if not self.sujos:
+            return
+        jogo = self.jogo
+        with jogo.travaLog:
+            sujos, self.sujos = self.sujos, set()
+
+        for observador in sujos:
+            with observador.trava:
+                with jogo.travaLog:
+                    mudancas, observador.pendentes = observador.pendentes, []
+                    desde, observador.versao = observador.versao, jogo.versao
+                if not mudancas:
+                    continue
+                delta = {'type': 'delta', 'from': desde, 'version': observador.versao, 'changes': mudancas}
+                try:
+                    jogo.enviarPara(observador.idJogador, observador.conexao, jogo.codificarPara(observador.idJogador, delta))
+                except (socket.error, KeyError):
+                    jogo.cancelarInscricao(observador.idJogador)
@@ -1,22 +1,51 @@
 # Jogador.py corrigido
+import argparse
 import socket
-import json
 import msvcrt
 import threading
 import time
 import signal
 from colorama import init, Fore, Style
 import sys
+from collections import deque
+from CanalUdp import MovimentosUdp
+from CodecBinario import CODECS, JSON
+from Grade import Grade, simbolo
+from Protocolo import Conexao, LeitorMensagens, enviarMensagem
+
+MOVIMENTOS = {'up': (-1, 0), 'down': (1, 0), 'left': (0, -1), 'right': (0, 1)}
+LIMITE_CONFIRMACAO_UDP = 0.5  # um movimento enviado por UDP e não confirmado até lá é dado como perdido
 
 class Jogador:
-    def __init__(self, host='localhost', port=5000):
+    def __init__(self, host='localhost', port=5000, partida=None, visao=None, codec=JSON, usarUdp=False):
         self.host = host
         self.port = port
+        self.partida = partida  # id da partida, ou 'nova', ao conectar por um lobby
+        self.visao = visao  # só acompanha as células até essa distância do jogador, para mapas muito grandes
+        self.codec = codec  # como o servidor deve codificar o que envia; JSON é mais fácil de depurar
+        self.usarUdp = usarUdp  # envia os movimentos por datagramas, para um pacote perdido não segurar os próximos
+        self.udp = None
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.leitor = LeitorMensagens(self.socket)
+        self.conexao = None
         self.idJogador = None
         self.estadoJogo = None
+        self.versao = -1
+        self.ressincronizando = False
+        self.mensagemStatus = ''
+        self.estadoMudou = threading.Event()
         self.ativo = True
-        self.ultimaRenderizacao = ""
+        # Modelo local da tela: o que está desenhado e o que mudou desde então, para redesenhar só as mudanças
+        self.travaEstado = threading.Lock()
+        self.ocupantes = {}  # (área, x, y) -> ids dos jogadores ali
+        self.celulasSujas = set()
+        self.redesenharTudo = True
+        self.janelaDesenhada = None
+        self.statusDesenhado = [None] * 3
+        self.euDesenhado = None
+        # Movimentos enviados que o servidor ainda não mostrou: [id do pedido, direção, versão que o mostra];
+        # os enviados por UDP têm (sequência, hora do envio) no lugar do id do pedido
+        self.movimentosPendentes = deque()
         init(autoreset=True)
 
         signal.signal(signal.SIGINT, self._tratadorSinal)
@@ -24,64 +53,316 @@ class Jogador:
 
     def _tratadorSinal(self, signum, frame):
         self.ativo = False
+        self.estadoMudou.set()
 
     def limparTela(self):
-        sys.stdout.write("\033[H")
+        sys.stdout.write("\033[2J\033[H")
         sys.stdout.flush()
 
     def conectar(self):
         try:
             self.socket.connect((self.host, self.port))
-            self.idJogador = int(self.socket.recv(1024).decode())
+            if self.partida is not None and not self.entrarPartida():
+                return False
+            resposta = self.leitor.receber()
+            if isinstance(resposta, dict):
+                print(f"Conexão recusada: {resposta.get('message')}")
+                return False
+            self.idJogador = int(resposta)
+            self.conexao = Conexao(self.socket, self.leitor)
             return True
-        except socket.error as e:
+        except (socket.error, TypeError, ValueError) as e:
             print(f"Erro de conexão: {e}")
             return False
 
+    def entrarPartida(self):
+        partida = self.partida
+        if partida == 'nova':
+            enviarMensagem(self.socket, {'type': 'create_match'})
+            resposta = self.leitor.receber()
+            if not resposta or resposta.get('status') != 'success':
+                print(f"Não foi possível criar a partida: {resposta and resposta.get('message')}")
+                return False
+            partida = resposta['match']
+        enviarMensagem(self.socket, {'type': 'join_match', 'match': int(partida)})
+        return True
+
     def enviarComando(self, comando):
-        try:
-            self.socket.send(json.dumps(comando).encode())
-            resposta = self.socket.recv(1024).decode()
-            return json.loads(resposta)
-        except (socket.error, json.JSONDecodeError) as e:
-            print(f"Erro de comunicação: {e}")
-            self.ativo = False
+        # Nunca espera a resposta, que volta para tratarResposta pela thread de leitura
+        return self.conexao.pedir(comando, self.tratarResposta)
+
+    def mover(self, direcao):
+        # Aparece na hora; o estado do servidor alcança uma ida e volta depois
+        with self.travaEstado:
+            if self.udp:
+                idPedido = (self.udp.mover(direcao), time.monotonic())
+            else:
+                idPedido = self.enviarComando({'type': 'move', 'direction': direcao})
+            self.movimentosPendentes.append([idPedido, direcao, None])
+        self.estadoMudou.set()
+
+    def abrirUdp(self, resposta):
+        if resposta.get('status') != 'success':
+            with self.travaEstado:
+                self.mensagemStatus = f"Movimentos continuam no TCP: {resposta.get('message')}"
+            self.estadoMudou.set()
+            return
+        self.udp = MovimentosUdp(self.host, resposta['port'], self.idJogador, resposta['token'], LIMITE_CONFIRMACAO_UDP)
+        threading.Thread(target=self.lerConfirmacoes, daemon=True).start()
+
+    def lerConfirmacoes(self):
+        while self.ativo:
+            confirmacao = self.udp.receber()
+            with self.travaEstado:
+                agora = time.monotonic()
+                for pendente in self.movimentosPendentes:
+                    if not isinstance(pendente[0], tuple) or pendente[2] is not None:
+                        continue
+                    sequencia, enviadoEm = pendente[0]
+                    if confirmacao is not None and sequencia <= confirmacao[0]:
+                        # Movimentos anteriores sem confirmação foram aplicados antes deste ou descartados
+                        # como velhos; nos dois casos o estado do servidor na versão confirmada os resolve
+                        pendente[2] = confirmacao[1]
+                    elif agora - enviadoEm > LIMITE_CONFIRMACAO_UDP:
+                        pendente[2] = self.versao
+                self.descartarConfirmados()
+            self.estadoMudou.set()
+
+    def tratarMensagem(self, mensagem):
+        # O servidor envia o estado sempre que ele muda, então não há mais polling
+        with self.travaEstado:
+            self.aplicarMensagem(mensagem)
+        self.estadoMudou.set()
+
+    def tratarResposta(self, mensagem):
+        with self.travaEstado:
+            for pendente in self.movimentosPendentes:
+                if pendente[0] == mensagem['id']:
+                    pendente[2] = mensagem.get('version', -1)
+                    if mensagem.get('status') == 'error':
+                        # Os movimentos depois de um recusado foram previstos a partir do lugar errado
+                        self.movimentosPendentes.clear()
+                    break
+            self.aplicarMensagem(mensagem)
+        self.estadoMudou.set()
+
+    def aplicarMensagem(self, mensagem):
+        if mensagem.get('type') == 'state':
+            self.carregarEstado(mensagem)
+        elif mensagem.get('type') == 'delta':
+            self.aplicarDelta(mensagem)
+        elif 'leaderboard' in mensagem:
+            self.mensagemStatus = self.linhaClassificacao(mensagem)
+        elif 'message' in mensagem:
+            self.mensagemStatus = mensagem['message']
+        self.descartarConfirmados()
+
+    def descartarConfirmados(self):
+        # Movimentos que o estado do servidor já mostra deixam de ser previstos
+        pendentes = self.movimentosPendentes
+        while pendentes and pendentes[0][2] is not None and pendentes[0][2] <= self.versao:
+            pendentes.popleft()
+
+    @staticmethod
+    def linhaClassificacao(mensagem):
+        melhores = '  '.join(f"{colocado['rank']}º {colocado['id']} ({colocado['score']})" for colocado in mensagem['leaderboard'])
+        return f"Você é o {mensagem['rank']}º de {mensagem['players']} | {melhores}"
+
+    def conexaoFechada(self, erro):
+        if erro:
+            print(f"Erro de comunicação: {erro}")
+        self.ativo = False
+        self.estadoMudou.set()
+
+    def carregarEstado(self, mensagem):
+        estado = mensagem['state']
+        if 'view' in estado:
+            # Só veio o quadrado em volta do jogador; o resto fica desconhecido até ele chegar perto
+            visao = estado.pop('view')
+            estado['map'] = Grade(estado['map_size'])
+            estado['room'] = Grade(estado['room_size'])
+            estado[visao['area']].carregarArea(visao['x'], visao['y'], visao['rows'], visao['cols'], visao['cells'])
+        else:
+            estado['map'] = Grade.decodificar(estado['map_size'], estado['map'])
+            estado['room'] = Grade.decodificar(estado['room_size'], estado['room'])
+        self.estadoJogo = estado
+        self.versao = mensagem['version']
+        self.ressincronizando = False
+
+        self.ocupantes = {}
+        for pid, dados in estado['jogadores'].items():
+            self.ocupantes.setdefault(self._chaveCelula(dados), set()).add(pid)
+        self.redesenharTudo = True
+
+    @staticmethod
+    def _chaveCelula(dados):
+        x, y = dados['position']
+        return ('room' if dados.get('naSala') else 'map', x, y)
+
+    def _posicionarJogador(self, idJogador, dados):
+        """Move a marca do jogador para onde `dados` diz (None a tira) e suja as duas células."""
+        antigo = self.estadoJogo['jogadores'].get(idJogador)
+        if antigo is not None:
+            chave = self._chaveCelula(antigo)
+            ocupantes = self.ocupantes.get(chave)
+            if ocupantes:
+                ocupantes.discard(idJogador)
+                if not ocupantes:
+                    del self.ocupantes[chave]
+            self.celulasSujas.add(chave)
+        if dados is not None:
+            chave = self._chaveCelula(dados)
+            self.ocupantes.setdefault(chave, set()).add(idJogador)
+            self.celulasSujas.add(chave)
+
+    def aplicarDelta(self, delta):
+        if self.estadoJogo is None or delta['from'] > self.versao:
+            # Perdeu alguma atualização, pede tudo depois da última versão conhecida
+            if not self.ressincronizando:
+                self.ressincronizando = True
+                self.enviarComando({'type': 'get_state', 'since': self.versao})
+            return
+
+        self.ressincronizando = False
+        # Mudanças feitas para uma visão (células ou jogadores entrando nela) têm a versão que as causou
+        conhecida = self.versao
+        for mudanca in delta['changes']:
+            if mudanca['v'] <= conhecida:
+                continue
+
+            op = mudanca['op']
+            if op == 'cell':
+                self.estadoJogo[mudanca['area']][mudanca['x'], mudanca['y']] = mudanca['value']
+                self.celulasSujas.add((mudanca['area'], mudanca['x'], mudanca['y']))
+            elif op == 'area':
+                area, x, y, linhas, colunas = mudanca['area'], mudanca['x'], mudanca['y'], mudanca['rows'], mudanca['cols']
+                self.estadoJogo[area].carregarArea(x, y, linhas, colunas, mudanca['cells'])
+                self.celulasSujas.update((area, i, j) for i in range(x, x + linhas) for j in range(y, y + colunas))
+            elif op == 'player':
+                dados = {
+                    'position': mudanca['position'],
+                    'score': mudanca['score'],
+                    'naSala': mudanca['naSala']
+                }
+                self._posicionarJogador(mudanca['id'], dados)
+                self.estadoJogo['jogadores'][mudanca['id']] = dados
+            elif op == 'remove':
+                self._posicionarJogador(mudanca['id'], None)
+                self.estadoJogo['jogadores'].pop(mudanca['id'], None)
+            elif op == 'counters':
+                self.estadoJogo['treasures_left'] = mudanca['treasures_left']
+        self.versao = max(conhecida, delta['version'])
+
+    def areaAtual(self):
+        # Mostra a sala do tesouro enquanto o jogador está nela, senão o mapa
+        jogador = self.estadoJogo['jogadores'].get(str(self.idJogador), {})
+        return 'room' if jogador.get('naSala', False) else 'map'
+
+    def janela(self):
+        """A parte da área atual na tela, (área, topo, esquerda, linhas, colunas): toda ela, ou a visão em volta do jogador."""
+        area = self.areaAtual()
+        tamanho = self.estadoJogo[area].tamanho
+        jogador = self.estadoJogo['jogadores'].get(str(self.idJogador))
+        if not self.visao or jogador is None:
+            return (area, 0, 0, tamanho, tamanho)
+        x, y = jogador['position']
+        topo, esquerda = max(0, x - self.visao), max(0, y - self.visao)
+        return (area, topo, esquerda, min(tamanho, x + self.visao + 1) - topo, min(tamanho, y + self.visao + 1) - esquerda)
+    def posicaoExibida(self):
+        """Onde o jogador é desenhado: a posição no servidor mais os movimentos ainda a caminho."""
+        jogador = self.estadoJogo['jogadores'].get(str(self.idJogador))
+        if jogador is None:
             return None
+        area, x, y = self._chaveCelula(jogador)
+        ultima = self.estadoJogo[area].tamanho - 1
+        for _, direcao, _ in self.movimentosPendentes:
+            dx, dy = MOVIMENTOS[direcao]
+            novoX, novoY = min(max(x + dx, 0), ultima), min(max(y + dy, 0), ultima)
+            # O servidor recusa casas ocupadas, então a previsão também não entra nelas
+            if not self.ocupantes.get((area, novoX, novoY), set()) - {str(self.idJogador)}:
+                x, y = novoX, novoY
+        return (area, x, y)
+
+    def celulaVisivel(self, area, x, y):
+        # Marca os jogadores (P = você, J = outros) por cima da célula
+        if (area, x, y) == self.euDesenhado:
+            return 'P'
+        if self.ocupantes.get((area, x, y), set()) - {str(self.idJogador)}:
+            return 'J'
+        return simbolo(self.estadoJogo[area][x, y])
 
-    def atualizarEstadoJogo(self):
-        resposta = self.enviarComando({'type': 'get_state'})
-        if resposta:
-            self.estadoJogo = resposta
+    @staticmethod
+    def formatarCelula(celula):
+        if celula.isdigit():
+            return Fore.YELLOW + celula + Style.RESET_ALL
+        if celula == 'X':
+            return Fore.CYAN + celula + Style.RESET_ALL
+        return celula
 
-    def gerarBufferTela(self):
-        if not self.estadoJogo:
-            return ""
+    def linhasStatus(self):
+        jogador = self.estadoJogo['jogadores'].get(str(self.idJogador), {})
+        return [
+            f"Pontuação: {Fore.GREEN}{jogador.get('score', 0)}{Style.RESET_ALL} | Tesouros restantes: {Fore.YELLOW}{self.estadoJogo['treasures_left']}{Style.RESET_ALL}",
+            "Controles: WASD/Setas para mover, E para entrar na sala, L para a classificação, Q para sair",
+            self.mensagemStatus
+        ]
 
+    def gerarBufferTela(self, janela):
+        area, topo, esquerda, linhas, colunas = janela
         buffer = [Fore.YELLOW + "=== CAÇA AO TESOURO ===" + Style.RESET_ALL]
-        buffer.append("   " + " ".join(str(i) for i in range(len(self.estadoJogo['map'][0]))))
-
-        for i, linha in enumerate(self.estadoJogo['map']):
-            linhaTexto = f"{i:2} "
-            for celula in linha:
-                if celula.isdigit():
-                    linhaTexto += Fore.YELLOW + celula + " " + Style.RESET_ALL
-                elif celula == 'X':
-                    linhaTexto += Fore.CYAN + celula + " " + Style.RESET_ALL
-                else:
-                    linhaTexto += celula + " "
-            buffer.append(linhaTexto)
+        buffer.append("   " + " ".join(str((esquerda + i) % 10) for i in range(colunas)))
 
-        jogador = self.estadoJogo['jogadores'].get(str(self.idJogador), {})
-        buffer.append(f"Pontuação: {Fore.GREEN}{jogador.get('score', 0)}{Style.RESET_ALL} | Tesouros restantes: {Fore.YELLOW}{self.estadoJogo['treasures_left']}{Style.RESET_ALL}")
-        buffer.append("Controles: WASD/Setas para mover, E para entrar na sala, Q para sair")
+        for x in range(topo, topo + linhas):
+            celulas = (self.formatarCelula(self.celulaVisivel(area, x, y)) for y in range(esquerda, esquerda + colunas))
+            buffer.append(f"{x % 100:2} " + " ".join(celulas))
+
+        buffer.extend(self.linhasStatus())
         return "\n".join(buffer)
 
     def desenharTela(self):
-        novaRenderizacao = self.gerarBufferTela()
-        if novaRenderizacao != self.ultimaRenderizacao:
-            self.limparTela()
-            print(novaRenderizacao)
-            self.ultimaRenderizacao = novaRenderizacao
+        """Redesenha só as células e linhas de status que mudaram desde o último quadro.
+
+        O cursor é posicionado com sequências ANSI (o colorama as traduz no console do Windows):
+        a linha x da janela fica na linha 3 + x da tela e a coluna y na coluna 4 + 2 * y.
+        """
+        with self.travaEstado:
+            if not self.estadoJogo:
+                return
+
+            # Com uma visão a tela rola junto com o jogador
+            janela = self.janela()
+            area, topo, esquerda, linhas, colunas = janela
+            eu = self.posicaoExibida()
+            if eu != self.euDesenhado:
+                self.celulasSujas.update(chave for chave in (self.euDesenhado, eu) if chave)
+                self.euDesenhado = eu
+
+            if self.redesenharTudo or janela != self.janelaDesenhada:
+                self.redesenharTudo = False
+                self.janelaDesenhada = janela
+                self.celulasSujas.clear()
+                self.statusDesenhado = self.linhasStatus()
+                self.limparTela()
+                sys.stdout.write(self.gerarBufferTela(janela) + "\n")
+                sys.stdout.flush()
+                return
+
+            saida = []
+            sujas, self.celulasSujas = self.celulasSujas, set()
+            for areaCelula, x, y in sujas:
+                if areaCelula == area and topo <= x < topo + linhas and esquerda <= y < esquerda + colunas:
+                    saida.append(f"\033[{3 + x - topo};{4 + 2 * (y - esquerda)}H" + self.formatarCelula(self.celulaVisivel(area, x, y)))
+
+            for deslocamento, linha in enumerate(self.linhasStatus()):
+                if linha != self.statusDesenhado[deslocamento]:
+                    saida.append(f"\033[{3 + linhas + deslocamento};1H{linha}\033[K")
+                    self.statusDesenhado[deslocamento] = linha
+
+        if saida:
+            # Devolve o cursor para baixo da tela, onde ele ficaria depois de um quadro completo
+            saida.append(f"\033[{3 + linhas + len(self.statusDesenhado)};1H")
+            sys.stdout.write("".join(saida))
+            sys.stdout.flush()
 
     def processarEntrada(self):
         teclasMovimento = {
@@ -93,19 +374,42 @@ class Jogador:
             if msvcrt.kbhit():
                 tecla = msvcrt.getch()
                 if tecla in teclasMovimento:
-                    self.enviarComando({'type': 'move', 'direction': teclasMovimento[tecla]})
+                    self.mover(teclasMovimento[tecla])
                 elif tecla in [b'e', b'E']:
                     self.enviarComando({'type': 'enter_room'})
+                elif tecla in [b'l', b'L']:
+                    self.enviarComando({'type': 'leaderboard', 'k': 3})
                 elif tecla in [b'q', b'Q']:
                     self.ativo = False
+                    self.estadoMudou.set()
 
     def executar(self):
         if self.conectar():
+            self.conexao.iniciar(self.tratarMensagem, self.conexaoFechada)
+            if self.codec != JSON:
+                self.conexao.usarCodec(self.codec)
+            self.conexao.enviar({'type': 'subscribe', 'view': self.visao} if self.visao else {'type': 'subscribe'})
+            if self.usarUdp:
+                self.conexao.pedir({'type': 'udp'}, self.abrirUdp)
             threading.Thread(target=self.processarEntrada, daemon=True).start()
+            # Redesenha só quando o servidor envia algo novo
             while self.ativo:
-                self.atualizarEstadoJogo()
-                self.desenharTela()
-                time.sleep(0.1)
+                if self.estadoMudou.wait(0.1):
+                    self.estadoMudou.clear()
+                    self.desenharTela()
+            self.conexao.fechar()
+            if self.udp:
+                self.udp.fechar()
 
 if __name__ == "__main__":
-    Jogador().executar()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Cliente do jogo Caça ao Tesouro')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--partida', help="partida para entrar por um lobby, ou 'nova' para criar uma")
+    parser.add_argument('--visao', type=int, help='só acompanha as células até essa distância de você (mapas grandes)')
+    parser.add_argument('--codec', choices=CODECS, default=JSON, help='codificação das mensagens do servidor')
+    parser.add_argument('--udp', action='store_true', help='envia os movimentos por UDP, se o servidor aceitar')
+    argumentos = parser.parse_args()
+
+    Jogador(argumentos.host, argumentos.port, argumentos.partida, argumentos.visao, argumentos.codec,
+            argumentos.udp).executar()
\ No newline at end of file
@@ -0,0 +1,149 @@
+# Jogadores.py - tabela compacta de jogadores: uma linha de campos int64 por jogador num único array.
+#
+# Um dict de jogador com a tupla da posição custa algumas centenas de bytes; uma linha custa 40.
+# Os ids são densos (veja AlocadorIds) e servem de número da linha, então achar, adicionar e
+# remover um jogador são O(1) sem índice à parte. A tabela compartilhada de Compartilhado.py usa
+# as mesmas linhas:
+#
+#   linha   q id (0 marca linha livre), q x, q y, q pontos, q naSala
+import threading
+from array import array
+
+ID, X, Y, PONTOS, NA_SALA = range(5)
+CAMPOS_JOGADOR = 5
+
+
+class RegistroJogador:
+    """Uma linha de uma tabela de jogadores, lida e escrita como os dicts de jogador."""
+
+    __slots__ = ('tabela', 'base')
+
+    def __init__(self, tabela, vaga):
+        self.tabela = tabela
+        self.base = vaga * CAMPOS_JOGADOR
+
+    def __getitem__(self, chave):
+        if chave == 'position':
+            return (self.tabela[self.base + X], self.tabela[self.base + Y])
+        if chave == 'score':
+            return self.tabela[self.base + PONTOS]
+        if chave == 'naSala':
+            return bool(self.tabela[self.base + NA_SALA])
+        raise KeyError(chave)
+
+    def get(self, chave, padrao=None):
+        try:
+            return self[chave]
+        except KeyError:
+            return padrao
+
+    def __setitem__(self, chave, valor):
+        if chave == 'position':
+            self.tabela[self.base + X], self.tabela[self.base + Y] = valor
+        elif chave == 'score':
+            self.tabela[self.base + PONTOS] = valor
+        elif chave == 'naSala':
+            self.tabela[self.base + NA_SALA] = int(valor)
+        else:
+            raise KeyError(chave)
+
+
+class TabelaJogadores:
+    """Id do jogador -> registro, usada como o dict de dicts de jogador que ela substitui.
+
+    A linha `idJogador` guarda esse jogador; a tabela dobra de tamanho quando entra um id maior.
+    """
+
+    __slots__ = ('tabela', 'quantidade')
+
+    def __init__(self, capacidade=64):
+        self.tabela = array('q', bytes(8 * CAMPOS_JOGADOR * capacidade))
+        self.quantidade = 0
+
+    def __contains__(self, idJogador):
+        base = idJogador * CAMPOS_JOGADOR
+        return 0 < idJogador and base < len(self.tabela) and self.tabela[base + ID] == idJogador
+
+    def get(self, idJogador, padrao=None):
+        return RegistroJogador(self.tabela, idJogador) if idJogador in self else padrao
+
+    def __getitem__(self, idJogador):
+        if idJogador not in self:
+            raise KeyError(idJogador)
+        return RegistroJogador(self.tabela, idJogador)
+
+    def __setitem__(self, idJogador, jogador):
+        if idJogador <= 0:
+            raise KeyError(idJogador)
+        base = idJogador * CAMPOS_JOGADOR
+        if base >= len(self.tabela):
+            linhas = max(len(self.tabela) // CAMPOS_JOGADOR, idJogador + 1)
+            self.tabela.frombytes(bytes(8 * CAMPOS_JOGADOR * linhas))
+        if self.tabela[base + ID] != idJogador:
+            self.quantidade += 1
+        registro = RegistroJogador(self.tabela, idJogador)
+        registro['position'] = jogador['position']
+        registro['score'] = jogador['score']
+        registro['naSala'] = jogador['naSala']
+        self.tabela[base + ID] = idJogador
+
+    def __delitem__(self, idJogador):
+        if idJogador not in self:
+            raise KeyError(idJogador)
+        self.tabela[idJogador * CAMPOS_JOGADOR + ID] = 0
+        self.quantidade -= 1
+
+    def __len__(self):
+        return self.quantidade
+
+    def __iter__(self):
+        return (idJogador for idJogador in self.tabela[ID::CAMPOS_JOGADOR] if idJogador)
+
+    def items(self):
+        return ((idJogador, RegistroJogador(self.tabela, idJogador)) for idJogador in self)
+
+    def values(self):
+        return (jogador for _, jogador in self.items())
+
+    def snapshot(self):
+        """Um dict de dicts de jogador, para enviar; as fatias por coluna deixam o laço em C."""
+        tabela = self.tabela
+        return {
+            idJogador: {'position': (x, y), 'score': pontos, 'naSala': bool(naSala)}
+            for idJogador, x, y, pontos, naSala in zip(tabela[ID::CAMPOS_JOGADOR], tabela[X::CAMPOS_JOGADOR],
+                                                       tabela[Y::CAMPOS_JOGADOR], tabela[PONTOS::CAMPOS_JOGADOR],
+                                                       tabela[NA_SALA::CAMPOS_JOGADOR])
+            if idJogador
+        }
+
+
+class AlocadorIds:
+    """Entrega ids de jogador a partir de 1, reaproveitando primeiro os liberados; as duas operações são O(1).
+
+    Dois jogadores em jogo nunca têm o mesmo id, e ids densos deixam a tabela de jogadores do
+    tamanho do máximo de jogadores que a partida já teve ao mesmo tempo. Liberar um id que já
+    está livre, ou que nunca foi entregue, não faz nada.
+    """
+
+    def __init__(self):
+        self.proximoId = 1
+        self.livres = []
+        self.idsLivres = set()  # os mesmos ids, para reconhecer uma liberação repetida
+        self.trava = threading.Lock()
+
+    def alocar(self):
+        with self.trava:
+            if self.livres:
+                idJogador = self.livres.pop()
+                self.idsLivres.discard(idJogador)
+                return idJogador
+            idJogador = self.proximoId
+            self.proximoId += 1
+            return idJogador
+
+    def liberar(self, idJogador):
+        with self.trava:
+            if idJogador in self.idsLivres or not 0 < idJogador < self.proximoId:
+                return
+            self.livres.append(idJogador)
+            self.idsLivres.add(idJogador)
@@ -4,65 +4,193 @@ import threading
 import json
 import time
 import random
+import argparse
+import asyncio
+import multiprocessing
+import queue
+import signal
+from collections import deque
+from contextlib import ExitStack, nullcontext
+from functools import partial
+from itertools import islice
 from threading import Lock
 from colorama import init, Fore, Style
+from CaixaSaida import CaixaSaida, CaixaSaidaAssincrona
+from CanalUdp import CanalUdp, DatagramasUdp
+from Classificacao import Classificacao
+from CodecBinario import CODECS, JSON
+from Compartilhado import (COLETADOS, JOGADOR_NA_SALA, SALA_OCUPADA, VERSAO, ContadorCompartilhado,
+                           EstadoCompartilhado, IdsCompartilhados, JogadoresCompartilhados)
+from Gravacao import ENTRAR, SAIR, SAIR_SALA, Gravador
+from Grade import FECHADA, SALA_TESOURO, VAZIA, ConjuntoCelulas, Grade
+from Interesse import Interesse
+from Jogadores import AlocadorIds, TabelaJogadores
+from Metricas import Metricas, servirMetricas
+from Protocolo import ErroProtocolo, LeitorMensagens, LeitorMensagensAssincrono, codificarMensagem, enviarMensagem
+from Temporizadores import rodaGlobal
+
+MAPA_CHEIO = {'status': 'error', 'message': 'Mapa cheio'}
+MOVIDO = {}  # um movimento que passou; a resposta sai do estado depois dos movimentos enviados com ele
+MAXIMO_CLASSIFICACAO = 100  # máximo de jogadores listados numa resposta de classificação
+LOTE_MOVIMENTOS = 64  # máximo de movimentos já lidos de uma conexão que são respondidos juntos
+LIMITE_ENTRADA = 64  # máximo de comandos de uma conexão que o modo por ticks segura antes de parar de lê-los
 
 class Jogo:
-    def __init__(self, host='localhost', port=5000):
+    def __init__(self, host='localhost', port=5000, backlog=5, tamanhoMapa=8, numeroTesouros=15, tamanhoRegiao=4,
+                 escutar=True, portaUdp=None, semente=None, caminhoGravacao=None):
         self.host = host
         self.port = port
-        self.tamanhoMapa = 8
-        self.numeroTesouros = 15
-        self.mapa = [["." for _ in range(self.tamanhoMapa)] for _ in range(self.tamanhoMapa)]
-        self.jogadores = {}
+        self.backlog = backlog
+        self.tamanhoMapa = tamanhoMapa
+        self.numeroTesouros = numeroTesouros
+        self.mapa = Grade(self.tamanhoMapa)
+
+        # Tudo o que é sorteado numa partida vem da semente, então a semente e os comandos aplicados
+        # bastam para jogá-la de novo
+        self.semente = semente if semente is not None else random.randrange(2 ** 32)
+        self.aleatorio = random.Random(self.semente)
+        self._inicializarTravas(tamanhoRegiao)
+        self.jogadores = TabelaJogadores()
+        self.idsJogadores = AlocadorIds()
+        # Por área, índice da célula -> id do jogador nela, ou um conjunto de ids enquanto vários a dividem;
+        # quase toda célula tem um jogador só, e um id solto custa bem menos que um conjunto por jogador
+        self.ocupacao = {'map': {}, 'room': {}}
         self.tesourosColetados = 0
         self.tesourosTotais = self.numeroTesouros
-        self.travaMapa = Lock()
+        self.classificacao = Classificacao()  # segue as mudanças de jogador registradas
 
         # Sala do Tesouro
         self.tamanhoSala = self.tamanhoMapa // 2
-        self.posicaoSala = (random.randint(0, self.tamanhoMapa - 1), random.randint(0, self.tamanhoMapa - 1))
-        self.salaTesouro = [["." for _ in range(self.tamanhoSala)] for _ in range(self.tamanhoSala)]
+        self.posicaoSala = (self.aleatorio.randint(0, self.tamanhoMapa - 1), self.aleatorio.randint(0, self.tamanhoMapa - 1))
+        self.salaTesouro = Grade(self.tamanhoSala)
         self.tesourosNaSala = 10
         self.salaOcupada = False
         self.jogadorNaSala = None
-        self.travaSala = Lock()
+        self.filaSala = deque()  # quem espera na entrada, na ordem de chegada
+        self.naFilaSala = set()
 
-        self.travaFinalizacao = Lock() # Evita que o jogo seja finalizado mais de uma vez
+        # Log de mudanças versionado, usado para enviar deltas em vez do estado inteiro
+        self.versao = 0
+        self.versaoTransmitida = 0
+        self.logMudancas = deque(maxlen=1024)
+
+        self._inicializarConexoes()
 
         init(autoreset=True)
         self._inicializarMapa()
-        self.socketServidor = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.socketServidor.bind((self.host, self.port))
-        self.socketServidor.listen(5)
+
+        # Log opcional de todos os comandos aplicados, para o Reproducao.py
+        self.gravador = None
+        if caminhoGravacao:
+            self.gravador = Gravador(caminhoGravacao, {'seed': self.semente, 'map_size': self.tamanhoMapa,
+                                                       'num_treasures': self.numeroTesouros, 'region_size': tamanhoRegiao})
+
+        # Partidas de um lobby recebem as conexões prontas em vez de escutar uma porta
+        self.socketServidor = None
+        self.udp = None
+        if escutar:
+            self.socketServidor = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.socketServidor.bind((self.host, self.port))
+            self.socketServidor.listen(self.backlog)
+            # Canal opcional de datagramas para os movimentos (veja CanalUdp.py); a porta 0 deixa o sistema escolher
+            if portaUdp is not None:
+                self.udp = CanalUdp(self.host, portaUdp)
+
+    def _inicializarTravas(self, tamanhoRegiao, travas=None, listras=None):
+        """Cria as métricas e as travas do jogo, todas medidas por elas.
+
+        Uma partida servida por vários processos passa as travas que eles dividem (veja Compartilhado.py),
+        por nome e uma por listra de regiões, para serem medidas no lugar de travas novas.
+        """
+        self.metricas = Metricas()
+        travas = travas or {}
+        self.travaAreaSala = self.metricas.travaMedida('area_sala', travas.get('area_sala'))  # a sala é pequena, uma trava só
+        self.travaSala = self.metricas.travaMedida('sala', travas.get('sala'))
+        self.travaContadores = self.metricas.travaMedida('contadores', travas.get('contadores'))
+        self.travaLivres = self.metricas.travaMedida('livres')
+        self.travaLog = self.metricas.travaMedida('log', travas.get('log'))
+        self.travaFinalizacao = Lock() # Evita que o jogo seja finalizado mais de uma vez
+
+        # O mapa é dividido em regiões tamanhoRegiao x tamanhoRegiao, cada uma com sua trava,
+        # para que movimentos em regiões diferentes rodem em paralelo
+        self.tamanhoRegiao = tamanhoRegiao
+        self.regioesPorLinha = -(-self.tamanhoMapa // tamanhoRegiao)
+        if listras is None:
+            listras = [None] * (self.regioesPorLinha * self.regioesPorLinha)
+        self.travasRegiao = [self.metricas.travaMedida('regiao', trava) for trava in listras]
+
+    def _inicializarConexoes(self):
+        # Conexões que recebem o estado por push: id do jogador -> última versão enviada a ela
+        self.inscritos = {}
+        self.caixasSaida = {}  # id do jogador -> CaixaSaida por onde passa tudo o que vai para a conexão dele
+        self.travaInscritos = Lock()
+        self.codecs = {}  # id do jogador -> codec para o qual a conexão dele passou, quando não é JSON
+
+        # Visões já serializadas da versão atual, compartilhadas por todos os clientes que as pedem
+        self.cacheCodificado = {}
+
+        # Inscritos que só acompanham a área em volta do próprio jogador
+        self.interesse = Interesse(self)
 
     def _inicializarMapa(self):
-        # Coloca tesouros no mapa
-        for _ in range(self.numeroTesouros):
-            while True:
-                x, y = random.randint(0, self.tamanhoMapa - 1), random.randint(0, self.tamanhoMapa - 1)
-                if self.mapa[x][y] == "." and (x, y) != self.posicaoSala:
-                    self.mapa[x][y] = str(random.randint(1, 9))
-                    break
+        totalCelulas = self.tamanhoMapa * self.tamanhoMapa
+        indiceSala = self.mapa.indice(*self.posicaoSala)
+        if self.numeroTesouros > totalCelulas - 1:
+            raise ValueError(f'{self.numeroTesouros} tesouros não cabem em um mapa {self.tamanhoMapa}x{self.tamanhoMapa}')
+        if self.tesourosNaSala > self.tamanhoSala * self.tamanhoSala:
+            raise ValueError(f'{self.tesourosNaSala} tesouros não cabem na sala {self.tamanhoSala}x{self.tamanhoSala}')
+
+        # Coloca tesouros no mapa, em células distintas e fora da entrada da sala
+        for indice in self.aleatorio.sample(range(totalCelulas - 1), self.numeroTesouros):
+            if indice >= indiceSala:
+                indice += 1
+            self.mapa.celulas[indice] = self.aleatorio.randint(1, 9)
 
         # Marca a entrada da sala do tesouro
-        self.mapa[self.posicaoSala[0]][self.posicaoSala[1]] = "X"
+        self.mapa.celulas[indiceSala] = SALA_TESOURO
 
         # Coloca tesouros na sala do tesouro
-        tesourosColocados = 0
-        while tesourosColocados < self.tesourosNaSala:
-            x, y = random.randint(0, self.tamanhoSala - 1), random.randint(0, self.tamanhoSala - 1)
-            if self.salaTesouro[x][y] == ".":
-                self.salaTesouro[x][y] = str(random.randint(5, 15))
-                tesourosColocados += 1
+        for indice in self.aleatorio.sample(range(self.tamanhoSala * self.tamanhoSala), self.tesourosNaSala):
+            self.salaTesouro.celulas[indice] = self.aleatorio.randint(5, 15)
+
+        # Células vazias e sem ninguém, usadas para posicionar novos jogadores
+        self.celulasLivres = ConjuntoCelulas(
+            totalCelulas, (indice for indice, valor in enumerate(self.mapa.celulas) if valor == VAZIA)
+        )
+
+    def _regiaoDe(self, celula):
+        area, x, y = celula
+        if area == 'room':
+            return (1, 0)
+        return (0, (x // self.tamanhoRegiao) * self.regioesPorLinha + y // self.tamanhoRegiao)
+
+    def _travarCelulas(self, *celulas):
+        """Trava as regiões das células (area, x, y), sempre na mesma ordem para evitar deadlock."""
+        pilha = ExitStack()
+        for area, indice in sorted({self._regiaoDe(celula) for celula in celulas}):
+            pilha.enter_context(self.travaAreaSala if area == 1 else self.travasRegiao[indice])
+        return pilha
+
+    def _travarTodasRegioes(self):
+        pilha = ExitStack()
+        for trava in self.travasRegiao:
+            pilha.enter_context(trava)
+        return pilha
+
+    def _coletarTesouro(self, idJogador, pontos):
+        with self.travaContadores:
+            self.tesourosColetados += 1
+            self.jogadores[idJogador]['score'] += pontos
+            return self._mudancaContadores()
 
     def moverJogador(self, idJogador, direcao):
-        with self.travaMapa:
+        while True:
             jogador = self.jogadores.get(idJogador)
             if not jogador:
                 return {'status': 'error', 'message': 'Jogador não encontrado'}
 
-            if jogador.get('naSala'):
+            area = self._areaDe(jogador)
+            if area == 'room':
                 # Movimentação dentro da sala do tesouro
                 mapaAtual = self.salaTesouro
                 tamanhoAtual = self.tamanhoSala
@@ -71,35 +199,51 @@ class Jogo:
                 mapaAtual = self.mapa
                 tamanhoAtual = self.tamanhoMapa
 
-        x, y = jogador['position']
-        novoX, novoY = x, y
+            x, y = jogador['position']
+            novoX, novoY = x, y
+
+            if direcao == 'up' and x > 0:
+                novoX -= 1
+            elif direcao == 'down' and x < tamanhoAtual - 1:
+                novoX += 1
+            elif direcao == 'left' and y > 0:
+                novoY -= 1
+            elif direcao == 'right' and y < tamanhoAtual - 1:
+                novoY += 1
+            mudou = (novoX, novoY) != (x, y)
 
-        if direcao == 'up' and x > 0:
-            novoX -= 1
-        elif direcao == 'down' and x < tamanhoAtual - 1:
-            novoX += 1
-        elif direcao == 'left' and y > 0:
-            novoY -= 1
-        elif direcao == 'right' and y < tamanhoAtual - 1:
-            novoY += 1
+            with self._travarCelulas((area, x, y), (area, novoX, novoY)):
+                # Os ids são reaproveitados, então um jogador removido nesse meio tempo não pode mover quem ficar com a linha dele
+                if idJogador not in self.jogadores:
+                    return {'status': 'error', 'message': 'Jogador não encontrado'}
+                # A saída automática da sala, ou um movimento do jogador pelo outro canal (TCP ou UDP),
+                # pode ter movido o jogador antes de travarmos
+                if self._areaDe(jogador) != area or jogador['position'] != (x, y):
+                    continue
 
-        # Verifica se a nova posição está livre
-        for pid, dados in self.jogadores.items():
-            if dados['position'] == (novoX, novoY):
-                return {'status': 'error', 'message': 'Posição ocupada por outro jogador'}
+                # Verifica se a nova posição está livre
+                if mudou and self.jogadoresEm(area, novoX, novoY):
+                    return {'status': 'error', 'message': 'Posição ocupada por outro jogador'}
 
-        # Verifica se a posição mudou
-        if (novoX, novoY) != (x, y):
-            jogador['position'] = (novoX, novoY)
+                # Verifica se a posição mudou
+                if mudou:
+                    self._desocupar(idJogador)
+                    jogador['position'] = (novoX, novoY)
+                    self._ocupar(idJogador)
 
-            # Coleta tesouro se houver
-            if mapaAtual[novoX][novoY].isdigit():
-                jogador['score'] += int(mapaAtual[novoX][novoY])
-                self.tesourosColetados += 1
-                mapaAtual[novoX][novoY] = "."
+                    # Coleta tesouro se houver; a célula só é lida e limpa com a trava da região
+                    if mapaAtual.temTesouro(novoX, novoY):
+                        pontos = mapaAtual[novoX, novoY]
+                        mapaAtual[novoX, novoY] = VAZIA
+                        contadores = self._coletarTesouro(idJogador, pontos)
+                        self._registrar({'op': 'cell', 'area': area, 'x': novoX, 'y': novoY, 'value': VAZIA}, contadores)
 
-        return self.obterEstadoJogo(idJogador)
+                    self._registrar(self._mudancaJogador(idJogador))
+            break
 
+        if mudou:
+            self.notificarMudanca()
+        return MOVIDO
 
     def entrarSalaTesouro(self, idJogador):
         with self.travaSala:
@@ -107,130 +251,1142 @@ class Jogo:
             if not jogador:
                 return {'status': 'error', 'message': 'Jogador não encontrado'}
 
-            # Verifica se a sala está ocupada
+            # Com a sala ocupada, quem está na entrada entra na fila e é admitido sozinho quando ela liberar
             if self.salaOcupada:
-                return {'status': 'error', 'message': 'Sala ocupada, aguarde sua vez'}
+                if jogador['naSala'] or jogador['position'] != self.posicaoSala:
+                    return {'status': 'error', 'message': 'Você não está na entrada da sala do tesouro'}
+                if idJogador not in self.naFilaSala:
+                    self.filaSala.append(idJogador)
+                    self.naFilaSala.add(idJogador)
+                posicao = self.filaSala.index(idJogador) + 1
+                return {'status': 'queued', 'position': posicao,
+                        'message': f'Sala ocupada, você é o {posicao}º da fila'}
 
-            # Verifica se o jogador está na posição da entrada
-            if jogador['position'] != self.posicaoSala:
-                return {'status': 'error', 'message': 'Você não está na entrada da sala do tesouro'}
-            
-            # Ocupa a sala
-            self.salaOcupada = True
-            self.jogadorNaSala = idJogador
-            jogador['naSala'] = True
-            jogador['position'] = (0, 0)  # Posição inicial na sala
+            with self._travarCelulas(('map', *self.posicaoSala), ('room', 0, 0)):
+                # Verifica se o jogador está na posição da entrada
+                if jogador['naSala'] or jogador['position'] != self.posicaoSala:
+                    return {'status': 'error', 'message': 'Você não está na entrada da sala do tesouro'}
+                self._ocuparSala(idJogador, jogador)
 
-            # saída automática
-            threading.Thread(target=self._sairSalaAposTempo, args=(idJogador,), daemon=True).start()
+            resposta = {'status': 'success', 'state': self.obterEstadoJogo()}
 
-            if all(all(cell == '.' for cell in row) for row in self.salaTesouro):
-                self.salaTesouro = [['#' for _ in range(self.tamanhoSala)] for _ in range(self.tamanhoSala)] # Troca os tesouros por '#'
-                # Apaga a sala do mapa principal, troca X por "." e impede o uso das teclas e e E
-                self.mapa[self.posicaoSala[0]][self.posicaoSala[1]] = "."
+        self.notificarMudanca()
+        return resposta
 
+    def _ocuparSala(self, idJogador, jogador):
+        # Chamado com a trava da sala e as da entrada e da sala presas
+        self.salaOcupada = True
+        self.jogadorNaSala = idJogador
+        self._desocupar(idJogador)
+        jogador['naSala'] = True
+        jogador['position'] = (0, 0)  # Posição inicial na sala
+        self._ocupar(idJogador)
+        self._registrar(self._mudancaJogador(idJogador))
 
-            return {'status': 'success', 'state': self.obterEstadoJogo(idJogador)}
+        # saída automática
+        self._agendarSaidaSala(idJogador)
 
-    def _sairSalaAposTempo(self, idJogador):
-        time.sleep(10)
-        self.sairSalaTesouro(idJogador)
+        if self.salaTesouro.vazia():
+            self.salaTesouro.preencher(FECHADA) # Troca os tesouros por '#'
+            # Apaga a sala do mapa principal, troca X por "." e impede o uso das teclas e e E
+            self.mapa[self.posicaoSala] = VAZIA
+            if not self.jogadoresEm('map', *self.posicaoSala):
+                self._liberarCelula(*self.posicaoSala)
+            self._registrar(*(
+                {'op': 'cell', 'area': 'room', 'x': x, 'y': y, 'value': FECHADA}
+                for x in range(self.tamanhoSala) for y in range(self.tamanhoSala)
+            ))
+            self._registrar({'op': 'cell', 'area': 'map', 'x': self.posicaoSala[0], 'y': self.posicaoSala[1], 'value': VAZIA})
+
+    def _agendarSaidaSala(self, idJogador):
+        rodaGlobal.agendar(10, self.sairSalaTesouro, idJogador)
 
     def sairSalaTesouro(self, idJogador):
-        with self.travaSala:
+        """Tira o jogador da sala quando o tempo acaba (ou libera a sala se ele saiu do jogo) e admite o próximo da fila."""
+        with self.gravando(idJogador, {'type': SAIR_SALA}), self.travaSala:
+            # Prazos de sessões que já acabaram não fazem nada
+            if not self.salaOcupada or self.jogadorNaSala != idJogador:
+                return
             jogador = self.jogadores.get(idJogador)
-            if jogador and jogador.get('naSala'):
-                jogador['naSala'] = False
-                jogador['position'] = self.posicaoSala
+            with self._travarCelulas(('room', 0, 0), ('map', *self.posicaoSala)):
+                if jogador is not None:
+                    self._desocupar(idJogador)
+                    jogador['naSala'] = False
+                    jogador['position'] = self.posicaoSala
+                    self._ocupar(idJogador)
+                    self._registrar(self._mudancaJogador(idJogador))
                 self.salaOcupada = False
                 self.jogadorNaSala = None
+                admitido = self._admitirProximo()
 
-    def obterEstadoJogo(self, idJogador):
-        jogador = self.jogadores.get(idJogador, {})
-        if jogador.get('naSala'):
-            return {
-                'map': self.salaTesouro,
-                'jogadores': {k: v for k, v in self.jogadores.items() if v.get('naSala')},
-                'treasures_left': self.tesourosTotais - self.tesourosColetados
-            }
-        else:
-            mapaComJogadores = [linha[:] for linha in self.mapa]  # Copia do mapa
-            for pid, dados in self.jogadores.items():
-                if not dados.get('naSala'):
-                    x, y = dados['position']
-                    mapaComJogadores[x][y] = 'P' if pid == idJogador else 'J'
+        self.notificarMudanca()
+        if admitido is not None:
+            self._avisarAdmissao(admitido)
 
-            return {
-                'map': mapaComJogadores,
-                'jogadores': self.jogadores,
-                'treasures_left': self.tesourosTotais - self.tesourosColetados
-            }
+    def admitirFila(self):
+        """Admite o próximo da fila se a sala estiver livre."""
+        with self.travaSala:
+            if self.salaOcupada or not self.filaSala:
+                return
+            with self._travarCelulas(('room', 0, 0), ('map', *self.posicaoSala)):
+                admitido = self._admitirProximo()
+
+        if admitido is not None:
+            self.notificarMudanca()
+            self._avisarAdmissao(admitido)
+
+    def _admitirProximo(self):
+        """Põe na sala o primeiro da fila que ainda espera na entrada; retorna o id dele ou None."""
+        while self.filaSala:
+            idJogador = self.filaSala.popleft()
+            self.naFilaSala.discard(idJogador)
+            jogador = self.jogadores.get(idJogador)
+            # Quem saiu do jogo ou da entrada enquanto esperava perde o lugar
+            if jogador is not None and not jogador['naSala'] and jogador['position'] == self.posicaoSala:
+                self._ocuparSala(idJogador, jogador)
+                return idJogador
+        return None
+
+    def _avisarAdmissao(self, idJogador):
+        # Só inscritos recebem o aviso; os demais veem naSala no próximo estado que pedirem
+        if not self.estaInscrito(idJogador):
+            return
+        try:
+            # A caixa de saída do jogador já sabe para qual conexão escrever
+            self.enviarPara(idJogador, None, self.codificarPara(
+                idJogador, {'status': 'success', 'message': 'Sua vez! Você entrou na sala do tesouro'}
+            ))
+        except (socket.error, KeyError):
+            self.cancelarInscricao(idJogador)
+
+    # Ocupação e células livres só mudam com a trava da região da célula
+    def _areaDe(self, jogador):
+        return 'room' if jogador.get('naSala') else 'map'
+
+    def _indiceCelula(self, jogador):
+        area = self._areaDe(jogador)
+        grade = self.salaTesouro if area == 'room' else self.mapa
+        return area, grade.indice(*jogador['position'])
+
+    def _ocupar(self, idJogador):
+        area, indice = self._indiceCelula(self.jogadores[idJogador])
+        ocupacao = self.ocupacao[area]
+        ocupantes = ocupacao.get(indice)
+        if ocupantes is None:
+            ocupacao[indice] = idJogador
+        elif isinstance(ocupantes, set):
+            ocupantes.add(idJogador)
+        elif ocupantes != idJogador:
+            ocupacao[indice] = {ocupantes, idJogador}
+        if area == 'map':
+            with self.travaLivres:
+                self.celulasLivres.discard(indice)
+
+    def _desocupar(self, idJogador):
+        area, indice = self._indiceCelula(self.jogadores[idJogador])
+        ocupacao = self.ocupacao[area]
+        ocupantes = ocupacao.get(indice)
+        if isinstance(ocupantes, set):
+            ocupantes.discard(idJogador)
+            if len(ocupantes) == 1:
+                ocupacao[indice] = ocupantes.pop()
+        elif ocupantes == idJogador:
+            del ocupacao[indice]
+            if area == 'map' and self.mapa.celulas[indice] == VAZIA:
+                self._liberarCelula(*self.mapa.posicao(indice))
+
+    def _liberarCelula(self, x, y):
+        with self.travaLivres:
+            self.celulasLivres.add(self.mapa.indice(x, y))
+
+    def jogadoresEm(self, area, x, y):
+        """Ids dos jogadores na célula (area é 'map' ou 'room'), em tempo constante."""
+        grade = self.salaTesouro if area == 'room' else self.mapa
+        ocupantes = self.ocupacao[area].get(grade.indice(x, y))
+        if ocupantes is None:
+            return set()
+        return ocupantes if isinstance(ocupantes, set) else {ocupantes}
+
+    def visaoCodificada(self, visao, gerar):
+        """Retorna `gerar()` da versão atual, gerando no máximo uma vez por versão e visão."""
+        with self.travaLog:
+            versao = self.versao
+            dados = self.cacheCodificado.get(visao)
+            if dados is not None and dados[0] == versao:
+                return dados[1]
+
+        dados = gerar()
+        with self.travaLog:
+            # Só guarda se nada mudou enquanto era gerado
+            if self.versao == versao:
+                self.cacheCodificado[visao] = (versao, dados)
+        return dados
+
+    def estadoCodificado(self, codec=JSON):
+        return self.visaoCodificada(('estado', codec), lambda: codificarMensagem(self.obterEstadoJogo(), codec))
+
+    def snapshotCodificado(self, codec=JSON):
+        return self.visaoCodificada(('snapshot', codec), lambda: codificarMensagem(self.obterSnapshot(), codec))
+
+    def atualizacaoCodificada(self, idJogador):
+        """O que um inscrito ainda não recebeu, num quadro só, ou None se ele está em dia.
+
+        Gerada pela caixa de saída do inscrito logo antes de escrever, então quem ficou para trás
+        recebe de uma vez tudo o que perdeu: um delta, ou um snapshot se o log já não vai tão longe.
+        """
+        with self.travaInscritos:
+            desde = self.inscritos.get(idJogador)
+        if desde is None:
+            return None
+        versao, dados = self.atualizacaoCodificadaDesde(desde, self.codecs.get(idJogador, JSON))
+        if versao == desde:
+            return None
+        with self.travaInscritos:
+            if idJogador not in self.inscritos:
+                return None
+            if self.inscritos[idJogador] == desde:
+                self.inscritos[idJogador] = versao
+            self.metricas.somarBytesEnviados(idJogador, len(dados))
+        return dados
+
+    def atualizacaoCodificadaDesde(self, desde, codec):
+        """A atualização desde `desde` e a versão a que ela leva um inscrito, compartilhada por todos os que estão lá."""
+        def gerar():
+            atualizacao = self.obterEstadoDesde(desde)
+            return atualizacao['version'], codificarMensagem(atualizacao, codec)
+        return self.visaoCodificada(('atualizacao', desde, codec), gerar)
+
+    def codificarPara(self, idJogador, mensagem):
+        return codificarMensagem(mensagem, self.codecs.get(idJogador, JSON))
+
+    def codificarResposta(self, idJogador, resposta):
+        # Respostas que são só o estado são iguais para todos, então reaproveitam o quadro do cache
+        if 'status' not in resposta and 'type' not in resposta:
+            return self.estadoCodificado(self.codecs.get(idJogador, JSON))
+        return self.codificarPara(idJogador, resposta)
+
+    def _registrar(self, *mudancas):
+        with self.travaLog:
+            self.cacheCodificado.clear()
+            for mudanca in mudancas:
+                self.versao += 1
+                mudanca['v'] = self.versao
+                self.logMudancas.append(mudanca)
+                # Toda mudança de pontos é registrada como mudança de jogador, então o ranking nunca percorre todos
+                if mudanca['op'] == 'player':
+                    self.classificacao.atualizar(int(mudanca['id']), mudanca['score'])
+                elif mudanca['op'] == 'remove':
+                    self.classificacao.remover(int(mudanca['id']))
+            if self.interesse.observadores:
+                self.interesse.distribuir(mudancas)
+
+    def _mudancaJogador(self, idJogador):
+        jogador = self.jogadores[idJogador]
+        return {
+            'op': 'player', 'id': str(idJogador),
+            'position': jogador['position'], 'score': jogador['score'], 'naSala': jogador['naSala']
+        }
+
+    def _mudancaContadores(self):
+        return {'op': 'counters', 'treasures_left': self.tesourosTotais - self.tesourosColetados}
+
+    def obterSnapshot(self):
+        with self.travaLog:
+            versao = self.versao
+        return {'type': 'state', 'version': versao, 'state': self.obterEstadoJogo()}
+
+    def obterEstadoDesde(self, versao):
+        """Retorna as mudanças após `versao`, ou o snapshot completo se o log já não cobre essa versão."""
+        with self.travaLog:
+            if self.logMudancas:
+                maisAntiga = self.logMudancas[0]['v']
+            else:
+                maisAntiga = self.versao + 1
+
+            if maisAntiga <= versao + 1 <= self.versao + 1:
+                mudancas = list(islice(self.logMudancas, versao + 1 - maisAntiga, None))
+                return {'type': 'delta', 'from': versao, 'version': self.versao, 'changes': mudancas}
+
+        return self.obterSnapshot()
+
+    def inscrever(self, idJogador, socketCliente, visao=None):
+        """Envia ao cliente toda mudança, ou só as que ficam a até `visao` células do jogador."""
+        if visao is not None and (not isinstance(visao, int) or visao < 1):
+            self.enviarPara(idJogador, socketCliente, self.codificarPara(idJogador, {'status': 'error', 'message': 'Visão inválida'}))
+            return
+
+        self.cancelarInscricao(idJogador)
+        if visao is None:
+            with self.travaLog:
+                versao = self.versao
+            snapshot = self.snapshotCodificado(self.codecs.get(idJogador, JSON))
+            # Enfileirado antes de o inscrito entrar na lista, para nenhum push passar na frente dele
+            with self.travaInscritos:
+                self.enviarPara(idJogador, socketCliente, snapshot)
+                self.inscritos[idJogador] = versao
+            return
+
+        with self.travaLog:
+            observador = self.interesse.adicionar(idJogador, socketCliente, visao)
+        with observador.trava:
+            with self.travaLog:
+                snapshot = self.interesse.snapshot(observador)
+            self.enviarPara(idJogador, socketCliente, self.codificarPara(idJogador, snapshot))
+
+    def cancelarInscricao(self, idJogador):
+        with self.travaInscritos:
+            self.inscritos.pop(idJogador, None)
+        with self.travaLog:
+            self.interesse.remover(idJogador)
+
+    def estaInscrito(self, idJogador):
+        return idJogador in self.inscritos or idJogador in self.interesse.observadores
+
+    def versaoConfirmacao(self, idJogador):
+        # Observadores pulam as versões que não veem, então são confirmados nas versões deles
+        with self.travaLog:
+            observador = self.interesse.observadores.get(idJogador)
+            return self.versao if observador is None else self.interesse.versaoConfirmacao(observador)
+
+    def enviarPara(self, idJogador, socketCliente, dados):
+        # Vai para a caixa de saída da conexão, então um cliente que não lê nunca trava o jogo
+        self.caixasSaida[idJogador].colocar(dados)
+        self.metricas.somarBytesEnviados(idJogador, len(dados))
+
+    def notificarMudanca(self):
+        self.interesse.despachar()
+        with self.travaInscritos:
+            inscritos = list(self.inscritos.items())
+        if not inscritos:
+            return
+
+        with self.travaLog:
+            desde, atual = self.versaoTransmitida, self.versao
+            self.versaoTransmitida = atual
+        if desde == atual:
+            return
+
+        # Os inscritos em dia precisam todos da mesma atualização, então ela é codificada aqui uma vez
+        # por codec; as caixas de saída só geram a sua quando ficaram para trás
+        for codec in {self.codecs.get(idJogador, JSON) for idJogador, versao in inscritos if versao == desde}:
+            self.atualizacaoCodificadaDesde(desde, codec)
+        for idJogador, _ in inscritos:
+            try:
+                self.caixasSaida[idJogador].empurrar(partial(self.atualizacaoCodificada, idJogador))
+            except (socket.error, KeyError):
+                self.cancelarInscricao(idJogador)
+
+    def obterEstadoJogo(self):
+        # Mapa e sala vão direto dos buffers; o cliente desenha P/J e escolhe o que mostrar
+        return {
+            'map': self.visaoCodificada('map', self.mapa.codificar),
+            'map_size': self.tamanhoMapa,
+            'room': self.visaoCodificada('room', self.salaTesouro.codificar),
+            'room_size': self.tamanhoSala,
+            'jogadores': self.jogadores.snapshot(),
+            'treasures_left': self.tesourosTotais - self.tesourosColetados
+        }
 
     def finalizarJogo(self):
         with self.travaFinalizacao:  # Garante que apenas uma thread execute a finalização
             if self.tesourosColetados < self.tesourosTotais:
                 return  # Evita finalizar o jogo mais de uma vez
 
-            vencedor = max(self.jogadores.items(), key=lambda x: x[1]['score'], default=(None, {'score': 0}))
-            idVencedor, dadosVencedor = vencedor
-            print(Fore.GREEN + f"\nJogo finalizado! Jogador {idVencedor} venceu com {dadosVencedor['score']} pontos!" + Style.RESET_ALL)
+            ranking = self.obterClassificacao(None, 10)['leaderboard']
+            vencedor = ranking[0] if ranking else {'id': None, 'score': 0}
+            print(Fore.GREEN + f"\nJogo finalizado! Jogador {vencedor['id']} venceu com {vencedor['score']} pontos!" + Style.RESET_ALL)
+            for colocado in ranking[1:]:
+                print(f"{colocado['rank']}º: jogador {colocado['id']} com {colocado['score']} pontos")
             return {
                 'status': 'game_over',
-                'winner': idVencedor,
-                'score': dadosVencedor['score']
+                'winner': vencedor['id'],
+                'score': vencedor['score'],
+                'rankings': ranking
             }
 
     def processarComando(self, idJogador, comando):
-        if comando['type'] == 'move':
-            return self.moverJogador(idJogador, comando['direction'])
-        elif comando['type'] == 'enter_room':
-            return self.entrarSalaTesouro(idJogador)
-        elif comando['type'] == 'get_state':
-            return self.obterEstadoJogo(idJogador)
-        return {'status': 'error', 'message': 'Comando inválido'}
+        with self.gravando(idJogador, comando):
+            return self.aplicarComando(idJogador, comando)
+
+    def aplicarComando(self, idJogador, comando):
+        inicio = time.perf_counter()
+        try:
+            if comando['type'] == 'move':
+                return self.moverJogador(idJogador, comando['direction'])
+            elif comando['type'] == 'enter_room':
+                return self.entrarSalaTesouro(idJogador)
+            elif comando['type'] == 'get_state':
+                observador = self.interesse.observadores.get(idJogador)
+                if observador is not None:
+                    # O observador não quer o mapa inteiro, ele recomeça do seu quadrado
+                    with observador.trava, self.travaLog:
+                        return self.interesse.snapshot(observador)
+                if 'since' in comando:
+                    return self.obterEstadoDesde(comando['since'])
+                return self.obterEstadoJogo()
+            elif comando['type'] == 'stats':
+                return {'status': 'success', 'stats': self.obterEstatisticas()}
+            elif comando['type'] == 'udp':
+                return self.abrirUdp(idJogador)
+            elif comando['type'] == 'leaderboard':
+                k = comando.get('k', 10)
+                if not isinstance(k, int) or k < 1:
+                    return {'status': 'error', 'message': 'Tamanho de classificação inválido'}
+                return self.obterClassificacao(idJogador, min(k, MAXIMO_CLASSIFICACAO))
+            return {'status': 'error', 'message': 'Comando inválido'}
+        finally:
+            self.metricas.observarComando(comando.get('type'), time.perf_counter() - inicio)
+
+    def abrirUdp(self, idJogador):
+        if self.udp is None:
+            return {'status': 'error', 'message': 'UDP não está habilitado'}
+        return self.udp.abrir(idJogador)
+
+    def servirUdp(self):
+        if self.udp:
+            print(Fore.CYAN + f"Movimentos também aceitos por UDP em {self.host}:{self.udp.port}" + Style.RESET_ALL)
+            threading.Thread(target=self.udp.servir, args=(self.tratarDatagrama,), daemon=True).start()
+
+    def tratarDatagrama(self, dados, endereco):
+        movimento = self.udp.aceitar(dados)
+        if movimento is not None:
+            self.aplicarMovimentoDatagrama(*movimento, endereco)
+
+    def aplicarMovimentoDatagrama(self, idJogador, sequencia, direcao, endereco):
+        """Aplica um movimento que veio por UDP e o confirma por lá com a nova posição do jogador."""
+        self.processarComando(idJogador, {'type': 'move', 'direction': direcao})
+        jogador = self.jogadores.get(idJogador)
+        if jogador is not None:
+            # Um movimento recusado também é confirmado, com a posição onde o jogador continua
+            self.udp.confirmar(sequencia, self.versaoConfirmacao(idJogador), self._areaDe(jogador),
+                               jogador['position'], endereco)
+        self.verificarFimDeJogo()
+
+    def obterEstatisticas(self):
+        return self.metricas.snapshot(len(self.jogadores))
+
+    def obterClassificacao(self, idJogador, k):
+        """Os `k` melhores jogadores e a posição de `idJogador`, sem olhar todos os jogadores."""
+        with self.travaLog:
+            return self._respostaClassificacao(self.classificacao, idJogador, k)
+
+    @staticmethod
+    def _respostaClassificacao(classificacao, idJogador, k):
+        return {
+            'status': 'success',
+            'leaderboard': [{'rank': posicao, 'id': idColocado, 'score': pontuacao}
+                            for posicao, idColocado, pontuacao in classificacao.melhores(k)],
+            'rank': classificacao.posicao(idJogador),
+            'players': len(classificacao)
+        }
 
     def gerenciarCliente(self, socketCliente, idJogador):
+        leitor = LeitorMensagens(socketCliente)
         try:
             while True:
-                dados = socketCliente.recv(1024).decode()
-                if not dados:
+                comando = leitor.receber()
+                if comando is None:
                     break
+                comandos = self.lerMovimentos(leitor, comando)
+                self.metricas.definirBytesRecebidos(idJogador, leitor.bytesLidos)
 
-                comando = json.loads(dados)
-                resposta = self.processarComando(idJogador, comando)
-                socketCliente.send(json.dumps(resposta).encode())
-
-                # Finaliza o jogo se todos os tesouros foram coletados
-                if self.tesourosColetados >= self.tesourosTotais:
-                    self.finalizarJogo()
+                if self.tratarComandos(idJogador, socketCliente, comandos):
                     break
 
-        except (json.JSONDecodeError, socket.error):
+        except (json.JSONDecodeError, ErroProtocolo, socket.error):
             pass
         finally:
-            self.jogadores.pop(idJogador, None)
+            # Fechar a caixa de saída fecha o socket, depois de escritas as respostas que ainda estão na fila
+            self.desconectarJogador(idJogador)
+
+    @staticmethod
+    def lerMovimentos(leitor, comando):
+        """`comando` seguido dos movimentos que já chegaram atrás dele (uma tecla segurada)."""
+        comandos = [comando]
+        while comando.get('type') == 'move' and len(comandos) < LOTE_MOVIMENTOS:
+            comando = leitor.jaRecebida()
+            if comando is None:
+                break
+            comandos.append(comando)
+        return comandos
+
+    def tratarComando(self, idJogador, conexao, comando):
+        """Executa um comando e responde; retorna True quando o jogo terminou."""
+        return self.tratarComandos(idJogador, conexao, [comando])
+
+    def tratarComandos(self, idJogador, conexao, comandos):
+        """Executa em ordem comandos que chegaram juntos, respondendo cada sequência de movimentos de uma vez;
+        retorna True quando o jogo terminou."""
+        movimentos = []
+        for comando in comandos:
+            if comando.get('type') == 'move':
+                movimentos.append(self.aplicarMovimento(idJogador, comando))
+                continue
+            self.responderMovimentos(idJogador, conexao, movimentos)
+            movimentos = []
+
+            if comando.get('type') == 'subscribe':
+                self.inscrever(idJogador, conexao, comando.get('view'))
+            elif comando.get('type') == 'codec':
+                self.definirCodec(idJogador, conexao, comando)
+            else:
+                resposta = self.processarComando(idJogador, comando)
+                if comando.get('id') is not None:
+                    # Pedidos com id sempre recebem resposta com o mesmo id, para clientes com pedidos em fila casarem cada uma
+                    self.enviarPara(idJogador, conexao, self.codificarPara(idJogador, dict(resposta, id=comando['id'])))
+                else:
+                    self.enviarPara(idJogador, conexao, self.codificarResposta(idJogador, resposta))
+        self.responderMovimentos(idJogador, conexao, movimentos)
+
+        return self.verificarFimDeJogo()
+
+    def aplicarMovimento(self, idJogador, comando):
+        return comando, self.processarComando(idJogador, comando), self.versaoConfirmacao(idJogador)
+
+    def responderMovimentos(self, idJogador, conexao, movimentos):
+        """Responde numa escrita só uma sequência de movimentos aplicados, em trios (comando, resposta, versão).
+
+        Movimentos recusados recebem o erro e movimentos com id uma resposta com esse id, mas só o
+        último que passou leva o estado, montado uma vez para todos; os outros são confirmados com a
+        versão que geraram, ou nem respondidos quando não têm id. Os movimentos de um inscrito só são
+        confirmados, já que o estado dele vai por push.
+        """
+        if not movimentos:
+            return
+        ultimo = None
+        if not self.estaInscrito(idJogador):
+            ultimo = max((i for i, (_, resposta, _) in enumerate(movimentos) if 'status' not in resposta), default=None)
+
+        quadros = []
+        for i, (comando, resposta, versao) in enumerate(movimentos):
+            idPedido = comando.get('id')
+            if i == ultimo:
+                if idPedido is None:
+                    quadros.append(self.estadoCodificado(self.codecs.get(idJogador, JSON)))
+                    continue
+                resposta = self.obterEstadoJogo()
+            elif 'status' not in resposta:
+                if idPedido is None:
+                    continue
+                resposta = {'status': 'success', 'version': versao}
+            if idPedido is not None:
+                resposta = dict(resposta, id=idPedido)
+            quadros.append(self.codificarPara(idJogador, resposta))
+
+        self.metricas.contarMovimentosAgrupados(len(movimentos) - 1)
+        if quadros:
+            self.enviarPara(idJogador, conexao, b''.join(quadros))
+
+    def definirCodec(self, idJogador, conexao, comando):
+        """Passa o que o servidor envia a esta conexão para o codec que ela pediu."""
+        codec = comando.get('codec')
+        if codec not in CODECS:
+            resposta = {'status': 'error', 'message': 'Codec desconhecido'}
+        else:
+            self.codecs[idJogador] = codec
+            resposta = {'status': 'success', 'codec': codec}
+        if 'id' in comando:
+            resposta['id'] = comando['id']
+        self.enviarPara(idJogador, conexao, self.codificarPara(idJogador, resposta))
+
+    def verificarFimDeJogo(self):
+        # Finaliza o jogo se todos os tesouros foram coletados
+        if self.terminou():
+            self.finalizarJogo()
+            return True
+        return False
+
+    def aceitarCliente(self, socketCliente):
+        """Adiciona um jogador para a nova conexão e envia o handshake; retorna None se o mapa estiver cheio."""
+        idJogador = self.conectarJogador()
+        if idJogador is None:
+            enviarMensagem(socketCliente, MAPA_CHEIO)
+            socketCliente.close()
+            return None
+        enviarMensagem(socketCliente, idJogador)
+        self.caixasSaida[idJogador] = CaixaSaida(socketCliente, self.metricas.contarConexaoDerrubada)
+        self.notificarMudanca()
+        return idJogador
+
+    def terminou(self):
+        return self.tesourosColetados >= self.tesourosTotais
+
+    def gravando(self, idJogador, comando):
+        return self.gravador.entrada(idJogador, comando) if self.gravador else nullcontext()
+
+    def fecharGravacao(self):
+        if self.gravador:
+            self.gravador.fechar(self)
+
+    def conectarJogador(self):
+        idJogador = self.idsJogadores.alocar()
+        if not self.adicionarJogador(idJogador):
+            self.idsJogadores.liberar(idJogador)
+            return None
+        return idJogador
+
+    def desconectarJogador(self, idJogador):
+        self.cancelarInscricao(idJogador)
+        self.codecs.pop(idJogador, None)
+        if self.udp:
+            self.udp.esquecer(idJogador)
+        self.metricas.fecharConexao(idJogador)
+        self.removerJogador(idJogador)
+        self.notificarMudanca()
+        caixa = self.caixasSaida.pop(idJogador, None)
+        if caixa is not None:
+            caixa.fechar()
+        # Quem cai dentro da sala não pode prender a fila até o prazo acabar
+        if self.jogadorNaSala == idJogador:
+            self.sairSalaTesouro(idJogador)
+            # O prazo dele continua agendado; o id só volta a ser usado depois, para não tirar outro da sala
+            rodaGlobal.agendar(10, self.idsJogadores.liberar, idJogador)
+        else:
+            self.idsJogadores.liberar(idJogador)
+
+    def removerJogador(self, idJogador):
+        with self.gravando(idJogador, {'type': SAIR}):
+            # Os ids são reaproveitados, então quem chegar com este id não herda o lugar na fila
+            with self.travaSala:
+                if idJogador in self.naFilaSala:
+                    self.naFilaSala.discard(idJogador)
+                    self.filaSala.remove(idJogador)
+            jogador = self.jogadores.get(idJogador)
+            if jogador is not None:
+                with self._travarCelulas((self._areaDe(jogador), *jogador['position'])):
+                    self._desocupar(idJogador)
+                    del self.jogadores[idJogador]
+                    self._registrar({'op': 'remove', 'id': str(idJogador)})
 
     def adicionarJogador(self, idJogador):
-        while True:
-            x, y = random.randint(0, self.tamanhoMapa - 1), random.randint(0, self.tamanhoMapa - 1)
-            if self.mapa[x][y] == ".":
+        """Coloca o jogador em uma célula livre sorteada; retorna False se o mapa estiver cheio."""
+        with self.gravando(idJogador, {'type': ENTRAR}):
+            # Só a região da célula sorteada é travada, então entrar não custa mais com o mapa maior
+            with self.travaLivres:
+                if not self.celulasLivres:
+                    return False
+                x, y = self.mapa.posicao(self.celulasLivres.sortear(self.aleatorio))
+            with self._travarCelulas(('map', x, y)):
                 self.jogadores[idJogador] = {'position': (x, y), 'score': 0, 'naSala': False}
-                break
+                self._ocupar(idJogador)
+                self._registrar(self._mudancaJogador(idJogador))
+            return True
+
+    def executar(self):
+        print(Fore.CYAN + f"Servidor iniciado em {self.host}:{self.port} (semente {self.semente})" + Style.RESET_ALL)
+        self.servirUdp()
+        try:
+            while True:
+                socketCliente, _ = self.socketServidor.accept()
+                idJogador = self.aceitarCliente(socketCliente)
+                if idJogador is None:
+                    continue
+
+                threading.Thread(target=self.gerenciarCliente, args=(socketCliente, idJogador), daemon=True).start()
+        except KeyboardInterrupt:
+            print(Fore.YELLOW + "\nDesligando servidor..." + Style.RESET_ALL)
+        finally:
+            self.socketServidor.close()
+            if self.udp:
+                self.udp.fechar()
+            self.fecharGravacao()
+
+class JogoAssincrono(Jogo):
+    """Roda o mesmo jogo em um único event loop do asyncio, sem uma thread por cliente.
+
+    Cada comando executa até o fim dentro do loop, então as travas do jogo viram no-ops.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.travaSala = self.travaAreaSala = self.travaFinalizacao = nullcontext()
+        self.travaContadores = self.travaLivres = nullcontext()
+        self.travasRegiao = [nullcontext()] * len(self.travasRegiao)
+        self.travaInscritos = self.travaLog = nullcontext()
+        self.loop = None
+
+    def _agendarSaidaSala(self, idJogador):
+        self.loop.call_later(10, self.sairSalaTesouro, idJogador)
+
+    async def gerenciarConexao(self, leitor, escritor):
+        idJogador = self.conectarJogador()
+        if idJogador is None:
+            escritor.write(codificarMensagem(MAPA_CHEIO))
+            escritor.close()
+            return
+
+        escritor.write(codificarMensagem(idJogador))
+        caixa = self.caixasSaida[idJogador] = CaixaSaidaAssincrona(escritor, self.metricas.contarConexaoDerrubada)
+        self.notificarMudanca()
+        mensagens = LeitorMensagensAssincrono(leitor)
+        try:
+            while True:
+                comando = await mensagens.receberAssincrono()
+                if comando is None:
+                    break
+                comandos = self.lerMovimentos(mensagens, comando)
+                self.metricas.definirBytesRecebidos(idJogador, mensagens.bytesLidos)
+
+                fim = self.tratarComandos(idJogador, escritor, comandos)
+                await caixa.esvaziar()
+                if fim:
+                    break
+        except (json.JSONDecodeError, ErroProtocolo, ConnectionError):
+            pass
+        finally:
+            self.desconectarJogador(idJogador)
+            escritor.close()
+
+    async def servir(self):
+        self.loop = asyncio.get_running_loop()
+        servidor = await asyncio.start_server(self.gerenciarConexao, sock=self.socketServidor, backlog=self.backlog)
+        if self.udp:
+            print(Fore.CYAN + f"Movimentos também aceitos por UDP em {self.host}:{self.udp.port}" + Style.RESET_ALL)
+            await self.loop.create_datagram_endpoint(lambda: DatagramasUdp(self), sock=self.udp.socket)
+        async with servidor:
+            await servidor.serve_forever()
+
+    def executar(self):
+        print(Fore.CYAN + f"Servidor assíncrono iniciado em {self.host}:{self.port} (semente {self.semente})" + Style.RESET_ALL)
+        try:
+            asyncio.run(self.servir())
+        except KeyboardInterrupt:
+            print(Fore.YELLOW + "\nDesligando servidor..." + Style.RESET_ALL)
+        finally:
+            self.socketServidor.close()
+            if self.udp:
+                self.udp.fechar()
+            self.fecharGravacao()
+
+class JogoPorTicks(Jogo):
+    """Modo autoritativo com tick fixo: as threads das conexões só enfileiram comandos e uma
+    única thread de simulação aplica o lote de cada tick e transmite uma atualização só.
+
+    Só a thread de simulação mexe no estado do jogo, então as travas do jogo viram no-ops.
+    """
+
+    # Marcadores de entrada e saída na fila; comparados por identidade para o cliente não forjar
+    ENTRADA = {'type': 'join'}
+    SAIDA = {'type': 'leave'}
+    SAIDA_SALA = {'type': 'leave_room'}
+
+    def __init__(self, *args, taxaTicks=20, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.taxaTicks = taxaTicks
+        self.comandos = queue.SimpleQueue()
+        self.entradas = {}  # id do jogador -> semáforo contando os comandos que ele ainda pode ter na fila
+        self.travaTick = Lock()  # presa enquanto um tick roda, para as caixas de saída gerarem atualizações entre os ticks
+        self.estadoMudou = False
+        self.jogoEncerrado = False
+        self.travaSala = self.travaAreaSala = self.travaFinalizacao = nullcontext()
+        self.travaContadores = self.travaLivres = nullcontext()
+        self.travaInscritos = self.travaLog = nullcontext()
+        self.travasRegiao = [nullcontext()] * len(self.travasRegiao)
+
+    def notificarMudanca(self):
+        # As mudanças são transmitidas uma vez só, no fim do tick
+        self.estadoMudou = True
+
+    def verificarFimDeJogo(self):
+        return False
+
+    def atualizacaoCodificada(self, idJogador):
+        # Chamada pelas threads das caixas de saída, e só a thread de simulação mexe no jogo durante o tick
+        with self.travaTick:
+            return super().atualizacaoCodificada(idJogador)
+
+    def _agendarSaidaSala(self, idJogador):
+        # A saída também entra na fila, para ser aplicada pela thread de simulação
+        rodaGlobal.agendar(10, self.comandos.put, (idJogador, None, self.SAIDA_SALA))
+
+    def gerenciarCliente(self, socketCliente, idJogador):
+        leitor = LeitorMensagens(socketCliente)
+        entrada = self.entradas[idJogador]
+        try:
+            while not self.jogoEncerrado:
+                comando = leitor.receber()
+                if comando is None:
+                    break
+                self.metricas.definirBytesRecebidos(idJogador, leitor.bytesLidos)
+                # Um cliente que envia mais rápido do que os ticks aplicam espera aqui, e então os buffers
+                # do socket dele enchem, em vez de a fila crescer
+                while not entrada.acquire(timeout=1):
+                    if self.jogoEncerrado:
+                        return
+                self.comandos.put((idJogador, socketCliente, comando))
+        except (json.JSONDecodeError, ErroProtocolo, socket.error):
+            pass
+        finally:
+            self.comandos.put((idJogador, socketCliente, self.SAIDA))
+
+    def tratarDatagrama(self, dados, endereco):
+        # Aplicado pela thread de simulação como qualquer outro comando
+        movimento = self.udp.aceitar(dados)
+        if movimento is not None:
+            idJogador, sequencia, direcao = movimento
+            # Movimentos por UDP dividem o limite de entrada da conexão; além dele são descartados como um datagrama perdido
+            entrada = self.entradas.get(idJogador)
+            if entrada is not None and entrada.acquire(blocking=False):
+                self.comandos.put((idJogador, endereco, (sequencia, direcao)))
+
+    def entrarJogador(self, idJogador, socketCliente):
+        if not self.adicionarJogador(idJogador):
+            # O id e a caixa de saída só vão embora quando a SAIDA enfileirada pela thread da conexão for
+            # aplicada; até lá, a caixa fechada recusa as respostas aos comandos que ela enfileirou
+            self.enviarPara(idJogador, socketCliente, codificarMensagem(MAPA_CHEIO))
+            self.caixasSaida[idJogador].fechar()
+            return
+        self.enviarPara(idJogador, socketCliente, codificarMensagem(idJogador))
+        self.notificarMudanca()
+
+    def executarTick(self):
+        lote = []
+        try:
+            while True:
+                lote.append(self.comandos.get_nowait())
+        except queue.Empty:
+            pass
+
+        movimentos = {}  # id do jogador -> (conexão, os movimentos que ele enviou no tick), respondidos depois do lote
+        for idJogador, conexao, comando in lote:
+            try:
+                if comando is self.ENTRADA:
+                    self.entrarJogador(idJogador, conexao)
+                elif comando is self.SAIDA:
+                    movimentos.pop(idJogador, None)
+                    self.entradas.pop(idJogador, None)
+                    self.desconectarJogador(idJogador)
+                elif comando is self.SAIDA_SALA:
+                    self.sairSalaTesouro(idJogador)
+                elif isinstance(comando, tuple):
+                    # Um movimento que veio por UDP, enfileirado com o endereço para onde confirmar
+                    entrada = self.entradas.get(idJogador)
+                    if entrada is not None:
+                        entrada.release()
+                    self.aplicarMovimentoDatagrama(idJogador, *comando, conexao)
+                else:
+                    self.entradas[idJogador].release()
+                    if comando.get('type') == 'move':
+                        movimentos.setdefault(idJogador, (conexao, []))[1].append(self.aplicarMovimento(idJogador, comando))
+                    else:
+                        # Os movimentos anteriores dele são respondidos antes, para as respostas seguirem a ordem dos comandos
+                        self.responderMovimentos(idJogador, *movimentos.pop(idJogador, (conexao, [])))
+                        self.tratarComando(idJogador, conexao, comando)
+            except (socket.error, KeyError):
+                # Uma conexão que já se foi nunca pode derrubar junto a thread de simulação
+                pass
+        for idJogador, (conexao, movimentosJogador) in movimentos.items():
+            try:
+                self.responderMovimentos(idJogador, conexao, movimentosJogador)
+            except (socket.error, KeyError):
+                pass
+
+        if self.estadoMudou:
+            self.estadoMudou = False
+            Jogo.notificarMudanca(self)
+        if Jogo.verificarFimDeJogo(self):
+            self.jogoEncerrado = True
+
+    def simular(self):
+        intervalo = 1 / self.taxaTicks
+        proximoTick = time.monotonic()
+        while not self.jogoEncerrado:
+            with self.travaTick:
+                self.executarTick()
+            proximoTick += intervalo
+            espera = proximoTick - time.monotonic()
+            if espera > 0:
+                time.sleep(espera)
+            else:
+                # Atrasado: pula os ticks perdidos em vez de tentar alcançá-los de uma vez
+                proximoTick = time.monotonic()
 
     def executar(self):
-        print(Fore.CYAN + f"Servidor iniciado em {self.host}:{self.port}" + Style.RESET_ALL)
+        print(Fore.CYAN + f"Servidor por ticks iniciado em {self.host}:{self.port} ({self.taxaTicks} ticks/s, semente {self.semente})" + Style.RESET_ALL)
+        threading.Thread(target=self.simular, daemon=True).start()
+        self.servirUdp()
         try:
             while True:
                 socketCliente, _ = self.socketServidor.accept()
-                idJogador = random.randint(1000, 9999)
-                self.adicionarJogador(idJogador)
-                socketCliente.send(str(idJogador).encode())
+                idJogador = self.idsJogadores.alocar()
+                self.caixasSaida[idJogador] = CaixaSaida(socketCliente, self.metricas.contarConexaoDerrubada)
+                self.entradas[idJogador] = threading.Semaphore(LIMITE_ENTRADA)
+                self.comandos.put((idJogador, socketCliente, self.ENTRADA))
 
                 threading.Thread(target=self.gerenciarCliente, args=(socketCliente, idJogador), daemon=True).start()
         except KeyboardInterrupt:
             print(Fore.YELLOW + "\nDesligando servidor..." + Style.RESET_ALL)
         finally:
             self.socketServidor.close()
+            if self.udp:
+                self.udp.fechar()
+            self.fecharGravacao()
+
+class JogoCompartilhado(Jogo):
+    """Um de vários processos servindo a mesma partida. Mapa, sala, contadores e jogadores ficam
+    em memória compartilhada (veja Compartilhado.py) e todos os processos aceitam na mesma porta,
+    então uma partida grande roda em tantos núcleos quantos forem os processos.
+
+    Cada processo só vê as mudanças que ele mesmo fez, então os clientes recebem snapshots em vez
+    de deltas e uma thread vigia envia as mudanças feitas pelos outros processos.
+    """
+
+    tesourosColetados = ContadorCompartilhado(COLETADOS)
+    versao = ContadorCompartilhado(VERSAO)
+    salaOcupada = ContadorCompartilhado(SALA_OCUPADA)
+
+    def __init__(self, estado, host='localhost', port=5000, backlog=5, socketServidor=None, intervaloVigia=0.05,
+                 trabalhador=0):
+        # A partida foi montada pelo processo pai; aqui só se criam as partes de cada processo,
+        # com as mesmas funções que Jogo.__init__ usa (que zeraria os contadores compartilhados)
+        self.estado = estado
+        self.host = host
+        self.port = port
+        self.backlog = backlog
+        self.gravador = None  # comandos de vários processos não têm uma ordem única para gravar
+        self.udp = None
+        # Cada processo sorteia as entradas de uma sequência própria tirada da semente da partida
+        self.semente = estado.semente
+        self.aleatorio = random.Random(f"{estado.semente}:{trabalhador}")
+        self.tamanhoMapa = estado.tamanhoMapa
+        self.tesourosTotais = estado.tesourosTotais
+        self.mapa = Grade(self.tamanhoMapa, estado.celulasMapa)
+        self.tamanhoSala = estado.tamanhoSala
+        self.posicaoSala = estado.posicaoSala
+        self.salaTesouro = Grade(self.tamanhoSala, estado.celulasSala)
+        self.filaSala = deque()  # cada processo tem a fila dos seus jogadores
+        self.naFilaSala = set()
+        self.intervaloVigia = intervaloVigia
+
+        self._inicializarTravas(estado.tamanhoRegiao, estado.travas, estado.listras)
+        self.jogadores = JogadoresCompartilhados(estado, self.travaContadores)
+        self.idsJogadores = IdsCompartilhados(estado, self.travaContadores)
+        self.versaoTransmitida = self.versao
+        self._inicializarConexoes()
+
+        init(autoreset=True)
+
+        # Com SO_REUSEPORT cada processo abre seu próprio socket e o kernel distribui as conexões
+        self.socketServidor = socketServidor
+        if socketServidor is None:
+            self.socketServidor = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.socketServidor.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            self.socketServidor.bind((self.host, self.port))
+            self.socketServidor.listen(self.backlog)
+
+    @property
+    def jogadorNaSala(self):
+        return self.estado.contadores[JOGADOR_NA_SALA] or None
+
+    @jogadorNaSala.setter
+    def jogadorNaSala(self, idJogador):
+        self.estado.contadores[JOGADOR_NA_SALA] = idJogador or 0
+
+    def _regiaoDe(self, celula):
+        # As regiões dividem as travas listradas em rodízio
+        area, indice = super()._regiaoDe(celula)
+        return (area, indice % len(self.travasRegiao))
+
+    def _registrar(self, *mudancas):
+        with self.travaLog:
+            self.cacheCodificado.clear()
+            for mudanca in mudancas:
+                self.versao += 1
+                mudanca['v'] = self.versao
+
+    def obterEstadoJogo(self):
+        return {
+            'map': self.visaoCodificada('map', self.mapa.codificar),
+            'map_size': self.tamanhoMapa,
+            'room': self.visaoCodificada('room', self.salaTesouro.codificar),
+            'room_size': self.tamanhoSala,
+            'jogadores': self.jogadores.snapshot(),
+            'treasures_left': self.tesourosTotais - self.tesourosColetados
+        }
+
+    def inscrever(self, idJogador, socketCliente, visao=None):
+        # As mudanças dos outros processos nunca passam por _registrar aqui, então as visões as perderiam
+        super().inscrever(idJogador, socketCliente)
+
+    def obterClassificacao(self, idJogador, k):
+        # Os pontos também mudam nos outros processos, então o ranking é montado da tabela compartilhada
+        classificacao = Classificacao()
+        for idColocado, jogador in self.jogadores.snapshot().items():
+            classificacao.atualizar(idColocado, jogador['score'])
+        return self._respostaClassificacao(classificacao, idJogador, k)
+
+    def obterEstadoDesde(self, versao):
+        # Não há log de mudanças compartilhado, então qualquer versão que não a atual recebe o snapshot
+        atual = self.versao
+        if versao == atual:
+            return {'type': 'delta', 'from': versao, 'version': atual, 'changes': []}
+        return self.obterSnapshot()
+
+    def adicionarJogador(self, idJogador):
+        with self._travarTodasRegioes():
+            indice = self._sortearCelulaLivre()
+            if indice is None or self.jogadores.cheio():
+                return False
+            self.jogadores[idJogador] = {'position': self.mapa.posicao(indice), 'score': 0, 'naSala': False}
+            self._ocupar(idJogador)
+            self._registrar(self._mudancaJogador(idJogador))
+            return True
+
+    def _sortearCelulaLivre(self):
+        """Uma célula vazia e sem ninguém; tenta algumas ao acaso antes de percorrer o mapa."""
+        celulas, ocupacao = self.estado.celulasMapa, self.estado.ocupacaoMapa
+        total = len(celulas)
+        for _ in range(32):
+            indice = self.aleatorio.randrange(total)
+            if celulas[indice] == VAZIA and not ocupacao[indice]:
+                return indice
+        inicio = self.aleatorio.randrange(total)
+        for deslocamento in range(total):
+            indice = (inicio + deslocamento) % total
+            if celulas[indice] == VAZIA and not ocupacao[indice]:
+                return indice
+        return None
+
+    # A ocupação é uma contagem compartilhada por célula, alterada com a trava da região da célula
+    def _celulaDe(self, jogador):
+        x, y = jogador['position']
+        if self._areaDe(jogador) == 'room':
+            return self.estado.ocupacaoSala, self.salaTesouro.indice(x, y)
+        return self.estado.ocupacaoMapa, self.mapa.indice(x, y)
+
+    def _ocupar(self, idJogador):
+        ocupacao, indice = self._celulaDe(self.jogadores[idJogador])
+        ocupacao[indice] += 1
+
+    def _desocupar(self, idJogador):
+        ocupacao, indice = self._celulaDe(self.jogadores[idJogador])
+        ocupacao[indice] -= 1
+
+    def _liberarCelula(self, x, y):
+        # Novos jogadores procuram direto nas células e na ocupação
+        pass
+
+    def jogadoresEm(self, area, x, y):
+        ocupacao, grade = (self.estado.ocupacaoSala, self.salaTesouro) if area == 'room' else (self.estado.ocupacaoMapa, self.mapa)
+        if not ocupacao[grade.indice(x, y)]:
+            return set()
+        return {idJogador for idJogador, jogador in self.jogadores.items()
+                if self._areaDe(jogador) == area and jogador['position'] == (x, y)}
+
+    def vigiarMudancas(self):
+        """Envia aos inscritos deste processo as mudanças feitas pelos outros processos e admite a fila
+        deste processo quando outro libera a sala."""
+        while not self.terminou():
+            time.sleep(self.intervaloVigia)
+            if self.versao != self.versaoTransmitida:
+                self.notificarMudanca()
+            if self.filaSala and not self.salaOcupada:
+                self.admitirFila()
+
+    def executar(self):
+        threading.Thread(target=self.vigiarMudancas, daemon=True).start()
+        try:
+            while True:
+                socketCliente, _ = self.socketServidor.accept()
+                idJogador = self.aceitarCliente(socketCliente)
+                if idJogador is None:
+                    continue
+
+                threading.Thread(target=self.gerenciarCliente, args=(socketCliente, idJogador), daemon=True).start()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.socketServidor.close()
+
+def rodarTrabalhadorCompartilhado(estado, host, port, backlog, socketServidor, portaMetricas, trabalhador):
+    servidor = JogoCompartilhado(estado, host, port, backlog, socketServidor, trabalhador=trabalhador)
+    if portaMetricas:
+        servirMetricas(host, portaMetricas, lambda: servidor.metricas.prometheus(len(servidor.jogadores)))
+    servidor.executar()
+
+def executarCompartilhado(host, port, backlog, processos, tamanhoMapa, numeroTesouros, tamanhoRegiao=4, portaMetricas=None,
+                          semente=None):
+    """Roda uma partida em `processos` processos trabalhadores que dividem o estado do jogo."""
+    # Um Jogo comum monta o mapa e a sala, que depois são copiados para a memória compartilhada
+    modelo = Jogo(tamanhoMapa=tamanhoMapa, numeroTesouros=numeroTesouros, tamanhoRegiao=tamanhoRegiao, escutar=False,
+                  semente=semente)
+    estado = EstadoCompartilhado(tamanhoMapa, modelo.mapa.celulas, modelo.tamanhoSala, modelo.salaTesouro.celulas,
+                                 modelo.posicaoSala, modelo.tesourosTotais, tamanhoRegiao, modelo.semente)
+
+    # Sem SO_REUSEPORT (no Windows, por exemplo) os processos aceitam de um único socket herdado
+    socketServidor = None
+    if not hasattr(socket, 'SO_REUSEPORT'):
+        socketServidor = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        socketServidor.bind((host, port))
+        socketServidor.listen(backlog)
+
+    trabalhadores = [
+        multiprocessing.Process(target=rodarTrabalhadorCompartilhado, args=(
+            estado, host, port, backlog, socketServidor, portaMetricas and portaMetricas + indice, indice
+        ))
+        for indice in range(processos)
+    ]
+    print(Fore.CYAN + f"Servidor compartilhado iniciado em {host}:{port} com {processos} processos (semente {modelo.semente})" + Style.RESET_ALL)
+    for trabalhador in trabalhadores:
+        trabalhador.start()
+    # Ser terminado ainda precisa parar os trabalhadores e liberar a memória compartilhada
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        while not estado.terminou() and all(trabalhador.is_alive() for trabalhador in trabalhadores):
+            time.sleep(0.5)
+    except KeyboardInterrupt:
+        print(Fore.YELLOW + "\nDesligando servidor..." + Style.RESET_ALL)
+    finally:
+        for trabalhador in trabalhadores:
+            trabalhador.terminate()
+            trabalhador.join()
+        if socketServidor:
+            socketServidor.close()
+        estado.fechar()
+        estado.remover()
 
 if __name__ == "__main__":
-    Jogo().executar() 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Servidor do jogo Caça ao Tesouro')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--backlog', type=int, default=5, help='fila de conexões pendentes do listen')
+    parser.add_argument('--motor', choices=['threads', 'asyncio', 'ticks'], default='threads',
+                        help='uma thread por cliente, um único event loop do asyncio ou lotes por tick')
+    parser.add_argument('--taxa-ticks', type=int, default=20, help='ticks por segundo no motor por ticks')
+    parser.add_argument('--tamanho-mapa', type=int, default=8)
+    parser.add_argument('--tesouros', type=int, default=15, help='tesouros no mapa principal')
+    parser.add_argument('--porta-metricas', type=int, help='serve métricas do Prometheus nesta porta em /metrics')
+    parser.add_argument('--porta-udp', type=int, help='aceita também movimentos por datagramas UDP nesta porta (0 escolhe uma)')
+    parser.add_argument('--processos', type=int, default=1,
+                        help='roda a partida nesta quantidade de processos dividindo o estado (só no motor threads); '
+                             'cada um serve suas métricas em --porta-metricas mais o seu índice')
+    parser.add_argument('--semente', type=int, help='semente do mapa, da sala, das posições e dos ids (sorteada se faltar)')
+    parser.add_argument('--gravar', help='grava neste arquivo todos os comandos aplicados, para o Reproducao.py')
+    argumentos = parser.parse_args()
+
+    if argumentos.processos > 1 and argumentos.motor != 'threads':
+        parser.error('--processos só funciona com o motor threads')
+    if argumentos.processos > 1 and argumentos.porta_udp is not None:
+        parser.error('--porta-udp não pode ser usada com --processos')
+    if argumentos.processos > 1 and argumentos.gravar:
+        parser.error('--gravar não pode ser usado com --processos')
+
+    opcoes = {'tamanhoMapa': argumentos.tamanho_mapa, 'numeroTesouros': argumentos.tesouros, 'portaUdp': argumentos.porta_udp,
+              'semente': argumentos.semente, 'caminhoGravacao': argumentos.gravar}
+    if argumentos.processos > 1:
+        executarCompartilhado(argumentos.host, argumentos.port, argumentos.backlog, argumentos.processos,
+                              argumentos.tamanho_mapa, argumentos.tesouros, portaMetricas=argumentos.porta_metricas,
+                              semente=argumentos.semente)
+    else:
+        if argumentos.gravar:
+            # Ser terminado ainda precisa fechar a gravação com o estado final
+            signal.signal(signal.SIGTERM, signal.default_int_handler)
+        if argumentos.motor == 'asyncio':
+            servidor = JogoAssincrono(argumentos.host, argumentos.port, argumentos.backlog, **opcoes)
+        elif argumentos.motor == 'ticks':
+            servidor = JogoPorTicks(argumentos.host, argumentos.port, argumentos.backlog, taxaTicks=argumentos.taxa_ticks, **opcoes)
+        else:
+            servidor = Jogo(argumentos.host, argumentos.port, argumentos.backlog, **opcoes)
+        if argumentos.porta_metricas:
+            servirMetricas(argumentos.host, argumentos.porta_metricas, lambda: servidor.metricas.prometheus(len(servidor.jogadores)))
+        servidor.executar() 
\ No newline at end of file
@@ -0,0 +1,278 @@
+# Lobby.py - lobby que hospeda várias partidas independentes atrás de uma única porta.
+#
+# Os clientes falam primeiro com o lobby:
+#
+#   {'type': 'list_matches'}
+#   {'type': 'create_match', 'map_size': 8, 'treasures': 15}
+#   {'type': 'join_match', 'match': 3}
+#
+# As partidas rodam em processos trabalhadores para o lobby usar todos os núcleos. Ao entrar
+# numa partida, o socket do cliente é repassado ao trabalhador dono dela; dali em diante a
+# conexão fala o protocolo normal do jogo, começando pelo handshake com o id do jogador.
+import argparse
+import itertools
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+import time
+from threading import Lock
+
+from colorama import Fore, Style
+from Jogo import Jogo
+from Protocolo import ErroProtocolo, LeitorMensagens, enviarMensagem
+
+TAMANHO_MINIMO_MAPA = 8  # a sala do tesouro (metade do mapa) precisa caber os 10 tesouros dela
+TAMANHO_MAXIMO_MAPA = 256
+
+
+class TrabalhadorPartidas:
+    """Roda as partidas de um processo trabalhador; o lobby manda comandos e sockets por um pipe."""
+
+    def __init__(self, conexao, tempoOcioso):
+        self.conexao = conexao
+        self.tempoOcioso = tempoOcioso
+        self.partidas = {}
+        self.sockets = {}  # id da partida -> sockets dos jogadores
+        self.vistaEm = {}  # id da partida -> última vez que teve jogadores
+        self.trava = Lock()
+        self.travaEnvio = Lock()
+
+    def avisar(self, *mensagem):
+        with self.travaEnvio:
+            self.conexao.send(mensagem)
+
+    def executar(self):
+        threading.Thread(target=self.recolher, daemon=True).start()
+        while True:
+            try:
+                mensagem = self.conexao.recv()
+            except EOFError:
+                break
+            if mensagem[0] == 'criar':
+                self.criar(*mensagem[1:])
+            elif mensagem[0] == 'entrar':
+                self.entrar(*mensagem[1:])
+
+    def criar(self, idPartida, tamanhoMapa, tesouros):
+        with self.trava:
+            self.partidas[idPartida] = Jogo(tamanhoMapa=tamanhoMapa, numeroTesouros=tesouros, escutar=False)
+            self.sockets[idPartida] = set()
+            self.vistaEm[idPartida] = time.monotonic()
+
+    def entrar(self, idPartida, socketCliente):
+        with self.trava:
+            partida = self.partidas.get(idPartida)
+            if partida is not None and not partida.terminou():
+                self.sockets[idPartida].add(socketCliente)
+        if partida is None or partida.terminou():
+            enviarMensagem(socketCliente, {'status': 'error', 'message': 'Partida não encontrada'})
+            socketCliente.close()
+            return
+
+        idJogador = partida.aceitarCliente(socketCliente)
+        if idJogador is None:
+            self.esquecer(idPartida, socketCliente)
+            return
+        threading.Thread(target=self.jogar, args=(idPartida, partida, socketCliente, idJogador), daemon=True).start()
+
+    def jogar(self, idPartida, partida, socketCliente, idJogador):
+        try:
+            partida.gerenciarCliente(socketCliente, idJogador)
+        finally:
+            socketCliente.close()
+            self.esquecer(idPartida, socketCliente)
+
+    def esquecer(self, idPartida, socketCliente):
+        with self.trava:
+            if idPartida in self.sockets:
+                self.sockets[idPartida].discard(socketCliente)
+
+    def recolher(self):
+        """Fecha partidas terminadas ou ociosas há muito tempo, liberando a memória, e informa o número de jogadores."""
+        informados = {}
+        while True:
+            time.sleep(1)
+            agora = time.monotonic()
+            fechadas = []
+            with self.trava:
+                for idPartida, partida in list(self.partidas.items()):
+                    if partida.jogadores:
+                        self.vistaEm[idPartida] = agora
+                    if not partida.terminou() and agora - self.vistaEm[idPartida] < self.tempoOcioso:
+                        continue
+                    del self.partidas[idPartida], self.vistaEm[idPartida]
+                    fechadas.append(self.sockets.pop(idPartida))
+                    informados.pop(idPartida, None)
+                    self.avisar('fechada', idPartida)
+
+                contagens = {idPartida: len(partida.jogadores) for idPartida, partida in self.partidas.items()}
+
+            # Acordar as threads dos jogadores deixa elas limparem tudo e soltarem as últimas referências
+            for sockets in fechadas:
+                for socketCliente in sockets:
+                    try:
+                        socketCliente.shutdown(socket.SHUT_RDWR)
+                    except OSError:
+                        pass
+
+            for idPartida, contagem in contagens.items():
+                if informados.get(idPartida) != contagem:
+                    informados[idPartida] = contagem
+                    self.avisar('jogadores', idPartida, contagem)
+
+
+def rodarTrabalhador(conexao, tempoOcioso, pontasLobby):
+    # Um trabalhador criado por fork herda cópias das pontas do lobby nos pipes; com qualquer uma
+    # aberta, ele nunca vê o fim do próprio pipe e sobreviveria ao lobby
+    for pontaLobby in pontasLobby:
+        pontaLobby.close()
+    TrabalhadorPartidas(conexao, tempoOcioso).executar()
+
+
+class Lobby:
+    def __init__(self, host='localhost', port=5000, backlog=5, trabalhadores=None, tempoOcioso=300):
+        self.host = host
+        self.port = port
+        self.backlog = backlog
+        self.tempoOcioso = tempoOcioso
+        self.trabalhadores = []
+        self.quantidadeTrabalhadores = trabalhadores or os.cpu_count() or 1
+        self.partidas = {}  # id da partida -> {'id', 'map_size', 'treasures', 'players', 'trabalhador'}
+        self.idsPartida = itertools.count(1)
+        self.trava = Lock()
+        self.socketServidor = None  # aberto depois que os trabalhadores sobem, para que nunca o herdem
+
+    def iniciarTrabalhadores(self):
+        for indice in range(self.quantidadeTrabalhadores):
+            conexao, conexaoTrabalhador = multiprocessing.Pipe()
+            pontasLobby = [trabalhador['conexao'] for trabalhador in self.trabalhadores] + [conexao]
+            processo = multiprocessing.Process(target=rodarTrabalhador, args=(conexaoTrabalhador, self.tempoOcioso, pontasLobby),
+                                               daemon=True)
+            processo.start()
+            conexaoTrabalhador.close()
+            trabalhador = {'indice': indice, 'processo': processo, 'conexao': conexao, 'travaEnvio': Lock(), 'partidas': 0}
+            self.trabalhadores.append(trabalhador)
+            threading.Thread(target=self.ouvirTrabalhador, args=(trabalhador,), daemon=True).start()
+
+    def enviarTrabalhador(self, trabalhador, *mensagem):
+        with trabalhador['travaEnvio']:
+            trabalhador['conexao'].send(mensagem)
+
+    def ouvirTrabalhador(self, trabalhador):
+        while True:
+            try:
+                mensagem = trabalhador['conexao'].recv()
+            except EOFError:
+                break
+            with self.trava:
+                partida = self.partidas.get(mensagem[1])
+                if partida is None:
+                    continue
+                if mensagem[0] == 'jogadores':
+                    partida['players'] = mensagem[2]
+                elif mensagem[0] == 'fechada':
+                    del self.partidas[mensagem[1]]
+                    trabalhador['partidas'] -= 1
+
+    def listarPartidas(self):
+        with self.trava:
+            partidas = [
+                {'id': partida['id'], 'map_size': partida['map_size'], 'treasures': partida['treasures'],
+                 'players': partida['players'], 'worker': partida['trabalhador']['indice']}
+                for partida in self.partidas.values()
+            ]
+        return {'status': 'success', 'matches': partidas}
+
+    def criarPartida(self, comando):
+        tamanhoMapa = comando.get('map_size', 8)
+        tesouros = comando.get('treasures', 15)
+        if not (isinstance(tamanhoMapa, int) and isinstance(tesouros, int)
+                and TAMANHO_MINIMO_MAPA <= tamanhoMapa <= TAMANHO_MAXIMO_MAPA
+                and 1 <= tesouros < tamanhoMapa * tamanhoMapa):
+            return {'status': 'error', 'message': 'Configuração de partida inválida'}
+
+        with self.trava:
+            # Partidas novas vão para o trabalhador com menos partidas
+            trabalhador = min(self.trabalhadores, key=lambda trabalhador: trabalhador['partidas'])
+            trabalhador['partidas'] += 1
+            idPartida = next(self.idsPartida)
+            self.partidas[idPartida] = {'id': idPartida, 'map_size': tamanhoMapa, 'treasures': tesouros,
+                                        'players': 0, 'trabalhador': trabalhador}
+        self.enviarTrabalhador(trabalhador, 'criar', idPartida, tamanhoMapa, tesouros)
+        return {'status': 'success', 'match': idPartida}
+
+    def entrarPartida(self, socketCliente, idPartida):
+        with self.trava:
+            partida = self.partidas.get(idPartida)
+        if partida is None:
+            return False
+        # O socket é duplicado para o trabalhador, então a cópia do lobby pode ser fechada em seguida
+        self.enviarTrabalhador(partida['trabalhador'], 'entrar', idPartida, socketCliente)
+        return True
+
+    def gerenciarCliente(self, socketCliente):
+        leitor = LeitorMensagens(socketCliente)
+        try:
+            while True:
+                comando = leitor.receber()
+                if comando is None:
+                    break
+
+                tipo = comando.get('type')
+                if tipo == 'list_matches':
+                    resposta = self.listarPartidas()
+                elif tipo == 'create_match':
+                    resposta = self.criarPartida(comando)
+                elif tipo == 'join_match':
+                    # O cliente espera o handshake depois de entrar, então nada fica sem ler aqui
+                    if self.entrarPartida(socketCliente, comando.get('match')):
+                        break
+                    resposta = {'status': 'error', 'message': 'Partida não encontrada'}
+                else:
+                    resposta = {'status': 'error', 'message': 'Comando inválido'}
+                if 'id' in comando:
+                    resposta = dict(resposta, id=comando['id'])
+                enviarMensagem(socketCliente, resposta)
+        except (ValueError, ErroProtocolo, socket.error):
+            pass
+        finally:
+            socketCliente.close()
+
+    def executar(self):
+        print(Fore.CYAN + f"Lobby iniciado em {self.host}:{self.port} com {self.quantidadeTrabalhadores} trabalhadores" + Style.RESET_ALL)
+        try:
+            self.iniciarTrabalhadores()
+            # Ser terminado ainda precisa parar os trabalhadores, o que daemon=True só faz numa saída normal
+            signal.signal(signal.SIGTERM, signal.default_int_handler)
+            self.socketServidor = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.socketServidor.bind((self.host, self.port))
+            self.socketServidor.listen(self.backlog)
+            while True:
+                socketCliente, _ = self.socketServidor.accept()
+                threading.Thread(target=self.gerenciarCliente, args=(socketCliente,), daemon=True).start()
+        except KeyboardInterrupt:
+            print(Fore.YELLOW + "\nDesligando lobby..." + Style.RESET_ALL)
+        finally:
+            if self.socketServidor is not None:
+                self.socketServidor.close()
+            self.pararTrabalhadores()
+
+    def pararTrabalhadores(self):
+        for trabalhador in self.trabalhadores:
+            trabalhador['processo'].terminate()
+            trabalhador['processo'].join()
+            trabalhador['conexao'].close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Lobby do Caça ao Tesouro com várias partidas')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--backlog', type=int, default=5, help='fila de conexões pendentes do listen')
+    parser.add_argument('--trabalhadores', type=int, help='processos que rodam as partidas (padrão: um por núcleo)')
+    parser.add_argument('--tempo-ocioso', type=float, default=300, help='segundos até fechar uma partida vazia')
+    argumentos = parser.parse_args()
+
+    Lobby(argumentos.host, argumentos.port, argumentos.backlog, argumentos.trabalhadores, argumentos.tempo_ocioso).executar()
@@ -0,0 +1,59 @@
+# MemoriaJogadores.py - mede quanto um jogador custa em memória enchendo uma partida de jogadores sintéticos.
+#
+# Os jogadores são adicionados direto num jogo sem sockets, então os números cobrem o estado da
+# partida (tabela de jogadores, ocupação, classificação, log de mudanças) e não os buffers de cada
+# conexão. Remover e adicionar todos de novo (sem o tracemalloc, para os tempos serem reais) confere
+# que a remoção é O(1) e que os ids são reaproveitados.
+#
+# Uso: python MemoriaJogadores.py [--jogadores 100000]
+import argparse
+import math
+import os
+import time
+import tracemalloc
+
+from Jogo import Jogo
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Memória por jogador com muitos jogadores')
+    parser.add_argument('--jogadores', type=int, default=100000)
+    parser.add_argument('--tesouros', type=int, default=1000)
+    argumentos = parser.parse_args()
+
+    # Mais ou menos metade das células vazias, para nunca faltar onde posicionar um jogador
+    tamanhoMapa = math.isqrt(2 * (argumentos.jogadores + argumentos.tesouros)) + 1
+    jogo = Jogo(tamanhoMapa=tamanhoMapa, numeroTesouros=argumentos.tesouros, escutar=False, semente=1)
+
+    tracemalloc.start()
+    antes = tracemalloc.take_snapshot()
+    for _ in range(argumentos.jogadores):
+        jogo.adicionarJogador(jogo.idsJogadores.alocar())
+    depois = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    print(f"{argumentos.jogadores} jogadores num mapa {tamanhoMapa}x{tamanhoMapa}")
+    total = 0
+    for estatistica in depois.compare_to(antes, 'filename'):
+        total += estatistica.size_diff
+        if estatistica.size_diff > 0.01 * argumentos.jogadores:
+            arquivo = os.path.basename(estatistica.traceback[0].filename)
+            print(f"  {arquivo:>16}: {estatistica.size_diff / argumentos.jogadores:6.1f} B/jogador")
+    print(f"  {'total':>16}: {total / argumentos.jogadores:6.1f} B/jogador")
+
+    idsJogadores = list(jogo.jogadores)
+    inicio = time.perf_counter()
+    for idJogador in idsJogadores:
+        jogo.removerJogador(idJogador)
+        jogo.idsJogadores.liberar(idJogador)
+    removidos = time.perf_counter() - inicio
+    inicio = time.perf_counter()
+    for _ in range(argumentos.jogadores):
+        jogo.adicionarJogador(jogo.idsJogadores.alocar())
+    adicionados = time.perf_counter() - inicio
+    print(f"adicionar {adicionados / argumentos.jogadores * 1e6:.2f}us, remover {removidos / argumentos.jogadores * 1e6:.2f}us "
+          f"por jogador; maior id depois de adicionar todos de novo: {max(jogo.jogadores)}")
+
+
+if __name__ == "__main__":
+    main()
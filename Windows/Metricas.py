@@ -0,0 +1,225 @@
+# Metricas.py - instrumentação do servidor: histogramas de latência por comando, espera e posse
+# das travas e contadores de tráfego.
+#
+# Tudo fica em histogramas de tamanho fixo e contadores simples, então registrar custa duas
+# leituras de relógio e um incremento de balde e pode ficar ligado em produção. Os números
+# são lidos pelo comando `stats` ou servidos no formato texto do Prometheus por servirMetricas.
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock
+
+# Limites superiores dos baldes dos histogramas, em segundos; o último balde pega todo o resto
+BALDES = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025,
+          0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+TIPOS_COMANDO = ('move', 'enter_room', 'get_state', 'stats', 'leaderboard')
+
+
+class Histograma:
+    __slots__ = ('contagens', 'soma', 'trava')
+
+    def __init__(self):
+        self.contagens = [0] * (len(BALDES) + 1)
+        self.soma = 0.0
+        self.trava = Lock()
+
+    def observar(self, segundos):
+        balde = bisect_left(BALDES, segundos)
+        with self.trava:
+            self.contagens[balde] += 1
+            self.soma += segundos
+
+    def total(self):
+        return sum(self.contagens)
+
+    def quantil(self, fracao):
+        """Limite superior do balde onde cai o quantil, ou None se nada foi observado."""
+        contagens = list(self.contagens)
+        posicao = fracao * sum(contagens)
+        vistos = 0
+        for limite, contagem in zip(BALDES + (float('inf'),), contagens):
+            vistos += contagem
+            if contagem and vistos >= posicao:
+                return limite
+        return None
+
+    def resumo(self):
+        total = self.total()
+        return {
+            'count': total,
+            'mean_ms': self.soma / total * 1000 if total else 0,
+            'p50_ms': _milissegundos(self.quantil(0.5)),
+            'p99_ms': _milissegundos(self.quantil(0.99))
+        }
+
+
+def _milissegundos(segundos):
+    return None if segundos is None or segundos == float('inf') else segundos * 1000
+
+
+class TravaMedida:
+    """Envolve uma trava e registra quanto tempo se espera por ela e quanto tempo ela fica presa."""
+
+    __slots__ = ('trava', 'espera', 'posse', 'adquiridaEm')
+
+    def __init__(self, trava, espera, posse):
+        self.trava = trava
+        self.espera = espera
+        self.posse = posse
+        self.adquiridaEm = 0.0
+
+    def __enter__(self):
+        inicio = time.perf_counter()
+        self.trava.acquire()
+        # Só quem tem a trava escreve adquiridaEm, então não precisa de outra trava
+        self.adquiridaEm = time.perf_counter()
+        self.espera.observar(self.adquiridaEm - inicio)
+        return self
+
+    def __exit__(self, *excecao):
+        presa = time.perf_counter() - self.adquiridaEm
+        self.trava.release()
+        self.posse.observar(presa)
+        return False
+
+
+class Metricas:
+    def __init__(self):
+        self.inicio = time.time()
+        self.comandos = {tipo: Histograma() for tipo in TIPOS_COMANDO + ('invalid',)}
+        self.esperaTravas = {}
+        self.posseTravas = {}
+
+        # id do jogador -> [bytes recebidos, bytes enviados]; cada entrada só muda pelas leituras e envios daquele jogador
+        self.conexoes = {}
+        self.bytesFechadas = [0, 0]
+        self.travaFechadas = Lock()
+
+        # Movimentos respondidos junto com um seguinte, e clientes derrubados por não lerem
+        self.movimentosAgrupados = 0
+        self.conexoesDerrubadas = 0
+        self.travaContadores = Lock()
+
+    def travaMedida(self, nome, trava=None):
+        """Retorna uma trava com espera e posse registradas em `nome`; várias travas podem dividir o nome."""
+        espera = self.esperaTravas.setdefault(nome, Histograma())
+        posse = self.posseTravas.setdefault(nome, Histograma())
+        return TravaMedida(trava or Lock(), espera, posse)
+
+    def observarComando(self, tipo, segundos):
+        histograma = self.comandos.get(tipo) or self.comandos['invalid']
+        histograma.observar(segundos)
+
+    def definirBytesRecebidos(self, idJogador, total):
+        self.conexoes.setdefault(idJogador, [0, 0])[0] = total
+
+    def somarBytesEnviados(self, idJogador, quantidade):
+        self.conexoes.setdefault(idJogador, [0, 0])[1] += quantidade
+
+    def contarMovimentosAgrupados(self, quantidade):
+        if quantidade:
+            with self.travaContadores:
+                self.movimentosAgrupados += quantidade
+
+    def contarConexaoDerrubada(self):
+        with self.travaContadores:
+            self.conexoesDerrubadas += 1
+
+    def fecharConexao(self, idJogador):
+        trafego = self.conexoes.pop(idJogador, None)
+        if trafego:
+            with self.travaFechadas:
+                self.bytesFechadas[0] += trafego[0]
+                self.bytesFechadas[1] += trafego[1]
+
+    def totalBytes(self):
+        with self.travaFechadas:
+            recebidos, enviados = self.bytesFechadas
+        for trafego in list(self.conexoes.values()):
+            recebidos += trafego[0]
+            enviados += trafego[1]
+        return recebidos, enviados
+
+    def snapshot(self, jogadoresAtivos):
+        recebidos, enviados = self.totalBytes()
+        return {
+            'uptime': time.time() - self.inicio,
+            'active_players': jogadoresAtivos,
+            'commands': {nome: histograma.resumo() for nome, histograma in self.comandos.items() if histograma.total()},
+            'lock_wait': {nome: histograma.resumo() for nome, histograma in self.esperaTravas.items()},
+            'lock_hold': {nome: histograma.resumo() for nome, histograma in self.posseTravas.items()},
+            'bytes_in': recebidos,
+            'bytes_out': enviados,
+            'merged_moves': self.movimentosAgrupados,
+            'dropped_connections': self.conexoesDerrubadas,
+            'connections': {str(idJogador): {'bytes_in': trafego[0], 'bytes_out': trafego[1]}
+                            for idJogador, trafego in list(self.conexoes.items())}
+        }
+
+    def prometheus(self, jogadoresAtivos):
+        """Gera as métricas no formato texto de exposição do Prometheus."""
+        linhas = []
+
+        def histograma(nome, ajuda, rotulo, histogramas):
+            linhas.append(f'# HELP {nome} {ajuda}')
+            linhas.append(f'# TYPE {nome} histogram')
+            for valor, dados in histogramas.items():
+                contagens = list(dados.contagens)
+                acumulado = 0
+                for limite, contagem in zip(BALDES, contagens):
+                    acumulado += contagem
+                    linhas.append(f'{nome}_bucket{{{rotulo}="{valor}",le="{limite}"}} {acumulado}')
+                acumulado += contagens[-1]
+                linhas.append(f'{nome}_bucket{{{rotulo}="{valor}",le="+Inf"}} {acumulado}')
+                linhas.append(f'{nome}_sum{{{rotulo}="{valor}"}} {dados.soma}')
+                linhas.append(f'{nome}_count{{{rotulo}="{valor}"}} {acumulado}')
+
+        histograma('tesouro_comando_segundos', 'Tempo processando comandos.', 'type', self.comandos)
+        histograma('tesouro_espera_trava_segundos', 'Tempo esperando pelas travas do jogo.', 'lock', self.esperaTravas)
+        histograma('tesouro_posse_trava_segundos', 'Tempo com as travas do jogo presas.', 'lock', self.posseTravas)
+
+        recebidos, enviados = self.totalBytes()
+        linhas += [
+            '# HELP tesouro_bytes_recebidos_total Bytes lidos dos clientes.',
+            '# TYPE tesouro_bytes_recebidos_total counter',
+            f'tesouro_bytes_recebidos_total {recebidos}',
+            '# HELP tesouro_bytes_enviados_total Bytes escritos para os clientes.',
+            '# TYPE tesouro_bytes_enviados_total counter',
+            f'tesouro_bytes_enviados_total {enviados}',
+            '# HELP tesouro_movimentos_agrupados_total Movimentos respondidos junto com um movimento seguinte do mesmo cliente.',
+            '# TYPE tesouro_movimentos_agrupados_total counter',
+            f'tesouro_movimentos_agrupados_total {self.movimentosAgrupados}',
+            '# HELP tesouro_conexoes_derrubadas_total Clientes desconectados por não lerem o que lhes foi enviado.',
+            '# TYPE tesouro_conexoes_derrubadas_total counter',
+            f'tesouro_conexoes_derrubadas_total {self.conexoesDerrubadas}',
+            '# HELP tesouro_jogadores_ativos Jogadores no jogo agora.',
+            '# TYPE tesouro_jogadores_ativos gauge',
+            f'tesouro_jogadores_ativos {jogadoresAtivos}'
+        ]
+        return '\n'.join(linhas) + '\n'
+
+
+def servirMetricas(host, porta, gerar):
+    """Serve `gerar()` como texto do Prometheus em http://host:porta/metrics a partir de uma thread daemon."""
+
+    class TratadorMetricas(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != '/metrics':
+                self.send_error(404)
+                return
+            corpo = gerar().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(corpo)))
+            self.end_headers()
+            self.wfile.write(corpo)
+
+        def log_message(self, format, *args):
+            pass
+
+    servidor = ThreadingHTTPServer((host, porta), TratadorMetricas)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor
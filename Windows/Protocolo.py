@@ -0,0 +1,228 @@
+# Protocolo.py - enquadramento das mensagens trocadas entre servidor e jogadores
+import itertools
+import json
+import queue
+import socket
+import struct
+import threading
+
+from CodecBinario import JSON, codificarBinaria, decodificarBinaria, ehBinaria
+
+# Cada mensagem é um tamanho de 4 bytes (big-endian) seguido do JSON, ou de um conteúdo binário
+# (veja CodecBinario.py) depois que a conexão passou a usá-lo
+# Um comando pode levar um 'id'; o servidor o devolve na resposta a esse comando
+CABECALHO = struct.Struct('!I')
+TAMANHO_MAXIMO_MENSAGEM = 16 * 1024 * 1024
+
+
+class ErroProtocolo(ValueError):
+    pass
+
+
+def codificarMensagem(mensagem, codec=JSON):
+    conteudo = None
+    if codec != JSON:
+        conteudo = codificarBinaria(mensagem)
+    if conteudo is None:
+        conteudo = json.dumps(mensagem).encode()
+    return CABECALHO.pack(len(conteudo)) + conteudo
+
+
+def decodificarConteudo(conteudo):
+    """Decodifica um conteúdo, binário ou JSON; cada quadro diz qual é."""
+    if ehBinaria(conteudo):
+        try:
+            return decodificarBinaria(conteudo)
+        except ValueError as e:
+            raise ErroProtocolo(str(e)) from e
+    return json.loads(str(conteudo, 'utf-8'))
+
+
+def enviarMensagem(sock, mensagem, codec=JSON):
+    sock.sendall(codificarMensagem(mensagem, codec))
+
+
+class LeitorMensagens:
+    """Lê mensagens com prefixo de tamanho usando um único buffer reutilizável.
+
+    Trata leituras parciais e várias mensagens chegando no mesmo recv.
+    """
+
+    def __init__(self, sock, tamanhoBuffer=64 * 1024):
+        self.sock = sock
+        self.buffer = bytearray(tamanhoBuffer)
+        self.visao = memoryview(self.buffer)
+        self.inicio = 0
+        self.fim = 0
+        self.bytesLidos = 0
+
+    def _proximoQuadro(self):
+        disponivel = self.fim - self.inicio
+        if disponivel < CABECALHO.size:
+            return None
+
+        (tamanho,) = CABECALHO.unpack_from(self.buffer, self.inicio)
+        if tamanho > TAMANHO_MAXIMO_MENSAGEM:
+            raise ErroProtocolo(f'Mensagem grande demais: {tamanho} bytes')
+        if disponivel < CABECALHO.size + tamanho:
+            self._reservar(CABECALHO.size + tamanho)
+            return None
+
+        comeco = self.inicio + CABECALHO.size
+        self.inicio = comeco + tamanho
+        return self.visao[comeco:self.inicio]
+
+    def _reservar(self, necessario):
+        # Abre espaço para um quadro inteiro: move os bytes pendentes para o início e só cresce se precisar
+        if self.inicio > 0 and len(self.buffer) - self.inicio < necessario:
+            pendente = self.fim - self.inicio
+            self.buffer[:pendente] = self.visao[self.inicio:self.fim]
+            self.inicio, self.fim = 0, pendente
+        if len(self.buffer) < necessario:
+            self.visao.release()
+            self.buffer.extend(bytes(necessario - len(self.buffer)))
+            self.visao = memoryview(self.buffer)
+
+    def _abrirEspaco(self):
+        if self.inicio == self.fim:
+            self.inicio = self.fim = 0
+        elif self.fim == len(self.buffer):
+            self._reservar(self.fim - self.inicio + CABECALHO.size)
+
+    def _recebidos(self, quantidade):
+        self.fim += quantidade
+        self.bytesLidos += quantidade
+        return quantidade > 0
+
+    def _preencher(self):
+        self._abrirEspaco()
+        return self._recebidos(self.sock.recv_into(self.visao[self.fim:]))
+
+    def lerQuadro(self):
+        """Retorna o próximo conteúdo como memoryview (válido até a próxima chamada), ou None se a conexão fechou."""
+        while True:
+            quadro = self._proximoQuadro()
+            if quadro is not None:
+                return quadro
+            if not self._preencher():
+                return None
+
+    def receber(self):
+        quadro = self.lerQuadro()
+        if quadro is None:
+            return None
+        with quadro:
+            return decodificarConteudo(quadro)
+
+    def jaRecebida(self):
+        """Retorna a próxima mensagem se ela já chegou inteira, sem ler do socket; senão None."""
+        quadro = self._proximoQuadro()
+        if quadro is None:
+            return None
+        with quadro:
+            return decodificarConteudo(quadro)
+
+
+class LeitorMensagensAssincrono(LeitorMensagens):
+    """Um LeitorMensagens sobre um StreamReader do asyncio, lendo tudo o que chegou a cada espera."""
+
+    def __init__(self, fluxo, tamanhoBuffer=64 * 1024):
+        super().__init__(None, tamanhoBuffer)
+        self.fluxo = fluxo
+
+    async def receberAssincrono(self):
+        while True:
+            quadro = self._proximoQuadro()
+            if quadro is not None:
+                with quadro:
+                    return decodificarConteudo(quadro)
+            self._abrirEspaco()
+            dados = await self.fluxo.read(len(self.buffer) - self.fim)
+            self.visao[self.fim:self.fim + len(dados)] = dados
+            if not self._recebidos(len(dados)):
+                return None
+
+
+class Conexao:
+    """Lado do cliente de uma conexão de jogo, com uma thread de leitura e uma de escrita.
+
+    Os comandos entram numa fila e saem sem esperar resposta; o que acumular enquanto uma escrita
+    está em andamento vai junto na próxima. `pedir` marca o comando com um id, que o servidor
+    devolve na resposta, então cada resposta chega ao retorno do pedido que a causou. Estado
+    enviado por push e respostas sem id vão para `aoReceber`.
+    """
+
+    def __init__(self, sock, leitor=None):
+        self.sock = sock
+        self.leitor = leitor or LeitorMensagens(sock)
+        self.codec = JSON
+        self.saida = queue.SimpleQueue()
+        self.pendentes = {}  # id do pedido -> retorno para a resposta
+        self.travaPendentes = threading.Lock()
+        self.idsPedido = itertools.count(1)
+        # As escritas já saem agrupadas, então o Nagle só as atrasaria
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def iniciar(self, aoReceber, aoFechar=None):
+        threading.Thread(target=self._lerSempre, args=(aoReceber, aoFechar), daemon=True).start()
+        threading.Thread(target=self._escreverSempre, daemon=True).start()
+
+    def enviar(self, comando):
+        self.saida.put(codificarMensagem(comando, self.codec))
+
+    def usarCodec(self, codec):
+        """Pede ao servidor que passe esta conexão para `codec`, e envia nele daqui em diante."""
+        self.enviar({'type': 'codec', 'codec': codec})
+        # O servidor lê as duas codificações, então não é preciso esperar a resposta
+        self.codec = codec
+
+    def pedir(self, comando, retorno=None):
+        """Envia o comando marcado com um novo id de pedido e retorna o id.
+
+        A resposta vai para `retorno`, ou para `aoReceber` quando não há retorno.
+        """
+        idPedido = next(self.idsPedido)
+        with self.travaPendentes:
+            self.pendentes[idPedido] = retorno
+        self.enviar(dict(comando, id=idPedido))
+        return idPedido
+
+    def fechar(self):
+        self.saida.put(None)
+        self.sock.close()
+
+    def _lerSempre(self, aoReceber, aoFechar):
+        erro = None
+        try:
+            while True:
+                mensagem = self.leitor.receber()
+                if mensagem is None:
+                    break
+
+                retorno = None
+                if isinstance(mensagem, dict) and 'id' in mensagem:
+                    with self.travaPendentes:
+                        retorno = self.pendentes.pop(mensagem['id'], None)
+                (retorno or aoReceber)(mensagem)
+        except (socket.error, ValueError) as e:
+            erro = e
+        finally:
+            if aoFechar:
+                aoFechar(erro)
+
+    def _escreverSempre(self):
+        while True:
+            quadros = [self.saida.get()]
+            try:
+                while True:
+                    quadros.append(self.saida.get_nowait())
+            except queue.Empty:
+                pass
+
+            fechando = None in quadros
+            try:
+                self.sock.sendall(b''.join(quadro for quadro in quadros if quadro is not None))
+            except socket.error:
+                return
+            if fechando:
+                return
@@ -0,0 +1,82 @@
+# Reproducao.py - repete uma partida gravada (veja Gravacao.py) direto no núcleo do jogo, sem sockets.
+#
+# Os comandos são aplicados um atrás do outro, tão rápido quanto o motor os aceita, então a execução
+# mede o custo de CPU do jogo em si. Toda execução precisa terminar no estado em que a gravação
+# terminou; uma que não termina é apontada, porque o tempo dela não mede o mesmo trabalho.
+#
+# Uso: python Reproducao.py SESSAO [--motor threads|asyncio] [--repeticoes 3]
+import argparse
+import sys
+import time
+
+from Gravacao import ENTRAR, SAIR, SAIR_SALA, carregarGravacao, resumoEstado
+from Jogo import Jogo, JogoAssincrono
+
+
+class SemPrazos:
+    # As saídas da sala estão na gravação; um prazo de verdade tiraria o jogador de novo no meio da repetição
+    def _agendarSaidaSala(self, idJogador):
+        pass
+
+
+class JogoRepetido(SemPrazos, Jogo):
+    pass
+
+
+class JogoAssincronoRepetido(SemPrazos, JogoAssincrono):
+    pass
+
+
+# O motor asyncio roda o mesmo jogo com as travas trocadas por no-ops
+MOTORES = {'threads': JogoRepetido, 'asyncio': JogoAssincronoRepetido}
+
+
+def repetir(motor, cabecalho, entradas):
+    """Aplica as entradas num servidor novo; retorna os segundos que levou e o servidor."""
+    jogo = MOTORES[motor](tamanhoMapa=cabecalho['map_size'], numeroTesouros=cabecalho['num_treasures'],
+                          tamanhoRegiao=cabecalho['region_size'], semente=cabecalho['seed'], escutar=False)
+    inicio = time.perf_counter()
+    for _, idJogador, comando in entradas:
+        tipo = comando.get('type')
+        if tipo == ENTRAR:
+            jogo.adicionarJogador(idJogador)
+        elif tipo == SAIR:
+            jogo.removerJogador(idJogador)
+        elif tipo == SAIR_SALA:
+            jogo.sairSalaTesouro(idJogador)
+        else:
+            jogo.processarComando(idJogador, comando)
+    return time.perf_counter() - inicio, jogo
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Repete uma partida gravada como benchmark de CPU')
+    parser.add_argument('sessao', help='arquivo gravado com Jogo.py --gravar')
+    parser.add_argument('--motor', choices=sorted(MOTORES), default='threads')
+    parser.add_argument('--repeticoes', type=int, default=3, help='execuções; a mais rápida é a informada')
+    argumentos = parser.parse_args()
+
+    cabecalho, entradas, final = carregarGravacao(argumentos.sessao)
+    gravado = entradas[-1][0] if entradas else 0
+    print(f"{argumentos.sessao}: semente {cabecalho['seed']}, {len(entradas)} comandos em {gravado:.1f}s")
+    if final is None:
+        print('a gravação não tem o estado final (o servidor não foi desligado direito); as execuções só são comparadas entre si')
+
+    melhor, resumos = None, set()
+    for _ in range(argumentos.repeticoes):
+        decorrido, jogo = repetir(argumentos.motor, cabecalho, entradas)
+        resumo, versao = resumoEstado(jogo)
+        resumos.add(resumo)
+        melhor = decorrido if melhor is None else min(melhor, decorrido)
+    print(f"{argumentos.motor}: {len(entradas) / melhor:,.0f} comandos/s ({melhor * 1000:.1f}ms para a sessão), "
+          f"versão final {versao}, estado {resumo[:16]}")
+
+    esperado = {final['final']} if final else set()
+    if len(resumos) > 1 or (esperado and resumos != esperado):
+        print('o estado final difere do gravado' if len(resumos) == 1 else 'as execuções terminaram em estados diferentes')
+        sys.exit(1)
+    print('estado final idêntico ao da gravação' if final else 'estado final idêntico entre as execuções')
+
+
+if __name__ == "__main__":
+    main()
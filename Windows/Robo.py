@@ -0,0 +1,180 @@
+# Robo.py - cliente sem terminal para testes de carga; joga sozinho e mede o tempo de cada comando
+#
+#   robo = Robo(port=5000, estrategia='tesouro')
+#   if robo.conectar():
+#       robo.jogar(duracao=10, taxa=20)
+#   print(robo.latencias)
+import random
+import socket
+import time
+
+from CanalUdp import MovimentosUdp
+from CodecBinario import JSON
+from Grade import SALA_TESOURO, VAZIA, Grade
+from Protocolo import LeitorMensagens, enviarMensagem
+
+DIRECOES = ['up', 'down', 'left', 'right']
+LIMITE_CONFIRMACAO_UDP = 1  # segundos esperando a confirmação de um movimento por UDP antes de contá-lo perdido
+
+
+def andarAleatorio(robo):
+    return {'type': 'move', 'direction': random.choice(DIRECOES)}
+
+
+def buscarTesouro(robo):
+    """Anda até o tesouro mais próximo e entra na sala do tesouro quando passa pela entrada."""
+    estado = robo.estadoJogo
+    if estado is None:
+        return {'type': 'get_state'}
+
+    jogador = estado['jogadores'][str(robo.idJogador)]
+    if jogador['naSala']:
+        grade = Grade.decodificar(estado['room_size'], estado['room'])
+    else:
+        grade = Grade.decodificar(estado['map_size'], estado['map'])
+    x, y = jogador['position']
+    if not jogador['naSala'] and grade[x, y] == SALA_TESOURO:
+        return {'type': 'enter_room'}
+
+    if robo.alvo is None or robo.alvo[0] != jogador['naSala'] or not grade.temTesouro(*robo.alvo[1:]):
+        robo.alvo = robo.tesouroMaisProximo(grade, jogador['naSala'], x, y)
+    if robo.alvo is None or robo.bloqueado:
+        robo.bloqueado = False
+        return andarAleatorio(robo)
+
+    _, alvoX, alvoY = robo.alvo
+    if alvoX != x:
+        direcao = 'down' if alvoX > x else 'up'
+    else:
+        direcao = 'right' if alvoY > y else 'left'
+    return {'type': 'move', 'direction': direcao}
+
+
+ESTRATEGIAS = {'aleatoria': andarAleatorio, 'tesouro': buscarTesouro}
+
+
+class Robo:
+    def __init__(self, host='localhost', port=5000, estrategia='aleatoria', tempoLimite=10, codec=JSON, udp=False):
+        self.host = host
+        self.port = port
+        self.estrategia = ESTRATEGIAS[estrategia]
+        self.codec = codec
+        self.usarUdp = udp
+        self.udp = None
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # Sem resposta nesse tempo o robô desiste, em vez de travar o benchmark inteiro
+        self.socket.settimeout(tempoLimite)
+        self.leitor = LeitorMensagens(self.socket)
+        self.idJogador = None
+        self.estadoJogo = None
+        self.alvo = None  # (naSala, x, y)
+        self.bloqueado = False
+        self.latencias = []  # segundos por comando
+        self.erros = 0
+
+    def conectar(self):
+        try:
+            self.socket.connect((self.host, self.port))
+            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            handshake = self.leitor.receber()
+            if isinstance(handshake, dict) or handshake is None:
+                return False
+            self.idJogador = int(handshake)
+            if self.codec != JSON:
+                enviarMensagem(self.socket, {'type': 'codec', 'codec': self.codec})
+                resposta = self.leitor.receber()
+                if not resposta or resposta.get('status') != 'success':
+                    return False
+            if self.usarUdp:
+                enviarMensagem(self.socket, {'type': 'udp'}, self.codec)
+                resposta = self.leitor.receber()
+                if not resposta or resposta.get('status') != 'success':
+                    return False
+                self.udp = MovimentosUdp(self.host, resposta['port'], self.idJogador, resposta['token'],
+                                         LIMITE_CONFIRMACAO_UDP)
+        except (socket.error, TypeError, ValueError):
+            return False
+
+        self.requisitar({'type': 'get_state'})
+        return self.estadoJogo is not None
+
+    def requisitar(self, comando, enviadoEm=None):
+        """Envia um comando e espera a resposta; a latência conta a partir de `enviadoEm`, se informado."""
+        if enviadoEm is None:
+            enviadoEm = time.perf_counter()
+        if self.udp and comando['type'] == 'move':
+            return self.moverPorUdp(comando['direction'], enviadoEm)
+        enviarMensagem(self.socket, comando, self.codec)
+        resposta = self.leitor.receber()
+        if resposta is None:
+            raise ConnectionError('o servidor fechou a conexão')
+        self.latencias.append(time.perf_counter() - enviadoEm)
+
+        if resposta.get('status') == 'error':
+            self.erros += 1
+            self.bloqueado = True
+        estado = resposta.get('state', resposta)
+        if 'map' in estado:
+            self.estadoJogo = estado
+        return resposta
+
+    def moverPorUdp(self, direcao, enviadoEm):
+        """Envia um movimento por datagrama e espera a confirmação; um movimento perdido na ida ou na volta conta como erro."""
+        sequencia = self.udp.mover(direcao)
+        while True:
+            confirmacao = self.udp.receber()
+            if confirmacao is None:
+                self.erros += 1
+                return None
+            if confirmacao[0] == sequencia:
+                break  # as mais antigas são confirmações atrasadas de movimentos já contados como perdidos
+        self.latencias.append(time.perf_counter() - enviadoEm)
+
+        _, _, area, posicao = confirmacao
+        jogador = self.estadoJogo['jogadores'][str(self.idJogador)]
+        # Sem sair do lugar, o movimento foi recusado (ou bateu na borda)
+        self.bloqueado = list(posicao) == list(jogador['position']) and (area == 'room') == jogador['naSala']
+        jogador['position'], jogador['naSala'] = list(posicao), area == 'room'
+        if (jogador['naSala'], *posicao) == self.alvo:
+            # O tesouro dali acabou de ser coletado, mas só o TCP traz o mapa novo
+            self.estadoJogo = None
+        return confirmacao
+
+    def tesouroMaisProximo(self, grade, naSala, x, y):
+        melhor, melhorDistancia = None, None
+        for indice, valor in enumerate(grade.celulas):
+            if VAZIA < valor < SALA_TESOURO:
+                celulaX, celulaY = grade.posicao(indice)
+                distancia = abs(celulaX - x) + abs(celulaY - y)
+                if melhor is None or distancia < melhorDistancia:
+                    melhor, melhorDistancia = (naSala, celulaX, celulaY), distancia
+        return melhor
+
+    def jogar(self, duracao, taxa, parar=None):
+        """Envia cerca de `taxa` comandos por segundo durante `duracao` segundos, ou até `parar` ser sinalizado.
+
+        A latência é medida a partir do horário agendado do envio, então um servidor travado
+        aparece na cauda em vez de só diminuir a taxa de comandos.
+        """
+        intervalo = 1 / taxa
+        proximoEnvio = time.perf_counter()
+        prazo = proximoEnvio + duracao
+        try:
+            while proximoEnvio < prazo and not (parar and parar.is_set()):
+                espera = proximoEnvio - time.perf_counter()
+                if espera > 0:
+                    time.sleep(espera)
+                self.requisitar(self.estrategia(self), enviadoEm=proximoEnvio)
+                proximoEnvio += intervalo
+        except (ConnectionError, socket.error):
+            pass
+        finally:
+            self.fechar()
+
+    def fechar(self):
+        try:
+            self.socket.close()
+        except socket.error:
+            pass
+        if self.udp:
+            self.udp.fechar()
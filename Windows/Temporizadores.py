@@ -0,0 +1,69 @@
+# Temporizadores.py - roda de temporizadores: uma única thread dispara todos os prazos do processo.
+#
+# Cada prazo cai numa fenda da roda, que avança uma fenda a cada `resolucao` segundos. Agendar e
+# disparar custam O(1), então milhares de sessões com prazo (como as da sala do tesouro) custam
+# quase nada, em vez de uma thread dormindo por sessão.
+import os
+import threading
+import time
+import traceback
+from math import ceil
+from threading import Lock
+
+
+class Temporizador:
+    __slots__ = ('prazo', 'funcao', 'argumentos')
+
+    def __init__(self, prazo, funcao, argumentos):
+        self.prazo = prazo  # em ticks da roda
+        self.funcao = funcao
+        self.argumentos = argumentos
+
+
+class RodaTemporizadores:
+    def __init__(self, resolucao=0.1, fendas=256):
+        self.resolucao = resolucao
+        self.fendas = [[] for _ in range(fendas)]
+        self.tick = 0
+        self.trava = Lock()
+        self.thread = None
+        self.pid = None
+
+    def agendar(self, atraso, funcao, *argumentos):
+        """Chama funcao(*argumentos) na thread da roda depois de `atraso` segundos, arredondados para cima."""
+        ticks = max(1, ceil(atraso / self.resolucao))
+        with self.trava:
+            # A thread só nasce no primeiro uso, e de novo num processo filho, que não herda threads
+            if self.pid != os.getpid():
+                self.fendas = [[] for _ in self.fendas]
+                self.pid = os.getpid()
+                self.thread = threading.Thread(target=self._girar, daemon=True)
+                self.thread.start()
+            prazo = self.tick + ticks
+            self.fendas[prazo % len(self.fendas)].append(Temporizador(prazo, funcao, argumentos))
+
+    def _girar(self):
+        proximo = time.monotonic()
+        while True:
+            proximo += self.resolucao
+            espera = proximo - time.monotonic()
+            if espera > 0:
+                time.sleep(espera)
+
+            with self.trava:
+                self.tick += 1
+                fenda = self.fendas[self.tick % len(self.fendas)]
+                # Prazos mais longos que uma volta ficam na fenda até a volta deles
+                vencidos = [temporizador for temporizador in fenda if temporizador.prazo <= self.tick]
+                if vencidos:
+                    fenda[:] = [temporizador for temporizador in fenda if temporizador.prazo > self.tick]
+
+            for temporizador in vencidos:
+                try:
+                    temporizador.funcao(*temporizador.argumentos)
+                except Exception:
+                    traceback.print_exc()
+
+
+# Uma roda por processo, dividida por todas as partidas dele
+rodaGlobal = RodaTemporizadores()